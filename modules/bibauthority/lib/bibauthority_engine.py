@@ -23,10 +23,13 @@ from invenio.bibauthority_config import \
     CFG_BIBAUTHORITY_PREFIX_SEP
 
 import re
+from invenio.config import CFG_CERN_SITE
+from invenio.dbquery import run_sql
 from invenio.errorlib import register_exception
 from invenio.search_engine import search_pattern, \
     record_exists
-from invenio.search_engine_utils import get_fieldvalues
+from invenio.search_engine_utils import get_fieldvalues, \
+    get_fieldvalues_by_record
 from invenio.bibauthority_config import \
     CFG_BIBAUTHORITY_AUTHORITY_COLLECTION_IDENTIFIER
 
@@ -286,3 +289,75 @@ def get_index_strings_by_control_no(control_no):
             string_list = list_union(new_strings, string_list)
     #return
     return string_list
+
+def get_index_strings_by_control_nos(control_nos):
+    """bulk counterpart of get_index_strings_by_control_no(): returns
+    the dictionary {control_no: list of index-relevant strings} of the
+    given control numbers, looking up the authority records of all of
+    them at once
+
+    @param control_nos: (INVENIO) MARC internal control_nos to authority records
+    @type control_nos: list of strings (e.g. 'author:(ABC)1234')
+
+    @return: dictionary of the lists of index-relevant strings
+    """
+
+    from invenio.bibindex_engine import list_union
+
+    control_nos = list(set(control_nos))
+    if not control_nos:
+        return {}
+    #1. get recIDs of the authority records with one query
+    tag = CFG_BIBAUTHORITY_RECORD_CONTROL_NUMBER_FIELD
+    bx = "bib%sx" % tag[0:2]
+    bibx = "bibrec_bib%sx" % tag[0:2]
+    res = run_sql("""SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx
+                     WHERE bx.tag LIKE %%s AND bx.value IN (%s)
+                     AND bx.id=bibx.id_bibxxx""" % \
+                  (bx, bibx, ", ".join(["%s"] * len(control_nos))),
+                  (tag, ) + tuple(control_nos))
+    rec_IDs = {}
+    for rec_id, value in res:
+        rec_IDs.setdefault(value, set()).add(rec_id)
+    # a control_no may match a value that is only equal to it in the
+    # collation of the table: look it up by itself
+    folded_values = set([value.lower().rstrip() for value in rec_IDs])
+    out = {}
+    for control_no in control_nos:
+        if control_no not in rec_IDs and \
+               control_no.lower().rstrip() in folded_values:
+            out[control_no] = get_index_strings_by_control_no(control_no)
+    #2. filter out "DELETED" recIDs
+    all_rec_IDs = set()
+    for recIDs in rec_IDs.itervalues():
+        all_rec_IDs.update(recIDs)
+    deleted_rec_IDs = set()
+    for rec_id, dbcollids in get_fieldvalues_by_record(all_rec_IDs, "980__%").iteritems():
+        if ("DELETED" in dbcollids) or (CFG_CERN_SITE and "DUMMY" in dbcollids):
+            deleted_rec_IDs.add(rec_id)
+    #3. concatenate all the info from the interesting fields of the records
+    tags_rec_IDs = {}
+    for control_no in control_nos:
+        if control_no in out:
+            continue
+        recIDs = sorted(rec_IDs.get(control_no, set()) - deleted_rec_IDs)
+        _assert_unique_control_no(recIDs, control_no)
+        rec_IDs[control_no] = recIDs
+        for tag in CFG_BIBAUTHORITY_AUTHORITY_SUBFIELDS_TO_INDEX.get(
+                       get_type_from_control_no(control_no), []):
+            tags_rec_IDs.setdefault(tag, set()).update(recIDs)
+    values = {}
+    for tag, recIDs in tags_rec_IDs.iteritems():
+        values[tag] = get_fieldvalues_by_record(recIDs, tag)
+    for control_no in control_nos:
+        if control_no in out:
+            continue
+        string_list = []
+        for rec_id in rec_IDs[control_no]:
+            for tag in CFG_BIBAUTHORITY_AUTHORITY_SUBFIELDS_TO_INDEX.get(
+                           get_type_from_control_no(control_no), []):
+                new_strings = values[tag].get(rec_id, [])
+                string_list = list_union(new_strings, string_list)
+        out[control_no] = string_list
+    #return
+    return out
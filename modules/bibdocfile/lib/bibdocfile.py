@@ -3169,6 +3169,33 @@ class BibDocFile(object):
             req.status = apache.HTTP_NOT_FOUND
             raise InvenioBibDocFileError, "%s does not exists!" % self.fullpath
 
+def get_latest_file_urls(recid_low, recid_high):
+    """
+    Return the list of (recid, url) tuples of the latest files of the
+    records from RECID_LOW to RECID_HIGH, hidden files included, as
+    BibRecDocs(recid).list_latest_files() would give them, but looked
+    up with one query for all the records.
+    """
+    res = run_sql("""SELECT brbd.id_bibrec, brbd.docname, fs.format
+                     FROM bibrec_bibdoc AS brbd
+                     JOIN bibdoc AS bd ON bd.id=brbd.id_bibdoc
+                     JOIN bibdocfsinfo AS fs ON fs.id_bibdoc=bd.id
+                     WHERE brbd.id_bibrec BETWEEN %s AND %s
+                     AND bd.status<>'DELETED' AND fs.last_version=true
+                     ORDER BY brbd.id_bibrec, brbd.docname, fs.format""",
+                  (recid_low, recid_high))
+    urls = []
+    for recid, docname, docformat in res:
+        docformat = normalize_format(docformat)
+        subformat = get_subformat_from_format(docformat)
+        args = {}
+        if subformat:
+            args['subformat'] = subformat
+        urls.append((recid, create_url('%s/%s/%s/files/%s%s' % (CFG_SITE_URL,
+                     CFG_SITE_RECORD, recid, docname,
+                     get_superformat_from_format(docformat)), args)))
+    return urls
+
 _RE_STATUS_PARSER = re.compile(r'^(?P<type>email|group|egroup|role|firerole|status):\s*(?P<value>.*)$', re.S + re.I)
 def check_bibdoc_authorization(user_info, status):
     """
@@ -32,6 +32,7 @@ from invenio.bibtask import write_message
 from invenio import search_engine
 from invenio import bibrecord
 from invenio import bibdocfile
+from invenio.bibformat import get_preformatted_records
 import os
 
 # imports used in perform_request_... methods
@@ -246,8 +247,10 @@ class FieldExporter:
         """
         output_xml = "<collection>"
 
+        preformatted_records, dummy = get_preformatted_records(record_IDs, "xm")
         for record_id in record_IDs:
-            record_xml = search_engine.print_record(recID = record_id, format = "xm")
+            record_xml = search_engine.print_record(recID = record_id, format = "xm",
+                                                    preformatted_record = preformatted_records.get(record_id, (None, None)))
             output_xml += record_xml
 
         output_xml += "</collection>"
@@ -43,6 +43,8 @@ in the last month.
 from invenio.config import CFG_WEBDIR, CFG_ETCDIR
 from invenio.bibtask import write_message
 from invenio.search_engine import perform_request_search, print_record
+from invenio.bibformat import get_preformatted_records
+from invenio.bibformat_config import CFG_BIBFORMAT_PREFORMATTED_BATCH_SIZE
 from ConfigParser import ConfigParser
 import os
 import gzip
@@ -147,9 +149,14 @@ class MARCXMLExporter:
         self._write_to_output_file(output_file,
                                    '<?xml version="1.0" encoding="UTF-8"?>\n<collection xmlns="http://www.loc.gov/MARC21/slim">\n')
 
-        for record in records:
-            marcxml = self._get_record_MARCXML(record)
-            output_file.write(marcxml)
+        records = list(records)
+        for i in xrange(0, len(records), CFG_BIBFORMAT_PREFORMATTED_BATCH_SIZE):
+            batch = records[i:i+CFG_BIBFORMAT_PREFORMATTED_BATCH_SIZE]
+            preformatted_records, dummy = get_preformatted_records(batch, 'xm')
+            for record in batch:
+                marcxml = self._get_record_MARCXML(record,
+                                                   preformatted_records.get(record, (None, None)))
+                output_file.write(marcxml)
 
         self._write_to_output_file(output_file, "\n</collection>")
         self._close_output_file(output_file)
@@ -183,9 +190,13 @@ class MARCXMLExporter:
         except (IOError, OSError), exception:
             self._report_error("Failed to write to file " + output_file.name, exception)
 
-    def _get_record_MARCXML(self, record):
-        """Returns the record in MARCXML format."""
-        return print_record(record, format='xm')
+    def _get_record_MARCXML(self, record, preformatted_record=None):
+        """Returns the record in MARCXML format.
+
+        preformatted_record - the record already fetched by
+        get_preformatted_records, if any"""
+        return print_record(record, format='xm',
+                            preformatted_record=preformatted_record)
 
     def _delete_files(self, path_to_directory, name_pattern):
         """Deletes files with file name starting with name_pattern
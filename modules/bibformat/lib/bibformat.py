@@ -23,6 +23,7 @@ Format records using chosen format.
 The main APIs are:
   - format_record
   - format_records
+  - get_preformatted_records
   - create_excel
   - get_output_format_content_type
 
@@ -44,7 +45,10 @@ from invenio import bibformat_utils
 from invenio.config import \
      CFG_SITE_LANG, \
      CFG_SITE_URL, \
-     CFG_SITE_RECORD
+     CFG_SITE_RECORD, \
+     CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS
+from invenio.bibformat_config import \
+     CFG_BIBFORMAT_PREFORMATTED_BATCH_SIZE
 import getopt
 import sys
 
@@ -52,7 +56,8 @@ import sys
 ##
 def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                   xml_record=None, user_info=None, on_the_fly=False,
-                  save_missing=True, force_2nd_pass=False):
+                  save_missing=True, force_2nd_pass=False,
+                  preformatted_record=None):
     """
     Returns the formatted record with id 'recID' and format 'of'
 
@@ -78,6 +83,10 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
     (the normal way is to use nocache="1" in a template to have it treated
      in the 2nd pass instead)
 
+    preformatted_record can be given to use the (formatted record,
+    needs 2nd pass) tuple already fetched from the bibfmt table instead
+    of querying it again.
+
     @param recID: the id of the record to fetch
     @param of: the output format code
     @return: formatted record as String, or '' if it does not exist
@@ -91,7 +100,8 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                                         xml_record=xml_record,
                                         user_info=user_info,
                                         on_the_fly=on_the_fly,
-                                        save_missing=save_missing)
+                                        save_missing=save_missing,
+                                        preformatted_record=preformatted_record)
     if needs_2nd_pass or force_2nd_pass:
         out = bibformat_engine.format_record_2nd_pass(
                                     recID=recID,
@@ -128,6 +138,72 @@ def record_get_xml(recID, format='xm', decompress=zlib.decompress):
     """
     return bibformat_utils.record_get_xml(recID=recID, format=format, decompress=decompress)
 
+class PreformattedRecords(object):
+    """
+    Read-only mapping of record IDs to the (formatted record, needs
+    2nd pass) tuples of their preformatted output, as returned by
+    get_preformatted_records.  Records are only decompressed when
+    they are accessed.
+    """
+
+    def __init__(self, blobs, decompress=zlib.decompress):
+        self._blobs = blobs
+        self._decompress = decompress
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def __contains__(self, recID):
+        return recID in self._blobs
+
+    def __iter__(self):
+        return iter(self._blobs)
+
+    def __getitem__(self, recID):
+        value, needs_2nd_pass = self._blobs[recID]
+        return self._decompress(value), needs_2nd_pass
+
+    def keys(self):
+        """Returns the IDs of the preformatted records."""
+        return self._blobs.keys()
+
+    def get(self, recID, default=None):
+        """Returns the preformatted record 'recID', or 'default'."""
+        if recID in self._blobs:
+            return self[recID]
+        return default
+
+
+def get_preformatted_records(recIDs, of, decompress=zlib.decompress):
+    """
+    Returns the preformatted versions of the records given by
+    'recIDs' in output format 'of', fetched with as few queries as
+    possible, together with the list of records that are not
+    preformatted and have to be formatted on the fly.
+
+    The preformatted records can be passed to format_record (as its
+    'preformatted_record' argument) so that it does not query the
+    database again:
+
+      >>> records, misses = get_preformatted_records(recids, 'hb')
+      >>> for recid in recids:
+      ...     out = format_record(recid, 'hb',
+      ...                         preformatted_record=records.get(recid, (None, None)))
+
+    @param recIDs: a list of record IDs
+    @type recIDs: list(int)
+    @param of: an output format code
+    @type of: string
+    @param decompress: the method used to decompress the preformatted records in database
+    @return: tuple (records, misses), where records maps record IDs
+             to (formatted record, needs 2nd pass) tuples, and misses
+             is the list of the record IDs that are not preformatted
+    @rtype: (PreformattedRecords, list(int))
+    """
+    blobs = bibformat_dblayer.get_preformatted_records(recIDs, of)
+    misses = [recID for recID in recIDs if recID not in blobs]
+    return PreformattedRecords(blobs, decompress), misses
+
 # Helper functions to do complex formatting of multiple records
 #
 # You should not modify format_records when adding a complex
@@ -138,7 +214,8 @@ def record_get_xml(recID, format='xm', decompress=zlib.decompress):
 def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                    xml_records=None, user_info=None, record_prefix=None,
                    record_separator=None, record_suffix=None, prologue="",
-                   epilogue="", req=None, on_the_fly=False):
+                   epilogue="", req=None, on_the_fly=False,
+                   batch_size=CFG_BIBFORMAT_PREFORMATTED_BATCH_SIZE):
     """
     Format records given by a list of record IDs or a list of records
     as xml.  Adds a prefix before each record, a suffix after each
@@ -195,73 +272,97 @@ def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
     @param req: an optional request object where to print records
     @param on_the_fly: if False, try to return an already preformatted version of the record in the database
     @type on_the_fly: boolean
+    @param batch_size: the number of preformatted records fetched at once from the database
+    @type batch_size: int
     @rtype: string
     """
-    if req is not None:
-        req.write(prologue)
+    formatted_records = []
+    for chunk in format_records_iterator(recIDs, of, ln=ln, verbose=verbose,
+                                         search_pattern=search_pattern,
+                                         xml_records=xml_records,
+                                         user_info=user_info,
+                                         record_prefix=record_prefix,
+                                         record_separator=record_separator,
+                                         record_suffix=record_suffix,
+                                         prologue=prologue,
+                                         epilogue=epilogue,
+                                         on_the_fly=on_the_fly,
+                                         batch_size=batch_size):
+        formatted_records.append(chunk)
+        if req is not None:
+            req.write(chunk)
+
+    return ''.join(formatted_records)
+
+
+def format_records_iterator(recIDs, of, ln=CFG_SITE_LANG, verbose=0,
+                            search_pattern=None, xml_records=None,
+                            user_info=None, record_prefix=None,
+                            record_separator=None, record_suffix=None,
+                            prologue="", epilogue="", on_the_fly=False,
+                            batch_size=CFG_BIBFORMAT_PREFORMATTED_BATCH_SIZE):
+    """
+    Same as format_records, but yields the output piece by piece
+    (prologue, prefixes, formatted records, suffixes, separators and
+    epilogue) instead of returning it as a single string, so that
+    large sets of records can be printed without keeping them in
+    memory.
 
-    formatted_records = ''
+    Preformatted records are fetched from the database
+    'batch_size' records at a time instead of one by one.
+
+    @see: format_records
+    """
+    if prologue:
+        yield prologue
 
-    #Fill one of the lists with Nones
     if xml_records is not None:
-        recIDs = [None for dummy in xml_records]
+        #Fill the list of record IDs with Nones
+        records = [(None, None, xml_record) for xml_record in xml_records]
+    elif not on_the_fly and \
+         (ln == CFG_SITE_LANG or
+          of.lower() == 'xm' or
+          of.lower() in CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS):
+        # the preformatted records can be used, so fetch them in batches:
+        records = ((recID, (value, needs_2nd_pass), None) for recID, value, needs_2nd_pass
+                   in bibformat_dblayer.iterate_preformatted_records(recIDs, of,
+                                                                     batch_size))
     else:
-        xml_records = [None for dummy in recIDs]
-
-    total_rec = len(recIDs)
-    last_iteration = False
-    for i in range(total_rec):
-        if i == total_rec - 1:
-            last_iteration = True
+        records = [(recID, None, None) for recID in recIDs]
 
+    if xml_records is not None:
+        total_rec = len(xml_records)
+    else:
+        total_rec = len(recIDs)
+    for i, (recID, preformatted_record, xml_record) in enumerate(records):
         #Print prefix
         if record_prefix is not None:
             if isinstance(record_prefix, str):
-                formatted_records += record_prefix
-                if req is not None:
-                    req.write(record_prefix)
+                yield record_prefix
             else:
-                string_prefix = record_prefix(i)
-                formatted_records += string_prefix
-                if req is not None:
-                    req.write(string_prefix)
+                yield record_prefix(i)
 
         #Print formatted record
-        formatted_record = format_record(recIDs[i], of, ln, verbose,
-                                         search_pattern, xml_records[i],
-                                         user_info, on_the_fly)
-        formatted_records += formatted_record
-        if req is not None:
-            req.write(formatted_record)
+        yield format_record(recID, of, ln, verbose, search_pattern,
+                            xml_record, user_info, on_the_fly,
+                            preformatted_record=preformatted_record)
 
         #Print suffix
         if record_suffix is not None:
             if isinstance(record_suffix, str):
-                formatted_records += record_suffix
-                if req is not None:
-                    req.write(record_suffix)
+                yield record_suffix
             else:
-                string_suffix = record_suffix(i)
-                formatted_records += string_suffix
-                if req is not None:
-                    req.write(string_suffix)
+                yield record_suffix(i)
 
         #Print separator if needed
-        if record_separator is not None and not last_iteration:
+        if record_separator is not None and i != total_rec - 1:
             if isinstance(record_separator, str):
-                formatted_records += record_separator
-                if req is not None:
-                    req.write(record_separator)
+                yield record_separator
             else:
-                string_separator = record_separator(i)
-                formatted_records += string_separator
-                if req is not None:
-                    req.write(string_separator)
-
-    if req is not None:
-        req.write(epilogue)
+                yield record_separator(i)
 
-    return prologue + formatted_records + epilogue
+    if epilogue:
+        yield epilogue
 
 
 def format_with_format_template(format_template_filename, bfo,
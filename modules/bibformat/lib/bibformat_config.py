@@ -36,6 +36,9 @@ CFG_BIBFORMAT_OUTPUTS_PATH = "%s%sbibformat%soutput_formats" % (CFG_ETCDIR, os.s
 CFG_BIBFORMAT_FORMAT_TEMPLATE_EXTENSION = "bft"
 CFG_BIBFORMAT_FORMAT_OUTPUT_EXTENSION = "bfo"
 
+# Number of preformatted records fetched at once from the bibfmt table
+CFG_BIBFORMAT_PREFORMATTED_BATCH_SIZE = 100
+
 # Exceptions: errors
 class InvenioBibFormatError(Exception):
     """A generic error for BibFormat."""
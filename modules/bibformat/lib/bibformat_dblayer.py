@@ -450,6 +450,64 @@ def get_preformatted_record(recID, of, decompress=zlib.decompress):
     else:
         return None, None
 
+def get_preformatted_records(recIDs, of, batch_size=1000):
+    """
+    Returns the compressed preformatted records with ids 'recIDs' and
+    format 'of', using one query for every 'batch_size' records.
+
+    Records that are not preformatted in 'of' are not returned.
+
+    @param recIDs: the ids of the records to fetch
+    @param of: the output format code
+    @param batch_size: the number of records fetched by each query
+    @return: dictionary {recID: (compressed formatted record, needs 2nd pass)}
+    """
+    # Decide whether to use DB slave:
+    if of in ('xm', 'recstruct'):
+        run_on_slave = False # for master formats, use DB master
+    else:
+        run_on_slave = True # for other formats, we can use DB slave
+    recIDs = list(recIDs)
+    batch_size = max(batch_size, 1)
+    blobs = {}
+    for i in xrange(0, len(recIDs), batch_size):
+        batch = recIDs[i:i+batch_size]
+        query = """SELECT id_bibrec, value, needs_2nd_pass FROM bibfmt
+                   WHERE format = %%s AND id_bibrec IN (%s)""" % \
+                ','.join(['%s'] * len(batch))
+        for recID, value, needs_2nd_pass in run_sql(query, [of] + batch,
+                                                    run_on_slave=run_on_slave):
+            blobs[recID] = (value, bool(needs_2nd_pass))
+    return blobs
+
+def iterate_preformatted_records(recIDs, of, batch_size=100,
+                                 decompress=zlib.decompress):
+    """
+    Iterates over the preformatted records with ids 'recIDs' and
+    format 'of', fetching them from the database 'batch_size' records
+    at a time, so that only one batch is kept in memory.
+
+    Yields tuples (recID, formatted record, needs 2nd pass) in the
+    order of 'recIDs'. The formatted record and the 2nd pass flag are
+    None for records that are not preformatted in 'of'.
+
+    @param recIDs: the ids of the records to fetch
+    @param of: the output format code
+    @param batch_size: the number of records fetched by each query
+    @param decompress: the method used to decompress the preformatted record in database
+    """
+    recIDs = list(recIDs)
+    batch_size = max(batch_size, 1)
+    for i in xrange(0, len(recIDs), batch_size):
+        batch = recIDs[i:i+batch_size]
+        blobs = get_preformatted_records(batch, of, batch_size)
+        for recID in batch:
+            blob = blobs.pop(recID, None)
+            if blob is None:
+                yield recID, None, None
+            else:
+                yield recID, decompress(blob[0]), blob[1]
+
 def get_preformatted_record_date(recID, of):
     """
     Returns the date of the last update of the cache for the considered
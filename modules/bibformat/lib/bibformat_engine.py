@@ -290,7 +290,7 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
 def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
                            search_pattern=None, xml_record=None,
                            user_info=None, on_the_fly=False,
-                           save_missing=True):
+                           save_missing=True, preformatted_record=None):
     """
     Format a record in given output format.
 
@@ -328,6 +328,11 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
     @param user_info: the information of the user who will view the formatted page (if applicable)
     @param on_the_fly: if False, try to return an already preformatted version of the record in the database
     @type on_the_fly: boolean
+    @param preformatted_record: the (formatted record, needs 2nd pass) tuple
+                                already fetched from the database, e.g. by
+                                bibformat_dblayer.iterate_preformatted_records,
+                                or None to fetch it here
+    @type preformatted_record: tuple or None
     @return: formatted record
     @rtype: string
     """
@@ -354,7 +359,10 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
         # always served from the same cache for any language.  Also,
         # do not fetch from DB when record has been deleted: we want
         # to return an "empty" record in that case
-        res, needs_2nd_pass = bibformat_dblayer.get_preformatted_record(recID, of)
+        if preformatted_record is not None:
+            res, needs_2nd_pass = preformatted_record
+        else:
+            res, needs_2nd_pass = bibformat_dblayer.get_preformatted_record(recID, of)
         if res is not None:
             # record 'recID' is formatted in 'of', so return it
             if verbose == 9:
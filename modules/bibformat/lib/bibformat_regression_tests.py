@@ -33,7 +33,9 @@ from invenio.testutils import (make_test_suite,
                               test_web_page_content,
                               get_authenticated_mechanize_browser,
                               make_url)
-from invenio.bibformat import format_record
+from invenio.bibformat import format_record, format_records, \
+     format_records_iterator, get_preformatted_records
+from invenio.bibformat_dblayer import iterate_preformatted_records
 from invenio.bibformat_engine import BibFormatObject
 from invenio.bibformat_elements import bfe_authority_author
 
@@ -56,6 +58,37 @@ class BibFormatAPITest(InvenioTestCase):
         result = test_web_page_content(pageurl,
                                        expected_text=result)
 
+    def test_format_records_iterator(self):
+        """bibformat - streaming formatted records in batches"""
+        recids = [1, 2, 3, 4, 5]
+        expected = '\n'.join([format_record(recid, 'xm') for recid in recids])
+        self.assertEqual(expected,
+                         ''.join(format_records_iterator(recids, 'xm',
+                                                         record_separator='\n',
+                                                         batch_size=2)))
+        self.assertEqual(expected,
+                         format_records(recids, 'xm', record_separator='\n'))
+
+    def test_iterate_preformatted_records(self):
+        """bibformat - fetching preformatted records in batches"""
+        result = list(iterate_preformatted_records([3, 9999999, 1], 'xm',
+                                                   batch_size=2))
+        self.assertEqual([3, 9999999, 1], [row[0] for row in result])
+        self.assertEqual((None, None), result[1][1:])
+        self.failUnless('<controlfield tag="001">3</controlfield>' in result[0][1])
+        self.failUnless('<controlfield tag="001">1</controlfield>' in result[2][1])
+
+    def test_get_preformatted_records(self):
+        """bibformat - fetching preformatted records in bulk"""
+        records, misses = get_preformatted_records([1, 9999999, 2], 'xm')
+        self.assertEqual([9999999], misses)
+        self.assertEqual([1, 2], sorted(records.keys()))
+        self.failIf(9999999 in records)
+        value, needs_2nd_pass = records[2]
+        self.failUnless('<controlfield tag="001">2</controlfield>' in value)
+        self.assertEqual(format_record(2, 'xm'),
+                         format_record(2, 'xm', preformatted_record=records[2]))
+
 class BibFormatObjectAPITest(InvenioTestCase):
     """Check BibFormatObject (bfo) APIs"""
 
@@ -28,9 +28,13 @@ __revision__ = "$Id$"
 import re
 import sys
 import time
+import signal
 import fnmatch
 import inspect
+from collections import deque
 from datetime import datetime
+from itertools import izip
+from multiprocessing import Pool
 
 from invenio.config import CFG_SOLR_URL
 from invenio.bibindex_engine_config import CFG_MAX_MYSQL_THREADS, \
@@ -42,7 +46,12 @@ from invenio.bibindex_engine_config import CFG_MAX_MYSQL_THREADS, \
      CFG_BIBINDEX_UPDATE_MODE, \
      CFG_BIBINDEX_TOKENIZER_TYPE, \
      CFG_BIBINDEX_WASH_INDEX_TERMS, \
-     CFG_BIBINDEX_SPECIAL_TAGS
+     CFG_BIBINDEX_SPECIAL_TAGS, \
+     CFG_BIBINDEX_FLUSH_CHUNK_SIZE, \
+     CFG_BIBINDEX_FLUSH_MAX_BYTES, \
+     CFG_BIBINDEX_TOKENIZER_CACHE_SIZE, \
+     CFG_BIBINDEX_TOKENIZER_CACHE_MAX_PHRASE_LENGTH, \
+     CFG_BIBINDEX_UNCACHED_TOKENIZERS
 from invenio.bibauthority_config import \
     CFG_BIBAUTHORITY_CONTROLLED_FIELDS_BIBLIOGRAPHIC
 from invenio.bibauthority_engine import \
@@ -53,8 +62,11 @@ from invenio.search_engine import perform_request_search, \
      search_pattern, \
      search_unit_in_bibrec
 
-from invenio.dbquery import run_sql, DatabaseError, serialize_via_marshal, \
-     deserialize_via_marshal, wash_table_column_name
+from invenio.dbquery import run_sql, run_sql_many, DatabaseError, \
+     wash_table_column_name
+from invenio.bibindex_termlist_codec import serialize_termlist, \
+     deserialize_termlist
+from invenio.data_cacher import bump_table_version
 from invenio.bibindex_engine_washer import wash_index_term
 from invenio.bibtask import task_init, write_message, get_datetime, \
     task_set_option, task_get_option, task_get_task_param, \
@@ -68,6 +80,7 @@ from invenio.bibindex_tokenizers.BibIndexJournalTokenizer import \
     CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK
 from invenio.bibindex_termcollectors import TermCollector
 from invenio.bibindex_engine_utils import load_tokenizers, \
+    TokenizerCache, \
     get_all_index_names_and_column_values, \
     get_index_tags, \
     get_field_tags, \
@@ -110,6 +123,7 @@ nb_char_in_line = 50  # for verbose pretty printing
 chunksize = 1000 # default size of chunks that the records will be treated by
 base_process_size = 4500 # process base size
 _last_word_table = None
+_worker_word_table = None # word table of the worker processes
 
 
 _TOKENIZERS = load_tokenizers()
@@ -473,6 +487,8 @@ def update_index_last_updated(indexes, starting_time=None):
                       (starting_time, index_name), verbose=9)
         run_sql("UPDATE idxINDEX SET last_updated=%s WHERE name=%s",
                 (starting_time, index_name))
+    # let web workers know that indexes have changed:
+    bump_table_version('idxINDEX')
 
 
 def get_percentage_completed(num_done, num_total):
@@ -592,6 +608,100 @@ def chunk_generator(rng):
             current_low += chunksize
 
 
+def chunk_hitlists_by_size(params, max_bytes=CFG_BIBINDEX_FLUSH_MAX_BYTES):
+    """
+        Splits the (term, dumped hitlist) tuples PARAMS into lists
+        whose hitlists take at most MAX_BYTES bytes in total, so that
+        each of them can be written by one multi-row statement.
+        A hitlist longer than MAX_BYTES gets a list of its own.
+    """
+    chunk = []
+    chunk_bytes = 0
+    for term, hitlist in params:
+        if chunk and chunk_bytes + len(hitlist) > max_bytes:
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append((term, hitlist))
+        chunk_bytes += len(hitlist)
+    if chunk:
+        yield chunk
+
+
+def get_recID_chunks(recIDs, opt_flush):
+    """
+        Splits the recIDs range list RECIDS into the chunks that are
+        indexed one after the other, of at most CHUNKSIZE records,
+        such that the word table is flushed every OPT_FLUSH records.
+        Returns the list of (low, high, flush) tuples of the chunks,
+        flush telling whether to flush the word table after the chunk.
+    """
+    recID_chunks = []
+    flush_count = 0
+    for arange in recIDs:
+        i_low = arange[0]
+        chunksize_count = 0
+        while i_low <= arange[1]:
+            i_high = min(i_low + opt_flush - flush_count - 1, arange[1])
+            i_high = min(i_low + chunksize - chunksize_count - 1, i_high)
+            flush_count = flush_count + i_high - i_low + 1
+            chunksize_count = chunksize_count + i_high - i_low + 1
+            if chunksize_count >= chunksize:
+                chunksize_count = 0
+            flush = flush_count >= opt_flush
+            if flush:
+                flush_count = 0
+            recID_chunks.append((i_low, i_high, flush))
+            i_low = i_high + 1
+    return recID_chunks
+
+
+def imap_bounded(pool, function, args_list, lookahead):
+    """
+        Returns iterator of the results of FUNCTION applied by POOL to
+        the items of ARGS_LIST, in order, keeping at most LOOKAHEAD
+        of them pending, so that the workers do not pile up results
+        while the ones already returned are being processed.
+    """
+    pending = deque()
+    for args in args_list:
+        pending.append(pool.apply_async(function, (args, )))
+        if len(pending) >= lookahead:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def init_worker_signals():
+    """
+        Initializer of the worker processes of WordTable.add_recIDs():
+        the workers inherit the bibtask signal handlers, which would
+        change the status of the whole task, so that they are reset.
+        The workers die when terminated and leave the interruptions
+        to the main process.
+    """
+    for signum in (signal.SIGTERM, signal.SIGQUIT, signal.SIGABRT):
+        signal.signal(signum, signal.SIG_DFL)
+    for signum in (signal.SIGINT, signal.SIGTSTP, signal.SIGUSR2):
+        signal.signal(signum, signal.SIG_IGN)
+
+
+def collect_recID_range_terms_in_worker(recID_range):
+    """
+        Worker of WordTable.add_recIDs(): returns the terms of the
+        records of RECID_RANGE collected by the word table being
+        indexed, together with the (hits, misses) tuple of its
+        tokenizer cache while collecting them, or None.
+    """
+    tokenizer_cache = _worker_word_table.tokenizer_cache
+    if tokenizer_cache is None:
+        return _worker_word_table.collect_recID_range_terms(*recID_range), None
+    hits, misses = tokenizer_cache.get_stats()
+    wlist = _worker_word_table.collect_recID_range_terms(*recID_range)
+    new_hits, new_misses = tokenizer_cache.get_stats()
+    return wlist, (new_hits - hits, new_misses - misses)
+
+
 class AbstractIndexTable(object):
     """
         This class represents an index table in database.
@@ -650,10 +760,22 @@ class AbstractIndexTable(object):
         nb_words_total = len(self.value)
         nb_words_report = int(nb_words_total / 10.0)
         nb_words_done = 0
-        for word in self.value.keys():
-            self.put_word_into_db(word)
-            nb_words_done += 1
-            if nb_words_report != 0 and ((nb_words_done % nb_words_report) == 0):
+        if CFG_BIBINDEX_FLUSH_CHUNK_SIZE and \
+               self.table_type != CFG_BIBINDEX_INDEX_TABLE_TYPE["Phrases"]:
+            words = sorted(self.value.keys())
+            chunks = [words[i:i + CFG_BIBINDEX_FLUSH_CHUNK_SIZE] for i in
+                      range(0, nb_words_total, CFG_BIBINDEX_FLUSH_CHUNK_SIZE)]
+        else:
+            chunks = [[word] for word in self.value.keys()]
+        for chunk in chunks:
+            if len(chunk) == 1:
+                self.put_word_into_db(chunk[0])
+            else:
+                self.put_words_into_db(chunk)
+            nb_words_done_before = nb_words_done
+            nb_words_done += len(chunk)
+            if nb_words_report != 0 and \
+                   nb_words_done / nb_words_report > nb_words_done_before / nb_words_report:
                 write_message('......processed %d/%d words' % \
                               (nb_words_done, nb_words_total))
                 percentage_display = get_percentage_completed(nb_words_done, nb_words_total)
@@ -728,6 +850,65 @@ class AbstractIndexTable(object):
         if not set: # never store empty words
             run_sql("DELETE FROM %s WHERE term=%%s" % wash_table_column_name(self.table_name), (word,)) # kwalitee: disable=sql
 
+    def put_words_into_db(self, words):
+        """Flush the sorted WORDS to the database like put_word_into_db()
+           does, but reading their hitlists with one query and writing
+           them back with multi-row statements.
+           The multi-row statements rely on the UNIQUE key on term of
+           the WORD and PAIR tables; the PHRASE tables only have a
+           prefix KEY on term, so their words are flushed one by one.
+        """
+        if self.table_type == CFG_BIBINDEX_INDEX_TABLE_TYPE["Phrases"]:
+            for word in words:
+                self.put_word_into_db(word)
+            return
+        table_name = wash_table_column_name(self.table_name)
+        old_hitlists = self.load_old_recIDs_bulk(words)
+        updates = []
+        deletions = []
+        insertions = []
+        for word in words:
+            set = old_hitlists.get(word)
+            if set is not None: # merge the word recIDs found in memory:
+                if self.merge_with_old_recIDs(word, set):
+                    write_message("......... updating hitlist for ``%s''" % \
+                                  word, verbose=9)
+                    if set:
+                        updates.append((word, set.fastdump()))
+                else:
+                    write_message("......... unchanged hitlist for ``%s''" % \
+                                  word, verbose=9)
+                if not set: # never store empty words
+                    deletions.append(word)
+            else: # the word is new, will create new set:
+                write_message("......... inserting hitlist for ``%s''" % \
+                              word, verbose=9)
+                set = intbitset(self.value[word].keys())
+                insertions.append((word, set.fastdump()))
+
+        for params in chunk_hitlists_by_size(updates):
+            run_sql_many("""INSERT INTO %s (term, hitlist) VALUES (%%s, %%s)
+                            ON DUPLICATE KEY UPDATE hitlist=VALUES(hitlist)""" % \
+                         table_name, params) # kwalitee: disable=sql
+        if deletions:
+            run_sql("DELETE FROM %s WHERE term IN (%s)" % \
+                    (table_name, ", ".join(["%s"] * len(deletions))),
+                    tuple(deletions)) # kwalitee: disable=sql
+        # The new words are inserted without ON DUPLICATE KEY UPDATE: a
+        # word not found by its exact value can still be equal to an
+        # existing term or to another new word in the collation of the
+        # table, in which case its hitlist has to be merged, which is
+        # what put_word_into_db() does when the insertion fails.
+        for params in chunk_hitlists_by_size(insertions):
+            try:
+                run_sql_many("INSERT INTO %s (term, hitlist) VALUES (%%s, %%s)" % \
+                             table_name, params) # kwalitee: disable=sql
+            except Exception:
+                write_message("......... falling back to flushing %d words one by one" % \
+                              len(params), verbose=9)
+                for word, dummy in params:
+                    self.put_word_into_db(word)
+
     def put(self, recID, word, sign):
         """Keeps track of changes done during indexing
            and stores these changes in memory for further use.
@@ -761,6 +942,15 @@ class AbstractIndexTable(object):
         else:
             return None
 
+    def load_old_recIDs_bulk(self, words):
+        """Load existing hitlists for the WORDS from the database index
+        files with one query.  Return dictionary {word: hitlist} of the
+        words found."""
+        query = "SELECT term, hitlist FROM %s WHERE term IN (%s)" % \
+                (self.table_name, ", ".join(["%s"] * len(words)))
+        return dict((term, intbitset(hitlist)) for term, hitlist
+                    in run_sql(query, tuple(words)))
+
     def merge_with_old_recIDs(self, word, set):
         """Merge the system numbers stored in memory
         (hash of recIDs with value +1 or -1 according
@@ -908,7 +1098,7 @@ class VirtualIndexTable(AbstractIndexTable):
         new_regular_values = run_sql(query, (records_range[0], records_range[1]))
         if new_regular_values:
             zipped = zip(*new_regular_values)
-            new_regular_values = dict(zip(zipped[0], map(deserialize_via_marshal, zipped[1])))
+            new_regular_values = dict(zip(zipped[0], map(deserialize_termlist, zipped[1])))
         else:
             new_regular_values = dict()
         return new_regular_values
@@ -928,7 +1118,7 @@ class VirtualIndexTable(AbstractIndexTable):
         old_virtual_values = run_sql(query, (records_range[0], records_range[1]))
         if old_virtual_values:
             zipped = zip(*old_virtual_values)
-            old_virtual_values = dict(zip(zipped[0], map(deserialize_via_marshal, zipped[1])))
+            old_virtual_values = dict(zip(zipped[0], map(deserialize_termlist, zipped[1])))
         else:
             old_virtual_values = dict()
         return old_virtual_values
@@ -965,9 +1155,9 @@ class VirtualIndexTable(AbstractIndexTable):
             run_sql("""INSERT INTO %s (id_bibrec,termlist,type)
                        VALUES (%%s,%%s,'FUTURE')""" % \
                        wash_table_column_name(virtual_tab_name),
-                       (recID, serialize_via_marshal(to_serialize))) # kwalitee: disable=sql
+                       (recID, serialize_termlist(to_serialize))) # kwalitee: disable=sql
             try:
-                run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(virtual_tab_name), (recID, serialize_via_marshal([]))) # kwalitee: disable=sql
+                run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(virtual_tab_name), (recID, serialize_termlist([]))) # kwalitee: disable=sql
             except DatabaseError:
                 pass
 
@@ -999,9 +1189,9 @@ class VirtualIndexTable(AbstractIndexTable):
             to_serialize = insert_to_cache_for_record(index_name, recID, old_values, new_values)
             if len(to_serialize) == 0:
                 continue
-            run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(virtual_tab_name), (recID, serialize_via_marshal(to_serialize))) # kwalitee: disable=sql
+            run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(virtual_tab_name), (recID, serialize_termlist(to_serialize))) # kwalitee: disable=sql
             try:
-                run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(virtual_tab_name), (recID, serialize_via_marshal([]))) # kwalitee: disable=sql
+                run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(virtual_tab_name), (recID, serialize_termlist([]))) # kwalitee: disable=sql
             except DatabaseError:
                 pass
 
@@ -1030,9 +1220,9 @@ class VirtualIndexTable(AbstractIndexTable):
             to_serialize = remove_from_cache_for_record(index_name, recID, old_values)
             if len(to_serialize) == 0:
                 continue
-            run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(virtual_tab_name), (recID, serialize_via_marshal(to_serialize))) # kwalitee: disable=sql
+            run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(virtual_tab_name), (recID, serialize_termlist(to_serialize))) # kwalitee: disable=sql
             try:
-                run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(virtual_tab_name), (recID, serialize_via_marshal([]))) # kwalitee: disable=sql
+                run_sql("INSERT INTO %s (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(virtual_tab_name), (recID, serialize_termlist([]))) # kwalitee: disable=sql
             except DatabaseError:
                 pass
 
@@ -1237,6 +1427,14 @@ class WordTable(AbstractIndexTable):
                                                             self.remove_latex_markup)
         self.tokenizer_type = detect_tokenizer_type(self.tokenizer)
         self.default_tokenizer_function = self.tokenizer.get_tokenizing_function(table_type)
+        self.tokenizer_cache = None
+        if CFG_BIBINDEX_TOKENIZER_CACHE_SIZE > 0 and \
+               self.tokenizer_type == CFG_BIBINDEX_TOKENIZER_TYPE["string"] and \
+               self.tokenizer.__class__.__name__ not in CFG_BIBINDEX_UNCACHED_TOKENIZERS:
+            self.tokenizer_cache = TokenizerCache(self.default_tokenizer_function,
+                                                  CFG_BIBINDEX_TOKENIZER_CACHE_SIZE,
+                                                  CFG_BIBINDEX_TOKENIZER_CACHE_MAX_PHRASE_LENGTH)
+            self.default_tokenizer_function = self.tokenizer_cache
 
         self.special_tags = self._handle_special_tags()
 
@@ -1347,12 +1545,15 @@ class WordTable(AbstractIndexTable):
             write_message("The word '%s' does not exist in the word file."\
                               % word)
 
-    def add_recIDs(self, recIDs, opt_flush):
+    def add_recIDs(self, recIDs, opt_flush, jobs=1):
         """Fetches records which id in the recIDs range list and adds
         them to the wordTable.  The recIDs range list is of the form:
         [[i1_low,i1_high],[i2_low,i2_high], ..., [iN_low,iN_high]].
+        With JOBS greater than one, the terms of the records are
+        collected by as many worker processes, while this process
+        stays the only one writing to the word tables.
         """
-        global chunksize, _last_word_table
+        global _worker_word_table
         flush_count = 0
         records_done = 0
         records_to_go = 0
@@ -1360,16 +1561,28 @@ class WordTable(AbstractIndexTable):
         for arange in recIDs:
             records_to_go = records_to_go + arange[1] - arange[0] + 1
 
+        recID_chunks = get_recID_chunks(recIDs, opt_flush)
+        pool = None
+        if jobs > 1 and len(recID_chunks) > 1:
+            write_message("%s collecting terms with %d workers" % \
+                          (self.table_name, jobs))
+            # the workers get the word table by forking:
+            _worker_word_table = self
+            pool = Pool(jobs, init_worker_signals)
+            wlists = (self.count_worker_tokenizer_cache_stats(wlist, stats)
+                      for wlist, stats in
+                      imap_bounded(pool, collect_recID_range_terms_in_worker,
+                                   [(i_low, i_high) for i_low, i_high, dummy
+                                    in recID_chunks], 2 * jobs))
+        else:
+            wlists = (self.collect_recID_range_terms(i_low, i_high)
+                      for i_low, i_high, dummy in recID_chunks)
+
         time_started = time.time() # will measure profile time
-        for arange in recIDs:
-            i_low = arange[0]
-            chunksize_count = 0
-            while i_low <= arange[1]:
+        collected = False
+        try:
+            for (i_low, i_high, flush_now), wlist in izip(recID_chunks, wlists):
                 task_sleep_now_if_required()
-                # calculate chunk group of recIDs and treat it:
-                i_high = min(i_low + opt_flush - flush_count - 1, arange[1])
-                i_high = min(i_low + chunksize - chunksize_count - 1, i_high)
-
                 try:
                     self.chk_recID_range(i_low, i_high)
                 except StandardError:
@@ -1384,16 +1597,13 @@ class WordTable(AbstractIndexTable):
                 percentage_display = get_percentage_completed(records_done, records_to_go)
                 task_update_progress("(%s:%s) adding recs %d-%d %s" % (self.table_name, self.index_name, i_low, i_high, percentage_display))
                 self.del_recID_range(i_low, i_high)
-                just_processed = self.add_recID_range(i_low, i_high)
+                just_processed = self.store_recID_range_terms(i_low, i_high, wlist)
                 flush_count = flush_count + i_high - i_low + 1
-                chunksize_count = chunksize_count + i_high - i_low + 1
                 records_done = records_done + just_processed
                 write_message(CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR % \
                         (self.table_name, i_low, i_high))
-                if chunksize_count >= chunksize:
-                    chunksize_count = 0
                 # flush if necessary:
-                if flush_count >= opt_flush:
+                if flush_now:
                     self.put_into_db()
                     self.clean()
                     if self.index_name == 'fulltext' and CFG_SOLR_URL:
@@ -1401,19 +1611,34 @@ class WordTable(AbstractIndexTable):
                     write_message("%s backing up" % (self.table_name))
                     flush_count = 0
                     self.log_progress(time_started, records_done, records_to_go)
-                # iterate:
-                i_low = i_high + 1
+                    self.log_tokenizer_cache_stats()
+            collected = True
+        finally:
+            if pool is not None:
+                if collected:
+                    pool.close()
+                else:
+                    pool.terminate()
+                pool.join()
+                _worker_word_table = None
         if flush_count > 0:
             self.put_into_db()
             if self.index_name == 'fulltext' and CFG_SOLR_URL:
                 solr_commit()
             self.log_progress(time_started, records_done, records_to_go)
+            self.log_tokenizer_cache_stats()
         self.notify_virtual_indexes(recIDs)
 
     def add_recID_range(self, recID1, recID2):
         """Add records from RECID1 to RECID2."""
+        wlist = self.collect_recID_range_terms(recID1, recID2)
+        return self.store_recID_range_terms(recID1, recID2, wlist)
+
+    def collect_recID_range_terms(self, recID1, recID2):
+        """Return dictionary {recID: list of terms} of the records from
+        RECID1 to RECID2, without changing the word tables, so that it
+        can be run by worker processes."""
         wlist = {}
-        self.recIDs_in_mem.append([recID1, recID2])
         # special case of author indexes where we also add author
         # canonical IDs:
         if self.index_name in ('author', 'firstauthor', 'exactauthor', 'exactfirstauthor'):
@@ -1431,6 +1656,8 @@ class WordTable(AbstractIndexTable):
                                       self.tags,
                                       [recID1, recID2])
             collector.set_special_tags(self.special_tags)
+            if self.tokenizer_cache is not None:
+                collector.set_tokenizing_function(self.tokenizer_cache)
             wlist = collector.collect(marc, wlist)
         if nonmarc:
             collector = NonmarcTermCollector(self.tokenizer,
@@ -1444,7 +1671,6 @@ class WordTable(AbstractIndexTable):
         # lookup index-time synonyms:
         synonym_kbrs = get_all_synonym_knowledge_bases()
         if synonym_kbrs.has_key(self.index_name):
-            if len(wlist) == 0: return 0
             recIDs = wlist.keys()
             for recID in recIDs:
                 for word in wlist[recID]:
@@ -1464,14 +1690,22 @@ class WordTable(AbstractIndexTable):
                 wlist[recID] = []
                 write_message("... record %d was declared deleted, removing its word list" % recID, verbose=9)
             write_message("... record %d, termlist: %s" % (recID, wlist[recID]), verbose=9)
+        return wlist
 
+    def store_recID_range_terms(self, recID1, recID2, wlist):
+        """Add the terms WLIST of the records from RECID1 to RECID2, as
+        returned by collect_recID_range_terms(), to the reverse table
+        and to the memory word list.  Return the number of records
+        having terms."""
+        self.recIDs_in_mem.append([recID1, recID2])
         if len(wlist) == 0: return 0
+        recIDs = wlist.keys()
         # put words into reverse index table with FUTURE status:
         for recID in recIDs:
-            run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_via_marshal(wlist[recID]))) # kwalitee: disable=sql
+            run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_termlist(wlist[recID]))) # kwalitee: disable=sql
             # ... and, for new records, enter the CURRENT status as empty:
             try:
-                run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_via_marshal([]))) # kwalitee: disable=sql
+                run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_termlist([]))) # kwalitee: disable=sql
             except DatabaseError:
                 # okay, it's an already existing record, no problem
                 pass
@@ -1523,6 +1757,21 @@ class WordTable(AbstractIndexTable):
             write_message("Estimated runtime: %.1f minutes" % \
                     ((todo - done) / time_recs_per_min))
 
+    def count_worker_tokenizer_cache_stats(self, wlist, stats):
+        """Add STATS, the (hits, misses) tuple of the tokenizer cache of
+        the worker which collected WLIST, to the tokenizer cache
+        statistics and return WLIST."""
+        if stats is not None and self.tokenizer_cache is not None:
+            self.tokenizer_cache.add_stats(*stats)
+        return wlist
+
+    def log_tokenizer_cache_stats(self):
+        """Write the hit rate and memory use statistics of the
+        tokenizer cache."""
+        if self.tokenizer_cache is not None:
+            write_message("%s %s" % (self.table_name,
+                                     self.tokenizer_cache.get_stats_message()))
+
     def put(self, recID, word, sign):
         """Keeps track of changes done during indexing
            and stores these changes in memory for further use.
@@ -1574,7 +1823,7 @@ class WordTable(AbstractIndexTable):
         recID_rows = run_sql(query, (low, high))
         for recID_row in recID_rows:
             recID = recID_row[0]
-            wlist = deserialize_via_marshal(recID_row[1])
+            wlist = deserialize_termlist(recID_row[1])
             for word in wlist:
                 self.put(recID, word, -1)
         write_message("%s fetching existing words for records #%d-#%d ended" % \
@@ -1728,7 +1977,7 @@ class WordTable(AbstractIndexTable):
                     write_message(query, verbose=9)
                     res = run_sql(query, (recID,))
                     for row in res:
-                        wlist = deserialize_via_marshal(row[1])
+                        wlist = deserialize_termlist(row[1])
                         write_message("Words are %s " % wlist, verbose=9)
                         if row[0] == 'TEMPORARY':
                             sign = 1
@@ -1776,12 +2025,13 @@ def main():
   -w, --windex=w1[,w2]\tword/phrase indexes to consider (all)
   -M, --maxmem=XXX\tmaximum memory usage in kB (no limit)
   -f, --flush=NNN\t\tfull consistent table flush after NNN records (10000)
+  -j, --jobs=N\t\tcollect the terms of the records with N processes (1)
   --force\t\tforce indexing of all records for provided indexes
   -Z, --remove-dependent-index=w  name of an index for removing from virtual index
   -l --all-virtual\t\t set of all virtual indexes; the same as: -w virtual_ind1, virtual_ind2, ...
 """,
             version=__revision__,
-            specific_params=("adi:m:c:w:krRM:f:oZ:l", [
+            specific_params=("adi:m:c:w:krRM:f:j:oZ:l", [
                 "add",
                 "del",
                 "id=",
@@ -1793,6 +2043,7 @@ def main():
                 "reindex",
                 "maxmem=",
                 "flush=",
+                "jobs=",
                 "force",
                 "remove-dependent-index=",
                 "all-virtual"
@@ -1848,6 +2099,10 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
                 (base_process_size + 1000))
     elif key in ("-f", "--flush"):
         task_set_option("flush", int(value))
+    elif key in ("-j", "--jobs"):
+        task_set_option("jobs", int(value))
+        if task_get_option("jobs") < 1:
+            raise StandardError("Number of jobs should be at least 1")
     elif key in ("-o", "--force"):
         task_set_option("force", True)
     elif key in ("-Z", "--remove-dependent-index",):
@@ -2193,7 +2448,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("jobs", 1))
                 task_sleep_now_if_required(can_stop_too=True)
             elif task_get_option("cmd") == "repair":
                 wordTable.repair(task_get_option("flush"))
@@ -2232,7 +2488,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("jobs", 1))
                 task_sleep_now_if_required(can_stop_too=True)
             elif task_get_option("cmd") == "repair":
                 wordTable.repair(task_get_option("flush"))
@@ -2271,7 +2528,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("jobs", 1))
                 if not task_get_option("id") and not task_get_option("collection"):
                     update_index_last_updated([index_name], task_get_task_param('task_starting_time'))
                 task_sleep_now_if_required(can_stop_too=True)
@@ -54,6 +54,36 @@ CFG_BIBINDEX_WASH_INDEX_TERMS = { 'Words': 50,
 
 CFG_BIBINDEX_TOKENIZERS_PATH = os.path.join(CFG_PYLIBDIR, 'invenio', 'bibindex_tokenizers')
 
+## number of terms flushed together into the word tables, by looking up
+## their hitlists with one query and writing them back with multi-row
+## statements; 0 means flushing the terms one by one:
+CFG_BIBINDEX_FLUSH_CHUNK_SIZE = 1000
+
+## largest total size in bytes of the hitlists written back by one
+## multi-row statement (keep it below max_allowed_packet):
+CFG_BIBINDEX_FLUSH_MAX_BYTES = 16 * 1024 * 1024
+
+## number of phrases whose terms are remembered by the tokenizer of
+## every word table, so that phrases repeated across records (journal
+## names, affiliations, collaborations...) are tokenized only once;
+## 0 disables the cache:
+CFG_BIBINDEX_TOKENIZER_CACHE_SIZE = 50000
+
+## phrases longer than this number of characters (e.g. abstracts) are
+## seldom repeated and are not kept in the tokenizer cache; 0 caches
+## phrases of any length:
+CFG_BIBINDEX_TOKENIZER_CACHE_MAX_PHRASE_LENGTH = 200
+
+## tokenizers whose terms are never cached, e.g. because they depend
+## on more than the phrase or are too big to be kept in memory:
+CFG_BIBINDEX_UNCACHED_TOKENIZERS = ('BibIndexFulltextTokenizer',
+                                    'BibIndexEmptyTokenizer')
+
+## format of the term lists written into the reverse index tables
+## (e.g. idxWORD01R), see bibindex_termlist_codec: 'marshal' or
+## 'frontcoded' (smaller, sorted terms); both formats are always read:
+CFG_BIBINDEX_TERMLIST_FORMAT = 'marshal'
+
 CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR = "%s adding records #%d-#%d started"
 
 CFG_BIBINDEX_UPDATE_MESSAGE = "Searching for records which should be reindexed..."
@@ -24,7 +24,7 @@ There should always be at least one test class for each class in b_e_t.
 from invenio.testutils import InvenioTestCase
 
 from invenio.testutils import make_test_suite, run_test_suite
-from invenio.bibindex_engine_utils import load_tokenizers
+from invenio.bibindex_engine_utils import load_tokenizers, TokenizerCache
 
 _TOKENIZERS = load_tokenizers()
 
@@ -357,10 +357,84 @@ class TestCJKTokenizer(InvenioTestCase):
         self.assertEqual(sorted(self.tokenizer.tokenize_for_words(phrase)), sorted(['春','眠','暁']))
 
 
+class TestTokenizerCache(InvenioTestCase):
+    """Test of the LRU cache of the tokenizers"""
+
+    def setUp(self):
+        self.tokenizer = _TOKENIZERS["BibIndexDefaultTokenizer"]()
+        self.calls = []
+
+    def tokenize(self, phrase):
+        """Tokenizing function counting its calls"""
+        self.calls.append(phrase)
+        return self.tokenizer.tokenize_for_words(phrase)
+
+    def test_same_terms(self):
+        """TokenizerCache - terms are the ones of the tokenizer"""
+        cache = TokenizerCache(self.tokenize, 10)
+        phrase = "Nucl. Phys. B"
+        expected = self.tokenizer.tokenize_for_words(phrase)
+        self.assertEqual(expected, cache(phrase))
+        self.assertEqual(expected, cache(phrase))
+        self.assertEqual([phrase], self.calls)
+        self.assertEqual((1, 1), cache.get_stats())
+
+    def test_terms_not_shared(self):
+        """TokenizerCache - returned terms can be changed by the caller"""
+        cache = TokenizerCache(self.tokenize, 10)
+        cache("ATLAS Collaboration").append("changed")
+        self.failIf("changed" in cache("ATLAS Collaboration"))
+
+    def test_least_recently_used_evicted(self):
+        """TokenizerCache - least recently used phrase is evicted"""
+        cache = TokenizerCache(self.tokenize, 2)
+        cache("CERN")
+        cache("DESY")
+        cache("CERN")
+        cache("SLAC")
+        self.assertEqual(2, len(cache))
+        cache("CERN")
+        cache("DESY")
+        self.assertEqual(["CERN", "DESY", "SLAC", "DESY"], self.calls)
+        self.assertEqual((2, 4), cache.get_stats())
+
+    def test_long_phrases_not_cached(self):
+        """TokenizerCache - phrases longer than the limit are not cached"""
+        cache = TokenizerCache(self.tokenize, 10, 10)
+        phrase = "Measurement of the top quark mass"
+        expected = self.tokenizer.tokenize_for_words(phrase)
+        self.assertEqual(expected, cache(phrase))
+        self.assertEqual(expected, cache(phrase))
+        cache("CERN")
+        cache("CERN")
+        self.assertEqual([phrase, phrase, "CERN"], self.calls)
+        self.assertEqual(1, len(cache))
+        self.assertEqual((1, 3), cache.get_stats())
+
+    def test_data_size(self):
+        """TokenizerCache - size of the cached phrases and terms is counted"""
+        cache = TokenizerCache(lambda phrase: phrase.split(), 2)
+        cache("CERN")
+        cache("DESY Hamburg")
+        self.assertEqual(4 + 4 + 12 + 11, cache.data_size)
+        cache("SLAC")
+        self.assertEqual(12 + 11 + 4 + 4, cache.data_size)
+
+    def test_stats_message(self):
+        """TokenizerCache - hit rate statistics of workers are counted"""
+        cache = TokenizerCache(self.tokenize, 10)
+        cache("CERN")
+        cache.add_stats(3, 0)
+        self.assertEqual("tokenizer cache: 3 hits, 1 misses (75.0% hit rate), "
+                         "1 phrases cached (1 kB of phrases and terms)",
+                         cache.get_stats_message())
+
+
 TEST_SUITE = make_test_suite(TestAuthorTokenizerScanning,
                              TestAuthorTokenizerTokens,
                              TestExactAuthorTokenizer,
-                             TestCJKTokenizer)
+                             TestCJKTokenizer,
+                             TestTokenizerCache)
 
 
 if __name__ == '__main__':
@@ -22,9 +22,19 @@
 __revision__ = \
     "$Id$"
 
+import signal
+from multiprocessing import Pool
+
 from invenio.testutils import InvenioTestCase
 
+try:
+    from mock import patch
+    HAS_MOCK = True
+except ImportError:
+    HAS_MOCK = False
+
 from invenio import bibindex_engine
+from invenio.intbitset import intbitset
 from invenio.bibindex_engine_utils import load_tokenizers, list_union
 from invenio.testutils import make_test_suite, run_test_suite
 from invenio.bibindex_engine_utils import get_values_recursively
@@ -253,6 +263,195 @@ class TestGetValuesFromRecjson(InvenioTestCase):
         self.assertEqual(phrases, ['name1', 'name2', 'name4'])
 
 
+class FakeWordTable(object):
+    """Word table in memory, whose terms are compared case-insensitively
+    like in the utf8_general_ci collation of MySQL.  With UNIQUE, the
+    term is a unique key like in the WORD and PAIR tables, otherwise
+    rows can have equal terms like in the PHRASE tables."""
+
+    def __init__(self, hitlists, unique=True):
+        self.unique = unique
+        self.rows = []
+        for term, hitlist in sorted(hitlists.iteritems()):
+            self.rows.append([term, intbitset(hitlist).fastdump()])
+
+    def get_hitlists(self):
+        """Return sorted list of (term, list of recIDs) of the rows of
+        the table."""
+        return sorted([(term, list(intbitset(hitlist)))
+                       for term, hitlist in self.rows])
+
+    def find(self, term):
+        """Return rows whose term is equal to TERM."""
+        return [row for row in self.rows if row[0].lower() == term.lower()]
+
+    def insert(self, term, hitlist, update=False):
+        rows = self.find(term)
+        if rows and self.unique:
+            if not update:
+                raise Exception("Duplicate entry '%s' for key 'term'" % term)
+            rows[0][1] = hitlist
+        else:
+            self.rows.append([term, hitlist])
+
+    def run_sql(self, query, params=None):
+        query = ' '.join(query.split())
+        if query.startswith('SELECT hitlist '):
+            return [(row[1], ) for row in self.find(params[0])]
+        elif query.startswith('SELECT term, hitlist '):
+            return [tuple(row) for row in self.rows
+                    if row[0].lower() in [term.lower() for term in params]]
+        elif query.startswith('UPDATE '):
+            for row in self.find(params[1]):
+                row[1] = params[0]
+        elif query.startswith('INSERT '):
+            self.insert(*params)
+        elif query.startswith('DELETE '):
+            terms = [term.lower() for term in params]
+            self.rows = [row for row in self.rows
+                         if row[0].lower() not in terms]
+        return ()
+
+    def run_sql_many(self, query, params):
+        for term, hitlist in params:
+            self.insert(term, hitlist, update='ON DUPLICATE KEY' in query)
+
+
+class TestBulkFlush(InvenioTestCase):
+    """Tests for flushing many words at once to the word tables."""
+
+    hitlists = {'ellis': [1, 2, 3], 'muon': [2, 5], 'Higgs': [4],
+                'boson': [7]}
+    changes = {'ellis': {2: -1, 8: 1}, 'muon': {2: -1, 5: -1},
+               'higgs': {9: 1}, 'boson': {7: 1}, 'quark': {3: 1, 6: 1},
+               'Quark': {4: 1}}
+    expected = [('Higgs', [4, 9]), ('Quark', [3, 4, 6]), ('boson', [7]),
+                ('ellis', [1, 3, 8])]
+
+    def flush(self, bulk, table_type='WORD'):
+        """Flush the changes to a fake word table of TABLE_TYPE, either
+        with put_words_into_db() or word by word, and return its
+        hitlists."""
+        table = FakeWordTable(self.hitlists, unique=(table_type != 'PHRASE'))
+        @patch('invenio.bibindex_engine.run_sql', table.run_sql)
+        @patch('invenio.bibindex_engine.run_sql_many', table.run_sql_many)
+        @patch('invenio.bibindex_engine.get_index_id_from_index_name',
+               lambda dummy: 1)
+        def flush_changes():
+            word_table = bibindex_engine.AbstractIndexTable('title', table_type)
+            word_table.value = dict((word, dict(signs)) for word, signs
+                                    in self.changes.iteritems())
+            words = sorted(word_table.value)
+            if bulk:
+                word_table.put_words_into_db(words)
+            else:
+                for word in words:
+                    word_table.put_word_into_db(word)
+        flush_changes()
+        return table.get_hitlists()
+
+    if HAS_MOCK:
+        def test_bulk_flush_equals_word_by_word_flush(self):
+            """bibindex engine - bulk flush of words"""
+            self.assertEqual(self.expected, self.flush(bulk=False))
+            self.assertEqual(self.expected, self.flush(bulk=True))
+
+        def test_bulk_flush_of_table_without_unique_key(self):
+            """bibindex engine - bulk flush of phrases, without unique key"""
+            self.assertEqual(self.flush(bulk=False, table_type='PHRASE'),
+                             self.flush(bulk=True, table_type='PHRASE'))
+            hitlists = dict(self.flush(bulk=True, table_type='PHRASE'))
+            self.assertEqual([1, 3, 8], hitlists['ellis'])
+            self.failIf('muon' in hitlists)
+
+    def test_chunk_hitlists_by_size(self):
+        """bibindex engine - chunks of hitlists by size"""
+        params = [('a', 'x' * 5), ('b', 'x' * 3), ('c', 'x' * 20),
+                  ('d', 'x'), ('e', 'x')]
+        self.assertEqual([params[:2], params[2:3], params[3:]],
+                         list(bibindex_engine.chunk_hitlists_by_size(params, 8)))
+        self.assertEqual([], list(bibindex_engine.chunk_hitlists_by_size([], 8)))
+
+class TestRecIDChunks(InvenioTestCase):
+    """Tests for the chunks of records indexed one after the other."""
+
+    def test_chunks_and_flushes(self):
+        """bibindex engine - chunks of records and flushes"""
+        chunksize = bibindex_engine.chunksize
+        bibindex_engine.chunksize = 4
+        try:
+            self.assertEqual([(1, 4, False), (5, 6, True), (7, 8, False),
+                              (9, 12, True), (20, 21, False)],
+                             bibindex_engine.get_recID_chunks([[1, 12], [20, 21]], 6))
+            self.assertEqual([(1, 2, True), (3, 4, True), (5, 5, False)],
+                             bibindex_engine.get_recID_chunks([[1, 5]], 2))
+        finally:
+            bibindex_engine.chunksize = chunksize
+
+
+class FakeAsyncResult(object):
+    """Result of FakePool.apply_async()."""
+
+    def __init__(self, pool, value):
+        self.pool = pool
+        self.value = value
+
+    def get(self):
+        self.pool.pending -= 1
+        return self.value
+
+
+class FakePool(object):
+    """Pool running the functions at once, counting the results that
+    were not fetched yet."""
+
+    def __init__(self):
+        self.pending = 0
+        self.max_pending = 0
+
+    def apply_async(self, function, args):
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        return FakeAsyncResult(self, function(*args))
+
+
+class TestImapBounded(InvenioTestCase):
+    """Tests for the results of the worker processes."""
+
+    def test_results_in_order(self):
+        """bibindex engine - results of the workers in order"""
+        pool = FakePool()
+        results = bibindex_engine.imap_bounded(pool, lambda x: x * x,
+                                               range(10), 3)
+        self.assertEqual([x * x for x in range(10)], list(results))
+        self.assertEqual(3, pool.max_pending)
+        self.assertEqual(0, pool.pending)
+
+
+def get_worker_signal_handlers(dummy):
+    """Return the handlers of the signals sent by bibsched."""
+    return [signal.getsignal(signum) for signum in
+            (signal.SIGTERM, signal.SIGINT, signal.SIGTSTP)]
+
+
+class TestWorkerSignals(InvenioTestCase):
+    """Tests for the signal handlers of the worker processes."""
+
+    def test_task_handlers_reset(self):
+        """bibindex engine - workers do not inherit the task signal handlers"""
+        def handler(signum, frame):
+            pass
+        old_handler = signal.signal(signal.SIGTERM, handler)
+        try:
+            pool = Pool(1, bibindex_engine.init_worker_signals)
+            handlers = pool.map(get_worker_signal_handlers, [0])[0]
+            pool.close()
+            pool.join()
+        finally:
+            signal.signal(signal.SIGTERM, old_handler)
+        self.assertEqual([signal.SIG_DFL, signal.SIG_IGN, signal.SIG_IGN],
+                         handlers)
+
 
 TEST_SUITE = make_test_suite(TestListSetOperations,
                              TestWashIndexTerm,
@@ -260,7 +459,11 @@ TEST_SUITE = make_test_suite(TestListSetOperations,
                              TestGetPairsFromPhrase,
                              TestGetWordsFromDateTag,
                              TestGetAuthorFamilyNameWords,
-                             TestGetValuesFromRecjson,)
+                             TestGetValuesFromRecjson,
+                             TestBulkFlush,
+                             TestRecIDChunks,
+                             TestImapBounded,
+                             TestWorkerSignals,)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -498,6 +498,90 @@ def list_union(list1, list2):
     return union_dict.keys()
 
 
+class TokenizerCache(object):
+    """
+    Bounded LRU cache of the terms returned by a tokenizing function
+    for the phrases it is called with.  Calls are made like calls of
+    the tokenizing function itself.  The tokenizing function is bound
+    to a tokenizer instance, so its configuration (stemming, stopwords,
+    markup removal, table type) is part of the cache key.  Phrases
+    longer than MAX_PHRASE_LENGTH (e.g. abstracts), which are seldom
+    repeated, are tokenized without being cached.
+    """
+
+    def __init__(self, tokenizing_function, size, max_phrase_length=0):
+        self.tokenizing_function = tokenizing_function
+        self.size = size
+        self.max_phrase_length = max_phrase_length
+        self.hits = 0
+        self.misses = 0
+        # total length of the cached phrases and of their terms:
+        self.data_size = 0
+        self._links = {}
+        # circular doubly linked list of [previous, next, phrase, terms],
+        # from the least to the most recently used phrase:
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __call__(self, phrase):
+        if self.max_phrase_length and len(phrase) > self.max_phrase_length:
+            self.misses += 1
+            return self.tokenizing_function(phrase)
+        root = self._root
+        link = self._links.get(phrase)
+        if link is not None:
+            self.hits += 1
+            previous_link, next_link, dummy, terms = link
+            previous_link[1] = next_link
+            next_link[0] = previous_link
+        else:
+            self.misses += 1
+            terms = tuple(self.tokenizing_function(phrase))
+            if len(self._links) >= self.size:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._links[oldest[2]]
+                self.data_size -= self._get_data_size(oldest[2], oldest[3])
+            link = [None, None, phrase, terms]
+            self._links[phrase] = link
+            self.data_size += self._get_data_size(phrase, terms)
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+        return list(terms)
+
+    def __len__(self):
+        return len(self._links)
+
+    def _get_data_size(self, phrase, terms):
+        """Returns the total length of PHRASE and of its TERMS."""
+        return len(phrase) + sum([len(term) for term in terms])
+
+    def add_stats(self, hits, misses):
+        """Counts HITS and MISSES of a copy of the cache, e.g. of a
+        worker process."""
+        self.hits += hits
+        self.misses += misses
+
+    def get_stats(self):
+        """Returns (hits, misses) tuple."""
+        return self.hits, self.misses
+
+    def get_stats_message(self):
+        """Returns the hit rate and memory use statistics as a log
+        message."""
+        calls = self.hits + self.misses
+        hit_rate = 0.0
+        if calls:
+            hit_rate = 100.0 * self.hits / calls
+        return "tokenizer cache: %d hits, %d misses (%.1f%% hit rate), " \
+               "%d phrases cached (%d kB of phrases and terms)" % \
+               (self.hits, self.misses, hit_rate, len(self._links),
+                (self.data_size + 1023) // 1024)
+
+
 def get_index_fields(index_id):
     """Returns fields that are connected to index specified by
        index_id.
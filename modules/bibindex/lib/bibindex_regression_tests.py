@@ -50,7 +50,8 @@ from invenio.bibindex_engine_config import \
 from invenio.bibtask import task_low_level_submission
 from invenio.config import CFG_BINDIR, CFG_LOGDIR
 from invenio.testutils import make_test_suite, run_test_suite, nottest
-from invenio.dbquery import run_sql, deserialize_via_marshal
+from invenio.dbquery import run_sql
+from invenio.bibindex_termlist_codec import deserialize_termlist
 from invenio.intbitset import intbitset
 from invenio.search_engine import get_record
 from invenio.search_engine_utils import get_fieldvalues
@@ -579,21 +580,21 @@ class BibIndexItemCountIndexTest(InvenioTestCase):
         query = "SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=1" \
                  % get_index_id_from_index_name('itemcount')
         res = run_sql(query)
-        self.assertEqual(deserialize_via_marshal(res[0][0]),['0'])
+        self.assertEqual(deserialize_termlist(res[0][0]),['0'])
 
     def test_records_for_number_of_copies_record30(self):
         """checks content of itemcount index for record: 30"""
         query = "SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=30" \
                  % get_index_id_from_index_name('itemcount')
         res = run_sql(query)
-        self.assertEqual(deserialize_via_marshal(res[0][0]),['1'])
+        self.assertEqual(deserialize_termlist(res[0][0]),['1'])
 
     def test_records_for_number_of_copies_record32(self):
         """checks content of itemcount index for record: 32"""
         query = "SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=32" \
                  % get_index_id_from_index_name('itemcount')
         res = run_sql(query)
-        self.assertEqual(deserialize_via_marshal(res[0][0]),['3'])
+        self.assertEqual(deserialize_termlist(res[0][0]),['3'])
 
 
 class BibIndexFiletypeIndexTest(InvenioTestCase):
@@ -621,8 +622,8 @@ class BibIndexFiletypeIndexTest(InvenioTestCase):
                  % get_index_id_from_index_name('filetype')
         res1 = run_sql(query1)
         res2 = run_sql(query2)
-        set1 = deserialize_via_marshal(res1[0][0])
-        set2 = deserialize_via_marshal(res2[0][0])
+        set1 = deserialize_termlist(res1[0][0])
+        set2 = deserialize_termlist(res2[0][0])
         self.assertEqual(set1, ['gif', 'jpg'])
         self.assertEqual(set2, ['pdf', 'ps.gz'])
 
@@ -637,14 +638,14 @@ class BibIndexDOIIndexTest(InvenioTestCase):
         query = "SELECT termlist FROM idxWORD%02dR where id_bibrec=127" \
                 % get_index_id_from_index_name('doi')
         res = run_sql(query)
-        self.assertEqual(deserialize_via_marshal(res[0][0]), ['10.1063/1.2737136'])
+        self.assertEqual(deserialize_termlist(res[0][0]), ['10.1063/1.2737136'])
 
     def test_doi_values_record_130(self):
         """bibindex - tests if record 130 doesn't have any values indexed"""
         query = "SELECT termlist FROM idxWORD%02dR where id_bibrec=130" \
                 % get_index_id_from_index_name('doi')
         res = run_sql(query)
-        self.assertEqual(deserialize_via_marshal(res[0][0]), [])
+        self.assertEqual(deserialize_termlist(res[0][0]), [])
 
     def test_doi_values_like_63(self):
         """bibindex - tests how many values like ".*63.*" were indexed"""
@@ -665,7 +666,7 @@ class BibIndexDOIIndexTest(InvenioTestCase):
         query = """SELECT id_bibrec,termlist FROM idxWORD%02dR """ \
                 % get_index_id_from_index_name('doi')
         res = run_sql(query)
-        self.assertTrue(96 in [id_bibrec for id_bibrec,terms in res if deserialize_via_marshal(terms)])
+        self.assertTrue(96 in [id_bibrec for id_bibrec,terms in res if deserialize_termlist(terms)])
 
 
 class BibIndexJournalIndexTest(InvenioTestCase):
@@ -770,8 +771,8 @@ class BibIndexCJKTokenizerTitleIndexTest(InvenioTestCase):
         res = run_sql(query)
         iset = []
         if res:
-            iset = deserialize_via_marshal(res[0][1])
-        self.assertEqual(iset, ['\xe6\x95\xac', '\xe7\x8d\xa8', '\xe4\xba\xad', '\xe5\x9d\x90'])
+            iset = deserialize_termlist(res[0][1])
+        self.assertEqual(sorted(iset), sorted(['\xe6\x95\xac', '\xe7\x8d\xa8', '\xe4\xba\xad', '\xe5\x9d\x90']))
 
 
 class BibIndexAuthorityRecordTest(InvenioTestCase):
@@ -807,7 +808,7 @@ class BibIndexAuthorityRecordTest(InvenioTestCase):
 
         reindex_for_type_with_bibsched(index_name, force_all=True)
         self.assertTrue(
-            authority_string in deserialize_via_marshal(
+            authority_string in deserialize_termlist(
                 run_sql("SELECT termlist FROM %s WHERE id_bibrec = %s" % (table, bibRecID))[0][0]
             )
         )
@@ -818,7 +819,7 @@ class BibIndexAuthorityRecordTest(InvenioTestCase):
         t1 = 'colorature'
         t2 = 'embellishment'
         table = "idxWORD%02dR" % get_index_id_from_index_name("authoritysubject")
-        res = deserialize_via_marshal(run_sql("""SELECT termlist
+        res = deserialize_termlist(run_sql("""SELECT termlist
                                                  FROM %s WHERE id_bibrec=%s
                                               """ % (table, bibRecID))[0][0])
         self.assertTrue(t1 in res)
@@ -1115,8 +1116,8 @@ class BibIndexIndexingAffectedIndexes(InvenioTestCase):
         query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec IN (""" % (index_id,)
         query = query + ", ".join(map(str, self.records)) + ")"
         resp = run_sql(query)
-        affiliation_rec1 = deserialize_via_marshal(resp[0][0])
-        affiliation_rec2 = deserialize_via_marshal(resp[1][0])
+        affiliation_rec1 = deserialize_termlist(resp[0][0])
+        affiliation_rec2 = deserialize_termlist(resp[1][0])
         self.assertEqual(['univers', 'particl'], affiliation_rec1)
         self.assertEqual(['of', 'cours', 'collis'], affiliation_rec2)
 
@@ -1127,8 +1128,8 @@ class BibIndexIndexingAffectedIndexes(InvenioTestCase):
         query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec IN (""" % (index_id,)
         query = query + ", ".join(map(str, self.records)) + ")"
         resp = run_sql(query)
-        author_rec1 = deserialize_via_marshal(resp[0][0])
-        author_rec2 = deserialize_via_marshal(resp[1][0])
+        author_rec1 = deserialize_termlist(resp[0][0])
+        author_rec2 = deserialize_termlist(resp[1][0])
         self.assertEqual(['dawkins', 'richard', ], author_rec1)
         self.assertEqual(['john', 'locke'], author_rec2)
 
@@ -1139,8 +1140,8 @@ class BibIndexIndexingAffectedIndexes(InvenioTestCase):
         query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec IN (""" % (index_id,)
         query = query + ", ".join(map(str, self.records)) + ")"
         resp = run_sql(query)
-        global_rec1 = deserialize_via_marshal(resp[0][0])
-        global_rec2 = deserialize_via_marshal(resp[1][0])
+        global_rec1 = deserialize_termlist(resp[0][0])
+        global_rec2 = deserialize_termlist(resp[1][0])
         misc_prefix = make_prefix("miscellaneous")
         title_prefix = make_prefix("title")
         self.assertEqual(True, misc_prefix + 'dawkin' in global_rec1)
@@ -1285,11 +1286,11 @@ class BibIndexGlobalIndexContentTest(InvenioTestCase):
         for rec in range(1, 4):
             query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s""" % (title_id, rec)
             res = run_sql(query)
-            termlist_title = deserialize_via_marshal(res[0][0])
+            termlist_title = deserialize_termlist(res[0][0])
             termlist_title = [prefix + item for item in termlist_title]
             query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s""" % (global_id, rec)
             glob = run_sql(query)
-            termlist_global = deserialize_via_marshal(glob[0][0])
+            termlist_global = deserialize_termlist(glob[0][0])
             self.assertEqual(is_part_of(termlist_global, termlist_title), True)
 
     def test_abstract_index_compatibility_reversed_table(self):
@@ -1300,11 +1301,11 @@ class BibIndexGlobalIndexContentTest(InvenioTestCase):
         for rec in range(6, 9):
             query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s""" % (abstract_id, rec)
             res = run_sql(query)
-            termlist_abstract = deserialize_via_marshal(res[0][0])
+            termlist_abstract = deserialize_termlist(res[0][0])
             termlist_abstract = [prefix + item for item in termlist_abstract]
             query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s""" % (global_id, rec)
             glob = run_sql(query)
-            termlist_global = deserialize_via_marshal(glob[0][0])
+            termlist_global = deserialize_termlist(glob[0][0])
             self.assertEqual(is_part_of(termlist_global, termlist_abstract), True)
 
     def test_misc_index_compatibility_reversed_table(self):
@@ -1315,11 +1316,11 @@ class BibIndexGlobalIndexContentTest(InvenioTestCase):
         for rec in range(10, 14):
             query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s""" % (misc_id, rec)
             res = run_sql(query)
-            termlist_misc = deserialize_via_marshal(res[0][0])
+            termlist_misc = deserialize_termlist(res[0][0])
             termlist_misc = [prefix + item for item in termlist_misc]
             query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s""" % (global_id, rec)
             glob = run_sql(query)
-            termlist_global = deserialize_via_marshal(glob[0][0])
+            termlist_global = deserialize_termlist(glob[0][0])
             self.assertEqual(is_part_of(termlist_global, termlist_misc), True)
 
     def test_journal_index_compatibility_forward_table(self):
@@ -1422,14 +1423,14 @@ class BibIndexVirtualIndexAlsoChangesTest(InvenioTestCase):
         """bibindex - after reindexing with different tokenizer virtual index also changes - record 1"""
         query = "SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s" % (self._id, 1)
         prefix = make_prefix("title")
-        self.assertEqual(prefix + 'Higgs' in deserialize_via_marshal(run_sql(query)[0][0]), True)
+        self.assertEqual(prefix + 'Higgs' in deserialize_termlist(run_sql(query)[0][0]), True)
 
     def test_virtual_index_3_correct_content_record_3(self):
         """bibindex - after reindexing with different tokenizer virtual index also changes - record 3"""
         query = "SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s" % (self._id, 3)
         prefix = make_prefix("title")
         self.assertEqual([prefix + item for item in ('Conference', 'Biology', 'Molecular', 'European')],
-                         deserialize_via_marshal(run_sql(query)[0][0]))
+                         deserialize_termlist(run_sql(query)[0][0]))
 
     def test_virtual_index_4_cleaned_up(self):
         """bibindex - after reindexing with normal title tokenizer everything is back to normal"""
@@ -1438,7 +1439,7 @@ class BibIndexVirtualIndexAlsoChangesTest(InvenioTestCase):
         query = "SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=%s" % (self._id, 3)
         prefix = make_prefix("title")
         self.assertEqual([prefix + item for item in ('biolog', 'molecular', 'confer', 'european')],
-                         deserialize_via_marshal(run_sql(query)[0][0]))
+                         deserialize_termlist(run_sql(query)[0][0]))
 
 
 class BibIndexVirtualIndexRemovalTest(InvenioTestCase):
@@ -1506,7 +1507,7 @@ class BibIndexVirtualIndexRemovalTest(InvenioTestCase):
         """bibindex - checks virtual index after authorcount index removal - termlist for record 16"""
         query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=16"""
         res = run_sql(query % self._id)
-        terms = deserialize_via_marshal(res[0][0])
+        terms = deserialize_termlist(res[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(['1985'], terms)
 
@@ -1514,7 +1515,7 @@ class BibIndexVirtualIndexRemovalTest(InvenioTestCase):
         """bibindex - checks virtual index after authorcount index removal - termlist for record 10"""
         query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=10"""
         res = run_sql(query % self._id)
-        terms = deserialize_via_marshal(res[0][0])
+        terms = deserialize_termlist(res[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(sorted(['2002', 'Eur. Phys. J., C']), sorted(terms))
 
@@ -1533,7 +1534,7 @@ class BibIndexVirtualIndexRemovalTest(InvenioTestCase):
         #must be run after: tearDown, test_year_removal_number_of_items
         query = """SELECT termlist FROM idxWORD%02dR WHERE id_bibrec=18"""
         res = run_sql(query % self._id)
-        terms = deserialize_via_marshal(res[0][0])
+        terms = deserialize_termlist(res[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(sorted(['151', '357','1985', 'Phys. Lett., B 151 (1985) 357', 'Phys. Lett., B']),
                          sorted(terms))
@@ -1622,10 +1623,10 @@ class BibIndexCommonWordsInVirtualIndexTest(InvenioTestCase):
     def test_1_initial_state_of_record_1(self):
         """bibindex - checks if record 1 has proper initial state for word: experiment"""
         query = """SELECT termlist FROM idxWORD08R WHERE id_bibrec=1"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         self.assertEqual(terms.count('experi'), 1)
         query = """SELECT termlist FROM idxWORD01R WHERE id_bibrec=1"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(terms.count('experi'), 2)
         self.assertEqual(terms.count('experiment'), 1)
@@ -1633,18 +1634,18 @@ class BibIndexCommonWordsInVirtualIndexTest(InvenioTestCase):
     def test_2_initial_state_of_record_3(self):
         """bibindex - checks if record 3 has proper initial state for word: biology"""
         query = """SELECT termlist FROM idxWORD08R WHERE id_bibrec=3"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         self.assertEqual(terms.count('biolog'), 1)
         self.assertEqual(terms.count('biology'), 0)
         query = """SELECT termlist FROM idxWORD01R WHERE id_bibrec=3"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(terms.count('biolog'), 2)
 
     def test_3_experiment_in_record_1(self):
         """bibindex - checks count of 'experiment' and 'experi' words in global virtual index"""
         query = """SELECT termlist FROM idxWORD01R WHERE id_bibrec=1"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(terms.count('experi'), 1)
         self.assertEqual(terms.count('experiment'), 2)
@@ -1652,25 +1653,25 @@ class BibIndexCommonWordsInVirtualIndexTest(InvenioTestCase):
     def test_4_boson_in_record_1(self):
         """bibindex - checks count of 'boson' - it doesn't change"""
         query = """SELECT termlist FROM idxWORD01R WHERE id_bibrec=1"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(terms.count('boson'), 3)
 
     def test_5_biology_in_record_3(self):
         """bibindex - checks count of 'biology' word in record 3"""
         query = """SELECT termlist FROM idxWORD01R WHERE id_bibrec=3"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(terms.count('biology'), 2)
         self.assertEqual(terms.count('biolog'), 1)
         query = """SELECT termlist FROM idxWORD08R WHERE id_bibrec=3"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         self.assertEqual(terms.count('biolog'), 0)
 
     def test_6_supersymmetry_in_record_9(self):
         """bibindex - checks count of 'supersymmetry' word in record 9"""
         query = """SELECT termlist FROM idxWORD01R WHERE id_bibrec=9"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual(terms.count('supersymmetri'), 0)
 
@@ -1683,10 +1684,10 @@ class BibIndexCommonWordsInVirtualIndexTest(InvenioTestCase):
     def test_8_nobel_prizewinners_pair_in_record_6(self):
         """bibindex - checks if 'nobel prizewinners' is in virtual index"""
         query = """SELECT termlist FROM idxPAIR08R WHERE id_bibrec=6"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         self.assertEqual('nobel prizewinners' in terms, True)
         query = """SELECT termlist FROM idxPAIR01R WHERE id_bibrec=6"""
-        terms = deserialize_via_marshal(run_sql(query)[0][0])
+        terms = deserialize_termlist(run_sql(query)[0][0])
         terms = [re.sub(re_prefix, '', term) for term in terms]
         self.assertEqual('nobel prizewinn' in terms, True)
         self.assertEqual('nobel prizewinners' in terms, True)
@@ -1794,7 +1795,7 @@ class BibIndexFilenameIndexTest(InvenioTestCase):
         query = """SELECT termlist FROM idxWORD%02dR
                    WHERE id_bibrec=12""" % index_id
         res = run_sql(query)
-        self.assertEqual(sorted(deserialize_via_marshal(res[0][0])),
+        self.assertEqual(sorted(deserialize_termlist(res[0][0])),
                          sorted(['0105155', '0105155.pdf',
                                  '0105155.ps', '0105155.ps.gz']))
 
@@ -1804,7 +1805,7 @@ class BibIndexFilenameIndexTest(InvenioTestCase):
         query = """SELECT termlist FROM idxWORD%02dR
                    WHERE id_bibrec=92""" % index_id
         res = run_sql(query)
-        self.assertTrue('0606096.pdf' in deserialize_via_marshal(res[0][0]))
+        self.assertTrue('0606096.pdf' in deserialize_termlist(res[0][0]))
 
     def test_incorrect_extension(self):
         """bibindex - checks if incorrect filename could not be found"""
@@ -1812,7 +1813,7 @@ class BibIndexFilenameIndexTest(InvenioTestCase):
         query = """SELECT termlist FROM idxWORD%02dR
                    WHERE id_bibrec=12""" % index_id
         res = run_sql(query)
-        self.assertFalse('0105155.gz' in deserialize_via_marshal(res[0][0]))
+        self.assertFalse('0105155.gz' in deserialize_termlist(res[0][0]))
 
     def test_filename_in_forward_table(self):
         """bibindex - checks if words are present in forward table"""
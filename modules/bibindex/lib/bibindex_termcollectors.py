@@ -21,16 +21,17 @@ BibIndex termcollectors.
 """
 
 import fnmatch
+import re
 
 from invenio.bibindex_engine_utils import list_union, \
     UnknownTokenizer, \
     get_values_recursively
 from invenio.bibindex_engine_config import CFG_BIBINDEX_TOKENIZER_TYPE
 from invenio.dbquery import run_sql
-from invenio.bibdocfile import BibRecDocs
-from invenio.search_engine_utils import get_fieldvalues
+from invenio.bibdocfile import get_latest_file_urls
+from invenio.search_engine_utils import get_fieldvalues_by_record
 
-from invenio.bibauthority_engine import get_index_strings_by_control_no
+from invenio.bibauthority_engine import get_index_strings_by_control_nos
 from invenio.bibauthority_config import \
     CFG_BIBAUTHORITY_CONTROLLED_FIELDS_BIBLIOGRAPHIC
 from invenio.bibfield import get_record
@@ -71,6 +72,13 @@ class TermCollector(object):
         """
         self.special_tags = special_tags
 
+    def set_tokenizing_function(self, tokenizing_function):
+        """
+        Replaces the tokenizing function of the tokenizer,
+        e.g. by a cached version of it.
+        """
+        self.tokenizing_function = tokenizing_function
+
     def collect(self, recIDs, termslist={}):
         """
         Finds terms and tokenizes them in order to obtain termslist.
@@ -113,55 +121,83 @@ class TermCollector(object):
         Collects terms from specific tags or fields.
         Used together with string tokenizer.
         """
-        for tag in self.tags:
-            tokenizing_function = self.special_tags.get(tag, self.tokenizing_function)
-            phrases = self._get_phrases_for_tokenizing(tag, recIDs)
-            for row in phrases:
-                recID, phrase = row
-                if recID in recIDs:
-                    if not recID in termslist:
-                        termslist[recID] = []
-                    new_words = tokenizing_function(phrase)
-                    termslist[recID] = list_union(new_words, termslist[recID])
+        recIDs_set = set(recIDs)
+        for recID, tag, phrase in self._get_tagged_phrases(recIDs):
+            if recID in recIDs_set:
+                if not recID in termslist:
+                    termslist[recID] = []
+                tokenizing_function = self.special_tags.get(tag, self.tokenizing_function)
+                new_words = tokenizing_function(phrase)
+                termslist[recID] = list_union(new_words, termslist[recID])
         return termslist
 
-    def _get_phrases_for_tokenizing(self, tag, recIDs):
+    def _get_tagged_phrases(self, recIDs):
         """
-        Gets phrases for later tokenization
-        for a range of records and specific tag.
-        @param tag: MARC tag
+        Gets phrases for later tokenization for all the tags of the
+        index and a list of records, with one query per bibXXx table,
+        one lookup of the fulltext files and one lookup of the
+        authority records.
+        Yields (recID, tag, phrase) tuples, where tag is the tag of
+        the index the phrase was found for.
         @param recIDs: list of specific recIDs (not range)
         """
         if len(recIDs) == 0:
-            return ()
-        bibXXx = "bib" + tag[0] + tag[1] + "x"
-        bibrec_bibXXx = "bibrec_" + bibXXx
-        query = """SELECT bb.id_bibrec,b.value FROM %s AS b, %s AS bb
-                   WHERE bb.id_bibrec BETWEEN %%s AND %%s
-                   AND bb.id_bibxxx=b.id AND tag LIKE %%s""" % (bibXXx, bibrec_bibXXx)
-        phrases = run_sql(query, (self.first_recID, self.last_recID, tag))
-        if tag == '8564_u':
+            return
+        first_recID = max(self.first_recID, min(recIDs))
+        last_recID = min(self.last_recID, max(recIDs))
+        tags_by_table = {}
+        for tag in self.tags:
+            tags_by_table.setdefault(tag[0:2], []).append(tag)
+        for table_prefix, tags in sorted(tags_by_table.items()):
+            bibXXx = "bib" + table_prefix + "x"
+            bibrec_bibXXx = "bibrec_" + bibXXx
+            query = """SELECT bb.id_bibrec,b.tag,b.value FROM %s AS b, %s AS bb
+                       WHERE bb.id_bibrec BETWEEN %%s AND %%s
+                       AND bb.id_bibxxx=b.id AND (%s)""" % \
+                    (bibXXx, bibrec_bibXXx, " OR ".join(["b.tag LIKE %s"] * len(tags)))
+            matchers = [(tag, get_tag_like_matcher(tag)) for tag in tags]
+            for recID, field_tag, phrase in run_sql(query, (first_recID, last_recID) + tuple(tags)):
+                for tag, matcher in matchers:
+                    if matcher(field_tag):
+                        yield recID, tag, phrase
+        if '8564_u' in self.tags:
             ## FIXME: Quick hack to be sure that hidden files are
             ## actually indexed.
-            phrases = set(phrases)
-            for recID in recIDs:
-                for bibdocfile in BibRecDocs(recID).list_latest_files():
-                    phrases.add((recID, bibdocfile.get_url()))
+            for recID, url in get_latest_file_urls(first_recID, last_recID):
+                yield recID, '8564_u', url
         #authority records
-        pattern = tag.replace('%', '*')
-        matches = fnmatch.filter(CFG_BIBAUTHORITY_CONTROLLED_FIELDS_BIBLIOGRAPHIC.keys(), pattern)
-        if not len(matches):
-            return phrases
-        phrases = set(phrases)
-        for tag_match in matches:
-            authority_tag = tag_match[0:3] + "__0"
+        authority_tags = []
+        for tag in self.tags:
+            pattern = tag.replace('%', '*')
+            matches = fnmatch.filter(CFG_BIBAUTHORITY_CONTROLLED_FIELDS_BIBLIOGRAPHIC.keys(), pattern)
+            for tag_match in matches:
+                authority_tags.append((tag, tag_match[0:3] + "__0"))
+        if not authority_tags:
+            return
+        control_nos_by_tag = []
+        all_control_nos = set()
+        for tag, authority_tag in authority_tags:
+            control_nos = get_fieldvalues_by_record(recIDs, authority_tag)
+            control_nos_by_tag.append((tag, control_nos))
+            for values in control_nos.itervalues():
+                all_control_nos.update(values)
+        index_strings = get_index_strings_by_control_nos(all_control_nos)
+        for tag, control_nos in control_nos_by_tag:
             for recID in recIDs:
-                control_nos = get_fieldvalues(recID, authority_tag)
-                for control_no in control_nos:
-                    new_strings = get_index_strings_by_control_no(control_no)
-                    for string_value in new_strings:
-                        phrases.add((recID, string_value))
-        return phrases
+                for control_no in control_nos.get(recID, []):
+                    for string_value in index_strings.get(control_no, []):
+                        yield recID, tag, string_value
+
+
+def get_tag_like_matcher(tag):
+    """
+    Returns a function telling whether a MARC tag matches TAG,
+    a pattern of the SQL LIKE operator as used in the index
+    definitions, e.g. '100__a' or '700__%'.
+    """
+    pattern = "".join([{'%': '.*', '_': '.'}.get(char, re.escape(char))
+                       for char in tag])
+    return re.compile("^%s$" % pattern, re.IGNORECASE).match
 
 
 class NonmarcTermCollector(TermCollector):
@@ -22,7 +22,8 @@ from invenio.dbquery import run_sql, \
     deserialize_via_marshal
 from invenio.testutils import make_test_suite, run_test_suite, nottest
 from invenio.bibindex_termcollectors import TermCollector, \
-    NonmarcTermCollector
+    NonmarcTermCollector, \
+    get_tag_like_matcher
 from invenio.bibindex_engine import detect_tokenizer_type
 from invenio.bibindex_engine_utils import get_index_id_from_index_name, \
     get_index_remove_stopwords, \
@@ -107,6 +108,29 @@ class BibIndexTermCollectorTest(unittest.TestCase):
         terms = mtc.collect([6, 7, 8, 22], {})
         self.assertEqual(len(terms[7]), 8)
 
+    def test_batched_tags_same_terms_as_single_tags(self):
+        """bibindex - tags collected together give the same terms as one by one"""
+        for index_name in ("author", "title", "keyword", "affiliation"):
+            mtc = initialise_term_collector(index_name)
+            recIDs = range(1, 20)
+            terms = mtc.collect(recIDs, {})
+            expected = {}
+            tags = mtc.tags
+            for tag in tags:
+                mtc.tags = [tag]
+                mtc.collect(recIDs, expected)
+            self.assertEqual(sorted(terms.keys()), sorted(expected.keys()))
+            for recID in terms:
+                self.assertEqual(sorted(terms[recID]), sorted(expected[recID]))
+
+    def test_tag_like_matcher(self):
+        """bibindex - tags of the index are matched like with SQL LIKE"""
+        self.assertTrue(get_tag_like_matcher("100__a")("100__a"))
+        self.assertTrue(get_tag_like_matcher("100__a")("10012A"))
+        self.assertTrue(get_tag_like_matcher("700__%")("700__u"))
+        self.assertFalse(get_tag_like_matcher("700__%")("710__a"))
+        self.assertFalse(get_tag_like_matcher("100__a")("100__au"))
+
 
 class BibIndexNonmarcTermCollectorTest(unittest.TestCase):
 
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibIndex termlist codec.
+
+Encodes and decodes the term lists of the records stored in the
+termlist column of the reverse index tables (e.g. idxWORD01R).  All
+the readers and writers of the reverse tables go through this module.
+
+Two formats are known:
+
+ - 'marshal': the list of terms serialized via marshal and compressed
+   with zlib, as done by dbquery.serialize_via_marshal();
+
+ - 'frontcoded': a version byte followed by the zlib compressed,
+   sorted and front-coded terms: the number of terms, then for every
+   term the length of the prefix it shares with the previous term,
+   the length of the rest of the term and the rest of the term, the
+   lengths being variable-length integers (7 bits per byte, the high
+   bit telling that more bytes follow).
+
+The version byte of the front-coded format is never the first byte of
+a zlib stream (whose low four bits are always 8), so the termlists
+written by older versions are still decoded.  Front-coding changes the
+order of the terms and only applies to lists of byte strings; other
+lists are always written via marshal.
+"""
+
+__revision__ = "$Id$"
+
+import marshal
+from zlib import compress, decompress
+
+from invenio.bibindex_engine_config import CFG_BIBINDEX_TERMLIST_FORMAT
+
+# version byte of the front-coded termlist format:
+CFG_BIBINDEX_TERMLIST_FRONTCODED_VERSION = '\x01'
+
+CFG_BIBINDEX_TERMLIST_FORMATS = ('marshal', 'frontcoded')
+
+
+def _encode_varint(number):
+    """Return variable-length encoding of non-negative integer NUMBER."""
+    out = []
+    while number > 0x7f:
+        out.append(chr(0x80 | (number & 0x7f)))
+        number >>= 7
+    out.append(chr(number))
+    return ''.join(out)
+
+
+def _decode_varint(data, position):
+    """Return (integer, next position) of the variable-length integer
+    starting at POSITION of DATA."""
+    byte = ord(data[position])
+    position += 1
+    if byte < 0x80:
+        return byte, position
+    number = byte & 0x7f
+    shift = 7
+    while True:
+        byte = ord(data[position])
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+def serialize_termlist_frontcoded(terms):
+    """Return front-coded string representation of the list of byte
+    strings TERMS."""
+    out = [_encode_varint(len(terms))]
+    previous = ''
+    for term in sorted(terms):
+        prefix = 0
+        max_prefix = min(len(previous), len(term))
+        while prefix < max_prefix and previous[prefix] == term[prefix]:
+            prefix += 1
+        out.append(_encode_varint(prefix))
+        out.append(_encode_varint(len(term) - prefix))
+        out.append(term[prefix:])
+        previous = term
+    return CFG_BIBINDEX_TERMLIST_FRONTCODED_VERSION + compress(''.join(out))
+
+
+def deserialize_termlist_frontcoded(data):
+    """Return list of terms of the front-coded string DATA."""
+    data = decompress(data[1:])
+    nb_terms, position = _decode_varint(data, 0)
+    terms = []
+    append = terms.append
+    previous = ''
+    for dummy in xrange(nb_terms):
+        prefix, position = _decode_varint(data, position)
+        length, position = _decode_varint(data, position)
+        previous = previous[:prefix] + data[position:position + length]
+        position += length
+        append(previous)
+    if position != len(data):
+        raise ValueError("front-coded termlist of wrong size")
+    return terms
+
+
+def serialize_termlist(terms, termlist_format=None):
+    """
+    Return string representation of the list of TERMS of a record, to
+    be stored into the termlist column of a reverse index table, in
+    TERMLIST_FORMAT (by default CFG_BIBINDEX_TERMLIST_FORMAT).
+    """
+    if termlist_format is None:
+        termlist_format = CFG_BIBINDEX_TERMLIST_FORMAT
+    if termlist_format == 'frontcoded':
+        for term in terms:
+            if type(term) is not str:
+                break
+        else:
+            return serialize_termlist_frontcoded(terms)
+    elif termlist_format != 'marshal':
+        raise ValueError("unknown termlist format %s" % termlist_format)
+    return compress(marshal.dumps(terms))
+
+
+def deserialize_termlist(data):
+    """Return list of terms of string DATA, as read from the termlist
+    column of a reverse index table, in any of the known formats."""
+    if data[:1] == CFG_BIBINDEX_TERMLIST_FRONTCODED_VERSION:
+        return deserialize_termlist_frontcoded(data)
+    return marshal.loads(decompress(data))
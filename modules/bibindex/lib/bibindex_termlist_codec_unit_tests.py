@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the BibIndex termlist codec."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.dbquery import serialize_via_marshal
+from invenio.bibindex_termlist_codec import serialize_termlist, \
+     deserialize_termlist
+
+TERMS = ['ellis', 'ellis, j', 'ellis, john', '__author__ellis', 'higgs',
+         'e', '\xe6\x95\xac', 'a' * 300, 'ellis']
+
+
+class TermlistCodecTest(InvenioTestCase):
+    """Test of the termlist formats."""
+
+    def test_frontcoded(self):
+        """bibindex termlist codec - front-coded terms are kept"""
+        data = serialize_termlist(TERMS, 'frontcoded')
+        self.assertEqual(sorted(TERMS), deserialize_termlist(data))
+
+    def test_marshal(self):
+        """bibindex termlist codec - marshal'ed terms are kept in order"""
+        data = serialize_termlist(TERMS, 'marshal')
+        self.assertEqual(TERMS, deserialize_termlist(data))
+
+    def test_old_termlists(self):
+        """bibindex termlist codec - termlists of older versions are read"""
+        for terms in (TERMS, [], [u'unicode']):
+            self.assertEqual(terms,
+                             deserialize_termlist(serialize_via_marshal(terms)))
+
+    def test_empty_termlist(self):
+        """bibindex termlist codec - empty termlists"""
+        self.assertEqual([], deserialize_termlist(
+                                 serialize_termlist([], 'frontcoded')))
+
+    def test_unicode_terms_marshalled(self):
+        """bibindex termlist codec - lists of unicode terms via marshal"""
+        terms = ['ellis', u'\xe9cole']
+        data = serialize_termlist(terms, 'frontcoded')
+        self.assertEqual(serialize_via_marshal(terms), data)
+        self.assertEqual(terms, deserialize_termlist(data))
+
+    def test_frontcoded_smaller(self):
+        """bibindex termlist codec - front-coded terms are smaller"""
+        terms = ['__title__term%05d' % i for i in xrange(2000)]
+        self.failUnless(len(serialize_termlist(terms, 'frontcoded')) <
+                        len(serialize_termlist(terms, 'marshal')))
+
+    def test_damaged_termlist(self):
+        """bibindex termlist codec - damaged front-coded termlists"""
+        data = serialize_termlist(TERMS, 'frontcoded')
+        self.assertRaises(Exception, deserialize_termlist, data[:-3])
+
+    def test_unknown_format(self):
+        """bibindex termlist codec - unknown termlist format"""
+        self.assertRaises(ValueError, serialize_termlist, TERMS, 'pickle')
+
+
+TEST_SUITE = make_test_suite(TermlistCodecTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
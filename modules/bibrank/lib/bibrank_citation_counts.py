@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibRank citation counts.
+
+Keeps the number of citations of every record, with and without
+self-citations, in two integer arrays indexed by record ID, together
+with the IDs of the cited records sorted by decreasing number of
+citations for both counts.  The web workers use them for cited:M->N
+searches, citation summaries and ranking by citations instead of
+building dictionaries and sorted lists of tuples of all the records.
+
+The citation indexer and the self-citations task store the arrays in
+redis as one binary blob after every run, so that the web workers
+only have to load it.
+
+Blob format: a header made of the magic string and the format
+version, the size of the count arrays (the largest record ID plus
+one) and the number of cited records, followed by the citation
+counts, the citation counts without self-citations and the two
+orders of the cited records, all as little-endian 32-bit integers.
+"""
+
+__revision__ = "$Id$"
+
+import sys
+import struct
+from array import array
+
+from invenio.intbitset import intbitset
+from invenio.redisutils import get_redis
+from invenio.dbquery import deserialize_via_marshal
+
+# magic string and version of the stored citation counts format:
+CFG_BIBRANK_CITATION_COUNTS_MAGIC = 'CITC'
+CFG_BIBRANK_CITATION_COUNTS_VERSION = 1
+
+# redis key of the stored citation counts:
+CFG_BIBRANK_CITATION_COUNTS_KEY = 'citation_counts'
+
+_HEADER = struct.Struct('<4sBxxx')
+_SIZES = struct.Struct('<II')
+
+# array type codes of unsigned and signed 32-bit integers:
+if array('I').itemsize == 4:
+    _UNSIGNED = 'I'
+else:
+    _UNSIGNED = 'L'
+if array('i').itemsize == 4:
+    _SIGNED = 'i'
+else:
+    _SIGNED = 'l'
+
+
+def _array_from_string(typecode, data):
+    """Return array of TYPECODE read from little-endian string DATA."""
+    values = array(typecode)
+    values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _array_to_string(values):
+    """Return little-endian string of array VALUES."""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+
+class CitationCounts(object):
+    """Citation counts of all the records."""
+
+    def __init__(self, cites, cites_excluding_selfcites, order,
+                 order_excluding_selfcites):
+        """
+        CITES and CITES_EXCLUDING_SELFCITES are the arrays of counts
+        indexed by record ID, ORDER and ORDER_EXCLUDING_SELFCITES the
+        arrays of the cited records sorted by decreasing count.
+        """
+        self.cites = cites
+        self.cites_excluding_selfcites = cites_excluding_selfcites
+        self.order = order
+        self.order_excluding_selfcites = order_excluding_selfcites
+        self.keys = intbitset(order.tolist())
+
+    def _get_arrays(self, exclude_selfcites):
+        """Return the counts and order arrays to use."""
+        if exclude_selfcites:
+            return self.cites_excluding_selfcites, self.order_excluding_selfcites
+        return self.cites, self.order
+
+    def get_count(self, recid, exclude_selfcites=False):
+        """Return number of citations of RECID."""
+        counts = self._get_arrays(exclude_selfcites)[0]
+        if 0 <= recid < len(counts):
+            return counts[recid]
+        return 0
+
+    def get_sorted_counts(self, exclude_selfcites=False):
+        """
+        Return iterator of (recid, count) tuples of the cited records,
+        sorted by decreasing count.
+        """
+        counts, order = self._get_arrays(exclude_selfcites)
+        for recid in order:
+            yield recid, counts[recid]
+
+    def _get_position(self, counts, order, count):
+        """Return position in ORDER of the first record cited less
+        than COUNT times."""
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if counts[order[middle]] >= count:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_records_with_counts(self, first, last=None,
+                                exclude_selfcites=False):
+        """
+        Return intbitset of the cited records cited between FIRST and
+        LAST times (without upper limit if LAST is None).
+        """
+        counts, order = self._get_arrays(exclude_selfcites)
+        start = 0
+        if last is not None:
+            start = self._get_position(counts, order, last + 1)
+        end = self._get_position(counts, order, first)
+        if start >= end:
+            return intbitset()
+        return intbitset(order[start:end].tolist())
+
+
+class CitationWeights(object):
+    """Read-only dictionary-like view {recid: count} of the cited
+    records of CitationCounts."""
+
+    def __init__(self, citation_counts, exclude_selfcites=False):
+        self.citation_counts = citation_counts
+        self.exclude_selfcites = exclude_selfcites
+
+    def __len__(self):
+        return len(self.citation_counts.keys)
+
+    def __contains__(self, recid):
+        return recid in self.citation_counts.keys
+
+    def __getitem__(self, recid):
+        if recid not in self.citation_counts.keys:
+            raise KeyError(recid)
+        return self.citation_counts.get_count(recid, self.exclude_selfcites)
+
+    def get(self, recid, default=None):
+        if recid not in self.citation_counts.keys:
+            return default
+        return self.citation_counts.get_count(recid, self.exclude_selfcites)
+
+    def keys(self):
+        return list(self.citation_counts.keys)
+
+    def iteritems(self):
+        return self.citation_counts.get_sorted_counts(self.exclude_selfcites)
+
+
+class SortedCitationCounts(object):
+    """Read-only list-like view of the (recid, count) tuples of the
+    cited records of CitationCounts, sorted by decreasing count."""
+
+    def __init__(self, citation_counts, exclude_selfcites=False):
+        self.citation_counts = citation_counts
+        self.exclude_selfcites = exclude_selfcites
+
+    def __len__(self):
+        return len(self.citation_counts.keys)
+
+    def __iter__(self):
+        return self.citation_counts.get_sorted_counts(self.exclude_selfcites)
+
+    def __getitem__(self, index):
+        counts, order = self.citation_counts._get_arrays(self.exclude_selfcites)
+        recid = order[index]
+        return recid, counts[recid]
+
+
+def build_citation_counts(weights, selfcites):
+    """
+    Return CitationCounts of WEIGHTS, the dictionary {recid: number of
+    citations}, and SELFCITES, the dictionary {recid: number of
+    self-citations}.
+    """
+    size = 0
+    if weights:
+        size = max(weights) + 1
+    cites = array(_UNSIGNED, [0]) * size
+    cites_excluding_selfcites = array(_SIGNED, [0]) * size
+    for recid, count in weights.iteritems():
+        cites[recid] = count
+        cites_excluding_selfcites[recid] = count - selfcites.get(recid, 0)
+    order = array(_UNSIGNED, sorted(weights,
+                                    key=lambda recid: (-cites[recid], recid)))
+    order_excluding_selfcites = array(_UNSIGNED, sorted(weights,
+        key=lambda recid: (-cites_excluding_selfcites[recid], recid)))
+    return CitationCounts(cites, cites_excluding_selfcites, order,
+                          order_excluding_selfcites)
+
+
+def dumps_citation_counts(citation_counts):
+    """Return string representation of CITATION_COUNTS."""
+    return ''.join([_HEADER.pack(CFG_BIBRANK_CITATION_COUNTS_MAGIC,
+                                 CFG_BIBRANK_CITATION_COUNTS_VERSION),
+                    _SIZES.pack(len(citation_counts.cites),
+                                len(citation_counts.order)),
+                    _array_to_string(citation_counts.cites),
+                    _array_to_string(citation_counts.cites_excluding_selfcites),
+                    _array_to_string(citation_counts.order),
+                    _array_to_string(citation_counts.order_excluding_selfcites)])
+
+
+def loads_citation_counts(data):
+    """
+    Return CitationCounts of string DATA, as returned by
+    dumps_citation_counts().  Raise ValueError if DATA is not valid.
+    """
+    if len(data) < _HEADER.size + _SIZES.size:
+        raise ValueError("citation counts too short")
+    magic, version = _HEADER.unpack_from(data)
+    if magic != CFG_BIBRANK_CITATION_COUNTS_MAGIC or \
+           version != CFG_BIBRANK_CITATION_COUNTS_VERSION:
+        raise ValueError("unknown citation counts format")
+    size, nb_cited = _SIZES.unpack_from(data, _HEADER.size)
+    if len(data) != _HEADER.size + _SIZES.size + 8 * (size + nb_cited):
+        raise ValueError("citation counts of wrong size")
+    position = _HEADER.size + _SIZES.size
+    arrays = []
+    for typecode, length in ((_UNSIGNED, size), (_SIGNED, size),
+                             (_UNSIGNED, nb_cited), (_UNSIGNED, nb_cited)):
+        arrays.append(_array_from_string(typecode,
+                                         data[position:position + 4 * length]))
+        position += 4 * length
+    return CitationCounts(*arrays)
+
+
+def get_cached_weights(rank_method_code, key):
+    """Return weights of RANK_METHOD_CODE stored in redis under KEY by
+    its indexer, or from the database."""
+    from invenio.bibrank_tag_based_indexer import fromDB
+    serialized_weights = get_redis().get(key)
+    if serialized_weights:
+        weights = deserialize_via_marshal(serialized_weights)
+        if weights is not None:
+            return weights
+    return fromDB(rank_method_code)
+
+
+def store_citation_counts(weights=None, selfcites=None):
+    """
+    Store in redis the citation counts of WEIGHTS and SELFCITES, the
+    latest weights of the citation and selfcites rank methods.  The
+    weights not given are read from their cache.  Return the stored
+    CitationCounts.
+    """
+    if weights is None:
+        weights = get_cached_weights('citation', 'citations_weights')
+    if selfcites is None:
+        selfcites = get_cached_weights('selfcites', 'selfcites_weights')
+    citation_counts = build_citation_counts(weights, selfcites)
+    get_redis().set(CFG_BIBRANK_CITATION_COUNTS_KEY,
+                    dumps_citation_counts(citation_counts))
+    return citation_counts
+
+
+def get_citation_counts():
+    """Return the citation counts stored in redis, building and storing
+    them if needed."""
+    data = get_redis().get(CFG_BIBRANK_CITATION_COUNTS_KEY)
+    if data:
+        try:
+            return loads_citation_counts(data)
+        except ValueError:
+            pass
+    return store_citation_counts()
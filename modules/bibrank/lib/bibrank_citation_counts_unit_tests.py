@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the BibRank citation counts."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio.bibrank_citation_counts import build_citation_counts, \
+     dumps_citation_counts, loads_citation_counts, CitationWeights, \
+     SortedCitationCounts
+
+# number of citations and of self-citations of the test records:
+WEIGHTS = {1: 5, 2: 1, 4: 12, 7: 5, 9: 3, 12: 1}
+SELFCITES = {1: 4, 4: 2, 9: 3}
+
+
+class CitationCountsTest(InvenioTestCase):
+    """Test of the citation counts arrays."""
+
+    def setUp(self):
+        """Build the test citation counts."""
+        self.counts = build_citation_counts(WEIGHTS, SELFCITES)
+
+    def test_counts(self):
+        """bibrank citation counts - counts of records"""
+        self.assertEqual(12, self.counts.get_count(4))
+        self.assertEqual(10, self.counts.get_count(4, exclude_selfcites=True))
+        self.assertEqual(0, self.counts.get_count(3))
+        self.assertEqual(0, self.counts.get_count(100))
+        self.assertEqual(intbitset(WEIGHTS.keys()), self.counts.keys)
+
+    def test_sorted_counts(self):
+        """bibrank citation counts - records sorted by counts"""
+        self.assertEqual([(4, 12), (1, 5), (7, 5), (9, 3), (2, 1), (12, 1)],
+                         list(self.counts.get_sorted_counts()))
+        self.assertEqual([(4, 10), (7, 5), (1, 1), (2, 1), (12, 1), (9, 0)],
+                         list(self.counts.get_sorted_counts(exclude_selfcites=True)))
+
+    def test_records_with_counts(self):
+        """bibrank citation counts - records cited between M and N times"""
+        for exclude_selfcites in (False, True):
+            weights = dict(self.counts.get_sorted_counts(exclude_selfcites))
+            for first, last in ((1, 1), (0, 5), (2, 11), (4, None),
+                                (13, None), (6, 4)):
+                expected = intbitset([recid for recid, count
+                                      in weights.iteritems()
+                                      if first <= count and
+                                      (last is None or count <= last)])
+                self.assertEqual(expected, self.counts.get_records_with_counts(
+                                           first, last, exclude_selfcites))
+
+    def test_serialization(self):
+        """bibrank citation counts - counts are kept by serialization"""
+        counts = loads_citation_counts(dumps_citation_counts(self.counts))
+        for attribute in ('cites', 'cites_excluding_selfcites', 'order',
+                          'order_excluding_selfcites'):
+            self.assertEqual(list(getattr(self.counts, attribute)),
+                             list(getattr(counts, attribute)))
+        self.assertEqual(self.counts.keys, counts.keys)
+
+    def test_invalid_serialization(self):
+        """bibrank citation counts - damaged counts are refused"""
+        data = dumps_citation_counts(self.counts)
+        self.assertRaises(ValueError, loads_citation_counts, data[:-1])
+        self.assertRaises(ValueError, loads_citation_counts,
+                          'not citation counts')
+
+    def test_empty_counts(self):
+        """bibrank citation counts - no citations"""
+        counts = loads_citation_counts(dumps_citation_counts(
+                                       build_citation_counts({}, {})))
+        self.assertEqual(0, counts.get_count(1))
+        self.assertEqual(intbitset(), counts.get_records_with_counts(0))
+
+
+class CitationCountsViewsTest(InvenioTestCase):
+    """Test of the views of the citation counts."""
+
+    def test_weights(self):
+        """bibrank citation counts - view as dictionary"""
+        counts = build_citation_counts(WEIGHTS, SELFCITES)
+        weights = CitationWeights(counts)
+        self.assertEqual(WEIGHTS, dict(weights.iteritems()))
+        self.assertEqual(5, weights[7])
+        self.assertEqual(0, weights.get(3, 0))
+        self.failIf(3 in weights)
+        self.assertRaises(KeyError, weights.__getitem__, 3)
+        selfcites_weights = CitationWeights(counts, exclude_selfcites=True)
+        self.assertEqual(0, selfcites_weights.get(9))
+        self.assertEqual(sorted(WEIGHTS.keys()), selfcites_weights.keys())
+
+    def test_sorted_counts(self):
+        """bibrank citation counts - view as sorted list"""
+        counts = build_citation_counts(WEIGHTS, SELFCITES)
+        sorted_counts = SortedCitationCounts(counts)
+        self.assertEqual(len(WEIGHTS), len(sorted_counts))
+        self.assertEqual((4, 12), sorted_counts[0])
+        self.assertEqual(list(counts.get_sorted_counts()), list(sorted_counts))
+
+
+TEST_SUITE = make_test_suite(CitationCountsTest,
+                             CitationCountsViewsTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
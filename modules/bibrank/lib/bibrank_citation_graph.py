@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibRank citation graph.
+
+Keeps the citations of rnkCITATIONDICT as two adjacency arrays in
+compressed sparse row (CSR) format, one going from the citing records
+to the cited ones (references) and one going from the cited records to
+the citing ones (citations).  The arrays are written by the citation
+indexer to a file in the cache directory and are memory-mapped
+read-only by the web workers, so that refersto:/citedby: searches
+and co-citation lists do not have to query rnkCITATIONDICT record by
+record.  The indexer refreshes the file from the changes it has just
+stored, without scanning rnkCITATIONDICT again.
+
+The file is stamped with the last rnkCITATIONLOG entry it accounts
+for.  Every change of rnkCITATIONDICT is logged there, so the web
+workers ignore a graph whose stamp is not the last entry of the log,
+e.g. a stale file on a node the indexer has not refreshed.
+
+File format: a header made of the magic string, the format version
+and the stamp, followed by the references and then by the citations
+adjacency.  Every adjacency is made of the number of rows (the
+largest record ID plus one), the number of edges, the row offsets and
+the sorted record IDs of every row, all as little-endian unsigned
+32-bit integers.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+from invenio.dbquery import run_sql
+from invenio.intbitset import intbitset
+from invenio.bibrank_rank_store import CFG_BIBRANK_RANK_STORE_DIR
+
+CFG_BIBRANK_CITATION_GRAPH_FILE = os.path.join(CFG_BIBRANK_RANK_STORE_DIR,
+                                               'citation_graph.csr')
+
+# magic string and version of the stored citation graph format:
+CFG_BIBRANK_CITATION_GRAPH_MAGIC = 'CITG'
+CFG_BIBRANK_CITATION_GRAPH_VERSION = 2
+
+# number of records whose citations are fetched at once when building
+# the graph from the database:
+CFG_BIBRANK_CITATION_GRAPH_CHUNK_SIZE = 100000
+
+_HEADER = struct.Struct('<4sBxxxQ')
+_COUNTS = struct.Struct('<II')
+_ROW = struct.Struct('<II')
+
+# array type code of unsigned 32-bit integers:
+if array('I').itemsize == 4:
+    _TYPECODE = 'I'
+else:
+    _TYPECODE = 'L'
+
+# citation graph mapped by this process and the identity of its file:
+_CITATION_GRAPH = {}
+
+
+def _from_little_endian(values):
+    """Convert array VALUES read from a file to the native byte order."""
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _to_little_endian(values):
+    """Return string of array VALUES in little-endian byte order."""
+    if sys.byteorder == 'big':
+        values = array(_TYPECODE, values)
+        values.byteswap()
+    return values.tostring()
+
+
+def build_adjacency(edges):
+    """
+    Return (offsets, targets) arrays of the adjacency of EDGES, a
+    sequence of (source, target) tuples sorted by source and target.
+    """
+    offsets = array(_TYPECODE, [0])
+    targets = array(_TYPECODE)
+    for source, target in edges:
+        if len(offsets) <= source:
+            offsets.extend(array(_TYPECODE, [len(targets)]) * (source + 1 - len(offsets)))
+        targets.append(target)
+    offsets.append(len(targets))
+    return offsets, targets
+
+
+def update_adjacency(offsets, targets, changes):
+    """
+    Return new (offsets, targets) arrays of the adjacency OFFSETS,
+    TARGETS with CHANGES, a dictionary of {source: (added targets,
+    removed targets)}.  The rows of the unchanged sources are copied
+    as they are.
+    """
+    old_size = len(offsets) - 1
+    size = old_size
+    if changes:
+        size = max(size, max(changes) + 1)
+    new_offsets = array(_TYPECODE, [0])
+    new_targets = array(_TYPECODE)
+    position = 0
+    for source in sorted(changes) + [size]:
+        copy_end = min(source, old_size)
+        if position < copy_end:
+            start, end = offsets[position], offsets[copy_end]
+            shift = len(new_targets) - start
+            new_targets.extend(targets[start:end])
+            new_offsets.extend(array(_TYPECODE, [offset + shift for offset
+                                     in offsets[position + 1:copy_end + 1]]))
+            position = copy_end
+        if position < source:
+            new_offsets.extend(array(_TYPECODE, [len(new_targets)]) * (source - position))
+            position = source
+        if source == size:
+            break
+        row = set()
+        if source < old_size:
+            row = set(targets[offsets[source]:offsets[source + 1]])
+        added, removed = changes[source]
+        new_targets.extend(array(_TYPECODE, sorted((row - set(removed)) | set(added))))
+        new_offsets.append(len(new_targets))
+        position = source + 1
+    return new_offsets, new_targets
+
+
+def get_adjacency_changes(added, removed, reverse=False):
+    """
+    Return dictionary of {source: (added targets, removed targets)}
+    of the ADDED and REMOVED (citer, citee) tuples, where the source
+    is the citer, or the citee if REVERSE is set.
+    """
+    changes = {}
+    for (pairs, index) in ((added, 0), (removed, 1)):
+        for citer, citee in pairs:
+            if reverse:
+                citer, citee = citee, citer
+            changes.setdefault(citer, ([], []))[index].append(citee)
+    return changes
+
+
+def get_citation_graph_stamp():
+    """Return ID of the last rnkCITATIONLOG entry, 0 if there is none."""
+    res = run_sql("SELECT MAX(id) FROM rnkCITATIONLOG")
+    if res and res[0][0]:
+        return int(res[0][0])
+    return 0
+
+
+def dumps_citation_graph(refs, cites, stamp=0):
+    """
+    Return string representation of the citation graph of the REFS
+    and CITES adjacencies, each being an (offsets, targets) tuple,
+    stamped with STAMP.
+    """
+    parts = [_HEADER.pack(CFG_BIBRANK_CITATION_GRAPH_MAGIC,
+                          CFG_BIBRANK_CITATION_GRAPH_VERSION, stamp)]
+    for offsets, targets in (refs, cites):
+        parts.append(_COUNTS.pack(len(offsets) - 1, len(targets)))
+        parts.append(_to_little_endian(offsets))
+        parts.append(_to_little_endian(targets))
+    return ''.join(parts)
+
+
+def save_citation_graph(refs, cites, filename=None, stamp=None):
+    """
+    Store the citation graph of the REFS and CITES adjacencies,
+    replacing the previous one atomically.  STAMP defaults to the
+    current stamp of rnkCITATIONLOG.
+    """
+    if filename is None:
+        filename = CFG_BIBRANK_CITATION_GRAPH_FILE
+    if stamp is None:
+        stamp = get_citation_graph_stamp()
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp_filename = '%s.%s' % (filename, os.getpid())
+    tmp_file = open(tmp_filename, 'wb')
+    try:
+        tmp_file.write(dumps_citation_graph(refs, cites, stamp))
+    finally:
+        tmp_file.close()
+    os.rename(tmp_filename, filename)
+
+
+def get_citation_pairs(column, chunk_size=CFG_BIBRANK_CITATION_GRAPH_CHUNK_SIZE):
+    """
+    Yield the (source, target) tuples of rnkCITATIONDICT sorted by
+    source and target, the source being the COLUMN citer or citee.
+    """
+    if column == 'citer':
+        other = 'citee'
+    else:
+        other = 'citer'
+    res = run_sql("SELECT MAX(%s) FROM rnkCITATIONDICT" % column)
+    max_source = res and res[0][0] or 0
+    for first in xrange(0, max_source + 1, chunk_size):
+        for pair in run_sql("""SELECT %s, %s FROM rnkCITATIONDICT
+                               WHERE %s BETWEEN %%s AND %%s
+                               ORDER BY %s, %s""" % (column, other, column,
+                                                     column, other),
+                            (first, first + chunk_size - 1)):
+            yield pair
+
+
+def rebuild_citation_graph(filename=None):
+    """Build the citation graph from rnkCITATIONDICT and store it."""
+    # stamp of the log before reading, so that changes made meanwhile
+    # make the graph stale:
+    stamp = get_citation_graph_stamp()
+    refs = build_adjacency(get_citation_pairs('citer'))
+    cites = build_adjacency(get_citation_pairs('citee'))
+    save_citation_graph(refs, cites, filename, stamp)
+    return len(refs[1])
+
+
+def update_citation_graph(added, removed, filename=None, stamp=None):
+    """
+    Refresh the stored citation graph with the ADDED and REMOVED
+    (citer, citee) tuples.  STAMP, if given, is the rnkCITATIONLOG
+    stamp before these changes were stored.  Build the graph from
+    rnkCITATIONDICT if there is no valid stored graph or if it does not
+    match STAMP.  Return the number of citations of the graph.
+    """
+    if filename is None:
+        filename = CFG_BIBRANK_CITATION_GRAPH_FILE
+    try:
+        graph = CitationGraph(filename)
+    except (EnvironmentError, ValueError):
+        return rebuild_citation_graph(filename)
+    try:
+        if stamp is not None and graph.stamp != stamp:
+            # the graph misses other changes than these ones
+            refs = None
+        else:
+            refs, cites = graph.get_adjacencies()
+    finally:
+        graph.close()
+    if refs is None:
+        return rebuild_citation_graph(filename)
+    refs = update_adjacency(refs[0], refs[1],
+                            get_adjacency_changes(added, removed))
+    cites = update_adjacency(cites[0], cites[1],
+                             get_adjacency_changes(added, removed, reverse=True))
+    save_citation_graph(refs, cites, filename)
+    return len(refs[1])
+
+
+def invalidate_citation_graph(filename=None):
+    """
+    Remove the stored citation graph, so that the citations are read
+    from rnkCITATIONDICT until the graph is built again.
+    """
+    if filename is None:
+        filename = CFG_BIBRANK_CITATION_GRAPH_FILE
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class CitationGraph(object):
+    """
+    Read-only citation graph, memory-mapped from the citation graph
+    file.
+    """
+
+    def __init__(self, filename):
+        """
+        Map FILENAME.  Raise ValueError if it is not a valid citation
+        graph, IOError if it cannot be read.
+        """
+        graph_file = open(filename, 'rb')
+        try:
+            self.identity = get_file_identity(graph_file.fileno())
+            if self.identity[2] < _HEADER.size:
+                raise ValueError("truncated citation graph %s" % filename)
+            self._map = mmap.mmap(graph_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            graph_file.close()
+        magic, version, self.stamp = _HEADER.unpack_from(self._map, 0)
+        if magic != CFG_BIBRANK_CITATION_GRAPH_MAGIC or \
+               version != CFG_BIBRANK_CITATION_GRAPH_VERSION:
+            self.close()
+            raise ValueError("unsupported citation graph %s" % filename)
+        self._adjacencies = []
+        offset = _HEADER.size
+        for dummy in range(2):
+            if len(self._map) < offset + _COUNTS.size:
+                self.close()
+                raise ValueError("truncated citation graph %s" % filename)
+            size, nb_edges = _COUNTS.unpack_from(self._map, offset)
+            offsets_start = offset + _COUNTS.size
+            targets_start = offsets_start + (size + 1) * 4
+            offset = targets_start + nb_edges * 4
+            if len(self._map) < offset:
+                self.close()
+                raise ValueError("truncated citation graph %s" % filename)
+            self._adjacencies.append((size, offsets_start, targets_start))
+
+    def close(self):
+        """Unmap the citation graph."""
+        self._map.close()
+
+    def _get_row(self, adjacency, recid):
+        """Return the array of the targets of RECID in ADJACENCY."""
+        size, offsets_start, targets_start = self._adjacencies[adjacency]
+        row = array(_TYPECODE)
+        if 0 <= recid < size:
+            start, end = _ROW.unpack_from(self._map, offsets_start + recid * 4)
+            row.fromstring(self._map[targets_start + start * 4:targets_start + end * 4])
+        return _from_little_endian(row)
+
+    def _get_rows(self, adjacency, recids):
+        """Return the array of the targets of all RECIDS in ADJACENCY."""
+        size, offsets_start, targets_start = self._adjacencies[adjacency]
+        mapping = self._map
+        unpack_from = _ROW.unpack_from
+        chunks = []
+        for recid in recids:
+            if recid >= size:
+                continue
+            start, end = unpack_from(mapping, offsets_start + recid * 4)
+            if start < end:
+                chunks.append(mapping[targets_start + start * 4:targets_start + end * 4])
+        rows = array(_TYPECODE)
+        rows.fromstring(''.join(chunks))
+        return _from_little_endian(rows)
+
+    def get_adjacencies(self):
+        """
+        Return the references and citations adjacencies as (offsets,
+        targets) tuples of arrays, copied in memory.
+        """
+        adjacencies = []
+        for size, offsets_start, targets_start in self._adjacencies:
+            offsets = array(_TYPECODE)
+            offsets.fromstring(self._map[offsets_start:targets_start])
+            _from_little_endian(offsets)
+            targets = array(_TYPECODE)
+            targets.fromstring(self._map[targets_start:targets_start + offsets[-1] * 4])
+            adjacencies.append((offsets, _from_little_endian(targets)))
+        return adjacencies
+
+    def get_refers_to(self, recid):
+        """Return array of the records cited by RECID."""
+        return self._get_row(0, recid)
+
+    def get_cited_by(self, recid):
+        """Return array of the records citing RECID."""
+        return self._get_row(1, recid)
+
+    def get_cited_by_count(self, recid):
+        """Return number of records citing RECID."""
+        size, offsets_start, dummy = self._adjacencies[1]
+        if 0 <= recid < size:
+            start, end = _ROW.unpack_from(self._map, offsets_start + recid * 4)
+            return end - start
+        return 0
+
+    def get_refersto_hitset(self, recids):
+        """Return intbitset of the records citing some of RECIDS."""
+        # intbitset() would load an array as a dumped bitset:
+        return intbitset(self._get_rows(1, recids).tolist())
+
+    def get_citedby_hitset(self, recids):
+        """Return intbitset of the records cited by some of RECIDS."""
+        return intbitset(self._get_rows(0, recids).tolist())
+
+    def get_co_cited_counts(self, recid):
+        """
+        Return dictionary of {recid: count} of the records cited
+        together with RECID, count being the number of records citing
+        both of them.
+        """
+        counts = {}
+        for ref in self._get_rows(0, self.get_cited_by(recid)):
+            counts[ref] = counts.get(ref, 0) + 1
+        counts.pop(recid, None)
+        return counts
+
+
+def get_file_identity(fileno_or_name):
+    """Return (inode, modification time, size) of a file."""
+    if isinstance(fileno_or_name, basestring):
+        stat = os.stat(fileno_or_name)
+    else:
+        stat = os.fstat(fileno_or_name)
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+def get_citation_graph(filename=None):
+    """
+    Return the CitationGraph of the stored citation graph, or None if
+    there is no valid one matching the current rnkCITATIONLOG stamp.
+    The graph is mapped again only when the citation indexer has
+    replaced the file.
+    """
+    if filename is None:
+        filename = CFG_BIBRANK_CITATION_GRAPH_FILE
+    try:
+        identity = get_file_identity(filename)
+    except OSError:
+        return None
+    stamp = get_citation_graph_stamp()
+    graph = _CITATION_GRAPH.get(filename)
+    if graph is not None and graph.identity == identity:
+        if graph.stamp != stamp:
+            return None
+        return graph
+    try:
+        new_graph = CitationGraph(filename)
+    except (EnvironmentError, ValueError):
+        return None
+    if new_graph.stamp != stamp:
+        # the indexer has not refreshed the graph yet:
+        new_graph.close()
+        return None
+    if graph is not None:
+        graph.close()
+    _CITATION_GRAPH[filename] = new_graph
+    return new_graph
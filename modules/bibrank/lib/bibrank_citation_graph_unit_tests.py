@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the BibRank citation graph."""
+
+__revision__ = "$Id$"
+
+import os
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio.bibrank_citation_graph import CitationGraph, build_adjacency, \
+     update_adjacency, get_adjacency_changes, save_citation_graph, \
+     update_citation_graph, invalidate_citation_graph, get_citation_graph
+
+try:
+    from mock import patch
+    HAS_MOCK = True
+except ImportError:
+    HAS_MOCK = False
+
+# (citer, citee) citations of the test graph:
+CITATIONS = [(1, 2), (1, 3), (4, 2), (4, 3), (4, 5), (6, 2), (7, 1)]
+
+
+def build_graph(citations):
+    """Return references and citations adjacencies of CITATIONS."""
+    refs = build_adjacency(sorted(citations))
+    cites = build_adjacency(sorted([(citee, citer) for citer, citee in citations]))
+    return refs, cites
+
+
+class CitationGraphTest(InvenioTestCase):
+    """Test of the stored citation graph."""
+
+    def setUp(self):
+        """Store the test graph in a temporary file."""
+        fd, self.filename = tempfile.mkstemp(prefix='citation_graph_')
+        os.close(fd)
+        refs, cites = build_graph(CITATIONS)
+        save_citation_graph(refs, cites, self.filename, stamp=7)
+
+    def tearDown(self):
+        """Remove the temporary file."""
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def test_records(self):
+        """bibrank citation graph - references and citations of records"""
+        graph = CitationGraph(self.filename)
+        self.assertEqual([2, 3, 5], list(graph.get_refers_to(4)))
+        self.assertEqual([1, 4, 6], list(graph.get_cited_by(2)))
+        self.assertEqual(3, graph.get_cited_by_count(2))
+        self.assertEqual([], list(graph.get_cited_by(100)))
+        self.assertEqual(0, graph.get_cited_by_count(100))
+        graph.close()
+
+    def test_hitsets(self):
+        """bibrank citation graph - records citing or cited by hitsets"""
+        graph = CitationGraph(self.filename)
+        self.assertEqual(intbitset([1, 4, 6, 7]),
+                         graph.get_refersto_hitset(intbitset([1, 2, 100])))
+        self.assertEqual(intbitset([2, 3, 5]),
+                         graph.get_citedby_hitset(intbitset([1, 4])))
+        graph.close()
+
+    def test_co_cited(self):
+        """bibrank citation graph - co-cited records"""
+        graph = CitationGraph(self.filename)
+        self.assertEqual({3: 2, 5: 1}, graph.get_co_cited_counts(2))
+        graph.close()
+
+    def test_update(self):
+        """bibrank citation graph - refreshed graph is like a new one"""
+        added = set([(4, 7), (10, 2), (1, 12)])
+        removed = set([(1, 3), (4, 5), (7, 1)])
+        update_citation_graph(added, removed, self.filename)
+        graph = CitationGraph(self.filename)
+        expected = build_graph((set(CITATIONS) - removed) | added)
+        self.assertEqual([tuple([list(array) for array in adjacency]) for adjacency in expected],
+                         [tuple([list(array) for array in adjacency]) for adjacency
+                          in graph.get_adjacencies()])
+        graph.close()
+
+    def test_invalid_graph(self):
+        """bibrank citation graph - damaged graph is refused"""
+        graph_file = open(self.filename, 'wb')
+        graph_file.write('not a citation graph')
+        graph_file.close()
+        self.assertRaises(ValueError, CitationGraph, self.filename)
+
+    def test_stamp(self):
+        """bibrank citation graph - graph is stamped"""
+        graph = CitationGraph(self.filename)
+        self.assertEqual(7, graph.stamp)
+        graph.close()
+
+    if HAS_MOCK:
+        @patch('invenio.bibrank_citation_graph.get_citation_graph_stamp',
+               lambda: 7)
+        def test_current_graph(self):
+            """bibrank citation graph - graph of the current stamp is used"""
+            graph = get_citation_graph(self.filename)
+            self.assertEqual([2, 3, 5], list(graph.get_refers_to(4)))
+
+        @patch('invenio.bibrank_citation_graph.get_citation_graph_stamp',
+               lambda: 8)
+        def test_stale_graph(self):
+            """bibrank citation graph - stale graph is not used"""
+            self.assertEqual(None, get_citation_graph(self.filename))
+
+        @patch('invenio.bibrank_citation_graph.get_citation_graph_stamp',
+               lambda: 8)
+        @patch('invenio.bibrank_citation_graph.run_sql', lambda *args: ())
+        def test_update_stale_graph(self):
+            """bibrank citation graph - stale graph is rebuilt, not updated"""
+            # rebuilt from the (empty) database:
+            self.assertEqual(0, update_citation_graph(set([(4, 7)]), set(),
+                                                      self.filename, stamp=6))
+            # updated:
+            self.assertEqual(1, update_citation_graph(set([(4, 7)]), set(),
+                                                      self.filename, stamp=8))
+
+    def test_invalidate(self):
+        """bibrank citation graph - invalidated graph is removed"""
+        invalidate_citation_graph(self.filename)
+        self.failIf(os.path.exists(self.filename))
+        invalidate_citation_graph(self.filename)
+        self.assertRaises(IOError, CitationGraph, self.filename)
+
+
+class UpdateAdjacencyTest(InvenioTestCase):
+    """Test of the incremental update of adjacencies."""
+
+    def test_update_adjacency(self):
+        """bibrank citation graph - rows are added, changed and emptied"""
+        offsets, targets = build_adjacency([(1, 5), (1, 6), (3, 1), (4, 2)])
+        changes = get_adjacency_changes([(0, 3), (3, 2), (8, 1)],
+                                        [(3, 1), (4, 2)])
+        self.assertEqual(build_adjacency([(0, 3), (1, 5), (1, 6), (3, 2), (8, 1)]),
+                         update_adjacency(offsets, targets, changes))
+
+    def test_no_changes(self):
+        """bibrank citation graph - adjacency without changes is kept"""
+        adjacency = build_adjacency([(1, 5), (2, 6)])
+        self.assertEqual(adjacency, update_adjacency(adjacency[0], adjacency[1], {}))
+
+
+TEST_SUITE = make_test_suite(CitationGraphTest,
+                             UpdateAdjacencyTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
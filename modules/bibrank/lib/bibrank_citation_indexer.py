@@ -26,6 +26,7 @@ import sys
 import ConfigParser
 from datetime import datetime
 from itertools import islice
+from multiprocessing import Pool
 
 from invenio.intbitset import intbitset
 from invenio.dbquery import run_sql
@@ -35,7 +36,11 @@ from invenio.bibindex_tokenizers.BibIndexJournalTokenizer import \
 from invenio.redisutils import get_redis
 from invenio.search_engine import search_pattern, \
                                   search_unit, \
-                                  get_collection_reclist
+                                  get_collection_reclist, \
+                                  is_search_unit_exact_bibwords_p, \
+                                  search_unit_in_bibwords_bulk, \
+                                  is_search_unit_exact_idxphrases_p, \
+                                  search_unit_in_idxphrases_bulk
 from invenio.bibformat_utils import parse_tag
 from invenio.bibknowledge import get_kb_mappings
 from invenio.bibtask import write_message, task_get_option, \
@@ -44,6 +49,10 @@ from invenio.bibtask import write_message, task_get_option, \
 from invenio.bibindex_engine_utils import get_field_tags
 from invenio.docextract_record import get_record
 from invenio.dbquery import serialize_via_marshal
+from invenio.bibrank_citation_graph import update_citation_graph, \
+     rebuild_citation_graph, invalidate_citation_graph, \
+     get_citation_graph_stamp
+from invenio.bibrank_citation_counts import store_citation_counts
 
 re_CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK \
                    = re.compile(CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK)
@@ -83,14 +92,71 @@ def get_recids_matching_query(p, f, config, m='e'):
     @param m: type of matching (usually 'e' for exact or 'r' for regexp)
     @type recID: string
     """
-    p = p.encode('utf-8')
+    return get_recids_matching_queries([p], f, config, m)[p]
+
+
+def get_recids_matching_queries(patterns, f, config, m='e',
+                                interruptible=True):
+    """Return dictionary {pattern: set of recIDs matching query for
+    pattern in field f} for all the PATTERNS.
+
+    Every distinct pattern is searched only once.  The exact patterns
+    that search_pattern() would look up as one term of the word or
+    phrase index of field f are looked up together, via one index query.
+    The task may be stopped or put to sleep while the other patterns are
+    searched one by one, unless INTERRUPTIBLE is False.
+
+    @param patterns: patterns to search for
+    @type patterns: iterable of unicode strings
+    @param f: field to search in
+    @type f: unicode string
+    @param config: bibrank configuration
+    @type config: dict
+    @param m: type of matching (usually 'e' for exact or 'r' for regexp)
+    @type m: string
+    @param interruptible: whether the task may be stopped or put to sleep
+    @type interruptible: bool
+    """
     f = f.encode('utf-8')
+    encoded_patterns = {}
+    for p in patterns:
+        encoded_patterns[p] = p.encode('utf-8')
+
+    hitsets = {}
+    if m == 'e':
+        if f == 'journal':
+            # the journal index is searched by words, see
+            # create_basic_search_units()
+            exact_patterns = [p for p in encoded_patterns.itervalues()
+                              if is_search_unit_exact_bibwords_p(p, f, 'w')]
+            if exact_patterns:
+                hitsets = search_unit_in_bibwords_bulk(exact_patterns, f)
+        else:
+            exact_patterns = [p for p in encoded_patterns.itervalues()
+                              if is_search_unit_exact_idxphrases_p(p, f, 'a')]
+            if exact_patterns:
+                hitsets = search_unit_in_idxphrases_bulk(exact_patterns, f)
+
     function = config.get("rank_method", "function")
     collections = config.get(function, 'collections')
-    if collections:
-        ret = search_pattern(p=p, f=f, m=m) & recids_cache(collections)
-    else:
-        ret = search_pattern(p=p, f=f, m=m) - deleted_recids_cache()
+    ret = {}
+    total = len([p for p in encoded_patterns.itervalues() if p not in hitsets])
+    done = 0
+    for p, encoded_p in encoded_patterns.iteritems():
+        hitset = hitsets.get(encoded_p)
+        if hitset is None:
+            if done % 30 == 0 and interruptible:
+                task_sleep_now_if_required()
+            if done % 1000 == 0 and total > 1:
+                mesg = "Searching %s done %s of %s" % (f, done, total)
+                write_message(mesg)
+                task_update_progress(mesg)
+            hitset = search_pattern(p=encoded_p, f=f, m=m)
+            done += 1
+        if collections:
+            ret[p] = hitset & recids_cache(collections)
+        else:
+            ret[p] = hitset - deleted_recids_cache()
     return ret
 
 
@@ -158,6 +224,11 @@ def process_and_store(recids, config, chunk_size):
     # If we have nothing to process
     # Do not update the weights dictionary
     modified = False
+    # Citations added and removed, to refresh the citation graph
+    # stamped with graph_stamp
+    added_citations = set()
+    removed_citations = set()
+    graph_stamp = get_citation_graph_stamp()
     # Process recent records first
     # The older records were most likely added by the above steps
     # to be reprocessed so they only have minor changes
@@ -165,25 +236,44 @@ def process_and_store(recids, config, chunk_size):
 
     # Split records to process into chunks so that we do not
     # fill up too much memory
-    while True:
-        task_sleep_now_if_required()
-
-        chunk = list(islice(recids_iter, chunk_size))
-        if not chunk:
-            break
-
-        write_message("Processing chunk #%s to #%s" % (chunk[0], chunk[-1]))
-        # The core work
-        cites, refs = process_chunk(chunk, config)
-        # Check that we haven't lost too many citations
-        cites_diff = compute_dicts_diff(chunk, refs, cites)
-        write_message("Citations balance %s" % cites_diff)
-        if citation_loss_limit and cites_diff <= -citation_loss_limit:
-            raise Exception('Lost too many references, aborting')
-
-        # Store processed citations/references
-        store_dicts(chunk, refs, cites)
-        modified = True
+    completed = False
+    try:
+        while True:
+            task_sleep_now_if_required()
+
+            chunk = list(islice(recids_iter, chunk_size))
+            if not chunk:
+                break
+
+            write_message("Processing chunk #%s to #%s" % (chunk[0], chunk[-1]))
+            # The core work
+            cites, refs = process_chunk(chunk, config)
+            # Check that we haven't lost too many citations
+            cites_diff = compute_dicts_diff(chunk, refs, cites)
+            write_message("Citations balance %s" % cites_diff)
+            if citation_loss_limit and cites_diff <= -citation_loss_limit:
+                raise Exception('Lost too many references, aborting')
+
+            # Store processed citations/references
+            added, removed = store_dicts(chunk, refs, cites)
+            # the last change of a citation wins:
+            added_citations -= removed
+            removed_citations -= added
+            added_citations |= added
+            removed_citations |= removed
+            modified = True
+        completed = True
+    finally:
+        if modified and not completed:
+            # The chunks already stored must reach the citation graph
+            # too, otherwise drop it until it is built again
+            try:
+                store_citation_graph(added_citations, removed_citations,
+                                     graph_stamp)
+            except Exception:
+                write_message("Citation graph could not be written, "
+                              "removing it", stream=sys.stderr)
+                invalidate_citation_graph()
 
     # Compute new weights dictionary
     if modified:
@@ -193,16 +283,54 @@ def process_and_store(recids, config, chunk_size):
 
     store_weights_cache(weights)
 
+    if modified:
+        store_citation_graph(added_citations, removed_citations, graph_stamp)
+
     return weights
 
 
+def store_citation_graph(added, removed, stamp=None):
+    """Refresh the citation graph with the ADDED and REMOVED
+    (citer, citee) citations, stored after the rnkCITATIONLOG STAMP"""
+    if task_get_option("quick") == "no":
+        nb_citations = rebuild_citation_graph()
+    else:
+        nb_citations = update_citation_graph(added, removed, stamp=stamp)
+    write_message("Citation graph written: %s citations (%s added, "
+                  "%s removed)" % (nb_citations, len(added), len(removed)))
+
+
 def store_weights_cache(weights):
     """Store into key/value store"""
     redis = get_redis()
     redis.set('citations_weights', serialize_via_marshal(weights))
+    if weights is not None:
+        store_citation_counts(weights=weights)
+
 
+def get_citation_workers(config):
+    """Return the number of worker processes analysing the citations,
+    as configured by the 'workers' option of the rank method"""
+    function = config.get("rank_method", "function")
+    try:
+        workers = int(config.get(function, "workers"))
+    except (ConfigParser.NoOptionError, ValueError, TypeError):
+        workers = 1
+    return max(workers, 1)
+
+
+def process_chunk(recids, config, workers=None):
+    """Return the citations and references dictionaries of RECIDS.
+
+    With WORKERS (by default as configured) greater than one, the
+    records are split between as many processes, whose results are
+    merged so that they do not depend on the number of workers.
+    """
+    if workers is None:
+        workers = get_citation_workers(config)
+    if workers > 1 and len(recids) > 1:
+        return process_chunk_in_parallel(recids, config, workers)
 
-def process_chunk(recids, config):
     tags = get_tags_config(config)
 
     # call the procedure that does the hard work by reading fields of
@@ -219,6 +347,55 @@ def process_chunk(recids, config):
                         config)
 
 
+def process_chunk_in_parallel(recids, config, workers):
+    """Analyse the citations of RECIDS with a pool of WORKERS processes.
+
+    Every worker analyses a part of the records, but knows all of them,
+    so that it records the citations between records of different
+    parts too.  The citations found by the workers are then merged.
+    """
+    updated_recids = set(recids)
+    parts = [(recids[i::workers], updated_recids, config)
+             for i in xrange(min(workers, len(recids)))]
+    write_message("Analysing citations with %s workers" % len(parts))
+    pool = Pool(len(parts))
+    try:
+        results = pool.map(process_chunk_part, parts)
+    finally:
+        pool.close()
+        pool.join()
+
+    citations = {}
+    references = {}
+    for recid in recids:
+        citations[recid] = set()
+        references[recid] = set()
+    for part_citations, part_references in results:
+        for recid, citers in part_citations.iteritems():
+            citations.setdefault(recid, set()).update(citers)
+        for recid, citees in part_references.iteritems():
+            references.setdefault(recid, set()).update(citees)
+    return citations, references
+
+
+def process_chunk_part(args):
+    """Worker of process_chunk_in_parallel(): return the non-empty
+    citations and references found by analysing the records of a part
+    of the chunk"""
+    recids, updated_recids, config = args
+    tags = get_tags_config(config)
+    citation_informations = get_citation_informations(recids, tags, config)
+    citations, references = ref_analyzer(citation_informations,
+                                         updated_recids,
+                                         tags,
+                                         config,
+                                         interruptible=False)
+    return (dict((recid, citers) for recid, citers
+                 in citations.iteritems() if citers),
+            dict((recid, citees) for recid, citees
+                 in references.iteritems() if citees))
+
+
 def get_bibrankmethod_lastupdate(rank_method_code):
     """Return the last excution date of bibrank method
     """
@@ -664,9 +841,13 @@ def standardize_report_number(report_number):
     return report_number
 
 
-def ref_analyzer(citation_informations, updated_recids, tags, config):
+def ref_analyzer(citation_informations, updated_recids, tags, config,
+                 interruptible=True):
     """Analyze the citation informations and calculate the citation weight
        and cited by list dictionary.
+
+       The task may be stopped or put to sleep while analysing unless
+       INTERRUPTIBLE is False, as for worker processes.
     """
     citations = {}
     for recid in updated_recids:
@@ -676,7 +857,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
         references[recid] = set()
 
     def step(msg_prefix, recid, done, total):
-        if done % 30 == 0:
+        if done % 30 == 0 and interruptible:
             task_sleep_now_if_required()
 
         if done % 1000 == 0:
@@ -715,6 +896,12 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     # e.g 8 -> ([astro-ph/9889],[hep-ph/768])
     # meaning: rec 8 contains these in bibliography
     write_message("Phase 1: Report numbers references")
+    matches = get_recids_matching_queries(
+        set(standardize_report_number(r)
+            for refnumbers in references_info['report-numbers'].itervalues()
+            for r in refnumbers if r),
+        'reportnumber', config,
+        interruptible=interruptible)
     done = 0
     for thisrecid, refnumbers in references_info['report-numbers'].iteritems():
         step("Report numbers references", thisrecid, done,
@@ -725,9 +912,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
             field = 'reportnumber'
             refnumber = standardize_report_number(refnumber)
             # Search for "hep-th/5644654 or such" in existing records
-            recids = get_recids_matching_query(p=refnumber,
-                                               f=field,
-                                               config=config)
+            recids = matches[refnumber]
             write_message("These match searching %s in %s: %s" %
                                    (refnumber, field, list(recids)), verbose=9)
 
@@ -755,6 +940,12 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     # Try to find references based on 999C5s
     # e.g. Phys.Rev.Lett. 53 (1986) 2285
     write_message("Phase 2: Journal references")
+    matches = get_recids_matching_queries(
+        set(r for refs in references_info['journals'].itervalues()
+            for r in refs
+            if r and re_CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK.match(r)),
+        'journal', config,
+        interruptible=interruptible)
     done = 0
     for thisrecid, refs in references_info['journals'].iteritems():
         step("Journal references", thisrecid, done,
@@ -773,9 +964,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
                 write_message(msg, stream=sys.stderr)
                 continue  # skip this ill-formed value
 
-            recids = get_recids_matching_query(p=p,
-                                               f=field,
-                                               config=config)
+            recids = matches[p]
             write_message("These match searching %s in %s: %s"
                                  % (reference, field, list(recids)), verbose=9)
 
@@ -803,6 +992,11 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     # Try to find references based on 999C5a
     # e.g. 10.1007/BF03170733
     write_message("Phase 3: DOI references")
+    matches = get_recids_matching_queries(
+        set(r for refs in references_info['doi'].itervalues()
+            for r in refs if r),
+        'doi', config,
+        interruptible=interruptible)
     done = 0
     for thisrecid, refs in references_info['doi'].iteritems():
         step("DOI references", thisrecid, done, len(references_info['doi']))
@@ -812,9 +1006,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
             p = reference
             field = 'doi'
 
-            recids = get_recids_matching_query(p=p,
-                                               f=field,
-                                               config=config)
+            recids = matches[p]
             write_message("These match searching %s in %s: %s"
                                  % (reference, field, list(recids)), verbose=9)
 
@@ -842,6 +1034,11 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     # Try to find references based on 999C5a (hdl references)
     # e.g. 4263537/4000
     write_message("Phase 4: HDL references")
+    matches = get_recids_matching_queries(
+        set(r for refs in references_info['hdl'].itervalues()
+            for r in refs if r),
+        'hdl', config,
+        interruptible=interruptible)
     done = 0
     for thisrecid, refs in references_info['hdl'].iteritems():
         step("HDL references", thisrecid, done, len(references_info['hdl']))
@@ -851,9 +1048,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
             p = reference
             field = 'hdl'
 
-            recids = get_recids_matching_query(p=p,
-                                               f=field,
-                                               config=config)
+            recids = matches[p]
             write_message("These match searching %s in %s: %s"
                                  % (reference, field, list(recids)), verbose=9)
 
@@ -881,13 +1076,18 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     # Try to find references based on 999C50
     # e.g. 1244
     write_message("Phase 5: Record ID references")
+    matches = get_recids_matching_queries(
+        set(r for refs in references_info['record_id'].itervalues()
+            for r in refs if r),
+        "001", config,
+        interruptible=interruptible)
     done = 0
     for thisrecid, refs in references_info['record_id'].iteritems():
         step("Record ID references", thisrecid, done, len(references_info['record_id']))
         done += 1
         field = "001"
         for recid in (r for r in refs if r):
-            valid = get_recids_matching_query(p=recid, f=field, config=config)
+            valid = matches[recid]
             write_message("These match searching %s in %s: %s"
                                  % (recid, field, list(valid)), verbose=9)
             if valid:
@@ -902,6 +1102,11 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     # Try to find references based on 999C5i
     # e.g. 978-3-942171-73-1
     write_message("Phase 6: ISBN references")
+    matches = get_recids_matching_queries(
+        set(r for refs in references_info['isbn'].itervalues()
+            for r in refs if r),
+        'isbn', config,
+        interruptible=interruptible)
     done = 0
     for thisrecid, refs in references_info['isbn'].iteritems():
         step("ISBN references", thisrecid, done, len(references_info['isbn']))
@@ -911,9 +1116,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
             p = reference
             field = 'isbn'
 
-            recids = get_recids_matching_query(p=p,
-                                               f=field,
-                                               config=config)
+            recids = matches[p]
             write_message("These match searching %s in %s: %s"
                                  % (reference, field, list(recids)), verbose=9)
 
@@ -940,6 +1143,23 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
 
     # Search for stuff like CERN-TH-4859/87 in list of refs
     write_message("Phase 7: report numbers catchup")
+    report_patterns = {}
+    for reportcodes in records_info['report-numbers'].itervalues():
+        for reportcode in (r for r in reportcodes if r):
+            if reportcode.startswith('arXiv'):
+                std_reportcode = standardize_report_number(reportcode)
+                report_patterns[reportcode] = r'^%s( *\[[a-zA-Z.-]*\])?' % \
+                                                re.escape(std_reportcode)
+    matches = get_recids_matching_queries(set(report_patterns.itervalues()),
+                                          tags['refs_report_number'],
+                                          m='r',
+                                          config=config,
+                                          interruptible=interruptible)
+    matches.update(get_recids_matching_queries(
+        set(r for reportcodes in records_info['report-numbers'].itervalues()
+            for r in reportcodes if r and r not in report_patterns),
+        tags['refs_report_number'], config,
+        interruptible=interruptible))
     done = 0
     for thisrecid, reportcodes in records_info['report-numbers'].iteritems():
         step("Report numbers catchup", thisrecid, done,
@@ -947,18 +1167,10 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
         done += 1
 
         for reportcode in (r for r in reportcodes if r):
-            if reportcode.startswith('arXiv'):
-                std_reportcode = standardize_report_number(reportcode)
-                report_pattern = r'^%s( *\[[a-zA-Z.-]*\])?' % \
-                                                re.escape(std_reportcode)
-                recids = get_recids_matching_query(p=report_pattern,
-                                                   f=tags['refs_report_number'],
-                                                   m='r',
-                                                   config=config)
+            if reportcode in report_patterns:
+                recids = matches[report_patterns[reportcode]]
             else:
-                recids = get_recids_matching_query(p=reportcode,
-                                                   f=tags['refs_report_number'],
-                                                   config=config)
+                recids = matches[reportcode]
             for recid in recids:
                 add_to_cites(recid, thisrecid)
 
@@ -968,6 +1180,12 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
 
     # Find this record's pubinfo in other records' bibliography
     write_message("Phase 8: journals catchup")
+    matches = get_recids_matching_queries(
+        set(journal.replace("\"", "")
+            for rec_journals in records_info['journals'].itervalues()
+            for journal in rec_journals),
+        tags['refs_journal'], config,
+        interruptible=interruptible)
     done = 0
     t8 = os.times()[4]
     for thisrecid, rec_journals in records_info['journals'].iteritems():
@@ -979,9 +1197,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
             journal = journal.replace("\"", "")
             # Search the publication string like
             # Phys. Lett., B 482 (2000) 417 in 999C5s
-            recids = get_recids_matching_query(p=journal,
-                                               f=tags['refs_journal'],
-                                               config=config)
+            recids = matches[journal]
             write_message("These records match %s in %s: %s"
                     % (journal, tags['refs_journal'], list(recids)), verbose=9)
 
@@ -993,6 +1209,11 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     task_update_progress(mesg)
 
     write_message("Phase 9: DOI catchup")
+    matches = get_recids_matching_queries(
+        set(value for values in records_info['doi'].itervalues()
+            for value in values),
+        tags['refs_doi'], config,
+        interruptible=interruptible)
     done = 0
     t9 = os.times()[4]
     for thisrecid, dois in records_info['doi'].iteritems():
@@ -1000,9 +1221,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
         done += 1
 
         for doi in dois:
-            recids = get_recids_matching_query(p=doi,
-                                               f=tags['refs_doi'],
-                                               config=config)
+            recids = matches[doi]
             write_message("These records match %s in %s: %s"
                             % (doi, tags['refs_doi'], list(recids)), verbose=9)
 
@@ -1014,6 +1233,11 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     task_update_progress(mesg)
 
     write_message("Phase 10: HDL catchup")
+    matches = get_recids_matching_queries(
+        set(value for values in records_info['hdl'].itervalues()
+            for value in values),
+        tags['refs_doi'], config,
+        interruptible=interruptible)
     done = 0
     t10 = os.times()[4]
     for thisrecid, hdls in records_info['hdl'].iteritems():
@@ -1021,9 +1245,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
         done += 1
 
         for hdl in hdls:
-            recids = get_recids_matching_query(p=hdl,
-                                               f=tags['refs_doi'],
-                                               config=config)
+            recids = matches[hdl]
             write_message("These records match %s in %s: %s"
                             % (hdl, tags['refs_doi'], list(recids)), verbose=9)
 
@@ -1035,6 +1257,11 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
     task_update_progress(mesg)
 
     write_message("Phase 11: ISBN catchup")
+    matches = get_recids_matching_queries(
+        set(value for values in records_info['isbn'].itervalues()
+            for value in values),
+        tags['refs_isbn'], config,
+        interruptible=interruptible)
     done = 0
     t11 = os.times()[4]
     for thisrecid, isbns in records_info['isbn'].iteritems():
@@ -1042,9 +1269,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
         done += 1
 
         for isbn in isbns:
-            recids = get_recids_matching_query(p=isbn,
-                                               f=tags['refs_isbn'],
-                                               config=config)
+            recids = matches[isbn]
             write_message("These records match %s in %s: %s"
                             % (isbn, tags['refs_isbn'], list(recids)), verbose=9)
 
@@ -1052,6 +1277,11 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
                 add_to_cites(recid, thisrecid)
 
     write_message("Phase 12: Record ID catchup")
+    matches = get_recids_matching_queries(
+        set(value for values in records_info['record_id'].itervalues()
+            for value in values),
+        tags['refs_record_id'], config,
+        interruptible=interruptible)
     done = 0
     t12 = os.times()[4]
     for thisrecid, record_ids in records_info['record_id'].iteritems():
@@ -1059,9 +1289,7 @@ def ref_analyzer(citation_informations, updated_recids, tags, config):
         done += 1
 
         for record_id in record_ids:
-            recids = get_recids_matching_query(p=record_id,
-                                               f=tags['refs_record_id'],
-                                               config=config)
+            recids = matches[record_id]
             write_message("These records match %s in %s: %s"
                             % (record_id, tags['refs_record_id'], list(recids)), verbose=9)
 
@@ -1142,10 +1370,31 @@ def compute_dicts_diff(recids, refs, cites):
 
 
 def store_dicts(recids, refs, cites):
-    """Insert the reference and citation list into the database"""
+    """Insert the reference and citation list into the database.
+    Return the sets of the (citer, citee) citations added and removed."""
+    added = set()
+    removed = set()
+
+    def add(citation):
+        added.add(citation)
+        removed.discard(citation)
+
+    def remove(citation):
+        removed.add(citation)
+        added.discard(citation)
+
     for recid in recids:
-        replace_refs(recid, refs[recid])
-        replace_cites(recid, cites[recid])
+        refs_added, refs_removed = replace_refs(recid, refs[recid])
+        for ref in refs_added:
+            add((recid, ref))
+        for ref in refs_removed:
+            remove((recid, ref))
+        cites_added, cites_removed = replace_cites(recid, cites[recid])
+        for cite in cites_added:
+            add((cite, recid))
+        for cite in cites_removed:
+            remove((cite, recid))
+    return added, removed
 
 
 def replace_refs(recid, new_refs):
@@ -1153,6 +1402,7 @@ def replace_refs(recid, new_refs):
     Given a set of references, replaces the references of given recid
     in the database.
     The changes are logged into rnkCITATIONLOG.
+    Returns the sets of the references added and deleted.
     """
     old_refs = set(row[0] for row in run_sql("""SELECT citee
                                                 FROM rnkCITATIONDICT
@@ -1177,6 +1427,8 @@ def replace_refs(recid, new_refs):
         run_sql("""INSERT INTO rnkCITATIONLOG (citer, citee, type, action_date)
                    VALUES (%s, %s, %s, %s)""", (recid, ref, 'removed', now))
 
+    return refs_to_add, refs_to_delete
+
 
 def replace_cites(recid, new_cites):
     """
@@ -1209,6 +1461,8 @@ def replace_cites(recid, new_cites):
         run_sql("""INSERT INTO rnkCITATIONLOG (citee, citer, type, action_date)
                    VALUES (%s, %s, %s, %s)""", (recid, cite, 'removed', now))
 
+    return cites_to_add, cites_to_delete
+
 
 def insert_into_missing(recid, report):
     """Mark reference string as missing.
@@ -102,6 +102,20 @@ class TestCitationIndexer(InvenioTestCase):
         compare_dicts(self, cites, EXPECTED_DICTS['cites'])
         compare_dicts(self, refs, EXPECTED_DICTS['refs'])
 
+    def test_parallel(self):
+        "tests that workers find the same citations as a single process"
+        from invenio.bibrank_citation_indexer import process_chunk
+        serial_cites, serial_refs = process_chunk(range(1, 100), CONFIG,
+                                                  workers=1)
+        for workers in (2, 3):
+            cites, refs = process_chunk(range(1, 100), CONFIG,
+                                        workers=workers)
+            # the dictionaries stored into rnkCITATIONDICT are the same
+            self.assertEqual(cites, serial_cites)
+            self.assertEqual(refs, serial_refs)
+        compare_dicts(self, serial_cites, EXPECTED_DICTS['cites'])
+        compare_dicts(self, serial_refs, EXPECTED_DICTS['refs'])
+
     def test_adding_record(self):
         "tests adding a record"
         from invenio.bibrank_citation_indexer import process_chunk
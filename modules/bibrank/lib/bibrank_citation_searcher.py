@@ -24,50 +24,35 @@ import re
 from invenio.dbquery import run_sql
 from invenio.intbitset import intbitset
 from invenio.data_cacher import DataCacher
-from invenio.redisutils import get_redis
-from invenio.dbquery import deserialize_via_marshal
+from invenio.bibrank_citation_graph import get_citation_graph
+from invenio.bibrank_citation_counts import get_citation_counts, \
+     CitationWeights, SortedCitationCounts
 from operator import itemgetter
 
 
 class CitationDictsDataCacher(DataCacher):
     """
-    Cache holding all citation dictionaries (citationdict,
-    reversedict, selfcitdict, selfcitedbydict).
+    Cache holding the citation counts of all the records, as
+    CitationCounts arrays (citation_counts) and as read-only views of
+    them (citations_weights, citations_keys, citations_counts,
+    selfcites_weights, selfcites_counts).
     """
     def __init__(self):
 
         def fill():
             alldicts = {}
-            from invenio.bibrank_tag_based_indexer import fromDB
-            redis = get_redis()
-            serialized_weights = redis.get('citations_weights')
-            if serialized_weights:
-                weights = deserialize_via_marshal(serialized_weights)
-            else:
-                weights = fromDB('citation')
-
-            alldicts['citations_weights'] = weights
+            counts = get_citation_counts()
+            alldicts['citation_counts'] = counts
+            alldicts['citations_weights'] = CitationWeights(counts)
             # for cited:M->N queries, it is interesting to cache also
             # some preprocessed citationdict:
-            alldicts['citations_keys'] = intbitset(weights.keys())
-
-            # Citation counts
-            alldicts['citations_counts'] = [t for t in weights.iteritems()]
-            alldicts['citations_counts'].sort(key=itemgetter(1), reverse=True)
-
+            alldicts['citations_keys'] = counts.keys
+            alldicts['citations_counts'] = SortedCitationCounts(counts)
             # Self-cites
-            serialized_weights = redis.get('selfcites_weights')
-            if serialized_weights:
-                selfcites = deserialize_via_marshal(serialized_weights)
-            else:
-                selfcites = fromDB('selfcites')
-            selfcites_weights = {}
-            for recid, counts in alldicts['citations_counts']:
-                selfcites_weights[recid] = counts - selfcites.get(recid, 0)
-            alldicts['selfcites_weights'] = selfcites_weights
-            alldicts['selfcites_counts'] = [(recid, selfcites_weights.get(recid, cites)) for recid, cites in alldicts['citations_counts']]
-            alldicts['selfcites_counts'].sort(key=itemgetter(1), reverse=True)
-
+            alldicts['selfcites_weights'] = CitationWeights(counts,
+                                                  exclude_selfcites=True)
+            alldicts['selfcites_counts'] = SortedCitationCounts(counts,
+                                                  exclude_selfcites=True)
             return alldicts
 
         def cache_filler():
@@ -112,6 +97,9 @@ def get_citation_dict(dictname):
 
 def get_refers_to(recordid):
     """Return a list of records referenced by this record"""
+    graph = get_citation_graph()
+    if graph is not None:
+        return set(graph.get_refers_to(recordid))
     rows = run_sql("SELECT citee FROM rnkCITATIONDICT WHERE citer = %s",
                    [recordid])
     return set(r[0] for r in rows)
@@ -119,6 +107,9 @@ def get_refers_to(recordid):
 
 def get_cited_by(recordid):
     """Return a list of records that cite recordid"""
+    graph = get_citation_graph()
+    if graph is not None:
+        return set(graph.get_cited_by(recordid))
     rows = run_sql("SELECT citer FROM rnkCITATIONDICT WHERE citee = %s",
                    [recordid])
     return set(r[0] for r in rows)
@@ -126,6 +117,9 @@ def get_cited_by(recordid):
 
 def get_cited_by_count(recordid):
     """Return how many records cite given RECORDID."""
+    graph = get_citation_graph()
+    if graph is not None:
+        return graph.get_cited_by_count(recordid)
     rows = run_sql("SELECT 1 FROM rnkCITATIONDICT WHERE citee = %s",
                    [recordid])
     return len(rows)
@@ -138,12 +132,8 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
        Warning: numstr is string and may not be numeric! It can
        be 10,0->100 etc
     """
-    if exclude_selfcites:
-        cache_cited_by_dictionary_counts = get_citation_dict("selfcites_counts")
-        citations_keys = intbitset(get_citation_dict("selfcites_weights").keys())
-    else:
-        cache_cited_by_dictionary_counts = get_citation_dict("citations_counts")
-        citations_keys = get_citation_dict("citations_keys")
+    citation_counts = get_citation_dict("citation_counts")
+    citations_keys = citation_counts.keys
 
     matches = intbitset()
     #once again, check that the parameter is a string
@@ -161,9 +151,8 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
             #we return recids that are not in keys
             return allrecs - citations_keys
         else:
-            return intbitset([recid for recid, cit_count
-                        in cache_cited_by_dictionary_counts
-                        if cit_count == num])
+            return citation_counts.get_records_with_counts(num, num,
+                                                   exclude_selfcites)
 
     # Try to get 1->10 or such
     firstsec = re.findall("(\d+)->(\d+)", numstr)
@@ -174,18 +163,16 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
             # Start with those that have no cites..
     	    matches = allrecs - citations_keys
         if first <= sec:
-            matches += intbitset([recid for recid, cit_count
-                             in cache_cited_by_dictionary_counts
-                             if first <= cit_count <= sec])
+            matches += citation_counts.get_records_with_counts(first, sec,
+                                                       exclude_selfcites)
         return matches
 
     # Try to get 10+
     firstsec = re.findall("(\d+)\+", numstr)
     if firstsec:
         first = int(firstsec[0])
-        matches = intbitset([recid for recid, cit_count
-                         in cache_cited_by_dictionary_counts \
-                         if cit_count > first])
+        matches = citation_counts.get_records_with_counts(first + 1, None,
+                                                  exclude_selfcites)
 
     return matches
 
@@ -197,6 +184,10 @@ def get_cited_by_list(recids):
     if not recids:
         return []
 
+    graph = get_citation_graph()
+    if graph is not None:
+        return [(recid, set(graph.get_cited_by(recid))) for recid in recids]
+
     in_sql = ','.join('%s' for dummy in recids)
     rows = run_sql("""SELECT citer, citee FROM rnkCITATIONDICT
                        WHERE citee IN (%s)""" % in_sql, recids)
@@ -215,6 +206,10 @@ def get_refers_to_list(recids):
     if not recids:
         return []
 
+    graph = get_citation_graph()
+    if graph is not None:
+        return [(recid, set(graph.get_refers_to(recid))) for recid in recids]
+
     in_sql = ','.join('%s' for dummy in recids)
     rows = run_sql("""SELECT citee, citer FROM rnkCITATIONDICT
                        WHERE citer IN (%s)""" % in_sql, recids)
@@ -240,6 +235,9 @@ def get_refersto_hitset(ahitset):
             # ignore attempt to iterate over infinite ahitset
             pass
         else:
+            graph = get_citation_graph()
+            if graph is not None:
+                return graph.get_refersto_hitset(ahitset)
             in_sql = ','.join('%s' for dummy in ahitset)
             rows = run_sql("""SELECT citer FROM rnkCITATIONDICT
                               WHERE citee IN (%s)""" % in_sql, ahitset)
@@ -249,19 +247,17 @@ def get_refersto_hitset(ahitset):
 def get_one_cited_by_weight(recID):
     """Returns a number_of_citing_records for one record
     """
-    weight = get_citation_dict("citations_weights")
-
-    return weight.get(recID, 0)
+    return get_citation_dict("citation_counts").get_count(recID)
 
 def get_cited_by_weight(recordlist):
     """Return a tuple of ([recid,number_of_citing_records],...) for all the
        records in recordlist.
     """
-    weights = get_citation_dict("citations_weights")
+    citation_counts = get_citation_dict("citation_counts")
 
     result = []
     for recid in recordlist:
-        result.append([recid, weights.get(recid, 0)])
+        result.append([recid, citation_counts.get_count(recid)])
 
     return result
 
@@ -279,6 +275,9 @@ def get_citedby_hitset(ahitset):
             # ignore attempt to iterate over infinite ahitset
             pass
         else:
+            graph = get_citation_graph()
+            if graph is not None:
+                return graph.get_citedby_hitset(ahitset)
             in_sql = ','.join('%s' for dummy in ahitset)
             rows = run_sql("""SELECT citee FROM rnkCITATIONDICT
                               WHERE citer IN (%s)""" % in_sql, ahitset)
@@ -314,12 +313,16 @@ def calculate_co_cited_with_list(record_id, sort_order="d"):
     result = []
     result_intermediate = {}
 
-    for cit_id in get_cited_by(record_id):
-        for ref_id in get_refers_to(cit_id):
-            if ref_id not in result_intermediate:
-                result_intermediate[ref_id] = 1
-            else:
-                result_intermediate[ref_id] += 1
+    graph = get_citation_graph()
+    if graph is not None:
+        result_intermediate = graph.get_co_cited_counts(record_id)
+    else:
+        for cit_id in get_cited_by(record_id):
+            for ref_id in get_refers_to(cit_id):
+                if ref_id not in result_intermediate:
+                    result_intermediate[ref_id] = 1
+                else:
+                    result_intermediate[ref_id] += 1
     for key, value in result_intermediate.iteritems():
         if key != record_id:
             result.append([key, value])
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Benchmark of the citerank PageRank engines on a synthetic citation
+graph.
+
+Usage: python bibrank_citerank_benchmark.py [nb_papers [nb_citations]]
+"""
+
+import random
+import sys
+import time
+
+from invenio.bibrank_citerank_indexer import construct_ref_array, \
+     construct_sparse_matrix, pagerank, construct_sparse_matrix_arrays, \
+     pagerank_sparse, import_scipy
+
+
+def generate_citation_graph(nb_papers, nb_citations, seed=0):
+    """returns a random citation graph of NB_PAPERS papers, in the
+    format of get_citations_from_db.  The cited papers are chosen with
+    a skewed distribution, so that few papers get most citations, like
+    in real citation graphs."""
+    generator = random.Random(seed)
+    cit = {}
+    for dummy in xrange(nb_citations):
+        citer = generator.randint(1, nb_papers)
+        citee = int(nb_papers * generator.random() ** 3) + 1
+        if citer != citee:
+            cit.setdefault(citee, set()).add(citer)
+    dict_of_ids = {}
+    for item in cit:
+        if item not in dict_of_ids:
+            dict_of_ids[item] = len(dict_of_ids)
+        for value in cit[item]:
+            if value not in dict_of_ids:
+                dict_of_ids[value] = len(dict_of_ids)
+    return cit, dict_of_ids
+
+
+def benchmark_pagerank_engines(nb_papers, nb_citations, damping_factor=0.85, \
+                               conv_threshold=0.0001, check_point=1):
+    """runs the PageRank method with the dict and the sparse engines on
+    a synthetic citation graph; returns a dictionary of the timings
+    (in seconds) and of the largest difference between the weights"""
+    cit, dict_of_ids = generate_citation_graph(nb_papers, nb_citations)
+    len_ = len(dict_of_ids)
+    ref = construct_ref_array(cit, dict_of_ids, len_)
+    results = {'papers': len_,
+               'citations': sum([len(citers) for citers in cit.values()]),
+               'scipy': bool(import_scipy)}
+
+    start = time.time()
+    sparse, semi_sparse, semi_sparse_coef = \
+        construct_sparse_matrix(cit, ref, dict_of_ids, len_, damping_factor)
+    built = time.time()
+    weights_dict = pagerank(conv_threshold, check_point, len_, sparse, \
+                            semi_sparse, semi_sparse_coef)
+    results['dict_build'] = built - start
+    results['dict_iterate'] = time.time() - built
+    del sparse
+
+    start = time.time()
+    matrix, semi_sparse, semi_sparse_coef = \
+        construct_sparse_matrix_arrays(cit, ref, dict_of_ids, len_, \
+                                       damping_factor)
+    built = time.time()
+    weights_sparse = pagerank_sparse(conv_threshold, check_point, len_, \
+                                     matrix, semi_sparse, semi_sparse_coef)
+    results['sparse_build'] = built - start
+    results['sparse_iterate'] = time.time() - built
+
+    results['max_difference'] = float(abs(weights_dict - weights_sparse).max())
+    return results
+
+
+def main():
+    """runs the benchmark with the sizes given on the command line"""
+    nb_papers = 10000
+    if len(sys.argv) > 1:
+        nb_papers = int(sys.argv[1])
+    nb_citations = 10 * nb_papers
+    if len(sys.argv) > 2:
+        nb_citations = int(sys.argv[2])
+    results = benchmark_pagerank_engines(nb_papers, nb_citations)
+    print "papers: %(papers)d, citations: %(citations)d, scipy: %(scipy)s" \
+          % results
+    for engine in ('dict', 'sparse'):
+        print "%-6s engine: build %8.3fs, iterate %8.3fs" \
+              % (engine, results[engine + '_build'], \
+                 results[engine + '_iterate'])
+    print "largest weight difference: %g" % results['max_difference']
+
+if __name__ == '__main__':
+    main()
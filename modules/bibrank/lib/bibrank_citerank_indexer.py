@@ -29,14 +29,22 @@ the citation graph:
 import ConfigParser
 from math import exp
 import datetime
+import marshal
+import os
 import time
 import re
 import sys
 try:
-    from numpy import array, ones, zeros, int32, float32, sqrt, dot
+    from numpy import array, ones, zeros, int32, float32, float64, sqrt, \
+         dot, bincount, concatenate, arange, where, asarray
     import_numpy = 1
 except ImportError:
     import_numpy = 0
+try:
+    from scipy.sparse import csr_matrix
+    import_scipy = 1
+except ImportError:
+    import_scipy = 0
 
 if sys.hexversion < 0x2040000:
     # pylint: disable=W0622
@@ -44,6 +52,8 @@ if sys.hexversion < 0x2040000:
     # pylint: enable=W0622
 
 from invenio.dbquery import run_sql, serialize_via_marshal
+from invenio.bibrank_rank_store import save_rank_store, \
+     CFG_BIBRANK_RANK_STORE_DIR
 from invenio.bibtask import write_message
 from invenio.config import CFG_ETCDIR
 
@@ -428,10 +438,12 @@ def statistics_on_sparse(sparse):
 
 
 def pagerank(conv_threshold, check_point, len_, sparse, \
-            semi_sparse, semi_sparse_coef):
+            semi_sparse, semi_sparse_coef, weights_start=None):
     """the core function of the PAGERANK method
     returns an array with the ranks coresponding to each recid"""
     weights_old = ones((len_), float32) # initial weights
+    if weights_start is not None:
+        weights_old = array(weights_start, float32)
     weights_new = array((), float32)
     converged = False
     nr_of_check_points = 0
@@ -461,11 +473,14 @@ The threshold was %s" % (str(nr_of_check_points), str(difference)),\
     return weights_old
 
 
-def pagerank_ext(conv_threshold, check_point, len_, sparse, semi_sparse):
+def pagerank_ext(conv_threshold, check_point, len_, sparse, semi_sparse, \
+            weights_start=None):
     """the core function of the PAGERANK_EXT method
     returns an array with the ranks coresponding to each recid"""
     weights_old = array((), float32)
     weights_old = ones((len_), float32)
+    if weights_start is not None:
+        weights_old = array(weights_start, float32)
     weights_new = array((), float32)
     converged = False
     nr_of_check_points = 0
@@ -535,6 +550,231 @@ The threshold was %s" % (str(nr_of_check_points), \
     return weights_old
 
 
+class CooMatrix(object):
+    """Sparse matrix in coordinate format, used for the matrix-vector
+    products of the sparse engine when SciPy is not installed"""
+
+    def __init__(self, rows, cols, values, size):
+        self.rows = rows
+        self.cols = cols
+        self.values = values
+        self.size = size
+
+    def dot(self, vector):
+        """returns the product of the matrix with VECTOR"""
+        return bincount(self.rows, weights=self.values * vector[self.cols],
+                        minlength=self.size)
+
+
+def make_sparse_matrix(rows, cols, values, size):
+    """returns the SIZE x SIZE matrix whose non zero VALUES are at the
+    positions given by ROWS and COLS, as a SciPy CSR matrix if
+    available"""
+    if import_scipy:
+        return csr_matrix((values, (rows, cols)), shape=(size, size))
+    return CooMatrix(rows, cols, values, size)
+
+
+def construct_citation_arrays(cit, dict_of_ids):
+    """returns the arrays of the indexes of the cited papers (rows)
+    and of the citing papers (columns) of all the citations"""
+    nr_of_citations = 0
+    for item in cit:
+        nr_of_citations += len(cit[item])
+    rows = zeros(nr_of_citations, int32)
+    cols = zeros(nr_of_citations, int32)
+    position = 0
+    for item in cit:
+        cited = dict_of_ids[item]
+        for value in cit[item]:
+            rows[position] = cited
+            cols[position] = dict_of_ids[value]
+            position += 1
+    write_message("Citation arrays of %s citations calculated" \
+                  % nr_of_citations, verbose=3)
+    return rows, cols
+
+
+def construct_sparse_matrix_arrays(cit, ref, dict_of_ids, len_, \
+        damping_factor, date_coef=None):
+    """sparse engine counterpart of construct_sparse_matrix and
+    construct_sparse_matrix_time (if DATE_COEF is given): returns the
+    sparse matrix, the array of the papers that do not cite anyone
+    and the coeficient of these papers"""
+    rows, cols = construct_citation_arrays(cit, dict_of_ids)
+    ref = asarray(ref, float64)
+    values = damping_factor / ref[cols]
+    if date_coef is not None:
+        values *= date_coef[cols]
+    matrix = make_sparse_matrix(rows, cols, values, len_)
+    semi_sparse = where(ref == 0)[0]
+    semi_sparse_coeficient = damping_factor/len_
+    write_message("Sparse matrix calculated", verbose=3)
+    return matrix, semi_sparse, semi_sparse_coeficient
+
+
+def construct_sparse_matrix_ext_arrays(cit, ref, ext_links, dict_of_ids, \
+        alpha, beta):
+    """sparse engine counterpart of construct_sparse_matrix_ext: the
+    external node has the index 0, the papers are shifted by one.
+    Returns the sparse matrix and the indexes and coeficients of the
+    papers that do not cite anyone"""
+    len_ = len(dict_of_ids)
+    ref = asarray(ref, float64)
+    ext = zeros(len_, float64)
+    for j in ext_links:
+        ext[j] = ext_links[j]
+    aux = beta * ext
+    # probability to go from paper j to the external node:
+    to_ext = where(ext == 0, beta/(len_ + beta),
+                   aux/(aux + where(ref == 0, len_, ref)))
+    rows, cols = construct_citation_arrays(cit, dict_of_ids)
+    papers = arange(1, len_ + 1, dtype=int32)
+    matrix = make_sparse_matrix(
+        concatenate((array([0], int32), papers, zeros(len_, int32), rows + 1)),
+        concatenate((array([0], int32), zeros(len_, int32), papers, cols + 1)),
+        concatenate((array([1.0 - alpha]), ones(len_) * alpha/len_, to_ext,
+                     (1.0 - to_ext[cols])/ref[cols])),
+        len_ + 1)
+    semi_sparse = where(ref == 0)[0]
+    semi_sparse_values = (1.0 - to_ext[semi_sparse])/len_
+    write_message("Sparse matrix calculated", verbose=3)
+    return matrix, semi_sparse + 1, semi_sparse_values
+
+
+def iterate_weights(step, weights_old, conv_threshold, check_point):
+    """the power iteration of the sparse engine: applies STEP to the
+    weights until they are stable, checking it every CHECK_POINT
+    steps, like the dict engine does"""
+    len_ = len(weights_old)
+    converged = False
+    nr_of_check_points = 0
+    difference = len_
+    while not converged:
+        nr_of_check_points += 1
+        for step_nr in range(check_point):
+            weights_new = step(weights_old)
+            if step_nr == check_point - 1:
+                diff = weights_new - weights_old
+                difference = sqrt(dot(diff, diff))/len_
+                write_message("Finished step: %s, %s " \
+                        %(str(check_point*(nr_of_check_points-1) + step_nr), \
+                            str(difference)), verbose=5)
+            weights_old = weights_new
+        converged = (difference < conv_threshold)
+    write_message("PageRank calculated for all recids finnished in %s steps. \
+The threshold was %s" % (str(nr_of_check_points), str(difference)),\
+             verbose=2)
+    return weights_old
+
+
+def pagerank_sparse(conv_threshold, check_point, len_, matrix, \
+            semi_sparse, semi_sparse_coef, weights_start=None):
+    """sparse engine counterpart of pagerank"""
+    if weights_start is None:
+        weights_start = ones(len_, float64)
+    zero_coeficient = 1.0/len_ - semi_sparse_coef
+
+    def step(weights_old):
+        """one iteration of the PAGERANK method"""
+        return matrix.dot(weights_old) + \
+               semi_sparse_coef * weights_old[semi_sparse].sum() + \
+               zero_coeficient * weights_old.sum()
+
+    return iterate_weights(step, weights_start, conv_threshold, check_point)
+
+
+def pagerank_ext_sparse(conv_threshold, check_point, len_, matrix, \
+            semi_sparse, semi_sparse_values, weights_start=None):
+    """sparse engine counterpart of pagerank_ext"""
+    if weights_start is None:
+        weights_start = ones(len_, float64)
+
+    def step(weights_old):
+        """one iteration of the PAGERANK_EXT method"""
+        weights_new = matrix.dot(weights_old)
+        weights_new[1:len_] += dot(semi_sparse_values, weights_old[semi_sparse])
+        return weights_new
+
+    weights = iterate_weights(step, weights_start, conv_threshold, check_point)
+    return weights[1:len_]
+
+
+def pagerank_time_sparse(conv_threshold, check_point, len_, matrix, \
+        semi_sparse, semi_sparse_coeficient, date_coef):
+    """sparse engine counterpart of pagerank_time"""
+    zero_coeficient = 1.0/len_ - semi_sparse_coeficient
+    semi_sparse_dates = date_coef[semi_sparse]
+
+    def step(weights_old):
+        """one iteration of the PAGERANK_TIME method"""
+        return matrix.dot(weights_old) + \
+               semi_sparse_coeficient * \
+               dot(weights_old[semi_sparse], semi_sparse_dates) + \
+               zero_coeficient * dot(weights_old, date_coef)
+
+    return iterate_weights(step, ones(len_, float64), conv_threshold, \
+                           check_point)
+
+
+def get_weights_file(rank_method_code):
+    """returns the file keeping the weights of the last run of
+    RANK_METHOD_CODE, used to warm-start the next run"""
+    return os.path.join(CFG_BIBRANK_RANK_STORE_DIR, \
+                        "%s.weights" % rank_method_code)
+
+
+def load_start_weights(weights_file, dict_of_ids, len_, offset=0):
+    """returns the initial weights vector of size LEN_: the weights
+    stored in WEIGHTS_FILE for the papers known in the previous run
+    (at their index in DICT_OF_IDS plus OFFSET), 1 for the other ones.
+    The vector is scaled to the total weight of the default one, so
+    that the iteration converges to the same weights."""
+    weights = ones(len_, float64)
+    try:
+        weights_file_ = open(weights_file, "rb")
+        try:
+            weights_by_recid = marshal.load(weights_file_)
+        finally:
+            weights_file_.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        write_message("No weights to start from in %s" % weights_file, \
+                      verbose=3)
+        return weights
+    nr_of_known = 0
+    for recid in dict_of_ids:
+        if recid in weights_by_recid:
+            weights[dict_of_ids[recid] + offset] = weights_by_recid[recid]
+            nr_of_known += 1
+    total = weights.sum()
+    if total > 0:
+        weights *= len_ / total
+    else:
+        weights = ones(len_, float64)
+    write_message("Starting from the weights of %s papers of the previous \
+run" % nr_of_known, verbose=3)
+    return weights
+
+
+def save_weights(weights_file, weights, dict_of_ids):
+    """stores the WEIGHTS of the papers into WEIGHTS_FILE, to be used
+    as the start of the next run"""
+    dirname = os.path.dirname(weights_file)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    weights_by_recid = {}
+    for recid in dict_of_ids:
+        weights_by_recid[recid] = float(weights[dict_of_ids[recid]])
+    tmp_file = "%s.%s" % (weights_file, os.getpid())
+    weights_file_ = open(tmp_file, "wb")
+    try:
+        marshal.dump(weights_by_recid, weights_file_)
+    finally:
+        weights_file_.close()
+    os.rename(tmp_file, weights_file)
+    write_message("Weights written into %s" % weights_file, verbose=5)
+
+
 def citation_rank_time(cit, dict_of_ids, date_coef, dates, decimals):
     """returns a dictionary recid:weight based on the total number of
     citations as function of time"""
@@ -618,44 +858,93 @@ def into_db(dict_of_ranks, rank_method_code):
     date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     run_sql("UPDATE rnkMETHOD SET last_updated=%s WHERE name=%s", \
         (date, rank_method_code))
+    save_rank_store(rank_method_code, dict_of_ranks, date)
     write_message("Finished writing the ranks into rnkMETHOD table", verbose=5)
 
 
 def run_pagerank(cit, dict_of_ids, len_, ref, damping_factor, \
-            conv_threshold, check_point, dates):
-    """returns the final form of the ranks when using pagerank method"""
-    write_message("Running the PageRank method", verbose=5)
-    sparse, semi_sparse, semi_sparse_coeficient = \
-        construct_sparse_matrix(cit, ref, dict_of_ids, len_, damping_factor)
-    weights = pagerank(conv_threshold, check_point, len_, \
-                    sparse, semi_sparse, semi_sparse_coeficient)
+            conv_threshold, check_point, dates, engine="sparse", \
+            weights_file=None):
+    """returns the final form of the ranks when using pagerank method;
+    ENGINE is 'sparse' (matrix-vector products on NumPy/SciPy arrays)
+    or 'dict' (the citation graph kept in a dictionary).  If
+    WEIGHTS_FILE is given, the iteration starts from the weights it
+    contains, and the new weights are stored into it."""
+    write_message("Running the PageRank method (%s engine)" % engine, \
+                  verbose=5)
+    weights_start = None
+    if weights_file:
+        weights_start = load_start_weights(weights_file, dict_of_ids, len_)
+    if engine == "dict":
+        sparse, semi_sparse, semi_sparse_coeficient = \
+            construct_sparse_matrix(cit, ref, dict_of_ids, len_, damping_factor)
+        weights = pagerank(conv_threshold, check_point, len_, \
+                        sparse, semi_sparse, semi_sparse_coeficient, \
+                        weights_start)
+    else:
+        matrix, semi_sparse, semi_sparse_coeficient = \
+            construct_sparse_matrix_arrays(cit, ref, dict_of_ids, len_, \
+                                           damping_factor)
+        weights = pagerank_sparse(conv_threshold, check_point, len_, \
+                        matrix, semi_sparse, semi_sparse_coeficient, \
+                        weights_start)
+    if weights_file:
+        save_weights(weights_file, weights, dict_of_ids)
     dict_of_ranks = get_ranks(weights, dict_of_ids, 1, dates, 2)
     return dict_of_ranks
 
 
 def run_pagerank_ext(cit, dict_of_ids, ref, ext_links, \
-                        conv_threshold, check_point, alpha, beta, dates):
-    """returns the final form of the ranks when using pagerank_ext method"""
-    write_message("Running the PageRank with external links method", verbose=5)
+                        conv_threshold, check_point, alpha, beta, dates, \
+                        engine="sparse", weights_file=None):
+    """returns the final form of the ranks when using pagerank_ext method;
+    see run_pagerank for ENGINE and WEIGHTS_FILE"""
+    write_message("Running the PageRank with external links method \
+(%s engine)" % engine, verbose=5)
     len_ = len(dict_of_ids)
-    sparse, semi_sparse = construct_sparse_matrix_ext(cit, ref, \
-        ext_links, dict_of_ids, alpha, beta)
-    weights = pagerank_ext(conv_threshold, check_point, \
-        len_ + 1, sparse, semi_sparse)
+    weights_start = None
+    if weights_file:
+        weights_start = load_start_weights(weights_file, dict_of_ids, \
+                                           len_ + 1, 1)
+    if engine == "dict":
+        sparse, semi_sparse = construct_sparse_matrix_ext(cit, ref, \
+            ext_links, dict_of_ids, alpha, beta)
+        weights = pagerank_ext(conv_threshold, check_point, \
+            len_ + 1, sparse, semi_sparse, weights_start)
+    else:
+        matrix, semi_sparse, semi_sparse_values = \
+            construct_sparse_matrix_ext_arrays(cit, ref, ext_links, \
+                                               dict_of_ids, alpha, beta)
+        weights = pagerank_ext_sparse(conv_threshold, check_point, \
+            len_ + 1, matrix, semi_sparse, semi_sparse_values, weights_start)
+    if weights_file:
+        save_weights(weights_file, weights, dict_of_ids)
     dict_of_ranks = get_ranks(weights, dict_of_ids, 1, dates, 2)
     return dict_of_ranks
 
 
 def run_pagerank_time(cit, dict_of_ids, len_, ref, damping_factor, \
-                        conv_threshold, check_point, date_coef, dates):
+                        conv_threshold, check_point, date_coef, dates, \
+                        engine="sparse"):
     """returns the final form of the ranks when using
-    pagerank + time decay method"""
-    write_message("Running the PageRank_time method", verbose=5)
-    sparse, semi_sparse, semi_sparse_coeficient = \
-        construct_sparse_matrix_time(cit, ref, dict_of_ids, \
-            damping_factor, date_coef)
-    weights = pagerank_time(conv_threshold, check_point, len_, \
-        sparse, semi_sparse, semi_sparse_coeficient, date_coef)
+    pagerank + time decay method; see run_pagerank for ENGINE.  The
+    weights of this method decay with the time, so that the iteration
+    can not be warm-started."""
+    write_message("Running the PageRank_time method (%s engine)" % engine, \
+                  verbose=5)
+    if engine == "dict":
+        sparse, semi_sparse, semi_sparse_coeficient = \
+            construct_sparse_matrix_time(cit, ref, dict_of_ids, \
+                damping_factor, date_coef)
+        weights = pagerank_time(conv_threshold, check_point, len_, \
+            sparse, semi_sparse, semi_sparse_coeficient, date_coef)
+    else:
+        date_coef = array([date_coef[j] for j in range(len_)], float64)
+        matrix, semi_sparse, semi_sparse_coeficient = \
+            construct_sparse_matrix_arrays(cit, ref, dict_of_ids, len_, \
+                damping_factor, date_coef)
+        weights = pagerank_time_sparse(conv_threshold, check_point, len_, \
+            matrix, semi_sparse, semi_sparse_coeficient, date_coef)
     dict_of_ranks = get_ranks(weights, dict_of_ids, 100000, dates, 2)
     return dict_of_ranks
 
@@ -798,6 +1087,17 @@ str(conv_threshold), str(check_point)), verbose=5)
         except (ConfigParser.NoOptionError, StandardError), err:
             write_message("Exception: %s" % err, sys.stderr)
             raise Exception
+        engine = "sparse"
+        if config.has_option(function, "citerank_engine"):
+            engine = config.get(function, "citerank_engine")
+        if engine not in ("sparse", "dict"):
+            write_message("Error: Unknown citerank engine %s. Please check \
+the citerank_engine parameter in the config. file." % engine, sys.stderr)
+            raise Exception
+        weights_file = None
+        if config.has_option(function, "warm_start") and \
+               config.get(function, "warm_start") == "yes":
+            weights_file = get_weights_file(rank_method_code)
         if method == "pagerank_classic":
             ref = construct_ref_array(cit, dict_of_ids, len_)
             use_ext_cit = ""
@@ -839,10 +1139,12 @@ sys.stderr)
                     write_message("Exception: %s" % err, sys.stderr)
                     raise Exception
                 dict_of_ranks = run_pagerank_ext(cit, dict_of_ids, ref, \
-                ext_links, conv_threshold, check_point, alpha, beta, dates)
+                ext_links, conv_threshold, check_point, alpha, beta, dates, \
+                engine, weights_file)
             else:
                 dict_of_ranks = run_pagerank(cit, dict_of_ids, len_, ref, \
-                    damping_factor, conv_threshold, check_point, dates)
+                    damping_factor, conv_threshold, check_point, dates, \
+                    engine, weights_file)
         elif method == "pagerank_time":
             try:
                 time_decay = float(config.get(function, "time_decay"))
@@ -855,7 +1157,8 @@ sys.stderr)
             cit = remove_loops(cit, dates, dict_of_ids)
             ref = construct_ref_array(cit, dict_of_ids, len_)
             dict_of_ranks = run_pagerank_time(cit, dict_of_ids, len_, ref, \
-             damping_factor, conv_threshold, check_point, date_coef, dates)
+             damping_factor, conv_threshold, check_point, date_coef, dates, \
+             engine)
         else:
             write_message("Error: Unknown ranking method. \
 Please check the ranking_method parameter in the config. file.", sys.stderr)
@@ -18,7 +18,9 @@
 ## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
 from invenio.testutils import InvenioTestCase
+import os
 import sys
+import tempfile
 
 if sys.hexversion < 0x2040000:
     # pylint: disable=W0622
@@ -51,6 +53,39 @@ class TestCiterankIndexer(InvenioTestCase):
         dict_of_ranks = bibrank_citerank_indexer.run_pagerank(self.cit, self.dict_of_ids, len(self.dict_of_ids), self.ref, self.damping_factor, self.conv_threshold, self.check_point, self.dates)
         self.assertEqual({96: 0.622, 18: 1.1419839999999999, 74: 0.88200100000000003, 77: 1.142002, 78: 1.6020020000000001, 79: 0.86200299999999996, 80: 0.62200199999999994, 81: 2.712002, 82: 0.62200199999999994, 83: 0.62200299999999997, 84: 1.6520029999999999, 85: 0.62200299999999997, 86: 0.62200299999999997, 87: 0.62200299999999997, 88: 0.62200299999999997, 89: 0.62200500000000003, 91: 0.88200699999999999, 92: 0.62200599999999995, 94: 1.1419969999999999, 95: 1.8519990000000002}, dict_of_ranks)
 
+    def test_sparse_engine(self):
+        """bibrank citerank indexer - sparse engine gives the weights of the dict engine"""
+        len_ = len(self.dict_of_ids)
+        sparse, semi_sparse, semi_sparse_coef = bibrank_citerank_indexer.construct_sparse_matrix(self.cit, self.ref, self.dict_of_ids, len_, self.damping_factor)
+        weights_dict = bibrank_citerank_indexer.pagerank(self.conv_threshold, self.check_point, len_, sparse, semi_sparse, semi_sparse_coef)
+        matrix, semi_sparse, semi_sparse_coef = bibrank_citerank_indexer.construct_sparse_matrix_arrays(self.cit, self.ref, self.dict_of_ids, len_, self.damping_factor)
+        weights_sparse = bibrank_citerank_indexer.pagerank_sparse(self.conv_threshold, self.check_point, len_, matrix, semi_sparse, semi_sparse_coef)
+        for i in range(len_):
+            self.assertAlmostEqual(weights_dict[i], weights_sparse[i], 4)
+
+    def test_sparse_engine_ext(self):
+        """bibrank citerank indexer - sparse engine with external citations"""
+        len_ = len(self.dict_of_ids)
+        ext_links = {0: 3, 5: 1, 8: 0, 13: 2}
+        sparse, semi_sparse = bibrank_citerank_indexer.construct_sparse_matrix_ext(self.cit, self.ref, ext_links, self.dict_of_ids, 0.5, 0.2)
+        weights_dict = bibrank_citerank_indexer.pagerank_ext(self.conv_threshold, self.check_point, len_ + 1, sparse, semi_sparse)
+        matrix, semi_sparse, semi_sparse_values = bibrank_citerank_indexer.construct_sparse_matrix_ext_arrays(self.cit, self.ref, ext_links, self.dict_of_ids, 0.5, 0.2)
+        weights_sparse = bibrank_citerank_indexer.pagerank_ext_sparse(self.conv_threshold, self.check_point, len_ + 1, matrix, semi_sparse, semi_sparse_values)
+        self.assertEqual(len_, len(weights_sparse))
+        for i in range(len_):
+            self.assertAlmostEqual(weights_dict[i], weights_sparse[i], 4)
+
+    def test_warm_start(self):
+        """bibrank citerank indexer - warm start gives the same ranks"""
+        weights_file = tempfile.mktemp(prefix='citerank_')
+        try:
+            dict_of_ranks = bibrank_citerank_indexer.run_pagerank(self.cit, self.dict_of_ids, len(self.dict_of_ids), self.ref, self.damping_factor, self.conv_threshold, self.check_point, self.dates, weights_file=weights_file)
+            self.failUnless(os.path.exists(weights_file))
+            self.assertEqual(dict_of_ranks, bibrank_citerank_indexer.run_pagerank(self.cit, self.dict_of_ids, len(self.dict_of_ids), self.ref, self.damping_factor, self.conv_threshold, self.check_point, self.dates, weights_file=weights_file))
+        finally:
+            if os.path.exists(weights_file):
+                os.remove(weights_file)
+
 TEST_SUITE = make_test_suite(TestCiterankIndexer,)
 
 if __name__ == "__main__":
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibRank rank store.
+
+Keeps the rank values of a rank method (as stored in rnkMETHODDATA)
+in a dense array of doubles indexed by record ID, so that web workers
+do not have to fetch and unmarshal the whole rnkMETHODDATA blob on
+every ranked search.  The array is written by the rank indexers to a
+file in the cache directory, next to the database row, and is
+memory-mapped read-only by the readers; the mapping is renewed only
+when rnkMETHOD.last_updated changes.
+
+File format: a header made of the magic string, the format version,
+the flags (whether the values are integers), the length of the
+last_updated stamp, the stamp itself and the number
+of values, followed by the values as little-endian doubles.  Records
+without rank value are stored as NaN.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import sys
+import mmap
+import heapq
+import struct
+from array import array
+
+from invenio.config import CFG_CACHEDIR
+from invenio.dbquery import run_sql
+
+CFG_BIBRANK_RANK_STORE_DIR = os.path.join(CFG_CACHEDIR, 'rank')
+
+# magic string and version of the stored rank store format:
+CFG_BIBRANK_RANK_STORE_MAGIC = 'RNKS'
+CFG_BIBRANK_RANK_STORE_VERSION = 1
+
+_HEADER = struct.Struct('<4sBBH')
+_SIZE = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+_NAN = float('nan')
+
+# header flags:
+CFG_BIBRANK_RANK_STORE_INTEGERS = 1
+
+# rank stores mapped by this process, per rank method:
+_RANK_STORES = {}
+
+
+def get_rank_store_filename(rank_method_code):
+    """Return name of the rank store file of RANK_METHOD_CODE."""
+    return os.path.join(CFG_BIBRANK_RANK_STORE_DIR, '%s.rnk' % rank_method_code)
+
+
+def get_rank_method_last_updated(rank_method_code):
+    """Return last_updated stamp of RANK_METHOD_CODE, or None."""
+    res = run_sql("SELECT last_updated FROM rnkMETHOD WHERE name=%s",
+                  (rank_method_code, ))
+    if res and res[0][0]:
+        return str(res[0][0])
+    return None
+
+
+def dumps_rank_store(rnkdict, stamp):
+    """
+    Return string representation of the rank store of RNKDICT, a
+    dictionary of record IDs and rank values, stamped with STAMP.
+    """
+    size = 0
+    if rnkdict:
+        size = max(rnkdict) + 1
+    values = array('d', [_NAN]) * size
+    flags = CFG_BIBRANK_RANK_STORE_INTEGERS
+    for recid, value in rnkdict.iteritems():
+        if recid >= 0:
+            if not isinstance(value, (int, long)):
+                flags = 0
+            values[recid] = float(value)
+    if values.itemsize != _VALUE.size:
+        raise ValueError("unsupported double size %s" % values.itemsize)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return _HEADER.pack(CFG_BIBRANK_RANK_STORE_MAGIC,
+                        CFG_BIBRANK_RANK_STORE_VERSION, flags,
+                        len(stamp)) + \
+           stamp + _SIZE.pack(size) + values.tostring()
+
+
+def save_rank_store(rank_method_code, rnkdict, stamp=None, filename=None):
+    """
+    Store the rank values RNKDICT of RANK_METHOD_CODE, replacing the
+    previous ones atomically.  STAMP defaults to the current
+    rnkMETHOD.last_updated value of the method.
+    """
+    if stamp is None:
+        stamp = get_rank_method_last_updated(rank_method_code) or ''
+    if filename is None:
+        filename = get_rank_store_filename(rank_method_code)
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp_filename = '%s.%s' % (filename, os.getpid())
+    tmp_file = open(tmp_filename, 'wb')
+    try:
+        tmp_file.write(dumps_rank_store(rnkdict, stamp))
+    finally:
+        tmp_file.close()
+    os.rename(tmp_filename, filename)
+
+
+def delete_rank_store(rank_method_code):
+    """Remove the rank store file of RANK_METHOD_CODE, if any."""
+    try:
+        os.remove(get_rank_store_filename(rank_method_code))
+    except OSError:
+        pass
+
+
+class RankStore(object):
+    """
+    Read-only rank values of a rank method, memory-mapped from the
+    rank store file.
+    """
+
+    def __init__(self, filename):
+        """
+        Map FILENAME.  Raise ValueError if it is not a valid rank
+        store, IOError if it cannot be read.
+        """
+        store_file = open(filename, 'rb')
+        try:
+            if os.fstat(store_file.fileno()).st_size < _HEADER.size:
+                raise ValueError("truncated rank store %s" % filename)
+            self._map = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            store_file.close()
+        magic, version, flags, stamp_size = _HEADER.unpack_from(self._map, 0)
+        if magic != CFG_BIBRANK_RANK_STORE_MAGIC or \
+               version != CFG_BIBRANK_RANK_STORE_VERSION:
+            self.close()
+            raise ValueError("unsupported rank store %s" % filename)
+        self.integers = bool(flags & CFG_BIBRANK_RANK_STORE_INTEGERS)
+        offset = _HEADER.size
+        self.stamp = self._map[offset:offset + stamp_size]
+        offset += stamp_size
+        if len(self._map) < offset + _SIZE.size:
+            self.close()
+            raise ValueError("truncated rank store %s" % filename)
+        self.size = _SIZE.unpack_from(self._map, offset)[0]
+        self._offset = offset + _SIZE.size
+        if len(self._map) < self._offset + self.size * _VALUE.size:
+            self.close()
+            raise ValueError("truncated rank store %s" % filename)
+
+    def close(self):
+        """Unmap the rank store."""
+        self._map.close()
+
+    def get(self, recid):
+        """Return rank value of RECID, or None if it has none."""
+        if 0 <= recid < self.size:
+            value = _VALUE.unpack_from(self._map, self._offset + recid * _VALUE.size)[0]
+            if value == value:
+                if self.integers:
+                    return int(value)
+                return value
+        return None
+
+    def gather(self, recids):
+        """
+        Return the list of (recid, value) tuples of the RECIDS having a
+        rank value and the list of the RECIDS without rank value.
+        """
+        unpack_from = _VALUE.unpack_from
+        mapping = self._map
+        offset = self._offset
+        itemsize = _VALUE.size
+        size = self.size
+        integers = self.integers
+        ranked = []
+        unranked = []
+        for recid in recids:
+            if recid < size:
+                value = unpack_from(mapping, offset + recid * itemsize)[0]
+                if value == value:
+                    if integers:
+                        value = int(value)
+                    ranked.append((recid, value))
+                    continue
+            unranked.append(recid)
+        return ranked, unranked
+
+
+def get_rank_store(rank_method_code):
+    """
+    Return the RankStore of RANK_METHOD_CODE, or None if there is no
+    rank store matching the current rnkMETHOD.last_updated value.
+    """
+    stamp = get_rank_method_last_updated(rank_method_code)
+    if stamp is None:
+        return None
+    store = _RANK_STORES.get(rank_method_code)
+    if store is not None and store.stamp == stamp:
+        return store
+    try:
+        new_store = RankStore(get_rank_store_filename(rank_method_code))
+    except (EnvironmentError, ValueError):
+        return None
+    if new_store.stamp != stamp:
+        # the indexer has not (re)written the store yet:
+        new_store.close()
+        return None
+    if store is not None:
+        store.close()
+    _RANK_STORES[rank_method_code] = new_store
+    return new_store
+
+
+def sort_ranked_records(ranked, nb_top=None):
+    """
+    Return the (recid, value) tuples RANKED in ascending order of
+    value, like rank_by_method() does.  If NB_TOP is given, only the
+    NB_TOP best records, that are put at the end of the list, are
+    sorted; the other ones precede them in record ID order.
+    """
+    if nb_top is None or nb_top >= len(ranked):
+        return sorted(ranked, key=lambda item: item[1])
+    if nb_top <= 0:
+        return list(ranked)
+    # heapq.nlargest() is stable, so ties are broken like in sorted():
+    top = heapq.nlargest(nb_top, reversed(ranked), key=lambda item: item[1])
+    top.reverse()
+    top_recids = set([recid for recid, dummy in top])
+    return [item for item in ranked if item[0] not in top_recids] + top
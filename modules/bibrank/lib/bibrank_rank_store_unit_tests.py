@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the BibRank rank store."""
+
+__revision__ = "$Id$"
+
+import os
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio.bibrank_rank_store import RankStore, save_rank_store, \
+     sort_ranked_records
+
+
+class RankStoreTest(InvenioTestCase):
+    """Test of the storage of rank values."""
+
+    def _save_and_map(self, rnkdict, stamp):
+        """Return RankStore of RNKDICT saved in a temporary file."""
+        fd, filename = tempfile.mkstemp(prefix='rank_store_')
+        os.close(fd)
+        try:
+            save_rank_store('test', rnkdict, stamp, filename)
+            return RankStore(filename)
+        finally:
+            os.remove(filename)
+
+    def test_float_values(self):
+        """bibrank rank store - float values are gathered from the store"""
+        store = self._save_and_map({1: 0.5, 3: 0.0, 10: 2.25}, '2015-01-02 03:04:05')
+        self.assertEqual('2015-01-02 03:04:05', store.stamp)
+        self.assertEqual(11, store.size)
+        self.assertEqual(([(1, 0.5), (3, 0.0), (10, 2.25)], [2, 11, 12]),
+                         store.gather(intbitset([1, 2, 3, 10, 11, 12])))
+        self.assertEqual(None, store.get(2))
+        store.close()
+
+    def test_integer_values(self):
+        """bibrank rank store - integer values stay integers"""
+        store = self._save_and_map({2: 7, 5: 3}, '')
+        self.assertEqual(7, store.get(2))
+        self.failUnless(isinstance(store.get(5), int))
+        store.close()
+
+    def test_empty_store(self):
+        """bibrank rank store - store without values"""
+        store = self._save_and_map({}, '')
+        self.assertEqual(([], [1]), store.gather([1]))
+        store.close()
+
+    def test_invalid_store(self):
+        """bibrank rank store - damaged store is refused"""
+        fd, filename = tempfile.mkstemp(prefix='rank_store_')
+        os.write(fd, 'not a rank store')
+        os.close(fd)
+        try:
+            self.assertRaises(ValueError, RankStore, filename)
+        finally:
+            os.remove(filename)
+
+
+class SortRankedRecordsTest(InvenioTestCase):
+    """Test of the partial sorting of ranked records."""
+
+    def test_top_records(self):
+        """bibrank rank store - best records are sorted like with full sort"""
+        ranked = [(recid, (recid * 7) % 5) for recid in range(1, 30)]
+        full = sort_ranked_records(ranked)
+        self.assertEqual(sorted(ranked, key=lambda item: item[1]), full)
+        for nb_top in (1, 4, 10, 29, 50):
+            partial = sort_ranked_records(ranked, nb_top)
+            self.assertEqual(len(ranked), len(partial))
+            self.assertEqual(full[-nb_top:], partial[-nb_top:])
+            self.assertEqual(sorted(full), sorted(partial))
+
+
+TEST_SUITE = make_test_suite(RankStoreTest,
+                             SortRankedRecordsTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
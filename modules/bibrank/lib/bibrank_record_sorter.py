@@ -40,6 +40,7 @@ from invenio.bibindex_engine_stopwords import is_stopword
 from invenio.bibrank_citation_searcher import get_cited_by_weight, \
                                               get_citation_dict
 from invenio.intbitset import intbitset
+from invenio.bibrank_rank_store import get_rank_store, sort_ranked_records
 from invenio.bibrank_word_searcher import find_similar
 # Do not remove these lines
 # it is necessary for func_object = globals().get(function)
@@ -222,7 +223,7 @@ def citation(rank_method_code, related_to, hitset, rank_limit_relevance, verbose
     return rank_by_citations(hits, verbose)
 
 
-def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[], verbose=0, field='', rg=None, jrec=None):
+def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[], verbose=0, field='', rg=None, jrec=None, partial_sort=False):
     """Sorts given records or related records according to given method
 
        Parameters:
@@ -240,8 +241,15 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[],
                       records
         - verbose, verbose level
         - field: stuff
-        - rg: more stuff
-        - jrec: even more stuff
+        - rg: number of records to display; together with jrec,
+              tells how many best records need to be sorted
+        - jrec: position of the first record to display
+        - partial_sort: if True, only the rg + jrec best records are
+                        sorted, at the end of the list, the other ones
+                        preceding them in record ID order; to be used
+                        only when the records are displayed in
+                        descending order of rank and the rest of the
+                        list is not used
 
        Output:
        - list of records
@@ -273,11 +281,16 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[],
             voutput += "function: %s <br/> " % function
             voutput += "related_to:  %s <br/>" % str(related_to)
 
+        # only the records up to the displayed page need to be sorted:
+        ranked_result_amount = None
+        if partial_sort and rg and rg > 0:
+            ranked_result_amount = rg + (jrec or 0)
+
         if func_object and related_to and related_to[0][0:6] == "recid:" and function == "word_similarity":
-            result = find_similar(rank_method_code, related_to[0][6:], hitset, rank_limit_relevance, verbose, METHODS)
+            result = find_similar(rank_method_code, related_to[0][6:], hitset, rank_limit_relevance, verbose, METHODS, ranked_result_amount)
         elif func_object:
             if function == "word_similarity":
-                result = func_object(rank_method_code, related_to, hitset, rank_limit_relevance, verbose, METHODS)
+                result = func_object(rank_method_code, related_to, hitset, rank_limit_relevance, verbose, METHODS, ranked_result_amount)
             elif function in ("word_similarity_solr", "word_similarity_xapian"):
                 if not rg:
                     rg = CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS
@@ -301,7 +314,7 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[],
             else:
                 result = func_object(rank_method_code, related_to, hitset, rank_limit_relevance, verbose)
         else:
-            result = rank_by_method(rank_method_code, related_to, hitset, rank_limit_relevance, verbose)
+            result = rank_by_method(rank_method_code, related_to, hitset, rank_limit_relevance, verbose, ranked_result_amount)
     except Exception, e:
         register_exception()
         result = (None, "", adderrorbox("An error occured when trying to rank the search result "+rank_method_code, ["Unexpected error: %s<br />" % (e,)]), voutput)
@@ -355,7 +368,7 @@ def combine_method(rank_method_code, pattern, hitset, rank_limit_relevance, verb
         return (None, "Warning: %s method cannot be used for ranking your query." % rank_method_code, "", voutput)
 
 
-def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance, verbose):
+def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, ranked_result_amount=None):
     """Ranking of records based on predetermined values.
     input:
     rank_method_code - the code of the method, from the name field in rnkMETHOD, used to get predetermined values from
@@ -364,6 +377,8 @@ def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance, verbo
     hitset - a list of hits for the query found by search_engine
     rank_limit_relevance - show only records with a rank value above this
     verbose - verbose value
+    ranked_result_amount - if given, only this number of best records are sorted,
+    the other ranked records precede them in record ID order
     output:
     reclist - a list of sorted records, with unsorted added to the end: [[23,34], [344,24], [1,01]]
     prefix - what to show before the rank value
@@ -371,10 +386,12 @@ def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance, verbo
     voutput - contains extra information, content dependent on verbose value"""
 
     voutput = ""
-    rnkdict = run_sql("SELECT relevance_data FROM rnkMETHODDATA,rnkMETHOD where rnkMETHOD.id=id_rnkMETHOD and rnkMETHOD.name=%s", (rank_method_code,))
+    rnkstore = get_rank_store(rank_method_code)
+    if rnkstore is None:
+        rnkdict = run_sql("SELECT relevance_data FROM rnkMETHODDATA,rnkMETHOD where rnkMETHOD.id=id_rnkMETHOD and rnkMETHOD.name=%s", (rank_method_code,))
 
-    if not rnkdict:
-        return (None, "Warning: Could not load ranking data for method %s." % rank_method_code, "", voutput)
+        if not rnkdict:
+            return (None, "Warning: Could not load ranking data for method %s." % rank_method_code, "", voutput)
 
     max_recid = 0
     res = run_sql("SELECT max(id) FROM bibrec")
@@ -398,37 +415,35 @@ def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance, verbo
             else:
                 return (None, "Warning: Given record IDs are out of range.", "", voutput)
 
-    rnkdict = deserialize_via_marshal(rnkdict[0][0])
-    if verbose > 0:
-        voutput += "<br />Running rank method: %s, using rank_by_method function in bibrank_record_sorter<br />" % rank_method_code
-        voutput += "Ranking data loaded, size of structure: %s<br />" % len(rnkdict)
-    lrecIDs = list(hitset)
+    if lwords_hitset:
+        hitset = hitset & lwords_hitset
 
     if verbose > 0:
-        voutput += "Number of records to rank: %s<br />" % len(lrecIDs)
-    reclist = []
-    reclist_addend = []
+        voutput += "<br />Running rank method: %s, using rank_by_method function in bibrank_record_sorter<br />" % rank_method_code
+        voutput += "Number of records to rank: %s<br />" % len(hitset)
 
-    if not lwords_hitset: #rank all docs, can this be speed up using something else than for loop?
-        for recID in lrecIDs:
+    if rnkstore is not None:
+        if verbose > 0:
+            voutput += "Ranking data mapped from rank store, size of structure: %s<br />" % rnkstore.size
+        reclist, recids_addend = rnkstore.gather(hitset)
+        reclist_addend = [(recID, 0) for recID in recids_addend]
+    else:
+        rnkdict = deserialize_via_marshal(rnkdict[0][0])
+        if verbose > 0:
+            voutput += "Ranking data loaded, size of structure: %s<br />" % len(rnkdict)
+        reclist = []
+        reclist_addend = []
+        for recID in hitset:
             if recID in rnkdict:
                 reclist.append((recID, rnkdict[recID]))
-                del rnkdict[recID]
             else:
                 reclist_addend.append((recID, 0))
-    else: #rank docs in hitset, can this be speed up using something else than for loop?
-        for recID in lwords_hitset:
-            if recID in rnkdict and recID in hitset:
-                reclist.append((recID, rnkdict[recID]))
-                del rnkdict[recID]
-            elif recID in hitset:
-                reclist_addend.append((recID, 0))
 
     if verbose > 0:
         voutput += "Number of records ranked: %s<br />" % len(reclist)
         voutput += "Number of records not ranked: %s<br />" % len(reclist_addend)
 
-    reclist.sort(lambda x, y: cmp(x[1], y[1]))
+    reclist = sort_ranked_records(reclist, ranked_result_amount)
     return (reclist_addend + reclist, METHODS[rank_method_code]["prefix"], METHODS[rank_method_code]["postfix"], voutput)
 
 
@@ -441,12 +456,12 @@ def rank_by_citations(hitset, verbose):
     voutput = ""
 
     if len(hitset) > CFG_WEBSEARCH_CITESUMMARY_SCAN_THRESHOLD:
-        cites_counts = get_citation_dict('citations_counts')
-        ret = [(recid, weight) for recid, weight in cites_counts
-                                                        if recid in hitset]
-        recids_without_cites = hitset - get_citation_dict('citations_keys')
+        citation_counts = get_citation_dict('citation_counts')
+        ret = [(recid, weight) for recid, weight
+               in citation_counts.get_sorted_counts() if recid in hitset]
+        recids_without_cites = hitset - citation_counts.keys
         ret.extend([(recid, 0) for recid in recids_without_cites])
-        ret = list(reversed(ret))
+        ret.reverse()
     else:
         ret = get_cited_by_weight(hitset)
         ret.sort(key=itemgetter(1))
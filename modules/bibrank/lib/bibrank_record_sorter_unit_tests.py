@@ -47,7 +47,73 @@ class TestListSetOperations(InvenioTestCase):
         self.assertEqual(({1: 7, 2: 7, 5: 5}, {1: 1, 2: 1, 5: 1}),  bibrank_word_searcher.calculate_record_relevance(("testterm", 2.0),
 {"Gi":(0, 50.0), 1: (3, 4.0), 2: (4, 5.0), 5: (1, 3.5)}, hitset, {}, {}, 0, None))
 
-TEST_SUITE = make_test_suite(TestListSetOperations,)
+
+class TestWordRankingEngine(InvenioTestCase):
+    """Test the word similarity ranking engine."""
+
+    def setUp(self):
+        """Prepare hitlists of three terms, with the bounds of their weights."""
+        self.hitlists = {}
+        for (term, Gi, step) in (("rare", 80, 7), ("common", 20, 2), ("frequent", 5, 1)):
+            hitlist = dict([(j, (1 + j % 3, 10 + j % 5)) for j in range(step, 100, step)])
+            bound = max([tf[0] * tf[1] for tf in hitlist.values()])
+            self.hitlists[term] = ((bound, Gi), hitlist)
+        self.terms = [("rare", 80), ("common", 20), ("frequent", 5)]
+        self.hitset = intbitset(range(1, 90))
+
+    def test_score_records(self):
+        """bibrank record sorter - scoring records of all terms at once"""
+        (recdict, rec_termcount) = bibrank_word_searcher.score_records([("testterm", 2.0)],
+            {"testterm": ((0, 50.0), {1: (3, 4.0), 2: (4, 5.0), 5: (1, 3.5)})},
+            intbitset([1, 2, 5]), bibrank_word_searcher.word_similarity_term_weight)
+        self.assertEqual(({1: 7, 2: 7, 5: 5}, {1: 1, 2: 1, 5: 1}), (recdict, rec_termcount))
+
+    def test_select_ranked_records(self):
+        """bibrank record sorter - selecting the best records"""
+        recdict = {1: 50, 2: 30, 3: 70, 4: 10}
+        rec_termcount = {1: 1, 2: 1, 3: 1, 4: 1}
+        self.assertEqual([(1, 71), (3, 100)],
+                         bibrank_word_searcher.select_ranked_records(recdict, rec_termcount, 50))
+        self.assertEqual([(2, 42), (4, 14), (1, 71), (3, 100)],
+                         bibrank_word_searcher.select_ranked_records(recdict, rec_termcount, 0, nb_top=2))
+
+    def test_pruned_top_records(self):
+        """bibrank record sorter - best records are exact with max-score pruning"""
+        for (term_weight, term_bound, record_score) in (
+            (bibrank_word_searcher.word_similarity_term_weight,
+             bibrank_word_searcher.word_similarity_term_bound, None),
+            (bibrank_word_searcher.find_similar_term_weight,
+             bibrank_word_searcher.find_similar_term_bound,
+             bibrank_word_searcher.find_similar_record_score)):
+            (recdict, rec_termcount) = bibrank_word_searcher.score_records(
+                self.terms, self.hitlists, self.hitset, term_weight, term_bound, record_score)
+            full = bibrank_word_searcher.select_ranked_records(recdict, rec_termcount, 0, record_score)
+            for nb_top in (1, 3, 10):
+                (recdict, rec_termcount) = bibrank_word_searcher.score_records(
+                    self.terms, self.hitlists, self.hitset, term_weight, term_bound, record_score, nb_top)
+                top = bibrank_word_searcher.select_ranked_records(recdict, rec_termcount, 0, record_score, nb_top)
+                self.assertEqual(full[-nb_top:], top[-nb_top:])
+
+    def test_pruned_top_records_small_weights(self):
+        """bibrank record sorter - best records are exact with terms of weight below 1"""
+        self.hitlists["frequent"] = ((self.hitlists["frequent"][0][0], 0.001),
+                                     self.hitlists["frequent"][1])
+        self.assertEqual(0, bibrank_word_searcher.word_similarity_term_weight((1, 10), 0.001, 5))
+        (recdict, rec_termcount) = bibrank_word_searcher.score_records(
+            self.terms, self.hitlists, self.hitset,
+            bibrank_word_searcher.word_similarity_term_weight,
+            bibrank_word_searcher.word_similarity_term_bound)
+        full = bibrank_word_searcher.select_ranked_records(recdict, rec_termcount, 0)
+        for nb_top in (1, 3, 10):
+            (recdict, rec_termcount) = bibrank_word_searcher.score_records(
+                self.terms, self.hitlists, self.hitset,
+                bibrank_word_searcher.word_similarity_term_weight,
+                bibrank_word_searcher.word_similarity_term_bound, nb_top=nb_top)
+            top = bibrank_word_searcher.select_ranked_records(recdict, rec_termcount, 0, nb_top=nb_top)
+            self.assertEqual(full[-nb_top:], top[-nb_top:])
+
+TEST_SUITE = make_test_suite(TestListSetOperations,
+                             TestWordRankingEngine)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -34,14 +34,19 @@ from itertools import chain
 import ConfigParser
 
 from invenio.bibformat_utils import parse_tag
-from invenio.search_engine_utils import get_fieldvalues
+from invenio.search_engine_utils import get_fieldvalues, \
+                                        get_fieldvalues_by_record
 from invenio.bibrank_citation_indexer import tagify
 from invenio.config import CFG_ETCDIR, \
                            CFG_BIBRANK_SELFCITES_USE_BIBAUTHORID, \
                            CFG_BIBRANK_SELFCITES_PRECOMPUTE
 from invenio.dbquery import run_sql
 from invenio.bibauthorid_searchinterface import get_authors_of_claimed_paper
-from invenio.bibrank_citation_searcher import get_cited_by
+from invenio.bibrank_citation_searcher import get_cited_by, \
+                                             get_cited_by_list
+
+# maximum number of records looked up per query by the bulk functions
+CFG_BIBRANK_SELFCITES_QUERY_CHUNK_SIZE = 5000
 
 
 def load_config_file(key):
@@ -116,6 +121,75 @@ def get_collaborations_from_record(recID, tags):
     return get_fieldvalues(recID, tags['collaboration_name'])
 
 
+def iter_query_chunks(recids):
+    """Split RECIDS into lists small enough for 'IN (...)' queries"""
+    recids = list(recids)
+    for i in xrange(0, len(recids), CFG_BIBRANK_SELFCITES_QUERY_CHUNK_SIZE):
+        yield recids[i:i + CFG_BIBRANK_SELFCITES_QUERY_CHUNK_SIZE]
+
+
+def get_personids_from_records(recids):
+    """Bulk version of get_personids_from_record()
+
+    Returns a dictionary {recid: set of personids} for all RECIDS.
+    """
+    person_ids = {}
+    for chunk in iter_query_chunks(recids):
+        in_sql = ','.join('%s' for dummy in chunk)
+        rows = run_sql("""SELECT bibrec, personid FROM aidPERSONIDPAPERS
+                          WHERE bibrec IN (%s) AND flag > -2""" % in_sql,
+                       chunk)
+        for recid, personid in rows:
+            person_ids.setdefault(recid, set()).add(personid)
+
+    ret = {}
+    for recid in recids:
+        ids = person_ids.get(recid, ())
+        if 0 < len(ids) <= 20:
+            ret[recid] = set(ids)
+        else:
+            ret[recid] = set()
+    return ret
+
+
+def get_authors_from_records(recids, tags,
+                             use_bibauthorid=CFG_BIBRANK_SELFCITES_USE_BIBAUTHORID):
+    """Bulk version of get_authors_from_record()
+
+    Returns a dictionary {recid: set of authors} for all RECIDS.
+    """
+    if use_bibauthorid:
+        return get_personids_from_records(recids)
+
+    values = {}
+    for tag in ('first_author', 'additional_author',
+                'alternative_author_name'):
+        for chunk in iter_query_chunks(recids):
+            for recid, authors_list in \
+                    get_fieldvalues_by_record(chunk, tags[tag]).iteritems():
+                values.setdefault(recid, []).extend(authors_list)
+
+    ret = {}
+    for recid in recids:
+        ret[recid] = set(hash(author)
+                         for author in values.get(recid, [])[:21])
+    return ret
+
+
+def get_collaborations_from_records(recids, tags):
+    """Bulk version of get_collaborations_from_record()
+
+    Returns a dictionary {recid: list of collaborations} for all RECIDS.
+    """
+    ret = {}
+    for chunk in iter_query_chunks(recids):
+        ret.update(get_fieldvalues_by_record(chunk,
+                                             tags['collaboration_name']))
+    for recid in recids:
+        ret.setdefault(recid, [])
+    return ret
+
+
 def compute_self_citations(recid, tags, authors_fun):
     """Compute the self-citations
 
@@ -165,6 +239,77 @@ def compute_self_citations(recid, tags, authors_fun):
     return self_citations
 
 
+def compute_self_citations_bulk(recids, tags, algorithm='simple'):
+    """Compute the self-citations of many records at once
+
+    Returns a dictionary {recid: set of self-citations} for all RECIDS,
+    as ALL_ALGORITHMS[ALGORITHM] would compute them record by record.
+    The authors, collaborations and co-authors of the records and of
+    their citers are fetched with a few queries for all of them, so
+    callers should pass chunks of reasonable size.
+    """
+    citers_dict = {}
+    for chunk in iter_query_chunks(recids):
+        citers_dict.update(get_cited_by_list(chunk))
+    all_citers = set()
+    for citers in citers_dict.itervalues():
+        all_citers.update(citers)
+
+    authors = get_authors_from_records(set(citers_dict) | all_citers, tags)
+    for recid in authors:
+        authors[recid] = frozenset(authors[recid])
+
+    # Collaborations are only needed for the records without authors or
+    # with too many of them, and for all their citers
+    need_collaborations = set()
+    for recid, citers in citers_dict.iteritems():
+        if not authors[recid] or len(authors[recid]) > 20:
+            need_collaborations.add(recid)
+            need_collaborations.update(citers)
+    for citer in all_citers:
+        if len(authors[citer]) > 20:
+            need_collaborations.add(citer)
+    collaborations = get_collaborations_from_records(need_collaborations,
+                                                     tags)
+
+    if algorithm == 'friends':
+        coauthors = get_records_coauthors(all_citers)
+        for citer in all_citers:
+            coauthors[citer] = frozenset(coauthors[citer]) | authors[citer]
+    else:
+        coauthors = authors
+
+    ret = {}
+    for recid, citers in citers_dict.iteritems():
+        self_citations = set()
+        ret[recid] = self_citations
+        if not citers:
+            continue
+
+        rec_authors = authors[recid]
+        rec_collaborations = None
+        if not rec_authors or len(rec_authors) > 20:
+            rec_collaborations = frozenset(collaborations[recid])
+
+        if rec_collaborations:
+            # Use collaborations names
+            for cit in citers:
+                if rec_collaborations.intersection(collaborations[cit]):
+                    self_citations.add(cit)
+        else:
+            # Use authors names
+            for cit in citers:
+                if (not rec_authors or len(authors[cit]) > 20) and \
+                        collaborations[cit]:
+                    # Record from a collaboration that cites
+                    # a record from an author, it's fine
+                    pass
+                elif rec_authors.intersection(coauthors[cit]):
+                    self_citations.add(cit)
+
+    return ret
+
+
 def fetch_references(recid):
     """Fetch the references stored in the self-citations table for given record
 
@@ -230,12 +375,11 @@ def get_self_citations_count(recids, algorithm='simple',
 
     if not precompute:
         tags = get_authors_tags()
-        selfcites_fun = ALL_ALGORITHMS[algorithm]
+        self_cites = compute_self_citations_bulk(recids, tags, algorithm)
 
-        for recid in recids:
-            citers = get_cited_by(recid)
-            self_cites = selfcites_fun(recid, tags)
-            total_cites += len(citers) - len(self_cites)
+        for chunk in iter_query_chunks(recids):
+            for recid, citers in get_cited_by_list(chunk):
+                total_cites += len(citers) - len(self_cites[recid])
     else:
         results = get_precomputed_self_cites_list(recids)
 
@@ -339,6 +483,23 @@ def get_record_coauthors(recid):
     return (r[0] for r in run_sql(sql, (recid, )))
 
 
+def get_records_coauthors(recids):
+    """Bulk version of get_record_coauthors()
+
+    Returns a dictionary {recid: set of authorids} for all RECIDS.
+    """
+    ret = {}
+    for recid in recids:
+        ret[recid] = set()
+    for chunk in iter_query_chunks(recids):
+        in_sql = ','.join('%s' for dummy in chunk)
+        rows = run_sql("""SELECT id, authorid FROM rnkEXTENDEDAUTHORS
+                          WHERE id IN (%s)""" % in_sql, chunk)
+        for recid, authorid in rows:
+            ret[recid].add(authorid)
+    return ret
+
+
 SELFCITES_CONFIG = load_config_file('selfcites')
 
 ALL_ALGORITHMS = {
@@ -100,6 +100,18 @@ class SelfCitesIndexerTests(InvenioTestCase):
         ret = compute_friends_self_citations(1, tags)
         self.assertEqual(ret, set())
 
+    def test_compute_self_citations_bulk(self):
+        from invenio.bibrank_selfcites_indexer import \
+                                                compute_self_citations_bulk
+        from invenio.bibrank_selfcites_indexer import get_authors_tags
+        from invenio.bibrank_selfcites_indexer import ALL_ALGORITHMS
+        tags = get_authors_tags()
+        recids = range(1, 100)
+        for algorithm, citations_fun in ALL_ALGORITHMS.iteritems():
+            ret = compute_self_citations_bulk(recids, tags, algorithm)
+            self.assertEqual(ret, dict((recid, citations_fun(recid, tags))
+                                       for recid in recids))
+
     def test_get_self_citations_count(self):
         from invenio.bibrank_selfcites_indexer import get_self_citations_count
         ret = get_self_citations_count([1, 2, 3, 4])
@@ -187,6 +199,17 @@ class SelfCitesTaskTests(InvenioTestCase):
             citation_fun = get_citations_fun(algorithm=algorithm)
         compute_and_store_self_citations(1, tags, citation_fun, {})
 
+    def test_compute_and_store_self_citations_bulk(self):
+        from invenio.bibrank_selfcites_indexer import get_authors_tags
+        from invenio.bibrank_selfcites_task import \
+                                        compute_and_store_self_citations_bulk
+        from invenio.bibrank_selfcites_indexer import ALL_ALGORITHMS
+
+        tags = get_authors_tags()
+        for algorithm in ALL_ALGORITHMS:
+            compute_and_store_self_citations_bulk(range(1, 20), tags,
+                                                  algorithm, {})
+
     def test_rebuild_tables(self):
         from invenio.bibrank_selfcites_task import rebuild_tables
         from invenio.bibrank_selfcites_indexer import ALL_ALGORITHMS
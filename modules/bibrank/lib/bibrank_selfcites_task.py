@@ -48,17 +48,24 @@ from invenio.config import CFG_BIBRANK_SELFCITES_USE_BIBAUTHORID, \
 from invenio.bibtask import task_get_option, write_message, \
                             task_sleep_now_if_required, \
                             task_update_progress
-from invenio.dbquery import run_sql
+from invenio.dbquery import run_sql, run_sql_many
 from invenio.bibrank_selfcites_indexer import update_self_cites_tables, \
                                               compute_friends_self_citations, \
                                               compute_simple_self_citations, \
+                                              compute_self_citations_bulk, \
+                                              iter_query_chunks, \
                                               get_authors_tags
-from invenio.bibrank_citation_searcher import get_refers_to
+from invenio.bibrank_citation_searcher import get_refers_to, \
+                                              get_refers_to_list
 from invenio.bibauthorid_daemon import get_user_logs as bibauthorid_user_log
 from invenio.bibrank_citation_indexer import get_bibrankmethod_lastupdate
 from invenio.bibrank_tag_based_indexer import intoDB, fromDB
+from invenio.bibrank_citation_counts import store_citation_counts
 from invenio.intbitset import intbitset
 
+# number of records whose self-citations are computed together
+CFG_BIBRANK_SELFCITES_CHUNK_SIZE = 1000
+
 
 def compute_and_store_self_citations(recid, tags, citations_fun, selfcites_dic,
                                                                 verbose=False):
@@ -103,6 +110,70 @@ def compute_and_store_self_citations(recid, tags, citations_fun, selfcites_dic,
             write_message("%s found" % len(cites))
 
 
+def compute_and_store_self_citations_bulk(recids, tags, algorithm,
+                                          selfcites_dic, verbose=False):
+    """Compute and store self-cites of many records at once
+
+    Bulk version of compute_and_store_self_citations(): the records
+    whose cached self-cites are outdated are computed together with
+    compute_self_citations_bulk() and stored with a few queries.
+
+    Args:
+     - recids: a chunk of records
+     - tags: used when bibauthorid is desactivated see get_author_tags()
+            in bibrank_selfcites_indexer
+     - algorithm: name of the self-cites algorithm
+    """
+    recids = list(recids)
+    if not recids:
+        return
+
+    references = {}
+    for chunk in iter_query_chunks(recids):
+        references.update(get_refers_to_list(chunk))
+    recids_to_check = set(recids)
+    for refs in references.itervalues():
+        recids_to_check.update(refs)
+    modification_dates = {}
+    for chunk in iter_query_chunks(recids_to_check):
+        placeholders = ','.join('%s' for r in chunk)
+        modification_dates.update(run_sql(
+                      "SELECT `id`, `modification_date` FROM `bibrec`"
+                      " WHERE `id` IN (%s)" % placeholders, chunk))
+
+    placeholders = ','.join('%s' for r in recids)
+    cached = {}
+    for recid, count, last_updated in run_sql(
+               "SELECT `id_bibrec`, `count`, `last_updated` FROM `rnkSELFCITES`"
+               " WHERE `id_bibrec` IN (%s)" % placeholders, recids):
+        cached[recid] = (count, last_updated)
+
+    to_compute = []
+    for recid in recids:
+        dates = [modification_dates[r] for r in
+                 set([recid]) | references[recid] if r in modification_dates]
+        cached_count, last_updated = cached.get(recid, (None, None))
+        if cached_count and dates and last_updated >= max(dates):
+            if verbose:
+                write_message("%s: %s found (cached)" % (recid, cached_count))
+        else:
+            to_compute.append(recid)
+
+    if not to_compute:
+        return
+    self_cites = compute_self_citations_bulk(to_compute, tags, algorithm)
+    for recid, cites in self_cites.iteritems():
+        selfcites_dic[recid] = len(cites)
+        if verbose:
+            write_message("%s: %s found" % (recid, len(cites)))
+    replace_cites_bulk(self_cites)
+    sql = """REPLACE INTO rnkSELFCITES (`id_bibrec`, `count`, `references`,
+             `last_updated`) VALUES (%s, %s, %s, NOW())"""
+    run_sql_many(sql, [(recid, len(cites),
+                        ','.join(str(r) for r in references[recid]))
+                       for recid, cites in self_cites.iteritems()])
+
+
 def replace_cites(recid, new_cites):
     """Update database with new citations set
 
@@ -129,6 +200,40 @@ def replace_cites(recid, new_cites):
                    WHERE citee = %s and citer = %s""", (recid, cit))
 
 
+def replace_cites_bulk(new_cites_dic):
+    """Update database with new citations sets
+
+    Bulk version of replace_cites() for a dictionary {recid: set of self
+    citations}.
+    """
+    old_cites_dic = {}
+    for chunk in iter_query_chunks(new_cites_dic):
+        placeholders = ','.join('%s' for r in chunk)
+        for citee, citer in run_sql("""SELECT citee, citer
+                                       FROM rnkSELFCITEDICT
+                                       WHERE citee IN (%s)""" % placeholders,
+                                    chunk):
+            old_cites_dic.setdefault(citee, set()).add(citer)
+
+    cites_to_add = []
+    cites_to_delete = []
+    for recid, new_cites in new_cites_dic.iteritems():
+        old_cites = old_cites_dic.get(recid, set())
+        cites_to_add.extend((recid, cit) for cit in new_cites - old_cites)
+        cites_to_delete.extend((recid, cit) for cit in old_cites - new_cites)
+
+    write_message('adding %s cites, deleting %s cites'
+                  % (len(cites_to_add), len(cites_to_delete)), verbose=1)
+    if cites_to_add:
+        now = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        run_sql_many("""INSERT INTO rnkSELFCITEDICT (citee, citer, last_updated)
+                        VALUES (%s, %s, %s)""",
+                     [(recid, cit, now) for recid, cit in cites_to_add])
+    if cites_to_delete:
+        run_sql_many("""DELETE FROM rnkSELFCITEDICT
+                        WHERE citee = %s and citer = %s""", cites_to_delete)
+
+
 def rebuild_tables(rank_method_code, config):
     """Rebuild the tables from scratch
 
@@ -228,19 +333,29 @@ def process_updates(rank_method_code):
     tags = get_authors_tags()
     recids, end_date = fetch_concerned_records(rank_method_code,
                                                task_get_option("id"))
-    citations_fun = get_citations_fun(config['algorithm'])
     weights = fromDB(rank_method_code)
 
     write_message("recids %s" % str(recids))
 
+    # Update the records and all their references
+    done = intbitset()
+    recids = list(recids)
     total = len(recids)
-    for count, recid in enumerate(recids):
+    for start in xrange(0, total, CFG_BIBRANK_SELFCITES_CHUNK_SIZE):
         task_sleep_now_if_required(can_stop_too=True)
-        msg = "Extracting for %s (%d/%d)" % (recid, count + 1, total)
+        chunk = recids[start:start + CFG_BIBRANK_SELFCITES_CHUNK_SIZE]
+        msg = "Extracting for %s-%s (%d/%d)" % (chunk[0], chunk[-1],
+                                                start + len(chunk), total)
         task_update_progress(msg)
         write_message(msg)
 
-        process_one(recid, tags, citations_fun, weights)
+        to_process = intbitset(chunk)
+        for dummy, references in get_refers_to_list(chunk):
+            to_process |= intbitset(list(references))
+        to_process -= done
+        compute_and_store_self_citations_bulk(to_process, tags,
+                                              config['algorithm'], weights)
+        done |= to_process
 
     intoDB(weights, end_date, rank_method_code)
     store_weights_cache(weights)
@@ -311,16 +426,15 @@ def fill_self_cites_tables(rank_method_code, config):
                 task_sleep_now_if_required()
             update_self_cites_tables(recid, config, tags)
     # Fill self-cites table
-    for index, recid in enumerate(all_ids):
-        if index % 1000 == 0:
-            msg = 'final %d/%d' % (index, len(all_ids))
-            task_update_progress(msg)
-            write_message(msg)
-            task_sleep_now_if_required()
-        compute_and_store_self_citations(recid,
-                                         tags,
-                                         citations_fun,
-                                         selfcites_dic)
+    all_ids = list(all_ids)
+    for index in xrange(0, len(all_ids), CFG_BIBRANK_SELFCITES_CHUNK_SIZE):
+        msg = 'final %d/%d' % (index, len(all_ids))
+        task_update_progress(msg)
+        write_message(msg)
+        task_sleep_now_if_required()
+        compute_and_store_self_citations_bulk(
+                   all_ids[index:index + CFG_BIBRANK_SELFCITES_CHUNK_SIZE],
+                   tags, algorithm, selfcites_dic)
     intoDB(selfcites_dic, begin_date, rank_method_code)
     store_weights_cache(selfcites_dic)
 
@@ -329,3 +443,4 @@ def store_weights_cache(weights):
     """Store into key/value store"""
     redis = get_redis()
     redis.set('selfcites_weights', serialize_via_marshal(weights))
+    store_citation_counts(selfcites=weights)
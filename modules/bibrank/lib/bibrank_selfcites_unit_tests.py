@@ -83,6 +83,26 @@ def get_record_coauthors_mock(recID, dummy_tags):
     return coauthors
 
 
+def get_authors_from_records_mock(recIDs, dummy_tags):
+    return dict((recID, set(get_personids_from_bibrec_mock(recID)))
+                for recID in recIDs)
+
+
+def get_collaborations_from_records_mock(recIDs, dummy_tags):
+    return dict((recID, []) for recID in recIDs)
+
+
+def get_cited_by_list_mock(cited_by):
+    def f(recIDs):
+        return [(recID, set(cited_by.get(recID, ()))) for recID in recIDs]
+    return f
+
+
+def get_records_coauthors_mock(recIDs):
+    return dict((recID, get_record_coauthors_mock(recID, None))
+                for recID in recIDs)
+
+
 # Document Graph
 # Docid -> Authorid
 # 1 -> 1
@@ -161,7 +181,53 @@ class SelfCitesOtherTests(InvenioTestCase):
             self.assertEqual(total_citations, set([1, 2, 3]))
 
 
-TEST_SUITE = make_test_suite(SelfCitesOtherTests)
+class SelfCitesBulkTests(InvenioTestCase):
+    if HAS_MOCK:
+        @patch('invenio.bibrank_selfcites_indexer.get_collaborations_from_records',
+            get_collaborations_from_records_mock)
+        @patch('invenio.bibrank_selfcites_indexer.get_authors_from_records',
+            get_authors_from_records_mock)
+        @patch('invenio.bibrank_selfcites_indexer.get_cited_by_list',
+            get_cited_by_list_mock({1: (3, 4), 2: (1, 2, 3), 3: (4, 5), 5: ()}))
+        def test_compute_self_citations_bulk(self):
+            """
+            Check bulk self citations match the record by record ones
+
+            see document graph up in this file
+            """
+            from invenio.bibrank_selfcites_indexer import \
+                compute_self_citations_bulk
+            tags = get_author_tags_mock()
+            self_citations = compute_self_citations_bulk([1, 2, 3, 5], tags)
+            self.assertEqual(self_citations, {1: set(),
+                                              2: set([1, 2, 3]),
+                                              3: set(),
+                                              5: set()})
+
+        @patch('invenio.bibrank_selfcites_indexer.get_records_coauthors',
+            get_records_coauthors_mock)
+        @patch('invenio.bibrank_selfcites_indexer.get_collaborations_from_records',
+            get_collaborations_from_records_mock)
+        @patch('invenio.bibrank_selfcites_indexer.get_authors_from_records',
+            get_authors_from_records_mock)
+        @patch('invenio.bibrank_selfcites_indexer.get_cited_by_list',
+            get_cited_by_list_mock({1: (3, 4), 4: (1, 5)}))
+        def test_compute_friends_self_citations_bulk(self):
+            """
+            Check bulk self citations with the friends algorithm
+
+            see document graph up in this file
+            """
+            from invenio.bibrank_selfcites_indexer import \
+                compute_self_citations_bulk
+            tags = get_author_tags_mock()
+            self_citations = compute_self_citations_bulk([1, 4], tags,
+                                                         'friends')
+            self.assertEqual(self_citations, {1: set([3]), 4: set()})
+
+
+TEST_SUITE = make_test_suite(SelfCitesOtherTests,
+                             SelfCitesBulkTests)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
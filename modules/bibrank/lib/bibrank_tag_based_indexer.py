@@ -34,6 +34,7 @@ from invenio.dbquery import run_sql, serialize_via_marshal, deserialize_via_mars
 from invenio.bibtask import task_get_option, write_message, task_sleep_now_if_required
 from invenio.bibindex_engine import create_range_list
 from invenio.intbitset import intbitset
+from invenio.bibrank_rank_store import save_rank_store
 
 options = {}
 
@@ -205,6 +206,8 @@ def intoDB(dic, date, rank_method_code):
     run_sql("INSERT INTO rnkMETHODDATA(id_rnkMETHOD, relevance_data) VALUES (%s,%s)", (midstr, serdata,))
     if date:
         run_sql("UPDATE rnkMETHOD SET last_updated=%s WHERE name=%s", (date, rank_method_code))
+    save_rank_store(rank_method_code, dic)
+    write_message("Rank store of %s written" % rank_method_code, verbose=5)
 
 def fromDB(rank_method_code):
     """Get the data for a rank method"""
@@ -278,6 +278,9 @@ class WordTable:
             else:
                 # yes there were some new words:
                 write_message("......... updating hitlist for ``%s''" % word, verbose=9)
+                if set.has_key("Gi"):
+                    # the bound of the term weights is unknown until post-processing:
+                    set["Gi"] = (0, set["Gi"][1])
                 run_sql("UPDATE %s SET hitlist=%%s WHERE term=%%s" % self.tablename,
                         (serialize_via_marshal(set), word))
         else: # the word is new, will create new set:
@@ -940,7 +943,7 @@ def rank_method_code_statistics(table):
             term_docs=deserialize_via_marshal(hitlist)
             terms[len(term_docs)] = terms.get(len(term_docs), 0) + 1
             if term_docs.has_key("Gi"):
-                Gi[t] = term_docs["Gi"]
+                Gi[t] = term_docs["Gi"][1]
         i=i + 10000
     terms=terms.items()
     terms.sort(lambda x, y: cmp(y[1], x[1]))
@@ -1114,13 +1117,17 @@ as recommended in %s/help/admin/howto-run"""
                 term_docs = deserialize_via_marshal(hitlist)
                 if term_docs.has_key("Gi"):
                     del term_docs["Gi"]
+                bound = 0
                 for (j, tf) in term_docs.iteritems():
                     if Nj.has_key(j):
-                        term_docs[j] = (tf[0], Nj[j])
+                        tf = term_docs[j] = (tf[0], Nj[j])
+                    bound = max(bound, tf[0] * tf[1])
                 Git = int(math.floor(Gi[t]*100))
                 if Git >= 0:
                     Git += 1
-                term_docs["Gi"] = (0, Git)
+                # the largest tf * norm product is kept with Gi so that the
+                # searcher can bound the weights of the term:
+                term_docs["Gi"] = (bound, Git)
                 run_sql("UPDATE %s SET hitlist=%%s WHERE term=%%s" % table,
                         (serialize_via_marshal(term_docs), t))
             except (ZeroDivisionError, OverflowError), e:
@@ -20,6 +20,7 @@ import string
 import time
 import math
 import re
+import heapq
 
 from operator import itemgetter
 
@@ -27,8 +28,11 @@ from invenio.dbquery import run_sql, deserialize_via_marshal
 from invenio.bibindex_engine_stemmer import stem
 from invenio.bibindex_engine_stopwords import is_stopword
 
+# maximum number of terms whose hitlists are fetched in one query:
+CFG_WORD_RANKING_TERMS_PER_QUERY = 500
 
-def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose, methods):
+
+def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose, methods, ranked_result_amount=None):
     """Finding terms to use for calculating similarity. Terms are taken from the recid given, returns a list of recids's and relevance,
     input:
     rank_method_code - the code of the method, from the name field in rnkMETHOD
@@ -36,6 +40,7 @@ def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose,
     hitset - a list of hits for the query found by search_engine
     rank_limit_relevance - show only records with a rank value above this
     verbose - verbose value
+    ranked_result_amount - if given, only this number of best records are sorted exactly
     output:
     reclist - a list of sorted records: [[23,34], [344,24], [1,01]]
     prefix - what to show before the rank value
@@ -64,8 +69,7 @@ def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose,
     if len(rec_terms) == 0:
         return (None, "Warning: Record specified has no content indexed for use with this method.", "", voutput)
     else:
-        terms = "%s" % rec_terms.keys()
-        terms_recs = dict(run_sql("""SELECT term, hitlist FROM %s WHERE term IN (%s)""" % (methods[rank_method_code]["rnkWORD_table"], terms[1:len(terms) - 1])))
+        terms_recs = get_term_hitlists(methods[rank_method_code]["rnkWORD_table"], rec_terms.keys())
 
     tf_values = {}
     #Calculate all term frequencies
@@ -76,21 +80,27 @@ def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose,
     tf_values.sort(lambda x, y: cmp(y[1], x[1])) #sort based on weigth
 
     lwords = []
+    terms = []
     stime = time.time()
-    (recdict, rec_termcount) = ({}, {})
 
     for (t, tf) in tf_values: #t=term, tf=term frequency
-        term_recs = deserialize_via_marshal(terms_recs[t])
-        if len(tf_values) <= methods[rank_method_code]["max_nr_words_lower"] or (len(term_recs) >= methods[rank_method_code]["min_nr_words_docs"] and (((float(len(term_recs)) / float(methods[rank_method_code]["col_size"])) <=  methods[rank_method_code]["max_word_occurence"]) and ((float(len(term_recs)) / float(methods[rank_method_code]["col_size"])) >= methods[rank_method_code]["min_word_occurence"]))): #too complicated...something must be done
+        (Gi, term_recs) = terms_recs[t]
+        nb_term_recs = len(term_recs) + (Gi is not None)
+        if len(tf_values) <= methods[rank_method_code]["max_nr_words_lower"] or (nb_term_recs >= methods[rank_method_code]["min_nr_words_docs"] and (((float(nb_term_recs) / float(methods[rank_method_code]["col_size"])) <=  methods[rank_method_code]["max_word_occurence"]) and ((float(nb_term_recs) / float(methods[rank_method_code]["col_size"])) >= methods[rank_method_code]["min_word_occurence"]))): #too complicated...something must be done
             lwords.append((t, methods[rank_method_code]["rnkWORD_table"])) #list of terms used
-            (recdict, rec_termcount) = calculate_record_relevance_findsimilar((t, round(tf, 4)) , term_recs, hitset, recdict, rec_termcount, verbose, "true") #true tells the function to not calculate all unimportant terms
+            terms.append((t, round(tf, 4)))
         if len(tf_values) > methods[rank_method_code]["max_nr_words_lower"] and (len(lwords) ==  methods[rank_method_code]["max_nr_words_upper"] or tf < 0):
             break
 
+    #quick tells the engine to not calculate all unimportant terms
+    (recdict, rec_termcount) = score_records(terms, terms_recs, hitset, find_similar_term_weight, find_similar_term_bound,
+                                             find_similar_record_score, ranked_result_amount, quick=True)
+
     if len(recdict) == 0 or len(lwords) == 0:
         return (None, "Could not find similar documents for this query.", "", voutput)
     else: #sort if we got something to sort
-        (reclist, hitset) = sort_record_relevance_findsimilar(recdict, rec_termcount, hitset, rank_limit_relevance, verbose)
+        reclist = select_ranked_records(recdict, rec_termcount, rank_limit_relevance, find_similar_record_score, ranked_result_amount)
+        reclist.reverse()
 
     if verbose > 0:
         voutput += "<br />Number of terms: %s<br />" % run_sql("SELECT count(id) FROM %s" % methods[rank_method_code]["rnkWORD_table"])[0][0]
@@ -169,7 +179,7 @@ def sort_record_relevance_findsimilar(recdict, rec_termcount, hitset, rank_limit
         voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
     return (reclist, hitset)
 
-def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, methods):
+def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, methods, ranked_result_amount=None):
     """Ranking a records containing specified words and returns a sorted list.
     input:
     rank_method_code - the code of the method, from the name field in rnkMETHOD
@@ -177,6 +187,8 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
     hitset - a list of hits for the query found by search_engine
     rank_limit_relevance - show only records with a rank value above this
     verbose - verbose value
+    ranked_result_amount - if given, only this number of best records are sorted exactly,
+    the other ranked records precede them in recid order
     output:
     reclist - a list of sorted records: [[23,34], [344,24], [1,01]]
     prefix - what to show before the rank value
@@ -202,20 +214,21 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
                 if lwords_old[i] != term: #add if stemmed word is different than original word
                     lwords.append((term, methods[rank_method_code]["rnkWORD_table"]))
 
-    (recdict, rec_termcount, lrecIDs_remove) = ({}, {}, {})
-    #For each term, if accepted, get a list of the records using the term
-    #calculate then relevance for each term before sorting the list of records
-    for (term, table) in lwords:
-        term_recs = run_sql("""SELECT term, hitlist FROM %s WHERE term=%%s""" % methods[rank_method_code]["rnkWORD_table"], (term,))
-        if term_recs: #if term exists in database, use for ranking
-            term_recs = deserialize_via_marshal(term_recs[0][1])
-            (recdict, rec_termcount) = calculate_record_relevance((term, int(term_recs["Gi"][1])) , term_recs, hitset, recdict, rec_termcount, verbose, quick=None)
-            del term_recs
+    #Get the list of the records using each accepted term, all at once, and
+    #calculate the relevance of the records, starting with the least used terms
+    terms_recs = get_term_hitlists(methods[rank_method_code]["rnkWORD_table"], [term for (term, table) in lwords])
+    terms = [(term, int(terms_recs[term][0][1])) for (term, table) in lwords
+             if terms_recs.has_key(term) and terms_recs[term][0] is not None]
+    terms.sort(key=lambda term: len(terms_recs[term[0]][1]))
+    (recdict, rec_termcount) = score_records(terms, terms_recs, hitset, word_similarity_term_weight, word_similarity_term_bound,
+                                             nb_top=ranked_result_amount)
 
     if len(recdict) == 0 or (len(lwords) == 1 and lwords[0] == ""):
         return (None, "Records not ranked. The query is not detailed enough, or not enough records found, for ranking to be possible.", "", voutput)
     else: #sort if we got something to sort
-        (reclist, hitset) = sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose)
+        #remove all ranked documents so that unranked can be added to the end
+        hitset -= recdict.keys()
+        reclist = select_ranked_records(recdict, rec_termcount, rank_limit_relevance, nb_top=ranked_result_amount)
 
     #Add any documents not ranked to the end of the list
     if hitset:
@@ -297,6 +310,124 @@ def sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance,
         voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
     return (reclist, hitset)
 
+def get_term_hitlists(table, terms):
+    """Fetches the hitlists of all the TERMS from the rnkWORD TABLE at once.
+    Returns {term: (Gi, hitlist)} for the terms found, where Gi is the
+    (bound, weight) tuple of the term and hitlist is {recid: (tf, norm)}."""
+    terms = dict.fromkeys(terms).keys()
+    hitlists = {}
+    for i in range(0, len(terms), CFG_WORD_RANKING_TERMS_PER_QUERY):
+        chunk = terms[i:i + CFG_WORD_RANKING_TERMS_PER_QUERY]
+        res = run_sql("""SELECT term, hitlist FROM %s WHERE term IN (%s)""" % (table, ",".join(["%s"] * len(chunk))),
+                      tuple(chunk))
+        for (term, hitlist) in res:
+            hitlist = deserialize_via_marshal(hitlist)
+            hitlists[term] = (hitlist.pop("Gi", None), hitlist)
+    return hitlists
+
+def word_similarity_term_weight(tf, Gi, qtf):
+    """Weight of a term in a record for word_similarity, or None if it cannot be calculated.
+    The weight is never negative, so that adding a term never lowers a score."""
+    try:
+        return max(0, int(math.log(tf[0] * Gi * tf[1] * qtf)))
+    except (ValueError, OverflowError):
+        return None
+
+def word_similarity_term_bound(bound, Gi, qtf):
+    """Upper bound of the weights of a term for word_similarity, BOUND being the
+    largest tf * norm product of its hitlist (clamped at 0 as the weights)."""
+    return max(0, int(math.log(bound * Gi * qtf)))
+
+def find_similar_term_weight(tf, Gi, qtf):
+    """Weight of a term in a record for find_similar."""
+    return int((1 + math.log(tf[0])) * Gi * tf[1] * qtf)
+
+def find_similar_term_bound(bound, Gi, qtf):
+    """Upper bound of the weights of a term for find_similar (1 + log(tf) <= tf)."""
+    return int(bound * Gi * qtf)
+
+def find_similar_record_score(score, termcount):
+    """Score of a record for find_similar: records matching only one term get nothing."""
+    if score > 0 and termcount > 1:
+        return math.log(score * termcount)
+    return 0
+
+def score_records(terms, hitlists, hitset, term_weight, term_bound=None, record_score=None, nb_top=None, quick=False):
+    """Calculates the relevance of the records of HITSET for the query TERMS.
+    terms - [(term, qtf)] the terms and their importance in the query, in the order to process them
+    hitlists - {term: (Gi, hitlist)} as returned by get_term_hitlists
+    hitset - the records that are allowed to be ranked
+    term_weight - function (tf, Gi, qtf) giving the weight of a term in a record, or None;
+                  the weights must not be negative when term_bound is given
+    term_bound - function (bound, Gi, qtf) giving the largest weight of a term
+    record_score - function (score, termcount) giving the final score of a record, the
+                   final scores must not decrease when a term is added to a record
+    nb_top - if given, only the nb_top best records have to be exact: once the
+             terms left cannot bring a new record among the nb_top best ones, they
+             are only used to update the records already found (max-score pruning)
+    quick - if true, the terms with a negative qtf are only used to update the records already found
+    Returns (recdict, rec_termcount):
+    recdict - {recid: score} the sum of the weights of the terms of each record
+    rec_termcount - {recid: count} the number of terms of the query in each record"""
+    if record_score is None:
+        record_score = lambda score, termcount: score
+
+    terms = [(term, qtf) + hitlists[term] for (term, qtf) in terms
+             if term in hitlists and hitlists[term][0] is not None]
+    # remaining_bounds[i] is the sum of the largest weights of terms i..n, None if unknown:
+    remaining_bounds = [0] * (len(terms) + 1)
+    for i in range(len(terms) - 1, -1, -1):
+        (term, qtf, Gi, hitlist) = terms[i]
+        if remaining_bounds[i + 1] is None or not term_bound or Gi[0] <= 0 or Gi[1] <= 0 or qtf <= 0:
+            remaining_bounds[i] = None
+        else:
+            remaining_bounds[i] = remaining_bounds[i + 1] + term_bound(Gi[0], Gi[1], qtf)
+
+    (recdict, rec_termcount) = ({}, {})
+    pruning = False
+    for (i, (term, qtf, Gi, hitlist)) in enumerate(terms):
+        if nb_top and not pruning and remaining_bounds[i] is not None and len(recdict) >= nb_top:
+            threshold = heapq.nlargest(nb_top, [record_score(recdict[j], rec_termcount[j]) for j in recdict])[-1]
+            pruning = record_score(remaining_bounds[i], len(terms) - i) < threshold
+        Gi = Gi[1]
+        if pruning or (quick and qtf < 0 and recdict):
+            # only update the records already found:
+            candidates = [(j, hitlist[j]) for j in recdict if j in hitlist]
+        elif len(hitset) < len(hitlist):
+            candidates = [(j, hitlist[j]) for j in hitset if j in hitlist]
+        else:
+            candidates = [(j, tf) for (j, tf) in hitlist.iteritems() if j in hitset]
+        for (j, tf) in candidates:
+            weight = term_weight(tf, Gi, qtf)
+            if weight is not None:
+                recdict[j] = recdict.get(j, 0) + weight
+                rec_termcount[j] = rec_termcount.get(j, 0) + 1
+    return (recdict, rec_termcount)
+
+def select_ranked_records(recdict, rec_termcount, rank_limit_relevance, record_score=None, nb_top=None):
+    """Gives each record a score between 0-100 and returns the records with a score
+    higher than rank_limit_relevance in increasing order of score.  If nb_top is
+    given, only the nb_top best records, at the end of the list, are sorted, the
+    other ones precede them in recid order."""
+    if record_score is None:
+        record_score = lambda score, termcount: score
+    final_scores = dict([(j, record_score(score, rec_termcount[j])) for (j, score) in recdict.iteritems()])
+    divideby = max(final_scores.values())
+    scores = [(score, j) for (j, score) in final_scores.iteritems()]
+    if nb_top is None or nb_top >= len(scores):
+        scores.sort()
+    else:
+        top = heapq.nlargest(nb_top, scores)
+        top.reverse()
+        top_recids = dict.fromkeys([j for (score, j) in top])
+        scores = [(final_scores[j], j) for j in sorted(final_scores) if j not in top_recids] + top
+    reclist = []
+    for (score, j) in scores:
+        score = int(score * 100 / divideby)
+        if score >= rank_limit_relevance:
+            reclist.append((j, score))
+    return reclist
+
 def rank_method_stat(rank_method_code, reclist, lwords):
     """Shows some statistics about the searchresult.
     rank_method_code - name field from rnkMETHOD
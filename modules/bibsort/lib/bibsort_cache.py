@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibSort cache maintenance.
+
+The incremental updates of BibSort publish the changes they make to
+the weights and buckets of a sorting method as numbered deltas in the
+bsrMETHODDATADELTA table.  The web workers apply these deltas in
+place to their cached copy of the method data, instead of reloading
+all of bsrMETHODDATA and bsrMETHODDATABUCKET after every update.  The
+workers reload the whole method only when they have missed deltas or
+when they meet a reload marker, a delta without data, which is
+published when the method has been rebalanced or deleted.
+
+The cached weights are also kept in an array indexed by record ID, so
+that sorting the candidate records only needs array look-ups.
+"""
+
+__revision__ = "$Id$"
+
+import time
+from array import array
+
+from invenio.dbquery import run_sql, serialize_via_marshal, \
+     deserialize_via_marshal
+from invenio.intbitset import intbitset
+
+# number of deltas kept per sorting method; workers that have missed
+# more deltas reload the whole method:
+CFG_BIBSORT_DELTAS_KEPT = 100
+
+# deltas changing the weights of more than this fraction of the records
+# are not published; the workers reload the method instead:
+CFG_BIBSORT_DELTA_MAX_RATIO = 0.5
+
+_NAN = float('nan')
+
+
+def get_bibsort_data_timestamp(method_id):
+    """Return last update time of the data of sorting method METHOD_ID."""
+    res = run_sql("""SELECT last_updated from bsrMETHODDATA where id_bsrMETHOD = %s""", (method_id,))
+    try:
+        update_time_methoddata = str(res[0][0])
+    except IndexError:
+        update_time_methoddata = '1970-01-01 00:00:00'
+    res = run_sql("""SELECT max(last_updated) from bsrMETHODDATABUCKET where id_bsrMETHOD = %s""", (method_id,))
+    try:
+        update_time_buckets = str(res[0][0])
+    except IndexError:
+        update_time_buckets = '1970-01-01 00:00:00'
+    return max(update_time_methoddata, update_time_buckets)
+
+
+def get_last_delta_version(method_id):
+    """Return version of the last delta of sorting method METHOD_ID."""
+    res = run_sql("""SELECT max(version) FROM bsrMETHODDATADELTA
+                     WHERE id_bsrMETHOD = %s""", (method_id,))
+    if res and res[0][0]:
+        return res[0][0]
+    return 0
+
+
+def compute_weight_changes(old_data_dict_ordered, data_dict_ordered):
+    """
+    Return dictionary of {recid: weight} of the records whose weight
+    differs between OLD_DATA_DICT_ORDERED and DATA_DICT_ORDERED, the
+    weight being None for the records that have been removed.
+    """
+    changes = {}
+    for recid, weight in data_dict_ordered.iteritems():
+        if old_data_dict_ordered.get(recid) != weight:
+            changes[recid] = weight
+    for recid in old_data_dict_ordered:
+        if recid not in data_dict_ordered:
+            changes[recid] = None
+    return changes
+
+
+def write_bibsort_delta(method_id, weights, bucket_insert, bucket_delete, nb_records):
+    """
+    Publish the changes of sorting method METHOD_ID: WEIGHTS, the
+    {recid: weight} changes, and BUCKET_INSERT, BUCKET_DELETE, the
+    {bucket_no: [recids]} records added to and removed from every
+    bucket.  If the changes touch too many of the NB_RECORDS records,
+    publish a delta asking the workers to reload the method.  Return
+    the version of the delta.
+    """
+    if len(weights) > CFG_BIBSORT_DELTA_MAX_RATIO * max(nb_records, 1):
+        return write_bibsort_reload_marker(method_id)
+    serialized_delta = serialize_via_marshal({'weights': weights,
+                                              'bucket_insert': bucket_insert,
+                                              'bucket_delete': bucket_delete,
+                                              'timestamp': get_bibsort_data_timestamp(method_id)})
+    return _insert_bibsort_delta(method_id, serialized_delta)
+
+
+def write_bibsort_reload_marker(method_id):
+    """
+    Publish a delta without data, asking the workers to reload sorting
+    method METHOD_ID, e.g. after it has been rebalanced.  Return the
+    version of the delta.
+    """
+    return _insert_bibsort_delta(method_id, None)
+
+
+def _insert_bibsort_delta(method_id, serialized_delta):
+    """Store SERIALIZED_DELTA as the next delta of sorting method
+    METHOD_ID, forget the oldest deltas and return its version."""
+    version = get_last_delta_version(method_id) + 1
+    date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    run_sql("""INSERT INTO bsrMETHODDATADELTA
+               (id_bsrMETHOD, version, delta_data, last_updated)
+               VALUES (%s, %s, %s, %s)""",
+            (method_id, version, serialized_delta, date))
+    run_sql("""DELETE FROM bsrMETHODDATADELTA
+               WHERE id_bsrMETHOD = %s AND version <= %s""",
+            (method_id, version - CFG_BIBSORT_DELTAS_KEPT))
+    return version
+
+
+def build_rank_array(data_dict_ordered):
+    """
+    Return array of the weights of DATA_DICT_ORDERED indexed by
+    record ID, NaN meaning that the record has no weight.
+    """
+    size = 0
+    if data_dict_ordered:
+        size = max(data_dict_ordered) + 1
+    rank_array = array('d', [_NAN]) * size
+    for recid, weight in data_dict_ordered.iteritems():
+        rank_array[recid] = weight
+    return rank_array
+
+
+def apply_bibsort_delta(cache, delta):
+    """Apply DELTA, as published by write_bibsort_delta(), to CACHE."""
+    data_dict_ordered = cache['data_dict_ordered']
+    rank_array = cache['rank_array']
+    for recid, weight in delta['weights'].iteritems():
+        if weight is None:
+            data_dict_ordered.pop(recid, None)
+            if recid < len(rank_array):
+                rank_array[recid] = _NAN
+        else:
+            data_dict_ordered[recid] = weight
+            if recid >= len(rank_array):
+                rank_array.extend(array('d', [_NAN]) * (recid + 1 - len(rank_array)))
+            rank_array[recid] = weight
+    bucket_data = cache.get('bucket_data', {})
+    for bucket_no, recids in delta['bucket_delete'].iteritems():
+        if bucket_no in bucket_data:
+            bucket_data[bucket_no] -= intbitset(recids)
+    for bucket_no, recids in delta['bucket_insert'].iteritems():
+        if bucket_no in bucket_data:
+            bucket_data[bucket_no] |= intbitset(recids)
+
+
+def update_bibsort_cache(cache, method_id):
+    """
+    Apply the deltas of sorting method METHOD_ID published since CACHE
+    was filled or last updated.  Return the data timestamp of the last
+    applied delta, '' if there was no new delta, or None if the deltas
+    cannot be applied and the method has to be reloaded.
+    """
+    version = cache.get('delta_version')
+    if version is None:
+        return None
+    res = run_sql("""SELECT version, delta_data FROM bsrMETHODDATADELTA
+                     WHERE id_bsrMETHOD = %s AND version > %s
+                     ORDER BY version""", (method_id, version))
+    timestamp = ''
+    for delta_version, delta_data in res:
+        if delta_version != version + 1 or delta_data is None:
+            return None
+        delta = deserialize_via_marshal(delta_data)
+        apply_bibsort_delta(cache, delta)
+        cache['delta_version'] = version = delta_version
+        timestamp = delta['timestamp']
+    return timestamp
+
+
+def sort_recids_by_rank(rank_array, recids, reverse=False):
+    """
+    Return the list of RECIDS having a weight in RANK_ARRAY, sorted by
+    weight, and the list of the RECIDS without weight.
+    """
+    size = len(rank_array)
+    ranked = []
+    missing = []
+    for recid in recids:
+        if recid < size and rank_array[recid] == rank_array[recid]:
+            ranked.append(recid)
+        else:
+            missing.append(recid)
+    ranked.sort(key=rank_array.__getitem__, reverse=reverse)
+    return ranked, missing
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Testing module for BibSort cache maintenance"""
+
+from invenio.testutils import InvenioTestCase
+
+from invenio.intbitset import intbitset
+from invenio.dbquery import serialize_via_marshal
+from invenio.bibsort_cache import compute_weight_changes, \
+    build_rank_array, apply_bibsort_delta, sort_recids_by_rank, \
+    update_bibsort_cache
+from invenio.testutils import make_test_suite, run_test_suite
+
+try:
+    from mock import patch
+    HAS_MOCK = True
+except ImportError:
+    HAS_MOCK = False
+
+
+DELTA = serialize_via_marshal({'weights': {2: 28},
+                               'bucket_insert': {},
+                               'bucket_delete': {},
+                               'timestamp': '2015-01-02 00:00:00'})
+
+def run_sql_delta_mock(query, params):
+    """Return the deltas after version 3, one update."""
+    return ((4, DELTA), )
+
+def run_sql_reload_marker_mock(query, params):
+    """Return the deltas after version 3, a reload marker and an update."""
+    return ((4, None), (5, DELTA))
+
+
+class TestBibSortCache(InvenioTestCase):
+    """Test BibSort cache maintenance."""
+
+    def setUp(self):
+        """Prepare cache of a sorting method."""
+        data_dict_ordered = {1: 8, 2: 16, 4: 24, 5: 32}
+        self.cache = {'data_dict_ordered': data_dict_ordered,
+                      'rank_array': build_rank_array(data_dict_ordered),
+                      'bucket_data': {1: intbitset([1, 2]), 2: intbitset([4, 5])}}
+
+    def test_compute_weight_changes(self):
+        """bibsort - changed weights of records"""
+        self.assertEqual({2: 44, 3: 8, 5: None},
+                         compute_weight_changes({1: 8, 2: 16, 5: 24},
+                                                {1: 8, 2: 44, 3: 8}))
+
+    def test_sort_recids_by_rank(self):
+        """bibsort - sorting records by weight"""
+        self.assertEqual(([1, 4, 5], [3, 9]),
+                         sort_recids_by_rank(self.cache['rank_array'], intbitset([1, 3, 4, 5, 9])))
+        self.assertEqual(([5, 4, 1], [3, 9]),
+                         sort_recids_by_rank(self.cache['rank_array'], intbitset([1, 3, 4, 5, 9]), True))
+
+    def test_apply_bibsort_delta(self):
+        """bibsort - applying changes to the cache"""
+        apply_bibsort_delta(self.cache, {'weights': {2: 28, 4: None, 7: 4},
+                                         'bucket_insert': {1: [7], 2: [2]},
+                                         'bucket_delete': {1: [2]}})
+        self.assertEqual({1: 8, 2: 28, 5: 32, 7: 4}, self.cache['data_dict_ordered'])
+        self.assertEqual(intbitset([1, 7]), self.cache['bucket_data'][1])
+        self.assertEqual(intbitset([2, 4, 5]), self.cache['bucket_data'][2])
+        self.assertEqual(([7, 1, 2, 5], [4]),
+                         sort_recids_by_rank(self.cache['rank_array'], [1, 2, 4, 5, 7]))
+
+    if HAS_MOCK:
+        @patch('invenio.bibsort_cache.run_sql', run_sql_delta_mock)
+        def test_update_bibsort_cache(self):
+            """bibsort - published deltas are applied in order"""
+            self.cache['delta_version'] = 3
+            self.assertEqual('2015-01-02 00:00:00', update_bibsort_cache(self.cache, 1))
+            self.assertEqual(4, self.cache['delta_version'])
+            self.assertEqual(28, self.cache['data_dict_ordered'][2])
+
+        @patch('invenio.bibsort_cache.run_sql', run_sql_reload_marker_mock)
+        def test_reload_marker(self):
+            """bibsort - reload marker stops the update of the cache"""
+            self.cache['delta_version'] = 3
+            self.assertEqual(None, update_bibsort_cache(self.cache, 1))
+            self.assertEqual(16, self.cache['data_dict_ordered'][2])
+
+        @patch('invenio.bibsort_cache.run_sql', run_sql_delta_mock)
+        def test_missed_deltas(self):
+            """bibsort - missed deltas stop the update of the cache"""
+            self.cache['delta_version'] = 2
+            self.assertEqual(None, update_bibsort_cache(self.cache, 1))
+            self.assertEqual(16, self.cache['data_dict_ordered'][2])
+
+TEST_SUITE = make_test_suite(TestBibSortCache, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -29,6 +29,8 @@ from invenio.intbitset import intbitset
 from invenio.bibtask import write_message, task_update_progress, \
 task_sleep_now_if_required
 from invenio.config import CFG_BIBSORT_BUCKETS, CFG_CERN_SITE
+from invenio.bibsort_cache import compute_weight_changes, write_bibsort_delta, \
+     write_bibsort_reload_marker
 from invenio.bibsort_washer import BibSortWasher, \
 InvenioBibSortWasherNotImplementedError
 
@@ -542,6 +544,11 @@ def delete_all_data_for_method(method_id):
     try:
         run_sql("DELETE FROM bsrMETHODDATA WHERE id_bsrMETHOD = %s", (method_id, ))
         run_sql("DELETE FROM bsrMETHODDATABUCKET WHERE id_bsrMETHOD = %s", (method_id, ))
+        # keep only a reload marker, numbered after the deltas the
+        # workers may have applied, so that they drop the method data
+        version = write_bibsort_reload_marker(method_id)
+        run_sql("DELETE FROM bsrMETHODDATADELTA WHERE id_bsrMETHOD = %s AND version < %s",
+                (method_id, version))
         run_sql("DELETE FROM bsrMETHODNAME WHERE id_bsrMETHOD = %s", (method_id, ))
         run_sql("DELETE FROM bsrMETHOD WHERE id = %s", (method_id, ))
         method_name = run_sql("SELECT name from bsrMETHOD WHERE id = %s", (method_id, ))[0][0]
@@ -618,6 +625,8 @@ def update_bibsort_tables(recids, method, update_timestamp = True):
     if recids_to_insert or recids_to_modify or recids_to_delete:
         data_dict_ordered = deserialize_via_marshal(res[0][1])
         data_list_sorted = deserialize_via_marshal(res[0][2])
+        #keep the old weights, to publish the changes to the web workers
+        old_data_dict_ordered = dict(data_dict_ordered)
         if recids_to_modify:
             write_message("%s records have been modified." \
                           %len(recids_to_modify), verbose=5)
@@ -650,16 +659,30 @@ def update_bibsort_tables(recids, method, update_timestamp = True):
 
         #update buckets
         try:
-            perform_update_buckets(recids_current_ordered, recids_to_insert, recids_old_ordered, method_id, update_timestamp)
+            bucket_insert, bucket_delete = perform_update_buckets(recids_current_ordered, recids_to_insert, recids_old_ordered, method_id, update_timestamp)
         except Error, err:
             write_message("[%s] The bucket data for method %s has not been updated" \
                           %(method, err), sys.stderr)
             return False
+
+        #publish the changes, for the web workers to apply them in place
+        weights = compute_weight_changes(old_data_dict_ordered, data_dict_ordered)
+        try:
+            version = write_bibsort_delta(method_id, weights, bucket_insert,
+                                          bucket_delete, len(data_dict_ordered))
+        except Error, err:
+            write_message("[%s] The changes of method %s have not been published" \
+                          %(err, method), sys.stderr)
+            return False
+        write_message("Changes of %s weights published as delta %s of method %s." \
+                      %(len(weights), version, method), verbose=5)
     return True
 
 
 def perform_update_buckets(recids_current_ordered, recids_to_insert, recids_old_ordered, method_id, update_timestamp = True):
-    """Updates the buckets"""
+    """Updates the buckets.
+    Returns the dictionaries {bucket_no: [recids]} of the records
+    inserted into and deleted from every bucket"""
     bucket_insert = {}
     bucket_delete = {}
     write_message("Updating the buckets for method_id = %s" %method_id, verbose=5)
@@ -725,6 +748,7 @@ def perform_update_buckets(recids_current_ordered, recids_to_insert, recids_old_
                     WHERE id_bsrMETHOD = %s AND bucket_no = %s", \
                     (bucket_data.fastdump(), method_id, bucket_no, ))
             write_message("Updating bucket %s for method %s." %(bucket_no, method_id), verbose=5)
+    return bucket_insert, bucket_delete
 
 
 def perform_modify_record(data_dict, data_dict_ordered, data_list_sorted, value, recid, spacing=CFG_BIBSORT_WEIGHT_DISTANCE):
@@ -923,6 +947,16 @@ def run_bibsort_rebalance(method_list = None):
             write_message('Method %s could not be executed correctly.' \
                           %name, sys.stderr)
             return False
+        # the weights and buckets have all changed, the workers have to
+        # reload the method instead of applying the next deltas
+        try:
+            version = write_bibsort_reload_marker(bibsort_methods[name]['id'])
+        except Error, err:
+            write_message("[%s] The rebalancing of method %s has not been published" \
+                          %(err, name), sys.stderr)
+            return False
+        write_message("Reload of method %s published as delta %s." \
+                      %(name, version), verbose=5)
         write_message('Done.')
         task_sleep_now_if_required(can_stop_too=True)
     task_update_progress('Rebalancing done.')
@@ -0,0 +1,1061 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio benchmark suite.
+
+Generates a synthetic corpus of configurable size, loads it into an
+in-memory SQLite stand-in of the Invenio database and times the
+search and ranking code on it: word, phrase and regular expression
+searches run by search_engine, ranking by bibrank_record_sorter and
+the sorting methods of bibsort_engine all query the stand-in via
+run_sql() as they would query MySQL.  The in-memory hot paths
+(collection splitting, citation counts and graph, word similarity
+ranking, bibsort sorting, partial sorting of ranked records, citerank
+and the encoding and decoding of the term lists of the reverse index
+tables in every termlist format) are timed on the corpus directly.
+When an installed site (e.g. the demo site) can be queried, the site
+workloads time word searches and term lists of its database too.
+
+The corpus has skewed term frequencies (Zipf's law) and a skewed
+citation graph, and is generated from a seed, so that runs on
+different commits work on the same data.  Its parts, as well as the
+queries of every workload, are generated from the seed and their
+name only, and the parts are generated only when a selected workload
+needs them.  The number of citations is capped, so that corpora of
+millions of records remain practical.  The results are printed as
+JSON, to be compared across commits.
+
+Usage: python benchmarkutils.py [options]
+
+  -n, --records=N      number of records of the corpus (default 10000)
+  -s, --seed=S         seed of the corpus (default 0)
+  -r, --repeat=R       number of timed runs of every workload (default 3)
+  -w, --workloads=W,.. workloads to run (default all)
+  -o, --output=FILE    write the JSON results to FILE instead of stdout
+"""
+
+__revision__ = "$Id$"
+
+import os
+import re
+import sys
+import time
+import getopt
+import random
+import platform
+import tempfile
+from thread import get_ident
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from invenio.intbitset import intbitset
+from invenio.jsonutils import json
+
+CFG_BENCHMARK_DEFAULT_RECORDS = 10000
+CFG_BENCHMARK_DEFAULT_REPEAT = 3
+
+# number of distinct terms of the synthetic word index and exponent of
+# their Zipf distribution:
+CFG_BENCHMARK_NB_TERMS = 2000
+CFG_BENCHMARK_ZIPF_EXPONENT = 1.1
+
+# average number of citations per record and largest number of
+# citations of the synthetic citation graph:
+CFG_BENCHMARK_CITATIONS_PER_RECORD = 10
+CFG_BENCHMARK_MAX_CITATIONS = 5000000
+
+# number of synthetic collections and queries per workload:
+CFG_BENCHMARK_NB_COLLECTIONS = 20
+CFG_BENCHMARK_NB_QUERIES = 50
+
+# number of the most frequent terms of the installed site searched by
+# the site workloads:
+CFG_BENCHMARK_NB_SITE_TERMS = 200
+
+# largest number of term lists of the reverse index tables read or
+# generated for the termlist workloads:
+CFG_BENCHMARK_NB_TERMLISTS = 5000
+
+# names of the synthetic indexes, ranking method and sorting method of
+# the stand-in database:
+CFG_BENCHMARK_WORD_INDEX = 'global'
+CFG_BENCHMARK_PHRASE_INDEX = 'keyword'
+CFG_BENCHMARK_RANK_METHOD = 'benchmark'
+CFG_BENCHMARK_SORT_METHOD = 'year'
+
+
+class InvenioBenchmarkSkipped(Exception):
+    """Raised by the setup of a workload that cannot be run here."""
+    pass
+
+
+class SyntheticCorpus(object):
+    """
+    Synthetic records with a word index, a citation graph, collections
+    and publication years.  Every part is generated with its own
+    generator the first time it is used, so that it does not depend
+    on the other ones.
+    """
+
+    def __init__(self, nb_records, seed=0):
+        self.nb_records = nb_records
+        self.seed = seed
+        self._word_index = None
+        self._citations = None
+        self._collections = None
+        self._years = None
+        self._database = None
+
+    def get_generator(self, name):
+        """Return random generator of the part or workload NAME,
+        seeded from the corpus seed and NAME only."""
+        digest = md5('%s:%s' % (self.seed, name)).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    @property
+    def word_index(self):
+        """Dictionary {term: hitset} of the records."""
+        if self._word_index is None:
+            self._word_index = generate_word_index(
+                self.nb_records, self.get_generator('word_index'))
+        return self._word_index
+
+    @property
+    def citations(self):
+        """Dictionary {citee: set of citers} of the records."""
+        if self._citations is None:
+            nb_citations = min(CFG_BENCHMARK_CITATIONS_PER_RECORD * self.nb_records,
+                               CFG_BENCHMARK_MAX_CITATIONS)
+            self._citations = generate_citations(
+                self.nb_records, nb_citations, self.get_generator('citations'))
+        return self._citations
+
+    @property
+    def collections(self):
+        """Dictionary {collection name: reclist} of the records."""
+        if self._collections is None:
+            self._collections = generate_collections(
+                self.nb_records, CFG_BENCHMARK_NB_COLLECTIONS,
+                self.get_generator('collections'))
+        return self._collections
+
+    @property
+    def years(self):
+        """Dictionary {recid: publication year} of the records."""
+        if self._years is None:
+            generator = self.get_generator('years')
+            self._years = dict((recid, 2015 - int(65 * generator.random() ** 2))
+                               for recid in xrange(1, self.nb_records + 1))
+        return self._years
+
+    @property
+    def database(self):
+        """BenchmarkDatabase holding the records."""
+        if self._database is None:
+            self._database = BenchmarkDatabase()
+            self._database.load_corpus(self)
+        return self._database
+
+    def uninstall_database(self):
+        """Uninstall the database of the records, if it was installed."""
+        if self._database is not None:
+            self._database.uninstall()
+
+    def get_queries(self, name, nb_terms, nb_queries=CFG_BENCHMARK_NB_QUERIES):
+        """Return NB_QUERIES lists of NB_TERMS terms of workload NAME.
+        The ranks of the terms by frequency are drawn log-uniformly,
+        as users tend to search the frequent terms."""
+        terms = sorted(self.word_index,
+                       key=lambda term: (-len(self.word_index[term]), term))
+        generator = self.get_generator(name)
+        queries = []
+        for dummy in xrange(nb_queries):
+            queries.append([terms[int(len(terms) ** generator.random()) - 1]
+                            for dummy in xrange(nb_terms)])
+        return queries
+
+
+class BenchmarkDatabaseCursor(object):
+    """
+    DB-API cursor of the stand-in database, taking the queries in the
+    MySQLdb parameter style and emulating the few MySQL statements
+    that Invenio uses besides plain SQL.
+    """
+
+    _re_param = re.compile(r'%(s|%)')
+    _re_write = re.compile(r'^\s*(?:INSERT\s+(?:INTO\s+)?|REPLACE\s+(?:INTO\s+)?|'
+                           r'UPDATE\s+|DELETE\s+FROM\s+)`?(\w+)', re.I)
+
+    def __init__(self, database):
+        self.database = database
+        self.cursor = database.connection.cursor()
+        self.description = None
+        self.lastrowid = None
+        self.rowcount = -1
+        self.rows = []
+
+    def execute(self, sql, param=None):
+        """Run SQL with PARAM and return the number of rows."""
+        words = sql.upper().split()
+        if words[:3] == ['SHOW', 'TABLE', 'STATUS']:
+            self._show_table_status(param[0])
+        elif words[:2] in (['LOCK', 'TABLES'], ['UNLOCK', 'TABLES']):
+            self.rows = []
+            self.description = None
+            self.rowcount = 0
+        else:
+            sql, args = self._translate(sql, param)
+            self.cursor.execute(sql, args)
+            self.description = self.cursor.description
+            self.lastrowid = self.cursor.lastrowid
+            self.rows = [tuple([isinstance(value, buffer) and str(value) or value
+                                for value in row])
+                         for row in self.cursor.fetchall()]
+            self.rowcount = self.cursor.rowcount
+            if self.description:
+                self.rowcount = len(self.rows)
+            match = self._re_write.match(sql)
+            if match:
+                self.database.touch(match.group(1))
+        return self.rowcount
+
+    def _translate(self, sql, param):
+        """Return SQL and PARAM converted to the SQLite parameter
+        style; sequences are expanded like MySQLdb does, e.g. for
+        'IN %s'."""
+        if param is None:
+            return sql, ()
+        args = []
+        values = iter(param)
+
+        def replace(match):
+            if match.group(1) == '%':
+                return '%'
+            value = values.next()
+            if isinstance(value, (tuple, list, set, frozenset, intbitset)):
+                value = list(value)
+                if [item for item in value if not isinstance(item, (int, long))]:
+                    args.extend(value)
+                    return '(%s)' % ','.join(['?'] * len(value))
+                # SQLite limits the number of parameters of a query:
+                return '(%s)' % ','.join([str(item) for item in value])
+            args.append(value)
+            return '?'
+        return self._re_param.sub(replace, sql), args
+
+    def _show_table_status(self, pattern):
+        """Emulate SHOW TABLE STATUS LIKE PATTERN in the MySQL 5 format,
+        as far as dbquery.get_table_status_info() goes."""
+        self.rows = []
+        for (name, ) in self.cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ?",
+                (pattern, )).fetchall():
+            nb_rows = self.cursor.execute('SELECT COUNT(*) FROM %s' % name).fetchone()[0]
+            update_time = self.database.get_update_time(name)
+            self.rows.append((name, 'SQLite', 10, 'Fixed', nb_rows, 0, 0, 0, 0, 0,
+                              None, self.database.creation_time, update_time,
+                              None, 'utf8_general_ci', None, '', ''))
+        self.description = None
+        self.rowcount = len(self.rows)
+
+    def fetchall(self):
+        """Return all the rows of the last query."""
+        rows, self.rows = self.rows, []
+        return tuple(rows)
+
+    def fetchmany(self, size):
+        """Return the next SIZE rows of the last query."""
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return tuple(rows)
+
+    def close(self):
+        """Close the cursor."""
+        self.cursor.close()
+
+
+class BenchmarkDatabase(object):
+    """
+    In-memory SQLite stand-in of the Invenio database, holding the
+    tables of a synthetic corpus.  Once installed, it is the database
+    connection of this thread used by run_sql(), so that the search
+    and ranking code queries it instead of MySQL.
+    """
+
+    def __init__(self):
+        import sqlite3
+        self.connection = sqlite3.connect(':memory:',
+                                          detect_types=sqlite3.PARSE_DECLTYPES)
+        # MySQLdb returns strings and blobs as str:
+        self.connection.text_factory = str
+        self.connection.create_function('regexp', 2, _sql_regexp)
+        self.creation_time = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.update_times = {}
+        self.caches = []
+        self._installed = None
+
+    def cursor(self):
+        """Return new cursor, like a MySQLdb connection does."""
+        return BenchmarkDatabaseCursor(self)
+
+    def autocommit(self, on):
+        """Accept MySQLdb autocommit settings; SQLite commits itself."""
+        pass
+
+    def close(self):
+        """Keep the database; it lives as long as the corpus."""
+        pass
+
+    def touch(self, table):
+        """Record that TABLE has just been updated."""
+        self.update_times[table] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def get_update_time(self, table):
+        """Return the last update time of TABLE."""
+        return self.update_times.get(table, self.creation_time)
+
+    def create_table(self, table, columns, rows=()):
+        """Create TABLE of COLUMNS, a list of column definitions, and
+        insert ROWS into it."""
+        self.connection.execute('CREATE TABLE %s (%s)' % (table, ', '.join(columns)))
+        if rows:
+            self.connection.executemany('INSERT INTO %s VALUES (%s)' %
+                                        (table, ','.join(['?'] * len(columns))),
+                                        rows)
+
+    def load_corpus(self, corpus):
+        """
+        Create the tables of the records of CORPUS: the global word
+        index, a keyword phrase index whose phrases have the hitsets
+        of the words, the publication years of the records as their
+        260__c values, the citation counts as the data of a ranking
+        method, and the tables of a bibsort method sorting by year.
+        """
+        from invenio.dbquery import serialize_via_marshal
+        date = self.creation_time
+        word_index = corpus.word_index
+        terms = sorted(word_index)
+        self.create_table('bibrec',
+                          ['id INTEGER PRIMARY KEY', 'creation_date TIMESTAMP',
+                           'modification_date TIMESTAMP', 'master_format VARCHAR(16)'],
+                          ((recid, date, date, 'marc')
+                           for recid in xrange(1, corpus.nb_records + 1)))
+        self.create_table('idxINDEX',
+                          ['id INTEGER PRIMARY KEY', 'name VARCHAR(50)',
+                           'description VARCHAR(255)', 'last_updated TIMESTAMP',
+                           'stemming_language VARCHAR(10)', 'indexer VARCHAR(10)',
+                           'synonym_kbrs VARCHAR(255)', 'remove_stopwords VARCHAR(255)',
+                           'remove_html_markup VARCHAR(10)',
+                           'remove_latex_markup VARCHAR(10)', 'tokenizer VARCHAR(50)'],
+                          [(index_id, name, '', date, '', 'native', '', 'No', 'No',
+                            'No', tokenizer)
+                           for index_id, name, tokenizer in
+                           ((1, CFG_BENCHMARK_WORD_INDEX, 'BibIndexDefaultTokenizer'),
+                            (2, CFG_BENCHMARK_PHRASE_INDEX, 'BibIndexKeywordTokenizer'))])
+        self.create_table('field',
+                          ['id INTEGER PRIMARY KEY', 'name VARCHAR(255)',
+                           'code VARCHAR(255)'],
+                          [(1, 'any field', 'anyfield'),
+                           (2, CFG_BENCHMARK_PHRASE_INDEX, CFG_BENCHMARK_PHRASE_INDEX)])
+        self.create_table('idxINDEX_field',
+                          ['id_idxINDEX INTEGER', 'id_field INTEGER',
+                           'regexp_punctuation VARCHAR(255)',
+                           'regexp_alphanumeric_separators VARCHAR(255)'],
+                          [(1, 1, '', ''), (2, 2, '', '')])
+        # terms compare like with the case insensitive MySQL collation:
+        self.create_table('idxWORD01F',
+                          ['id INTEGER PRIMARY KEY',
+                           'term VARCHAR(50) UNIQUE COLLATE NOCASE', 'hitlist LONGBLOB'],
+                          [(idx + 1, term, buffer(word_index[term].fastdump()))
+                           for idx, term in enumerate(terms)])
+        self.create_table('idxPHRASE02F',
+                          ['id INTEGER PRIMARY KEY', 'term TEXT COLLATE NOCASE',
+                           'hitlist LONGBLOB'],
+                          [(idx + 1, get_benchmark_phrase(term),
+                            buffer(word_index[term].fastdump()))
+                           for idx, term in enumerate(terms)])
+        self.connection.execute('CREATE INDEX idxPHRASE02F_term ON idxPHRASE02F (term)')
+        years = sorted(set(corpus.years.itervalues()))
+        year_ids = dict((year, idx + 1) for idx, year in enumerate(years))
+        self.create_table('bib26x',
+                          ['id INTEGER PRIMARY KEY', 'tag VARCHAR(6)', 'value TEXT'],
+                          [(year_ids[year], '260__c', str(year)) for year in years])
+        self.create_table('bibrec_bib26x',
+                          ['id_bibrec INTEGER', 'id_bibxxx INTEGER',
+                           'field_number INTEGER'],
+                          ((recid, year_ids[year], 1)
+                           for recid, year in corpus.years.iteritems()))
+        self.connection.execute('CREATE INDEX bibrec_bib26x_id_bibrec ON bibrec_bib26x (id_bibrec)')
+        self.create_table('rnkMETHOD',
+                          ['id INTEGER PRIMARY KEY', 'name VARCHAR(20)',
+                           'last_updated TIMESTAMP'],
+                          [(1, CFG_BENCHMARK_RANK_METHOD, date)])
+        relevance_data = dict((citee, len(citers)) for citee, citers
+                              in corpus.citations.iteritems())
+        self.create_table('rnkMETHODDATA',
+                          ['id_rnkMETHOD INTEGER PRIMARY KEY', 'relevance_data LONGBLOB'],
+                          [(1, buffer(serialize_via_marshal(relevance_data)))])
+        self.create_table('bsrMETHOD',
+                          ['id INTEGER PRIMARY KEY', 'name VARCHAR(20)',
+                           'definition VARCHAR(255)', 'washer VARCHAR(255)'],
+                          [(1, CFG_BENCHMARK_SORT_METHOD, 'MARC: 260__c', '')])
+        self.create_table('bsrMETHODDATA',
+                          ['id_bsrMETHOD INTEGER PRIMARY KEY', 'data_dict LONGBLOB',
+                           'data_dict_ordered LONGBLOB', 'data_list_sorted LONGBLOB',
+                           'last_updated TIMESTAMP'])
+        self.create_table('bsrMETHODDATABUCKET',
+                          ['id_bsrMETHOD INTEGER', 'bucket_no INTEGER',
+                           'bucket_data LONGBLOB', 'bucket_last_value VARCHAR(255)',
+                           'last_updated TIMESTAMP'])
+        self.connection.commit()
+
+    def install(self, caches=()):
+        """
+        Make the database the connection of run_sql() in this thread
+        and recreate the data CACHES (DataCacher instances) from it.
+        The term hitlist cache shared by the processes of the node is
+        switched off meanwhile, so as not to fill it with the terms of
+        the corpus.
+        """
+        from invenio import dbquery
+        from invenio import search_engine_hitlist_cache
+        if dbquery.CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
+            raise InvenioBenchmarkSkipped("the stand-in database cannot "
+                                          "replace SQLAlchemy pooled connections")
+        if self._installed is None:
+            thread_ident = (os.getpid(), get_ident())
+            hosts = [dbquery.CFG_DATABASE_HOST]
+            if dbquery.CFG_DATABASE_SLAVE:
+                hosts.append(dbquery.CFG_DATABASE_SLAVE)
+            connections = []
+            for host in hosts:
+                connections.append((host, dbquery._DB_CONN[host].get(thread_ident)))
+                dbquery._DB_CONN[host][thread_ident] = self
+            hitlist_cache = search_engine_hitlist_cache._HITLIST_CACHE.copy()
+            search_engine_hitlist_cache._HITLIST_CACHE['cache'] = None
+            self._installed = (thread_ident, connections, hitlist_cache)
+        for cache in caches:
+            if cache not in self.caches:
+                self.caches.append(cache)
+            cache.clear()
+
+    def uninstall(self):
+        """Restore the database connection of run_sql() and the term
+        hitlist cache, and recreate the data caches without the
+        corpus."""
+        if self._installed is None:
+            return
+        from invenio import dbquery
+        from invenio import search_engine_hitlist_cache
+        thread_ident, connections, hitlist_cache = self._installed
+        self._installed = None
+        for host, connection in connections:
+            if connection is None:
+                del dbquery._DB_CONN[host][thread_ident]
+            else:
+                dbquery._DB_CONN[host][thread_ident] = connection
+        search_engine_hitlist_cache._HITLIST_CACHE.clear()
+        search_engine_hitlist_cache._HITLIST_CACHE.update(hitlist_cache)
+        caches, self.caches = self.caches, []
+        for cache in caches:
+            cache.clear()
+
+
+def _sql_regexp(pattern, value):
+    """Implement the MySQL REGEXP operator for SQLite."""
+    return value is not None and \
+           re.search(pattern, value, re.I | re.U) is not None
+
+
+def get_benchmark_phrase(term):
+    """Return the phrase of the keyword index having the hitset of TERM."""
+    return 'keyword %s' % term[len('term'):]
+
+
+def setup_database_workload(corpus, run, caches=()):
+    """
+    Install the stand-in database of CORPUS, recreating the data
+    CACHES from it, and check that it can answer the queries of RUN
+    by running it once.  The database is uninstalled by
+    run_benchmarks() once the workload is timed.
+    """
+    corpus.database.install(caches)
+    try:
+        run()
+    except StandardError, excp:
+        if excp.__class__.__module__ != 'sqlite3':
+            raise
+        raise InvenioBenchmarkSkipped("the stand-in database cannot run "
+                                      "the workload: %s" % excp)
+
+
+def check_database_workload(results, expected):
+    """Raise InvenioBenchmarkSkipped unless the hitsets RESULTS of a
+    workload run on the stand-in database are the EXPECTED ones."""
+    for result, hitset in zip(results, expected):
+        if result != hitset:
+            raise InvenioBenchmarkSkipped("the stand-in database gives %d "
+                                          "hits instead of %d" %
+                                          (len(result), len(hitset)))
+
+
+def generate_word_index(nb_records, generator, nb_terms=CFG_BENCHMARK_NB_TERMS,
+                        exponent=CFG_BENCHMARK_ZIPF_EXPONENT):
+    """Return dictionary {term: hitset} of NB_TERMS terms, the term of
+    rank i being in about NB_RECORDS / (i + 1) ** EXPONENT records."""
+    word_index = {}
+    for rank in xrange(nb_terms):
+        nb_hits = min(max(1, int(nb_records / (rank + 1) ** exponent)), nb_records)
+        if 2 * nb_hits > nb_records:
+            # draw the records without the term, which are fewer:
+            hits = intbitset(xrange(1, nb_records + 1))
+            hits -= intbitset(generator.sample(xrange(1, nb_records + 1),
+                                               nb_records - nb_hits))
+        else:
+            hits = intbitset(generator.sample(xrange(1, nb_records + 1), nb_hits))
+        word_index['term%d' % rank] = hits
+    return word_index
+
+
+def generate_citations(nb_records, nb_citations, generator):
+    """Return dictionary {citee: set of citers} of about NB_CITATIONS
+    citations, few records getting most of them."""
+    citations = {}
+    draw = generator.random
+    for dummy in xrange(nb_citations):
+        citer = int(nb_records * draw()) + 1
+        citee = int(nb_records * draw() ** 3) + 1
+        if citer != citee:
+            if citee in citations:
+                citations[citee].add(citer)
+            else:
+                citations[citee] = set([citer])
+    return citations
+
+
+def generate_collections(nb_records, nb_collections, generator):
+    """Return dictionary {collection name: reclist} of NB_COLLECTIONS
+    collections of decreasing size, every record being in one or two
+    of them."""
+    collections = dict(('Collection%d' % i, []) for i in xrange(nb_collections))
+    names = sorted(collections)
+    for recid in xrange(1, nb_records + 1):
+        collections[names[int(nb_collections * generator.random() ** 2)]].append(recid)
+        if generator.random() < 0.2:
+            collections[names[generator.randrange(nb_collections)]].append(recid)
+    return dict((name, intbitset(reclist)) for name, reclist in collections.iteritems())
+
+
+def generate_word_hitlists(corpus, terms):
+    """Return word similarity hitlists {term: (Gi, hitlist)} of the
+    TERMS of CORPUS, as returned by get_term_hitlists()."""
+    generator = corpus.get_generator('word_hitlists')
+    hitlists = {}
+    for term in sorted(set(terms)):
+        hitset = corpus.word_index[term]
+        hitlist = {}
+        bound = 0
+        for recid in hitset:
+            tf = (generator.randint(1, 10), generator.random())
+            hitlist[recid] = tf
+            bound = max(bound, tf[0] * tf[1])
+        weight = 1.0 + float(corpus.nb_records) / len(hitset)
+        hitlists[term] = ((bound, weight), hitlist)
+    return hitlists
+
+
+def benchmark_word_search(corpus):
+    """Multi-word searches of the global index by search_pattern()."""
+    from invenio import search_engine
+    queries = corpus.get_queries('word_search', 3)
+    expected = []
+    for query in queries:
+        hitset = intbitset(corpus.word_index[query[0]])
+        for term in query[1:]:
+            hitset &= corpus.word_index[term]
+        expected.append(hitset)
+
+    def run():
+        for query in queries:
+            search_engine.search_pattern(p=' '.join(query), f='')
+    setup_database_workload(corpus, run, [search_engine.index_stemming_cache,
+                                          search_engine.field_tokenizer_cache])
+    check_database_workload([search_engine.search_pattern(p=' '.join(query), f='')
+                             for query in queries], expected)
+    return run
+
+
+def benchmark_phrase_search(corpus):
+    """Phrase searches of the keyword index by search_pattern()."""
+    from invenio import search_engine
+    queries = corpus.get_queries('phrase_search', 1)
+    patterns = ['"%s"' % get_benchmark_phrase(query[0]) for query in queries]
+
+    def run():
+        for pattern in patterns:
+            search_engine.search_pattern(p=pattern, f=CFG_BENCHMARK_PHRASE_INDEX)
+    setup_database_workload(corpus, run, [search_engine.index_stemming_cache,
+                                          search_engine.field_tokenizer_cache])
+    check_database_workload([search_engine.search_pattern(p=pattern,
+                                                          f=CFG_BENCHMARK_PHRASE_INDEX)
+                             for pattern in patterns],
+                            [corpus.word_index[query[0]] for query in queries])
+    return run
+
+
+def benchmark_regexp_search(corpus):
+    """Regular expression searches of the keyword index by
+    search_pattern()."""
+    from invenio import search_engine
+    queries = corpus.get_queries('regexp_search', 1, 10)
+    patterns = ['/^%s[0-9]$/' % get_benchmark_phrase(query[0]) for query in queries]
+    expected = []
+    for query in queries:
+        hitset = intbitset()
+        for digit in xrange(10):
+            hitset |= corpus.word_index.get('%s%d' % (query[0], digit), intbitset())
+        expected.append(hitset)
+
+    def run():
+        for pattern in patterns:
+            search_engine.search_pattern(p=pattern, f=CFG_BENCHMARK_PHRASE_INDEX)
+    setup_database_workload(corpus, run, [search_engine.index_stemming_cache,
+                                          search_engine.field_tokenizer_cache])
+    check_database_workload([search_engine.search_pattern(p=pattern,
+                                                          f=CFG_BENCHMARK_PHRASE_INDEX)
+                             for pattern in patterns], expected)
+    return run
+
+
+def benchmark_rank_by_method(corpus):
+    """Ranking of hitsets by citation counts by rank_by_method()."""
+    from invenio import bibrank_record_sorter
+    bibrank_record_sorter.METHODS.setdefault(CFG_BENCHMARK_RANK_METHOD,
+                                             {'function': 'rank_by_method',
+                                              'prefix': '(',
+                                              'postfix': ')'})
+    hitsets = [corpus.word_index[query[0]]
+               for query in corpus.get_queries('rank_by_method', 1, 10)]
+
+    def run():
+        for hitset in hitsets:
+            bibrank_record_sorter.rank_by_method(CFG_BENCHMARK_RANK_METHOD, [],
+                                                 hitset, 0, 0, 10)
+    setup_database_workload(corpus, run)
+    check_database_workload([intbitset([recid for recid, dummy in
+                                        bibrank_record_sorter.rank_by_method(
+                                            CFG_BENCHMARK_RANK_METHOD, [],
+                                            hitset, 0, 0, 10)[0] or []])
+                             for hitset in hitsets], hitsets)
+    return run
+
+
+def benchmark_bibsort_method(corpus):
+    """Computation and storage of a bibsort method sorting by year
+    by run_sorting_method()."""
+    from invenio import bibsort_engine
+    recids = intbitset(xrange(1, corpus.nb_records + 1))
+
+    def run():
+        if not bibsort_engine.run_sorting_method(recids, CFG_BENCHMARK_SORT_METHOD,
+                                                 1, 'MARC: 260__c', ''):
+            raise InvenioBenchmarkSkipped("the sorting method could not be stored")
+    setup_database_workload(corpus, run)
+    return run
+
+
+def get_site_search_terms(nb_terms=CFG_BENCHMARK_NB_SITE_TERMS):
+    """
+    Return the NB_TERMS most frequent terms of the global word index of
+    the installed site.  Raise InvenioBenchmarkSkipped if there is no
+    site to search.
+    """
+    try:
+        from invenio.dbquery import run_sql
+        res = run_sql("SELECT id FROM idxINDEX WHERE name='global'")
+        if not res:
+            raise InvenioBenchmarkSkipped("no global index to search")
+        terms = [term for (term, ) in
+                 run_sql("""SELECT term FROM idxWORD%02dF
+                            ORDER BY LENGTH(hitlist) DESC, term
+                            LIMIT %%s""" % res[0][0], (nb_terms, ))]
+    except StandardError, excp:
+        raise InvenioBenchmarkSkipped("no installed site to search: %s" % excp)
+    if not terms:
+        raise InvenioBenchmarkSkipped("no indexed terms to search")
+    return terms
+
+
+def benchmark_site_word_search(corpus):
+    """Multi-term AND queries of search units on the installed site."""
+    terms = get_site_search_terms()
+    from invenio.search_engine import search_unit
+    generator = corpus.get_generator('site_word_search')
+    queries = []
+    for dummy in xrange(CFG_BENCHMARK_NB_QUERIES):
+        queries.append([terms[int(len(terms) * generator.random() ** 2)]
+                        for dummy in xrange(3)])
+    info = {'source': 'database',
+            'terms': len(terms)}
+
+    def run():
+        for query in queries:
+            hitset = search_unit(query[0], m='w')
+            for term in query[1:]:
+                hitset &= search_unit(term, m='w')
+    return run, info
+
+
+def benchmark_collection_split(corpus):
+    """Splitting of hitsets into the collections."""
+    from invenio.search_engine_collection_index import CollectionMembershipIndex
+    index = CollectionMembershipIndex.build(corpus.collections)
+    colls = sorted(corpus.collections)
+    hitsets = [corpus.word_index[query[0]] for query in corpus.get_queries('collection_split', 1, 10)]
+
+    def run():
+        for hitset in hitsets:
+            index.split(hitset, colls)
+    return run
+
+
+def benchmark_citation_counts(corpus):
+    """cited:M->N searches and ranking by citations."""
+    from invenio.bibrank_citation_counts import build_citation_counts
+    weights = dict((citee, len(citers)) for citee, citers
+                   in corpus.citations.iteritems())
+    counts = build_citation_counts(weights, {})
+    hitsets = [corpus.word_index[query[0]]
+               for query in corpus.get_queries('citation_counts', 1, 10)]
+
+    def run():
+        for first, last in ((1, 1), (10, 50), (100, None)):
+            counts.get_records_with_counts(first, last)
+        for hitset in hitsets:
+            ranked = [(recid, count) for recid, count
+                      in counts.get_sorted_counts() if recid in hitset]
+            ranked.extend((recid, 0) for recid in hitset - counts.keys)
+    return run
+
+
+def benchmark_citation_graph(corpus):
+    """refersto: and citedby: searches on the citation graph."""
+    from invenio.bibrank_citation_graph import CitationGraph, \
+         build_adjacency, save_citation_graph
+    edges = [(citer, citee) for citee, citers in corpus.citations.iteritems()
+             for citer in citers]
+    refs = build_adjacency(sorted(edges))
+    cites = build_adjacency(sorted([(citee, citer) for citer, citee in edges]))
+    fd, filename = tempfile.mkstemp(prefix='benchmark_citation_graph_')
+    os.close(fd)
+    save_citation_graph(refs, cites, filename, stamp=0)
+    graph = CitationGraph(filename)
+    os.remove(filename)
+    hitsets = [corpus.word_index[query[0]]
+               for query in corpus.get_queries('citation_graph', 1, 10)]
+
+    def run():
+        for hitset in hitsets:
+            graph.get_refersto_hitset(hitset)
+            graph.get_citedby_hitset(hitset)
+    return run
+
+
+def benchmark_word_similarity(corpus):
+    """Word similarity ranking of the best records of queries."""
+    from invenio.bibrank_word_searcher import score_records, \
+         select_ranked_records, word_similarity_term_weight, \
+         word_similarity_term_bound
+    queries = corpus.get_queries('word_similarity', 4, 10)
+    hitlists = generate_word_hitlists(corpus, sum(queries, []))
+    hitset = intbitset(range(1, corpus.nb_records + 1))
+
+    def run():
+        for query in queries:
+            terms = [(term, 1) for term in query]
+            recdict, rec_termcount = score_records(terms, hitlists, hitset,
+                                                   word_similarity_term_weight,
+                                                   word_similarity_term_bound,
+                                                   nb_top=10)
+            if recdict:
+                select_ranked_records(recdict, rec_termcount, 0, nb_top=10)
+    return run
+
+
+def benchmark_bibsort(corpus):
+    """Sorting of hitsets by a bibsort method."""
+    from invenio.bibsort_cache import build_rank_array, sort_recids_by_rank
+    generator = corpus.get_generator('bibsort')
+    rank_array = build_rank_array(dict((recid, generator.random())
+                                       for recid in xrange(1, corpus.nb_records + 1)
+                                       if generator.random() < 0.9))
+    hitsets = [corpus.word_index[query[0]]
+               for query in corpus.get_queries('bibsort', 1, 10)]
+
+    def run():
+        for hitset in hitsets:
+            sort_recids_by_rank(rank_array, hitset, reverse=True)
+    return run
+
+
+def benchmark_ranked_sort(corpus):
+    """Partial sorting of the first page of ranked records."""
+    from invenio.bibrank_rank_store import sort_ranked_records
+    generator = corpus.get_generator('ranked_sort')
+    ranked = [(recid, generator.random()) for recid in xrange(1, corpus.nb_records + 1)]
+
+    def run():
+        sort_ranked_records(list(ranked), 10)
+    return run
+
+
+def benchmark_citerank(corpus):
+    """Citerank PageRank computation with the sparse engine."""
+    from invenio.bibrank_citerank_indexer import construct_ref_array, \
+         construct_sparse_matrix_arrays, pagerank_sparse
+    dict_of_ids = {}
+    for citee, citers in corpus.citations.iteritems():
+        for recid in [citee] + sorted(citers):
+            if recid not in dict_of_ids:
+                dict_of_ids[recid] = len(dict_of_ids)
+    len_ = len(dict_of_ids)
+    ref = construct_ref_array(corpus.citations, dict_of_ids, len_)
+
+    def run():
+        matrix, semi_sparse, semi_sparse_coef = construct_sparse_matrix_arrays(
+            corpus.citations, ref, dict_of_ids, len_, 0.85)
+        pagerank_sparse(0.0001, 1, len_, matrix, semi_sparse, semi_sparse_coef)
+    return run
+
+
+def get_synthetic_termlists(corpus, nb_termlists=CFG_BENCHMARK_NB_TERMLISTS):
+    """Return up to NB_TERMLISTS term lists of the records of CORPUS,
+    as stored in the reverse word index tables."""
+    nb_termlists = min(nb_termlists, corpus.nb_records)
+    termlists = [[] for dummy in xrange(nb_termlists)]
+    for term in sorted(corpus.word_index):
+        for recid in corpus.word_index[term]:
+            if recid > nb_termlists:
+                break
+            termlists[recid - 1].append(term)
+    return termlists
+
+
+def get_site_termlists(nb_termlists=CFG_BENCHMARK_NB_TERMLISTS):
+    """
+    Return up to NB_TERMLISTS term lists of the reverse word index
+    tables of the installed site.  Raise InvenioBenchmarkSkipped if
+    they cannot be read.
+    """
+    from invenio.bibindex_termlist_codec import deserialize_termlist
+    termlists = []
+    try:
+        from invenio.dbquery import run_sql
+        for (index_id, ) in run_sql("SELECT id FROM idxINDEX ORDER BY id"):
+            for (data, ) in run_sql("""SELECT termlist FROM idxWORD%02dR
+                                       WHERE type='CURRENT' LIMIT %%s""" % index_id,
+                                    (nb_termlists - len(termlists), )):
+                termlists.append(deserialize_termlist(data))
+            if len(termlists) >= nb_termlists:
+                break
+    except StandardError, excp:
+        raise InvenioBenchmarkSkipped("no installed site to read: %s" % excp)
+    if not termlists:
+        raise InvenioBenchmarkSkipped("no term lists to read")
+    return termlists
+
+
+def benchmark_termlists(termlists, source, termlist_format):
+    """Return run function and size information of the encoding and
+    decoding of TERMLISTS, read from SOURCE, in TERMLIST_FORMAT."""
+    from invenio.bibindex_termlist_codec import serialize_termlist, \
+         deserialize_termlist
+    encoded = [serialize_termlist(terms, termlist_format) for terms in termlists]
+    info = {'source': source,
+            'termlists': len(termlists),
+            'bytes': sum([len(data) for data in encoded])}
+
+    def run():
+        for terms in termlists:
+            serialize_termlist(terms, termlist_format)
+        for data in encoded:
+            deserialize_termlist(data)
+    return run, info
+
+
+def benchmark_termlists_marshal(corpus):
+    """Reverse index term lists encoded and decoded via marshal."""
+    return benchmark_termlists(get_synthetic_termlists(corpus), 'synthetic',
+                               'marshal')
+
+
+def benchmark_termlists_frontcoded(corpus):
+    """Reverse index term lists encoded and decoded front-coded."""
+    return benchmark_termlists(get_synthetic_termlists(corpus), 'synthetic',
+                               'frontcoded')
+
+
+def benchmark_site_termlists_marshal(corpus):
+    """Term lists of the installed site encoded and decoded via
+    marshal."""
+    return benchmark_termlists(get_site_termlists(), 'database', 'marshal')
+
+
+def benchmark_site_termlists_frontcoded(corpus):
+    """Term lists of the installed site encoded and decoded
+    front-coded."""
+    return benchmark_termlists(get_site_termlists(), 'database', 'frontcoded')
+
+
+CFG_BENCHMARK_WORKLOADS = [
+    ('word_search', benchmark_word_search),
+    ('phrase_search', benchmark_phrase_search),
+    ('regexp_search', benchmark_regexp_search),
+    ('collection_split', benchmark_collection_split),
+    ('citation_counts', benchmark_citation_counts),
+    ('citation_graph', benchmark_citation_graph),
+    ('rank_by_method', benchmark_rank_by_method),
+    ('word_similarity', benchmark_word_similarity),
+    ('bibsort', benchmark_bibsort),
+    ('bibsort_method', benchmark_bibsort_method),
+    ('ranked_sort', benchmark_ranked_sort),
+    ('citerank', benchmark_citerank),
+    ('termlists_marshal', benchmark_termlists_marshal),
+    ('termlists_frontcoded', benchmark_termlists_frontcoded),
+    ('site_word_search', benchmark_site_word_search),
+    ('site_termlists_marshal', benchmark_site_termlists_marshal),
+    ('site_termlists_frontcoded', benchmark_site_termlists_frontcoded),
+]
+
+# workloads working on the database of the installed site instead of
+# the synthetic corpus:
+CFG_BENCHMARK_SITE_WORKLOADS = ['site_word_search',
+                                'site_termlists_marshal',
+                                'site_termlists_frontcoded']
+
+
+def time_workload(run, repeat):
+    """Return list of the durations in seconds of REPEAT runs of RUN."""
+    durations = []
+    for dummy in xrange(repeat):
+        start = time.time()
+        run()
+        durations.append(time.time() - start)
+    return durations
+
+
+def run_benchmarks(nb_records=CFG_BENCHMARK_DEFAULT_RECORDS, seed=0,
+                   repeat=CFG_BENCHMARK_DEFAULT_REPEAT, workloads=None):
+    """
+    Run the WORKLOADS (names of CFG_BENCHMARK_WORKLOADS, by default
+    all of them) on a synthetic corpus of NB_RECORDS records and
+    return the results as a dictionary that can be dumped as JSON.
+    Workloads whose modules cannot be imported (e.g. because of
+    missing optional dependencies) or that need an installed site when
+    there is none are reported as skipped.  Workloads may report more
+    information about their data, e.g. its size.  The setup time of a
+    workload includes the generation of the corpus parts it uses first
+    and the loading of the stand-in database, which is uninstalled
+    after every workload.
+    """
+    corpus = SyntheticCorpus(nb_records, seed)
+    results = {'records': nb_records,
+               'seed': seed,
+               'repeat': repeat,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+               'workloads': {}}
+    for name, setup in CFG_BENCHMARK_WORKLOADS:
+        if workloads and name not in workloads:
+            continue
+        try:
+            try:
+                start = time.time()
+                run = setup(corpus)
+                setup_seconds = time.time() - start
+                info = {}
+                if isinstance(run, tuple):
+                    run, info = run
+                durations = time_workload(run, repeat)
+            except (ImportError, InvenioBenchmarkSkipped), excp:
+                results['workloads'][name] = {'skipped': str(excp)}
+                continue
+        finally:
+            corpus.uninstall_database()
+        results['workloads'][name] = {'description': setup.__doc__,
+                                      'setup_seconds': setup_seconds,
+                                      'seconds': durations,
+                                      'best_seconds': min(durations)}
+        results['workloads'][name].update(info)
+    return results
+
+
+def usage(exitcode=1, msg=""):
+    """Print usage information and exit with EXITCODE."""
+    if msg:
+        sys.stderr.write("Error: %s.\n" % msg)
+    sys.stderr.write(__doc__[__doc__.index('Usage:'):])
+    sys.exit(exitcode)
+
+
+def main():
+    """Run the benchmarks with the command line options."""
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:s:r:w:o:",
+                                   ["help", "records=", "seed=", "repeat=",
+                                    "workloads=", "output="])
+    except getopt.GetoptError, err:
+        usage(1, err)
+    if args:
+        usage(1, "unexpected arguments %s" % ' '.join(args))
+    options = {'nb_records': CFG_BENCHMARK_DEFAULT_RECORDS,
+               'seed': 0,
+               'repeat': CFG_BENCHMARK_DEFAULT_REPEAT,
+               'workloads': None}
+    output = None
+    try:
+        for opt, value in opts:
+            if opt in ("-h", "--help"):
+                usage(0)
+            elif opt in ("-n", "--records"):
+                options['nb_records'] = int(value)
+            elif opt in ("-s", "--seed"):
+                options['seed'] = int(value)
+            elif opt in ("-r", "--repeat"):
+                options['repeat'] = int(value)
+            elif opt in ("-w", "--workloads"):
+                options['workloads'] = value.split(',')
+            elif opt in ("-o", "--output"):
+                output = value
+    except ValueError, err:
+        usage(1, err)
+    results = run_benchmarks(**options)
+    if output:
+        output_file = open(output, 'w')
+        json.dump(results, output_file, indent=2, sort_keys=True)
+        output_file.close()
+    else:
+        print json.dumps(results, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
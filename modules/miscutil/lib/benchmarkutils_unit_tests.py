@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the benchmark suite."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.jsonutils import json
+from invenio.intbitset import intbitset
+from invenio.benchmarkutils import SyntheticCorpus, run_benchmarks, \
+     get_benchmark_phrase, CFG_BENCHMARK_WORKLOADS, \
+     CFG_BENCHMARK_SITE_WORKLOADS
+
+
+class SyntheticCorpusTest(InvenioTestCase):
+    """Test of the synthetic corpus."""
+
+    def test_same_seed_same_corpus(self):
+        """benchmarkutils - corpus depends only on its seed"""
+        corpus1 = SyntheticCorpus(500, seed=1)
+        corpus2 = SyntheticCorpus(500, seed=1)
+        self.assertEqual(corpus1.word_index, corpus2.word_index)
+        self.assertEqual(corpus1.citations, corpus2.citations)
+        self.assertEqual(corpus1.collections, corpus2.collections)
+        self.assertEqual(corpus1.get_queries('word_search', 2),
+                         corpus2.get_queries('word_search', 2))
+
+    def test_parts_independent(self):
+        """benchmarkutils - corpus parts do not depend on each other"""
+        corpus1 = SyntheticCorpus(500, seed=1)
+        corpus2 = SyntheticCorpus(500, seed=1)
+        corpus2.citations
+        self.assertEqual(corpus1.collections, corpus2.collections)
+        self.assertEqual(corpus1.word_index, corpus2.word_index)
+        self.assertEqual(corpus1.citations, corpus2.citations)
+
+    def test_workload_queries_independent(self):
+        """benchmarkutils - queries of a workload do not depend on other ones"""
+        corpus1 = SyntheticCorpus(500, seed=1)
+        corpus2 = SyntheticCorpus(500, seed=1)
+        corpus2.get_queries('collection_split', 1, 10)
+        self.assertEqual(corpus1.get_queries('word_search', 3),
+                         corpus2.get_queries('word_search', 3))
+        self.assertNotEqual(corpus1.get_queries('word_search', 3),
+                            corpus1.get_queries('phrase_search', 3))
+
+    def test_term_frequency_skew(self):
+        """benchmarkutils - first terms are the most frequent ones"""
+        corpus = SyntheticCorpus(1000)
+        self.assertEqual(1000, len(corpus.word_index['term0']))
+        self.failUnless(len(corpus.word_index['term1']) <
+                        len(corpus.word_index['term0']))
+        self.assertEqual(1, len(corpus.word_index['term1999']))
+
+    def test_records_in_collections(self):
+        """benchmarkutils - every record is in some collection"""
+        corpus = SyntheticCorpus(1000)
+        recids = set()
+        for reclist in corpus.collections.itervalues():
+            recids.update(reclist)
+        self.assertEqual(set(range(1, 1001)), recids)
+
+
+class BenchmarkDatabaseTest(InvenioTestCase):
+    """Test of the stand-in database of the corpus."""
+
+    def setUp(self):
+        """Load a small corpus."""
+        self.corpus = SyntheticCorpus(300)
+        self.cursor = self.corpus.database.cursor()
+
+    def test_sequence_parameters(self):
+        """benchmarkutils - sequences expanded in MySQLdb parameters"""
+        self.cursor.execute("SELECT term, hitlist FROM idxWORD01F "
+                            "WHERE term IN %s AND term LIKE 'TERM%%'",
+                            (('term0', 'TERM7', 'missing'), ))
+        self.assertEqual({'term0': self.corpus.word_index['term0'],
+                          'term7': self.corpus.word_index['term7']},
+                         dict([(term, intbitset(hitlist)) for term, hitlist
+                               in self.cursor.fetchall()]))
+        self.cursor.execute("SELECT id FROM bibrec WHERE id IN %s",
+                            (intbitset([2, 3, 500]), ))
+        self.assertEqual(((2, ), (3, )), self.cursor.fetchall())
+
+    def test_regexp(self):
+        """benchmarkutils - REGEXP operator of the phrase index"""
+        self.cursor.execute("SELECT term FROM idxPHRASE02F WHERE term REGEXP %s",
+                            ('^keyword 1[0-2]$', ))
+        self.assertEqual(sorted([get_benchmark_phrase('term%d' % rank)
+                                 for rank in (10, 11, 12)]),
+                         sorted([term for (term, ) in self.cursor.fetchall()]))
+
+    def test_table_status(self):
+        """benchmarkutils - MySQL table status of the tables"""
+        self.cursor.execute("SHOW TABLE STATUS LIKE %s", ('bibrec', ))
+        row = self.cursor.fetchall()[0]
+        self.assertEqual(('bibrec', 300), (row[0], row[4]))
+        self.cursor.execute("DELETE FROM bibrec WHERE id > %s", (200, ))
+        self.cursor.execute("SHOW TABLE STATUS LIKE %s", ('bibrec', ))
+        row = self.cursor.fetchall()[0]
+        self.assertEqual(200, row[4])
+        self.failIf(row[12] < row[11])
+
+
+class RunBenchmarksTest(InvenioTestCase):
+    """Test of the benchmark runs."""
+
+    def test_results(self):
+        """benchmarkutils - results of the synthetic workloads as JSON"""
+        workloads = [name for name, dummy in CFG_BENCHMARK_WORKLOADS
+                     if name not in CFG_BENCHMARK_SITE_WORKLOADS]
+        results = json.loads(json.dumps(run_benchmarks(300, repeat=2,
+                                                       workloads=workloads)))
+        self.assertEqual(300, results['records'])
+        self.assertEqual(sorted(workloads), sorted(results['workloads']))
+        for result in results['workloads'].itervalues():
+            if 'skipped' not in result:
+                self.assertEqual(2, len(result['seconds']))
+                self.assertEqual(min(result['seconds']), result['best_seconds'])
+
+    def test_selected_workloads(self):
+        """benchmarkutils - only the selected workloads are run"""
+        results = run_benchmarks(300, repeat=1, workloads=['bibsort'])
+        self.assertEqual(['bibsort'], results['workloads'].keys())
+
+    def test_termlists(self):
+        """benchmarkutils - termlist formats compared on the same data"""
+        results = run_benchmarks(300, repeat=1,
+                                 workloads=['termlists_marshal',
+                                            'termlists_frontcoded'])
+        marshal_result = results['workloads']['termlists_marshal']
+        frontcoded_result = results['workloads']['termlists_frontcoded']
+        self.failUnless(marshal_result['termlists'])
+        self.assertEqual(marshal_result['termlists'],
+                         frontcoded_result['termlists'])
+        self.assertEqual('synthetic', marshal_result['source'])
+        self.assertEqual('synthetic', frontcoded_result['source'])
+        self.failUnless(frontcoded_result['bytes'])
+
+
+TEST_SUITE = make_test_suite(SyntheticCorpusTest,
+                             BenchmarkDatabaseTest,
+                             RunBenchmarksTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
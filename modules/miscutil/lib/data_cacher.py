@@ -20,11 +20,60 @@
 """
 Tool for caching important infos, which are slow to rebuild, but that
 rarely change.
+
+Caches verify whether they are up-to-date at most once every
+CFG_DATACACHER_CHECK_INTERVAL seconds per process.  The cheap way to
+know whether a table has changed is get_table_version(), which looks
+up a version key in the shared key/value store before falling back to
+the MySQL table update time.  Processes modifying tables cached by web
+workers should call bump_table_version() so that the change is seen
+by all the workers at their next verification.
 """
 
+from invenio.config import CFG_DATACACHER_CHECK_INTERVAL
 from invenio.dbquery import run_sql, get_table_update_time
+from invenio.redisutils import get_redis
 import time
 
+## number of calls to bump_table_version() made in this process; when
+## it changes, caches are verified without waiting for the end of the
+## check interval:
+_TABLE_VERSION_BUMPS = [0]
+
+def _get_table_version_key(tablename):
+    """Return key/value store key holding version of TABLENAME."""
+    return 'datacacher_table_version:%s' % tablename
+
+def get_table_version(tablename):
+    """
+    Return version of TABLENAME, in the format of the table update
+    time, suitable for cache timestamp verifiers.  The version is
+    read from the shared key/value store if a process has published
+    it recently; otherwise the table update time is looked up in the
+    database and published for CFG_DATACACHER_CHECK_INTERVAL seconds
+    for the other processes.
+    """
+    redis = get_redis()
+    key = _get_table_version_key(tablename)
+    version = redis.get(key)
+    if version is None:
+        version = str(get_table_update_time(tablename))
+        redis.set(key, version, CFG_DATACACHER_CHECK_INTERVAL or None)
+    return version
+
+def bump_table_version(tablename, version=None):
+    """
+    Mark TABLENAME as modified, so that the caches depending on it
+    are recreated at their next verification in all the processes.
+    The new VERSION defaults to the current time.  Return it.
+    """
+    if version is None:
+        version = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    get_redis().set(_get_table_version_key(tablename), version,
+                    CFG_DATACACHER_CHECK_INTERVAL or None)
+    _TABLE_VERSION_BUMPS[0] += 1
+    return version
+
 class InvenioDataCacherError(Exception):
     """Error raised by data cacher."""
     pass
@@ -45,6 +94,8 @@ class DataCacher(object):
                    checking if something has changed after cache creation.
         """
         self.timestamp = 0 # WARNING: may be exposed to clients
+        self.last_verified = 0 # time of the last timestamp verification
+        self.last_verified_bumps = _TABLE_VERSION_BUMPS[0]
         self.cache = {} # WARNING: may be exposed to clients; lazy
                         # clients may even alter this object on the fly
         if not callable(cache_filler):
@@ -71,8 +122,16 @@ class DataCacher(object):
     def recreate_cache_if_needed(self):
         """
         Recreate cache if needed, by verifying the cache timestamp
-        against the timestamp verifier function.
+        against the timestamp verifier function.  The verification is
+        done at most once every CFG_DATACACHER_CHECK_INTERVAL seconds,
+        unless a table version was bumped by this process meanwhile.
         """
+        now = time.time()
+        if now - self.last_verified < CFG_DATACACHER_CHECK_INTERVAL and \
+               self.last_verified_bumps == _TABLE_VERSION_BUMPS[0]:
+            return
+        self.last_verified = now
+        self.last_verified_bumps = _TABLE_VERSION_BUMPS[0]
         if self.timestamp_verifier() > self.timestamp:
             self.create_cache()
 
@@ -97,7 +156,7 @@ class SQLDataCacher(DataCacher):
         def timestamp_verifier():
             """The standard timestamp verifier is looking at affected
             tables time stamp."""
-            return max([get_table_update_time(table)
+            return max([get_table_version(table)
                 for table in self.affected_tables])
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
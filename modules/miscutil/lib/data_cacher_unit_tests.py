@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the data cacher."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio import data_cacher
+from invenio.data_cacher import DataCacher, bump_table_version
+
+
+class DataCacherVerificationIntervalTest(InvenioTestCase):
+    """Test of the throttling of cache timestamp verifications."""
+
+    def setUp(self):
+        """Create cacher counting its verifications."""
+        self.check_interval = data_cacher.CFG_DATACACHER_CHECK_INTERVAL
+        data_cacher.CFG_DATACACHER_CHECK_INTERVAL = 3600
+        self.verifications = []
+        def cache_filler():
+            return {}
+        def timestamp_verifier():
+            self.verifications.append(1)
+            return '1970-01-01 00:00:00'
+        self.cacher = DataCacher(cache_filler, timestamp_verifier)
+
+    def tearDown(self):
+        """Restore check interval."""
+        data_cacher.CFG_DATACACHER_CHECK_INTERVAL = self.check_interval
+
+    def test_verification_is_throttled(self):
+        """data cacher - timestamp is verified at most once per interval"""
+        for dummy in range(10):
+            self.cacher.recreate_cache_if_needed()
+        self.assertEqual(1, len(self.verifications))
+
+    def test_bump_forces_verification(self):
+        """data cacher - bumping a table version forces a new verification"""
+        self.cacher.recreate_cache_if_needed()
+        bump_table_version('datacachertest')
+        self.cacher.recreate_cache_if_needed()
+        self.cacher.recreate_cache_if_needed()
+        self.assertEqual(2, len(self.verifications))
+
+
+TEST_SUITE = make_test_suite(DataCacherVerificationIntervalTest, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
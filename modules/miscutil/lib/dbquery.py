@@ -110,6 +110,11 @@ _DB_CONN = {}
 _DB_CONN[CFG_DATABASE_HOST] = {}
 _DB_CONN[CFG_DATABASE_SLAVE] = {}
 
+## Per-thread counters of the queries run and of the rows they
+## returned, switched on only when somebody is interested in them
+## (e.g. search engine traces):
+_RUN_SQL_STATISTICS = {}
+
 def get_connection_for_dump_on_slave():
     """
     Return a valid connection, suitable to perform dump operation
@@ -206,6 +211,21 @@ def close_connection(dbhost=CFG_DATABASE_HOST):
     except KeyError:
         pass
 
+def start_run_sql_statistics():
+    """Start counting the queries run by run_sql() in this thread."""
+    _RUN_SQL_STATISTICS[get_ident()] = [0, 0]
+
+def stop_run_sql_statistics():
+    """Stop counting the queries run by run_sql() in this thread."""
+    _RUN_SQL_STATISTICS.pop(get_ident(), None)
+
+def get_run_sql_statistics():
+    """
+    Return tuple (number of queries, number of rows) counted so far
+    in this thread, or (0, 0) if the counting was not started.
+    """
+    return tuple(_RUN_SQL_STATISTICS.get(get_ident(), (0, 0)))
+
 def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave=False, connection=None):
     """Run SQL on the server with PARAM and return result.
     @param param: tuple of string params to insert in the query (see
@@ -270,11 +290,17 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
         except (OperationalError, InterfaceError): # unexpected disconnect, bad malloc error, etc
             raise
 
+    statistics = _RUN_SQL_STATISTICS.get(get_ident())
+    if statistics is not None:
+        statistics[0] += 1
+
     if string.upper(string.split(sql)[0]) in ("SELECT", "SHOW", "DESC", "DESCRIBE"):
         if n:
             recset = cur.fetchmany(n)
         else:
             recset = cur.fetchall()
+        if statistics is not None:
+            statistics[1] += len(recset)
 
         if with_dict: # return list of dictionaries
             # let's extract column names
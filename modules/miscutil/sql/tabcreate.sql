@@ -4768,6 +4768,14 @@ CREATE TABLE IF NOT EXISTS bsrMETHODDATABUCKET (
   PRIMARY KEY (id_bsrMETHOD, bucket_no)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS bsrMETHODDATADELTA (
+  id_bsrMETHOD mediumint(8) unsigned NOT NULL,
+  version int(11) unsigned NOT NULL,
+  delta_data longblob,
+  last_updated datetime,
+  PRIMARY KEY (id_bsrMETHOD, version)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS collection_bsrMETHOD (
   id_collection mediumint(9) unsigned NOT NULL,
   id_bsrMETHOD mediumint(9) unsigned NOT NULL,
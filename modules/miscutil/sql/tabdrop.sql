@@ -540,6 +540,7 @@ DROP TABLE IF EXISTS bsrMETHOD;
 DROP TABLE IF EXISTS bsrMETHODNAME;
 DROP TABLE IF EXISTS bsrMETHODDATA;
 DROP TABLE IF EXISTS bsrMETHODDATABUCKET;
+DROP TABLE IF EXISTS bsrMETHODDATADELTA;
 DROP TABLE IF EXISTS collection_bsrMETHOD;
 DROP TABLE IF EXISTS lnkENTRY;
 DROP TABLE IF EXISTS lnkENTRYURLTITLE;
@@ -61,7 +61,7 @@ from invenio.intbitset import intbitset
 from invenio.htmlutils import X, EscapedXMLString
 from invenio.dbquery import run_sql, wash_table_column_name
 from invenio.search_engine import record_exists, get_all_restricted_recids, get_all_field_values, search_unit_in_bibxxx, get_record, search_pattern
-from invenio.bibformat import format_record
+from invenio.bibformat import format_record, get_preformatted_records
 from invenio.bibrecord import record_get_field_instances
 from invenio.errorlib import register_exception
 from invenio.oai_repository_config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
@@ -289,7 +289,8 @@ def get_record_rights(dummy):
             #elif code == CFG_OAI_LICENSE_URI_SUBFIELD:
                 #license_uri = value
 
-def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set_last_updated=None):
+def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set_last_updated=None,
+                 preformatted_record=None):
     """Prints record 'recid' formatted according to 'prefix'.
 
     - if record does not exist, return nothing.
@@ -301,6 +302,9 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
     - if record has been deleted and CFG_OAI_DELETED_POLICY is 'no',
       then return nothing.
 
+    - 'preformatted_record' is the preformatted metadata of the
+      record, as returned by bibformat.get_preformatted_records.
+
     """
 
     record_exists_result = record_exists(recid) == 1
@@ -351,7 +355,8 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
         return header
     else:
         if record_exists_result:
-            metadata_body = format_record(recid, CFG_OAI_METADATA_FORMATS[prefix][0])
+            metadata_body = format_record(recid, CFG_OAI_METADATA_FORMATS[prefix][0],
+                                          preformatted_record=preformatted_record)
             metadata = X.metadata(body=metadata_body)
             provenance_body = get_record_provenance(recid)
             if provenance_body:
@@ -427,8 +432,16 @@ def oai_list_records_or_identifiers(req, argd):
     set_last_updated = get_set_last_update(argd.get('set', ""))
 
     req.write(oai_header(argd, verb))
-    for recid in list(complete_list)[cursor:cursor+CFG_OAI_LOAD]:
-        req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated))
+    recids = list(complete_list)[cursor:cursor+CFG_OAI_LOAD]
+    if verb == 'ListRecords':
+        # fetch the metadata of all the records of this chunk at once:
+        preformatted_records, dummy = get_preformatted_records(recids,
+                                                               CFG_OAI_METADATA_FORMATS[argd['metadataPrefix']][0])
+    else:
+        preformatted_records = {}
+    for recid in recids:
+        req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated,
+                               preformatted_record=preformatted_records.get(recid, (None, None))))
 
     if list(complete_list)[cursor+CFG_OAI_LOAD:]:
         resumption_token = oai_generate_resumption_token(argd.get('set', ''))
@@ -29,6 +29,7 @@ __revision__ = "$Id$"
 import cgi
 import cStringIO
 import copy
+import heapq
 import os
 import re
 import time
@@ -61,10 +62,15 @@ from invenio.config import \
      CFG_WEBSEARCH_CREATE_SIMILARLY_NAMED_AUTHORS_LINK_BOX, \
      CFG_WEBSEARCH_FIELDS_CONVERT, \
      CFG_WEBSEARCH_NB_RECORDS_TO_SORT, \
+     CFG_WEBSEARCH_SORT_COLUMN_CACHE_SIZE, \
+     CFG_WEBSEARCH_SEARCH_CACHE_BACKEND, \
      CFG_WEBSEARCH_SEARCH_CACHE_SIZE, \
      CFG_WEBSEARCH_USE_MATHJAX_FOR_FORMATS, \
      CFG_WEBSEARCH_USE_ALEPH_SYSNOS, \
      CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, \
+     CFG_WEBSEARCH_COLLECTION_INDEX_THRESHOLD, \
+     CFG_WEBSEARCH_SEARCH_UNIT_RESTRICTION_LIMIT, \
+     CFG_WEBSEARCH_OUTPUT_FLUSH_SIZE, \
      CFG_WEBSEARCH_FULLTEXT_SNIPPETS, \
      CFG_WEBSEARCH_DISPLAY_NEAREST_TERMS, \
      CFG_BIBUPLOAD_SERIALIZE_RECORD_STRUCTURE, \
@@ -76,6 +82,7 @@ from invenio.config import \
      CFG_LOGDIR, \
      CFG_BIBFORMAT_HIDDEN_TAGS, \
      CFG_BIBFORMAT_HIDDEN_RECJSON_FIELDS, \
+     CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS, \
      CFG_SITE_URL, \
      CFG_ACCESS_CONTROL_LEVEL_ACCOUNTS, \
      CFG_SOLR_URL, \
@@ -94,7 +101,18 @@ from invenio.search_engine_config import \
      InvenioWebSearchWildcardLimitError, \
      CFG_WEBSEARCH_IDXPAIRS_FIELDS,\
      CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH
+from invenio.search_engine_hitlist_cache import get_hitlist_cache
+from invenio.search_engine_results_cache import create_search_results_cache
+from invenio.search_engine_collection_index import load_collection_membership_index
+from invenio.search_engine_trace import trace_stage, start_search_trace, \
+     stop_search_trace, get_current_search_trace
+from invenio.search_engine_query_planner import plan_search_units, \
+     CFG_SEARCH_UNIT_COST_KNOWN, \
+     CFG_SEARCH_UNIT_COST_INDEX, \
+     CFG_SEARCH_UNIT_COST_SCAN, \
+     CFG_SEARCH_UNIT_COST_SUBQUERY
 from invenio.search_engine_utils import (get_fieldvalues,
+                                         get_fieldvalues_by_record,
                                          get_fieldvalues_alephseq_like,
                                          record_exists)
 from invenio.bibrecord import create_record, record_xml_output
@@ -110,11 +128,13 @@ from invenio.bibindex_engine_utils import author_name_requires_phrase_search, \
     get_field_tags
 from invenio.bibindex_engine_washer import wash_index_term, lower_index_term, wash_author_name
 from invenio.bibindex_engine_config import CFG_BIBINDEX_SYNONYM_MATCH_TYPE
+from invenio.bibindex_termlist_codec import deserialize_termlist
 from invenio.bibindex_engine_utils import get_idx_indexer
-from invenio.bibformat import format_record, format_records, get_output_format_content_type, create_excel
+from invenio.bibformat import format_record, format_records, format_records_iterator, \
+     get_output_format_content_type, get_preformatted_records, create_excel
 from invenio.bibrank_downloads_grapher import create_download_history_graph_and_box
 from invenio.bibknowledge import get_kbr_values
-from invenio.data_cacher import DataCacher
+from invenio.data_cacher import DataCacher, get_table_version
 from invenio.websearch_external_collections import print_external_results_overview, perform_external_collection_search
 from invenio.access_control_admin import acc_get_action_id
 from invenio.access_control_config import VIEWRESTRCOLL, \
@@ -140,6 +160,9 @@ from invenio.bibrank_citation_searcher import calculate_cited_by_list, \
     get_refers_to_list, get_citers_log
 
 from invenio.bibrank_citation_grapher import create_citation_history_graph_and_box
+from invenio.bibsort_cache import get_bibsort_data_timestamp, \
+     get_last_delta_version, build_rank_array, update_bibsort_cache, \
+     sort_recids_by_rank
 from invenio.bibrank_selfcites_searcher import get_self_cited_by_list, \
                                                get_self_cited_by, \
                                                get_self_refers_to_list
@@ -236,7 +259,7 @@ class RestrictedCollectionDataCacher(DataCacher):
             return ret
 
         def timestamp_verifier():
-            return max(get_table_update_time('accROLE_accACTION_accARGUMENT'), get_table_update_time('accARGUMENT'))
+            return max(get_table_version('accROLE_accACTION_accARGUMENT'), get_table_version('accARGUMENT'))
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -282,23 +305,80 @@ def get_permitted_restricted_collections(user_info, recreate_cache_if_needed=Tru
             ret.append(collection)
     return ret
 
+## hitsets of restricted records that cannot be viewed, per set of
+## permitted restricted collections (see
+## get_restricted_recids_not_permitted()), valid as long as the
+## 'sources' caches they were computed from are:
+_RESTRICTED_RECIDS_CACHE = {'sources': None, 'hitsets': {}}
+
+## maximum number of hitsets in _RESTRICTED_RECIDS_CACHE:
+CFG_RESTRICTED_RECIDS_CACHE_SIZE = 1000
+
+def get_restricted_recids_not_permitted(permitted_restricted_collections, policy=None, recreate_cache_if_needed=True):
+    """
+    Return the set of the restricted recids that cannot be viewed by a
+    user permitted to view the restricted collections
+    PERMITTED_RESTRICTED_COLLECTIONS only (as returned e.g. by
+    get_permitted_restricted_collections()), according to the view
+    restriction POLICY ('ANY' or 'ALL', defaults to
+    CFG_WEBSEARCH_VIEWRESTRCOLL_POLICY).  Filtering search results by
+    user rights then boils down to one set difference.
+
+    The result is cached per set of permitted collections, i.e. it is
+    shared by the users having the same roles, until webcoll updates
+    the collection reclists or the access rights of the restricted
+    collections change.  It must not be modified.
+    """
+    if policy is None:
+        policy = CFG_WEBSEARCH_VIEWRESTRCOLL_POLICY
+    policy = policy.strip().upper()
+    if recreate_cache_if_needed:
+        restricted_collection_cache.recreate_cache_if_needed()
+        collection_reclist_cache.recreate_cache_if_needed()
+    sources = _RESTRICTED_RECIDS_CACHE['sources']
+    if sources is None or sources[0] is not restricted_collection_cache.cache or \
+           sources[1] is not collection_reclist_cache.cache:
+        # restricted collections or their reclists have changed:
+        _RESTRICTED_RECIDS_CACHE['sources'] = (restricted_collection_cache.cache,
+                                               collection_reclist_cache.cache)
+        _RESTRICTED_RECIDS_CACHE['hitsets'] = {}
+    hitsets = _RESTRICTED_RECIDS_CACHE['hitsets']
+    restricted_collections = restricted_collection_cache.cache
+    permitted = frozenset([collection for collection in permitted_restricted_collections
+                           if collection in restricted_collections])
+    key = (policy == 'ANY', permitted)
+    if key in hitsets:
+        return hitsets[key]
+    permitted_recids = intbitset()
+    notpermitted_recids = intbitset()
+    for collection in restricted_collections:
+        if collection in permitted:
+            permitted_recids |= get_collection_reclist(collection, recreate_cache_if_needed=False)
+        else:
+            notpermitted_recids |= get_collection_reclist(collection, recreate_cache_if_needed=False)
+    if policy == 'ANY':
+        # the user needs to have access to at least one collection
+        # that restricts the records
+        notpermitted_recids -= permitted_recids
+    if len(hitsets) >= CFG_RESTRICTED_RECIDS_CACHE_SIZE:
+        hitsets.clear()
+    hitsets[key] = notpermitted_recids
+    return notpermitted_recids
+
 def get_all_restricted_recids():
     """
     Return the set of all the restricted recids, i.e. the ids of those records
-    which belong to at least one restricted collection.
+    which belong to at least one restricted collection.  The set is
+    cached and must not be modified.
     """
-    ret = intbitset()
-    for collection in restricted_collection_cache.cache:
-        ret |= get_collection_reclist(collection)
-    return ret
+    return get_restricted_recids_not_permitted([])
 
 def get_restricted_collections_for_recid(recid, recreate_cache_if_needed=True):
     """
     Return the list of restricted collection names to which recid belongs.
     """
-    if recreate_cache_if_needed:
-        restricted_collection_cache.recreate_cache_if_needed()
-        collection_reclist_cache.recreate_cache_if_needed()
+    if recid not in get_restricted_recids_not_permitted([], recreate_cache_if_needed=recreate_cache_if_needed):
+        return []
     return [collection for collection in restricted_collection_cache.cache if recid in get_collection_reclist(collection, recreate_cache_if_needed=False)]
 
 def is_user_owner_of_record(user_info, recid):
@@ -373,6 +453,10 @@ def check_user_can_view_record(user_info, recid):
     policy = CFG_WEBSEARCH_VIEWRESTRCOLL_POLICY.strip().upper()
     if isinstance(recid, str):
         recid = int(recid)
+    if record_public_p(recid) and recid not in get_all_restricted_recids():
+        ## The record is public and not part of any restricted
+        ## collection, no need to look further
+        return (0, '')
     ## At this point, either webcoll has not yet run or there are some
     ## restricted collections. Let's see first if the user own the record.
     if is_user_owner_of_record(user_info, recid):
@@ -437,7 +521,7 @@ class IndexStemmingDataCacher(DataCacher):
             return dict(res)
 
         def timestamp_verifier():
-            return get_table_update_time('idxINDEX')
+            return get_table_version('idxINDEX')
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -453,6 +537,82 @@ def get_index_stemming_language(index_id, recreate_cache_if_needed=True):
     return index_stemming_cache.cache[index_id]
 
 
+class IndexLastUpdatedDataCacher(DataCacher):
+    """
+    Provides cache for last updated times of word/phrase indexes.
+    This class is not to be used directly; use function
+    get_index_last_updated() instead.
+    """
+    def __init__(self):
+        def cache_filler():
+            try:
+                res = run_sql("""SELECT id, last_updated FROM idxINDEX""")
+            except DatabaseError:
+                # database problems, return empty cache
+                return {}
+            return dict([(index_id, str(last_updated)) for index_id, last_updated in res])
+
+        def timestamp_verifier():
+            return get_table_version('idxINDEX')
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+try:
+    index_last_updated_cache.is_ok_p
+except Exception:
+    index_last_updated_cache = IndexLastUpdatedDataCacher()
+
+def get_index_last_updated(index_id, recreate_cache_if_needed=True):
+    """Return last updated time of given index as a string."""
+    if recreate_cache_if_needed:
+        index_last_updated_cache.recreate_cache_if_needed()
+    return index_last_updated_cache.cache.get(index_id, '')
+
+def fold_index_term(term):
+    """
+    Return TERM folded the way the DB collation of the index tables
+    compares terms (accents, case and trailing spaces), so that the
+    terms that a query may match with one another are recognised.
+    """
+    return strip_accents(term).lower().rstrip()
+
+def get_index_term_hitlists(table, index_id, terms):
+    """
+    Return list of (term, hitlist) tuples for TERMS found in the word,
+    pair or phrase index TABLE of index INDEX_ID, looking first into
+    the term hitlist cache shared by worker processes, if enabled.
+    The hitlists are intbitset dumps.  Note that, as for a plain SQL
+    query, the returned terms may differ from the asked ones as far as
+    the DB collation goes.
+    """
+    res = []
+    hitlist_cache = get_hitlist_cache()
+    if hitlist_cache:
+        stamp = get_index_last_updated(index_id)
+        missing_terms = []
+        for term in terms:
+            hitlist = hitlist_cache.get("%s:%s" % (table, term), stamp)
+            if hitlist is None:
+                missing_terms.append(term)
+            else:
+                res.append((term, hitlist))
+    else:
+        missing_terms = list(terms)
+    if not missing_terms:
+        return res
+    if len(missing_terms) == 1:
+        res_db = run_sql("SELECT term,hitlist FROM %s WHERE term=%%s" % table,
+                         (missing_terms[0],))
+    else:
+        res_db = run_sql("SELECT term,hitlist FROM %s WHERE term IN (%s)" %
+                         (table, ','.join(['%s'] * len(missing_terms))),
+                         tuple(missing_terms))
+    if hitlist_cache:
+        for term, hitlist in res_db:
+            if term in missing_terms:
+                hitlist_cache.set("%s:%s" % (table, term), stamp, hitlist)
+    return res + list(res_db)
+
 class FieldTokenizerDataCacher(DataCacher):
     """
     Provides cache for tokenizer information for fields corresponding to indexes.
@@ -469,7 +629,7 @@ class FieldTokenizerDataCacher(DataCacher):
             return dict(res)
 
         def timestamp_verifier():
-            return get_table_update_time('idxINDEX')
+            return get_table_version('idxINDEX')
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -504,7 +664,7 @@ class CollectionRecListDataCacher(DataCacher):
             return ret
 
         def timestamp_verifier():
-            return get_table_update_time('collection')
+            return get_table_version('collection')
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -534,6 +694,59 @@ def get_collection_reclist(coll, recreate_cache_if_needed=True):
     # finally, return reclist:
     return collection_reclist_cache.cache[coll]
 
+class CollectionMembershipIndexDataCacher(DataCacher):
+    """
+    Provides cache for the index of the collections every record
+    belongs to, as built by webcoll.  This class is not to be used
+    directly; use function get_collection_membership_index() instead.
+    """
+    def __init__(self):
+        def cache_filler():
+            if not CFG_WEBSEARCH_COLLECTION_INDEX_THRESHOLD:
+                return None
+            index = load_collection_membership_index()
+            if index is not None and index.stamp < get_table_version('collection'):
+                # reclists were updated after the index was built
+                return None
+            return index
+
+        def timestamp_verifier():
+            return get_table_version('collection')
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+try:
+    if not collection_membership_index_cache.is_ok_p:
+        raise Exception
+except Exception:
+    collection_membership_index_cache = CollectionMembershipIndexDataCacher()
+
+def get_collection_membership_index():
+    """
+    Return index of the collections every record belongs to, or None
+    if it is not available or not up to date with the reclists.
+    """
+    collection_membership_index_cache.recreate_cache_if_needed()
+    return collection_membership_index_cache.cache
+
+def split_hitset_into_collections(hitset, colls):
+    """
+    Return dict of hitsets given by intersection of 'hitset' with the
+    reclists of collections 'colls'.  When there are many
+    collections, the collection membership index is used to intersect
+    the hitset with the records of every distinct set of collections
+    instead of with every reclist, if there are fewer such sets.
+    """
+    if CFG_WEBSEARCH_COLLECTION_INDEX_THRESHOLD and \
+           len(colls) >= CFG_WEBSEARCH_COLLECTION_INDEX_THRESHOLD:
+        index = get_collection_membership_index()
+        if index is not None and index.get_nb_classes(colls) < len(colls):
+            return index.split(hitset, colls)
+    results = {}
+    for coll in colls:
+        results[coll] = hitset & get_collection_reclist(coll)
+    return results
+
 def get_available_output_formats(visible_only=False):
     """
     Return the list of available output formats.  When visible_only is
@@ -559,26 +772,10 @@ def get_available_output_formats(visible_only=False):
                        })
     return formats
 
-class SearchResultsCache(DataCacher):
-    """
-    Provides temporary lazy cache for Search Results.
-    Useful when users click on `next page'.
-    """
-    def __init__(self):
-        def cache_filler():
-            return {}
-
-        def timestamp_verifier():
-            return '1970-01-01 00:00:00' # lazy cache is always okay;
-                                         # its filling is governed by
-                                         # CFG_WEBSEARCH_SEARCH_CACHE_SIZE
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
-
 try:
-    if not search_results_cache.is_ok_p:
-        raise Exception
+    search_results_cache is not None
 except Exception:
-    search_results_cache = SearchResultsCache()
+    search_results_cache = create_search_results_cache()
 
 class CollectionI18nNameDataCacher(DataCacher):
     """
@@ -601,7 +798,7 @@ class CollectionI18nNameDataCacher(DataCacher):
             return ret
 
         def timestamp_verifier():
-            return get_table_update_time('collectionname')
+            return get_table_version('collectionname')
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -658,7 +855,7 @@ class FieldI18nNameDataCacher(DataCacher):
             return ret
 
         def timestamp_verifier():
-            return get_table_update_time('fieldname')
+            return get_table_version('fieldname')
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -767,6 +964,7 @@ def get_words_from_pattern(pattern):
             words[word] = 1
     return words.keys()
 
+@trace_stage('create_basic_search_units')
 def create_basic_search_units(req, p, f, m=None, of='hb'):
     """Splits search pattern and search field into a list of independently searchable units.
        - A search unit consists of '(operator, pattern, field, type, hitset)' tuples where
@@ -1660,6 +1858,7 @@ def wash_colls(cc, c, split_colls=0, verbose=0):
 
     return (cc, colls_out_for_display, colls_out, hosted_colls_out, debug)
 
+@trace_stage('get_synonym_terms')
 def get_synonym_terms(term, kbr_name, match_type, use_memoise=False):
     """
     Return list of synonyms for TERM by looking in KBR_NAME in
@@ -1931,7 +2130,7 @@ class CollectionAllChildrenDataCacher(DataCacher):
             return ret
 
         def timestamp_verifier():
-            return max(get_table_update_time('collection'), get_table_update_time('collection_collection'))
+            return max(get_table_version('collection'), get_table_version('collection_collection'))
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -2067,6 +2266,7 @@ def browse_in_bibwords(req, p, f, ln=CFG_SITE_LANG):
     ))
     return
 
+@trace_stage('search_pattern')
 def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True, wl=0):
     """Search for complex pattern 'p' within field 'f' according to
        matching type 'm'.  Return hitset of recIDs.
@@ -2115,10 +2315,16 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
         t2 = os.times()[4]
         write_warning("Search stage 1: basic search units are: %s" % cgi.escape(repr(basic_search_units)), req=req)
         write_warning("Search stage 1: execution took %.2f seconds." % (t2 - t1), req=req)
-    # search stage 2: do search for each search unit and verify hit presence:
+    # search stage 2: do search for each search unit and verify hit
+    # presence; search stage 3: apply boolean query for each search
+    # unit.  Both are done together, the units being evaluated in the
+    # order given by the query planner, so that the most selective
+    # ones are run first:
     if verbose and of.startswith("h"):
         t1 = os.times()[4]
-    basic_search_units_hitsets = []
+    basic_search_units_hitsets = [None] * len(basic_search_units)
+    # units whose hitset was restricted to the running results:
+    restricted_units = set()
     #prepare hiddenfield-related..
     myhiddens = CFG_BIBFORMAT_HIDDEN_TAGS
     can_see_hidden = False
@@ -2140,8 +2346,9 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
                           {'x_range_from_year': '2008',
                            'x_range_to_year': '2012'}, req=req)
 
-    for idx_unit in xrange(len(basic_search_units)):
-        bsu_o, bsu_p, bsu_f, bsu_m = basic_search_units[idx_unit]
+    # wash fields and matching types of the units:
+    washed_search_units = []
+    for bsu_o, bsu_p, bsu_f, bsu_m in basic_search_units:
         if bsu_f and len(bsu_f) < 2:
             if of.startswith("h"):
                 write_warning(_("There is no index %s.  Searching for %s in all fields." % (bsu_f, bsu_p)), req=req)
@@ -2149,59 +2356,125 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
             bsu_m = 'w'
             if of.startswith("h") and verbose:
                 write_warning(_('Instead searching %s.' % str([bsu_o, bsu_p, bsu_f, bsu_m])), req=req)
-        try:
-            basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl)
-        except InvenioWebSearchWildcardLimitError, excp:
-            basic_search_unit_hitset = excp.res
-            if of.startswith("h"):
-                write_warning(_("Search term too generic, displaying only partial results..."), req=req)
-        # FIXME: print warning if we use native full-text indexing
-        if bsu_f == 'fulltext' and bsu_m != 'w' and of.startswith('h') and not CFG_SOLR_URL:
-            write_warning(_("No phrase index available for fulltext yet, looking for word combination..."), req=req)
-        #check that the user is allowed to search with this tag
-        #if he/she tries it
-        if bsu_f and len(bsu_f) > 1 and bsu_f[0].isdigit() and bsu_f[1].isdigit():
-            for htag in myhiddens:
-                ltag = len(htag)
-                samelenfield = bsu_f[0:ltag]
-                if samelenfield == htag: #user searches by a hidden tag
-                    #we won't show you anything..
-                    basic_search_unit_hitset = intbitset()
-                    if verbose >= 9 and of.startswith("h"):
-                        write_warning("Pattern %s hitlist omitted since \
-                                            it queries in a hidden tag %s" %
-                                      (cgi.escape(repr(bsu_p)), repr(myhiddens)), req=req)
-                    display_nearest_terms_box = False #..and stop spying, too.
-        if verbose >= 9 and of.startswith("h"):
-            write_warning("Search stage 1: pattern %s gave hitlist %s" % (cgi.escape(bsu_p), basic_search_unit_hitset), req=req)
-        if len(basic_search_unit_hitset) > 0 or \
-           ap<1 or \
-           bsu_o in ("|", "-") or \
-           ((idx_unit+1)<len(basic_search_units) and basic_search_units[idx_unit+1][0]=="|"):
-            # stage 2-1: this basic search unit is retained, since
-            # either the hitset is non-empty, or the approximate
-            # pattern treatment is switched off, or the search unit
-            # was joined by an OR operator to preceding/following
-            # units so we do not require that it exists
-            basic_search_units_hitsets.append(basic_search_unit_hitset)
+        washed_search_units.append([bsu_o, bsu_p, bsu_f, bsu_m])
+
+    # prefetch hitsets of exact word units, one query per word index,
+    # so that their sizes are known to the query planner:
+    bibwords_bulk_hitsets = search_units_in_bibwords_bulk(washed_search_units, min_words=1)
+    if verbose >= 9 and of.startswith("h") and bibwords_bulk_hitsets:
+        write_warning("Search stage 2: prefetched exact words %s in bulk." %
+                      cgi.escape(repr(dict([(bsu_f, bulk_hitsets.keys()) for bsu_f, bulk_hitsets in bibwords_bulk_hitsets.iteritems()]))), req=req)
+
+    # plan the order of evaluation of the units:
+    estimates = []
+    for dummy_bsu_o, bsu_p, bsu_f, bsu_m in washed_search_units:
+        if bsu_m == 'w' and bsu_p in bibwords_bulk_hitsets.get(bsu_f, {}):
+            estimates.append((CFG_SEARCH_UNIT_COST_KNOWN,
+                              len(bibwords_bulk_hitsets[bsu_f][bsu_p])))
         else:
-            # stage 2-2: no hits found for this search unit, try to replace non-alphanumeric chars inside pattern:
-            if re.search(r'[^a-zA-Z0-9\s\:]', bsu_p) and bsu_f != 'refersto' and bsu_f != 'citedby':
-                if bsu_p.startswith('"') and bsu_p.endswith('"'): # is it ACC query?
-                    bsu_pn = re.sub(r'[^a-zA-Z0-9\s\:]+', "*", bsu_p)
-                else: # it is WRD query
-                    bsu_pn = re.sub(r'[^a-zA-Z0-9\s\:]+', " ", bsu_p)
-                if verbose and of.startswith('h') and req:
-                    write_warning("Trying (%s,%s,%s)" % (cgi.escape(bsu_pn), cgi.escape(bsu_f), cgi.escape(bsu_m)), req=req)
-                basic_search_unit_hitset = search_pattern(req=None, p=bsu_pn, f=bsu_f, m=bsu_m, of="id", ln=ln, wl=wl)
-                if len(basic_search_unit_hitset) > 0:
-                    # we retain the new unit instead
-                    if of.startswith('h'):
-                        write_warning(_("No exact match found for %(x_query1)s, using %(x_query2)s instead...") %
-                                      {'x_query1': "<em>" + cgi.escape(bsu_p) + "</em>",
-                                       'x_query2': "<em>" + cgi.escape(bsu_pn) + "</em>"}, req=req)
-                    basic_search_units[idx_unit][1] = bsu_pn
-                    basic_search_units_hitsets.append(basic_search_unit_hitset)
+            estimates.append((get_search_unit_cost(bsu_p, bsu_f, bsu_m), None))
+    search_plan = plan_search_units([unit[0] for unit in washed_search_units], estimates)
+    if verbose >= 9 and of.startswith("h"):
+        write_warning("Search stage 2: evaluation plan is %s." % cgi.escape(repr(search_plan)), req=req)
+
+    # let the initial set be the complete universe:
+    hitset_in_any_collection = intbitset(trailing_bits=1)
+    hitset_in_any_collection.discard(0)
+    hitset_in_any_collection_is_universe = True
+
+    search_trace = get_current_search_trace()
+    for search_plan_segment in search_plan:
+        for idx_unit in search_plan_segment:
+            bsu_o, bsu_p, bsu_f, bsu_m = washed_search_units[idx_unit]
+            restriction = None
+            if bsu_o in ("+", "-") and not hitset_in_any_collection_is_universe:
+                if not hitset_in_any_collection:
+                    # the rest of the segment cannot change the results:
+                    break
+                if len(hitset_in_any_collection) <= CFG_WEBSEARCH_SEARCH_UNIT_RESTRICTION_LIMIT:
+                    restriction = hitset_in_any_collection
+            if search_trace is not None:
+                unit_start_time = time.time()
+            try:
+                if bsu_m == 'w' and bsu_p in bibwords_bulk_hitsets.get(bsu_f, {}):
+                    basic_search_unit_hitset = bibwords_bulk_hitsets[bsu_f][bsu_p]
+                    restriction = None
+                else:
+                    basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl,
+                                                           restriction=restriction)
+                    if restriction is not None and not basic_search_unit_hitset and \
+                       ap >= 1 and bsu_o == "+":
+                        # the unit may exist outside of the running
+                        # results, which matters for the approximate
+                        # pattern treatment below:
+                        restriction = None
+                        basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl)
+            except InvenioWebSearchWildcardLimitError, excp:
+                basic_search_unit_hitset = excp.res
+                if of.startswith("h"):
+                    write_warning(_("Search term too generic, displaying only partial results..."), req=req)
+            if search_trace is not None:
+                search_trace.add_search_unit(bsu_o, bsu_p, bsu_f, bsu_m,
+                                             len(basic_search_unit_hitset),
+                                             time.time() - unit_start_time)
+            if restriction is not None:
+                restricted_units.add(idx_unit)
+            # FIXME: print warning if we use native full-text indexing
+            if bsu_f == 'fulltext' and bsu_m != 'w' and of.startswith('h') and not CFG_SOLR_URL:
+                write_warning(_("No phrase index available for fulltext yet, looking for word combination..."), req=req)
+            #check that the user is allowed to search with this tag
+            #if he/she tries it
+            if bsu_f and len(bsu_f) > 1 and bsu_f[0].isdigit() and bsu_f[1].isdigit():
+                for htag in myhiddens:
+                    ltag = len(htag)
+                    samelenfield = bsu_f[0:ltag]
+                    if samelenfield == htag: #user searches by a hidden tag
+                        #we won't show you anything..
+                        basic_search_unit_hitset = intbitset()
+                        if verbose >= 9 and of.startswith("h"):
+                            write_warning("Pattern %s hitlist omitted since \
+                                                it queries in a hidden tag %s" %
+                                          (cgi.escape(repr(bsu_p)), repr(myhiddens)), req=req)
+                        display_nearest_terms_box = False #..and stop spying, too.
+            if verbose >= 9 and of.startswith("h"):
+                write_warning("Search stage 1: pattern %s gave hitlist %s" % (cgi.escape(bsu_p), basic_search_unit_hitset), req=req)
+            if len(basic_search_unit_hitset) > 0 or \
+               ap<1 or \
+               bsu_o in ("|", "-") or \
+               ((idx_unit+1)<len(basic_search_units) and basic_search_units[idx_unit+1][0]=="|"):
+                # stage 2-1: this basic search unit is retained, since
+                # either the hitset is non-empty, or the approximate
+                # pattern treatment is switched off, or the search unit
+                # was joined by an OR operator to preceding/following
+                # units so we do not require that it exists
+                basic_search_units_hitsets[idx_unit] = basic_search_unit_hitset
+            else:
+                # stage 2-2: no hits found for this search unit, try to replace non-alphanumeric chars inside pattern:
+                if re.search(r'[^a-zA-Z0-9\s\:]', bsu_p) and bsu_f != 'refersto' and bsu_f != 'citedby':
+                    if bsu_p.startswith('"') and bsu_p.endswith('"'): # is it ACC query?
+                        bsu_pn = re.sub(r'[^a-zA-Z0-9\s\:]+', "*", bsu_p)
+                    else: # it is WRD query
+                        bsu_pn = re.sub(r'[^a-zA-Z0-9\s\:]+', " ", bsu_p)
+                    if verbose and of.startswith('h') and req:
+                        write_warning("Trying (%s,%s,%s)" % (cgi.escape(bsu_pn), cgi.escape(bsu_f), cgi.escape(bsu_m)), req=req)
+                    basic_search_unit_hitset = search_pattern(req=None, p=bsu_pn, f=bsu_f, m=bsu_m, of="id", ln=ln, wl=wl)
+                    if len(basic_search_unit_hitset) > 0:
+                        # we retain the new unit instead
+                        if of.startswith('h'):
+                            write_warning(_("No exact match found for %(x_query1)s, using %(x_query2)s instead...") %
+                                          {'x_query1': "<em>" + cgi.escape(bsu_p) + "</em>",
+                                           'x_query2': "<em>" + cgi.escape(bsu_pn) + "</em>"}, req=req)
+                        basic_search_units[idx_unit][1] = bsu_pn
+                        basic_search_units_hitsets[idx_unit] = basic_search_unit_hitset
+                    else:
+                        # stage 2-3: no hits found either, propose nearest indexed terms:
+                        if of.startswith('h') and display_nearest_terms_box:
+                            if req:
+                                if bsu_f == "recid":
+                                    write_warning(_("Requested record does not seem to exist."), req=req)
+                                else:
+                                    write_warning(create_nearest_terms_box(req.argd, bsu_p, bsu_f, bsu_m, ln=ln), req=req)
+                        return hitset_empty
                 else:
                     # stage 2-3: no hits found either, propose nearest indexed terms:
                     if of.startswith('h') and display_nearest_terms_box:
@@ -2211,39 +2484,32 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
                             else:
                                 write_warning(create_nearest_terms_box(req.argd, bsu_p, bsu_f, bsu_m, ln=ln), req=req)
                     return hitset_empty
+            # apply the boolean operation of the unit:
+            this_unit_hitset = basic_search_units_hitsets[idx_unit]
+            if bsu_o == '+':
+                hitset_in_any_collection.intersection_update(this_unit_hitset)
+                hitset_in_any_collection_is_universe = False
+            elif bsu_o == '-':
+                hitset_in_any_collection.difference_update(this_unit_hitset)
+            elif bsu_o == '|':
+                hitset_in_any_collection.union_update(this_unit_hitset)
             else:
-                # stage 2-3: no hits found either, propose nearest indexed terms:
-                if of.startswith('h') and display_nearest_terms_box:
-                    if req:
-                        if bsu_f == "recid":
-                            write_warning(_("Requested record does not seem to exist."), req=req)
-                        else:
-                            write_warning(create_nearest_terms_box(req.argd, bsu_p, bsu_f, bsu_m, ln=ln), req=req)
-                return hitset_empty
+                if of.startswith("h"):
+                    write_warning("Invalid set operation %s." % cgi.escape(bsu_o), "Error", req=req)
     if verbose and of.startswith("h"):
         t2 = os.times()[4]
         for idx_unit in range(0, len(basic_search_units)):
-            write_warning("Search stage 2: basic search unit %s gave %d hits." %
-                          (basic_search_units[idx_unit][1:], len(basic_search_units_hitsets[idx_unit])), req=req)
-        write_warning("Search stage 2: execution took %.2f seconds." % (t2 - t1), req=req)
-    # search stage 3: apply boolean query for each search unit:
-    if verbose and of.startswith("h"):
+            if basic_search_units_hitsets[idx_unit] is None:
+                write_warning("Search stage 2: basic search unit %s was not needed." %
+                              (basic_search_units[idx_unit][1:],), req=req)
+            elif idx_unit in restricted_units:
+                write_warning("Search stage 2: basic search unit %s gave %d hits among the previous results." %
+                              (basic_search_units[idx_unit][1:], len(basic_search_units_hitsets[idx_unit])), req=req)
+            else:
+                write_warning("Search stage 2: basic search unit %s gave %d hits." %
+                              (basic_search_units[idx_unit][1:], len(basic_search_units_hitsets[idx_unit])), req=req)
+        write_warning("Search stage 2+3: execution took %.2f seconds." % (t2 - t1), req=req)
         t1 = os.times()[4]
-    # let the initial set be the complete universe:
-    hitset_in_any_collection = intbitset(trailing_bits=1)
-    hitset_in_any_collection.discard(0)
-    for idx_unit in xrange(len(basic_search_units)):
-        this_unit_operation = basic_search_units[idx_unit][0]
-        this_unit_hitset = basic_search_units_hitsets[idx_unit]
-        if this_unit_operation == '+':
-            hitset_in_any_collection.intersection_update(this_unit_hitset)
-        elif this_unit_operation == '-':
-            hitset_in_any_collection.difference_update(this_unit_hitset)
-        elif this_unit_operation == '|':
-            hitset_in_any_collection.union_update(this_unit_hitset)
-        else:
-            if of.startswith("h"):
-                write_warning("Invalid set operation %s." % cgi.escape(this_unit_operation), "Error", req=req)
     if len(hitset_in_any_collection) == 0:
         # no hits found, propose alternative boolean query:
         if of.startswith('h') and display_nearest_terms_box:
@@ -2252,7 +2518,16 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
                 bsu_o, bsu_p, bsu_f, bsu_m = basic_search_units[idx_unit]
                 if bsu_p.startswith("%") and bsu_p.endswith("%"):
                     bsu_p = "'" + bsu_p[1:-1] + "'"
-                bsu_nbhits = len(basic_search_units_hitsets[idx_unit])
+                bsu_hitset = basic_search_units_hitsets[idx_unit]
+                if bsu_hitset is None or idx_unit in restricted_units:
+                    # the unit was skipped or restricted by the query
+                    # planner, so let us search it on its own:
+                    dummy_o, washed_p, washed_f, washed_m = washed_search_units[idx_unit]
+                    try:
+                        bsu_hitset = search_unit(washed_p, washed_f, washed_m, wl)
+                    except InvenioWebSearchWildcardLimitError, excp:
+                        bsu_hitset = excp.res
+                bsu_nbhits = len(bsu_hitset)
 
                 # create a similar query, but with the basic search unit only
                 argd = {}
@@ -2346,7 +2621,8 @@ def search_pattern_parenthesised(req=None, p=None, f=None, m=None, ap=0, of="id"
         return search_pattern(req, p, f, m, ap, of, verbose, ln, display_nearest_terms_box=display_nearest_terms_box, wl=wl)
 
 
-def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
+@trace_stage('search_unit')
+def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None, restriction=None):
     """Search for basic search unit defined by pattern 'p' and field
        'f' and matching type 'm'.  Return hitset of recIDs.
 
@@ -2368,6 +2644,12 @@ def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
        Parameter 'ignore_synonyms' is a list of terms for which we
        should not try to further find a synonym.
 
+       Parameter 'restriction' is an optional hitset of the only
+       records the caller is interested in.  Searches that scan
+       record values or dates are then restricted to these records,
+       other searches ignore it, so that the returned hitset may or
+       may not be limited to 'restriction'.
+
        This function is suitable as a low-level API.
     """
 
@@ -2397,7 +2679,7 @@ def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
             if p_synonym != p and \
                    not p_synonym in ignore_synonyms:
                 hitset_synonyms |= search_unit(p_synonym, f, m, wl,
-                                               ignore_synonyms)
+                                               ignore_synonyms, restriction)
 
     ## look up hits:
     if f == 'fulltext' and get_idx_indexer('fulltext') == 'SOLR' and CFG_SOLR_URL:
@@ -2423,9 +2705,9 @@ def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
             register_exception()
             return hitset
     if f == 'datecreated':
-        hitset = search_unit_in_bibrec(p, p, 'c')
+        hitset = search_unit_in_bibrec(p, p, 'c', restriction)
     elif f == 'datemodified':
-        hitset = search_unit_in_bibrec(p, p, 'm')
+        hitset = search_unit_in_bibrec(p, p, 'm', restriction)
     elif f == 'refersto':
         # we are doing search by the citation count
         hitset = search_unit_refersto(p)
@@ -2458,7 +2740,7 @@ def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
             else:
                 hitset = search_unit_in_idxphrases(p, f, m, wl)
         else:
-            hitset = search_unit_in_bibxxx(p, f, m, wl)
+            hitset = search_unit_in_bibxxx(p, f, m, wl, restriction)
             # if not hitset and m == 'a' and (p[0] != '%' and p[-1] != '%'):
             #     #if we have no results by doing exact matching, do partial matching
             #     #for removing the distinction between simple and double quotes
@@ -2563,8 +2845,8 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
                     res = excp.res
                     limit_reached = 1 # set the limit reached flag to true
         else:
-            res = run_sql("SELECT term,hitlist FROM %s WHERE term=%%s" % bibwordsX,
-                          (wash_index_term(word),))
+            res = get_index_term_hitlists(bibwordsX, index_id,
+                                          [wash_index_term(word)])
     # fill the result set:
     for word, hitlist in res:
         hitset_bibwrd = intbitset(hitlist)
@@ -2581,6 +2863,141 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
     # okay, return result set:
     return hitset
 
+def is_search_unit_exact_bibwords_p(p, f, m):
+    """
+    Return True if the basic search unit defined by pattern 'p', field
+    'f' and matching type 'm' would be answered by search_unit() by
+    looking up exactly one term in the bibwordsX table, i.e. without
+    wildcards, spans, synonyms, CJK tokenization, citation/date
+    special fields or external full-text engines.  Such units can be
+    fetched in bulk via search_units_in_bibwords_bulk().
+    """
+    if m != 'w' or not p:
+        return False
+    if f and len(f) < 2:
+        return False
+    if f in ('datecreated', 'datemodified', 'refersto',
+             'referstoexcludingselfcites', 'cataloguer', 'rawref',
+             'citedby', 'citedbyexcludingselfcites', 'subject'):
+        return False
+    if f == 'fulltext' and \
+           ((get_idx_indexer('fulltext') == 'SOLR' and CFG_SOLR_URL) or
+            (get_idx_indexer('fulltext') == 'XAPIAN' and CFG_XAPIAN_ENABLED)):
+        return False
+    if p.startswith("cited:") or p.startswith("citedexcludingselfcites:"):
+        return False
+    if '*' in p or '%' in p or '->' in p:
+        return False
+    if f and f.endswith('count') and p.endswith('+'):
+        return False
+    if CFG_WEBSEARCH_SYNONYM_KBRS.has_key(f or 'anyfield'):
+        return False
+    if get_field_tokenizer_type(f) == "BibIndexCJKTokenizer" and \
+           is_there_any_CJK_character_in_text(p):
+        return False
+    return True
+
+def get_search_unit_cost(p, f, m):
+    """
+    Return estimated cost of the search of the basic search unit
+    defined by pattern 'p', field 'f' and matching type 'm' via
+    search_unit(), as one of the CFG_SEARCH_UNIT_COST_* values of the
+    query planner.
+    """
+    if f in ('refersto', 'referstoexcludingselfcites', 'citedby',
+             'citedbyexcludingselfcites', 'cataloguer', 'rawref') or \
+           p.startswith("cited:") or p.startswith("citedexcludingselfcites:"):
+        return CFG_SEARCH_UNIT_COST_SUBQUERY
+    if f == 'fulltext' and \
+           ((get_idx_indexer('fulltext') == 'SOLR' and CFG_SOLR_URL) or
+            (get_idx_indexer('fulltext') == 'XAPIAN' and CFG_XAPIAN_ENABLED)):
+        return CFG_SEARCH_UNIT_COST_SUBQUERY
+    if f in ('datecreated', 'datemodified'):
+        return CFG_SEARCH_UNIT_COST_SCAN
+    if (m == 'a' or m == 'r' or f == 'subject') and f != 'fulltext' and \
+           not get_index_id_from_field(f):
+        return CFG_SEARCH_UNIT_COST_SCAN
+    return CFG_SEARCH_UNIT_COST_INDEX
+
+@trace_stage('search_unit')
+def search_units_in_bibwords_bulk(basic_search_units, decompress=zlib.decompress, min_words=2):
+    """
+    Look up all exact word units of BASIC_SEARCH_UNITS (as returned
+    by create_basic_search_units()) in their bibwordsX tables, issuing
+    only one 'term IN (...)' query per index instead of one query per
+    word.  Only indexes queried for at least MIN_WORDS exact words are
+    prefetched.  The lookup is traced as a 'search_unit' stage, like
+    the search_unit() calls it replaces.
+
+    Return dictionary {field: {word: hitset}} where words that are
+    not indexed are mapped to empty hitsets.  Units that are not
+    exact word units (see is_search_unit_exact_bibwords_p()) are not
+    present in the output and have to be searched via search_unit().
+    """
+    words_by_field = {}
+    for dummy_bsu_o, bsu_p, bsu_f, bsu_m in basic_search_units:
+        if is_search_unit_exact_bibwords_p(bsu_p, bsu_f, bsu_m):
+            words = words_by_field.setdefault(bsu_f, [])
+            if bsu_p not in words:
+                words.append(bsu_p)
+    out = {}
+    for f, words in words_by_field.iteritems():
+        if len(words) >= min_words:
+            out[f] = search_unit_in_bibwords_bulk(words, f, decompress)
+    return out
+
+def search_unit_in_bibwords_bulk(words, f, decompress=zlib.decompress):
+    """
+    Searches for exact 'words' inside bibwordsX table for field 'f'
+    via one query and returns dictionary {word: hitset of recIDs}.
+    Words not present in the index are mapped to empty hitsets.
+
+    Unlike search_unit_in_bibwords(), the words must not contain
+    truncation characters or span operators.
+    """
+    out = {}
+    for word in words:
+        out[word] = intbitset()
+    # if no field is specified, search in the global index.
+    f = f or 'anyfield'
+    index_id = get_index_id_from_field(f)
+    if not index_id or not words:
+        return out # word index f does not exist
+    bibwordsX = "idxWORD%02dF" % index_id
+    stemming_language = get_index_stemming_language(index_id)
+
+    # wash 'words' the same way search_unit_in_bibwords() does for
+    # exact words; several words may wash to the same term:
+    words_by_term = {}
+    for word in words:
+        term = word
+        if f != 'journal': # FIXME: quick hack for the journal index
+            term = re_word.sub('', term)
+        if stemming_language:
+            term = stem(lower_index_term(term), stemming_language)
+        words_by_term.setdefault(wash_index_term(term), []).append(word)
+
+    terms = words_by_term.keys()
+    res = get_index_term_hitlists(bibwordsX, index_id, terms)
+    unmatched_terms = set(terms)
+    returned_terms = set()
+    for term, hitlist in res:
+        returned_terms.add(fold_index_term(term))
+        if term in words_by_term:
+            unmatched_terms.discard(term)
+            for word in words_by_term[term]:
+                out[word] = intbitset(hitlist)
+    # the DB collation may match some terms differently than the
+    # plain string comparison above (e.g. accents), even with a row
+    # another term matched exactly (e.g. the same word with and without
+    # accents), so let us look up these words individually:
+    collated = len(res) > len(terms) - len(unmatched_terms)
+    for term in unmatched_terms:
+        if collated or fold_index_term(term) in returned_terms:
+            for word in words_by_term[term]:
+                out[word] = search_unit_in_bibwords(word, f, decompress)
+    return out
+
 def search_unit_in_idxpairs(p, f, search_type, wl=0):
     """Searches for pair 'p' inside idxPAIR table for field 'f' and
     returns hitset of recIDs found."""
@@ -2667,8 +3084,8 @@ def search_unit_in_idxpairs(p, f, search_type, wl=0):
                 res = excp.res
                 limit_reached = 1 # set the limit reached flag to true
         else:
-            res = run_sql("SELECT term, hitlist FROM %s WHERE term %s"
-                      % (idxpair_table_washed, query_addons), query_params) #kwalitee:disable=sql
+            res = get_index_term_hitlists(idxpair_table_washed, index_id,
+                                          query_params)
         if not res:
             return intbitset()
         for pair, hitlist in res:
@@ -2691,7 +3108,7 @@ def search_unit_in_idxpairs(p, f, search_type, wl=0):
         for recid in result_set:
             res = run_sql("SELECT termlist FROM %s WHERE id_bibrec %s" %(idxphrase_table_washed, '=%s'), (recid, )) #kwalitee:disable=sql
             if res:
-                termlist = deserialize_via_marshal(res[0][0])
+                termlist = deserialize_termlist(res[0][0])
                 if not [term for term in termlist if term.lower().find(p.lower()) > -1]:
                     not_exact_search.add(recid)
             else:
@@ -2701,6 +3118,77 @@ def search_unit_in_idxpairs(p, f, search_type, wl=0):
     return result_set
 
 
+def is_search_unit_exact_idxphrases_p(p, f, m):
+    """
+    Return True if the basic search unit defined by pattern 'p', field
+    'f' and matching type 'm' would be answered by search_unit() by
+    looking up exactly one phrase in the idxPHRASE table of 'f', i.e.
+    without truncation, spans, synonyms, CJK tokenization, author name
+    washing, pair tables or special fields.  Such units can be fetched
+    in bulk via search_unit_in_idxphrases_bulk().
+    """
+    if m != 'a' or not p or not f or len(f) < 2:
+        return False
+    if f[0].isdigit() and f[1].isdigit():
+        # MARC tags may be hidden tags, see search_pattern()
+        return False
+    if f in ('datecreated', 'datemodified', 'refersto',
+             'referstoexcludingselfcites', 'cataloguer', 'rawref',
+             'citedby', 'citedbyexcludingselfcites', 'fulltext',
+             'author', 'firstauthor', 'exactauthor', 'exactfirstauthor',
+             'authorityauthor') or f.endswith('count'):
+        return False
+    if p.startswith("cited:") or p.startswith("citedexcludingselfcites:"):
+        return False
+    if '*' in p or '%' in p or '->' in p:
+        return False
+    if CFG_WEBSEARCH_SYNONYM_KBRS.has_key(f):
+        return False
+    if get_field_tokenizer_type(f) == "BibIndexCJKTokenizer" and \
+           is_there_any_CJK_character_in_text(p):
+        return False
+    index_id = get_index_id_from_field(f)
+    if not index_id or index_id in get_idxpair_field_ids():
+        return False
+    return True
+
+def search_unit_in_idxphrases_bulk(phrases, f):
+    """
+    Searches for exact 'phrases' inside idxPHRASE*F table for field
+    'f' via one query and returns dictionary {phrase: hitset of
+    recIDs}.  Phrases not present in the index are mapped to empty
+    hitsets.
+
+    The phrases must be exact phrase units, see
+    is_search_unit_exact_idxphrases_p().
+    """
+    out = {}
+    for phrase in phrases:
+        out[phrase] = intbitset()
+    index_id = get_index_id_from_field(f)
+    if not index_id or not phrases:
+        return out # phrase index f does not exist
+    idxphraseX = "idxPHRASE%02dF" % index_id
+    res = get_index_term_hitlists(idxphraseX, index_id, out.keys())
+    unmatched_phrases = set(out)
+    returned_terms = set()
+    collated = False
+    for term, hitlist in res:
+        returned_terms.add(fold_index_term(term))
+        if term in out:
+            unmatched_phrases.discard(term)
+            out[term] = intbitset(hitlist)
+        else:
+            collated = True
+    # the DB collation may match some phrases with other terms than
+    # the plain string comparison above (e.g. case or accents), even
+    # with a row another phrase matched exactly (e.g. "Foo" and "foo"),
+    # so let us look up these phrases individually:
+    for phrase in unmatched_phrases:
+        if collated or fold_index_term(phrase) in returned_terms:
+            out[phrase] = search_unit_in_idxphrases(phrase, f, 'a')
+    return out
+
 def search_unit_in_idxphrases(p, f, search_type, wl=0):
     """Searches for phrase 'p' inside idxPHRASE*F table for field 'f' and returns hitset of recIDs found.
     The search type is defined by 'type' (e.g. equals to 'r' for a regexp search)."""
@@ -2712,7 +3200,8 @@ def search_unit_in_idxphrases(p, f, search_type, wl=0):
     limit_reached = 0 # flag for knowing if the query limit has been reached
     use_query_limit = False # flag for knowing if to limit the query results or not
     # deduce in which idxPHRASE table we will search:
-    idxphraseX = "idxPHRASE%02dF" % get_index_id_from_field("anyfield")
+    index_id = get_index_id_from_field("anyfield")
+    idxphraseX = "idxPHRASE%02dF" % index_id
     if f:
         index_id = get_index_id_from_field(f)
         if index_id:
@@ -2755,7 +3244,7 @@ def search_unit_in_idxphrases(p, f, search_type, wl=0):
             res = excp.res
             limit_reached = 1 # set the limit reached flag to true
     else:
-        res = run_sql("SELECT term,hitlist FROM %s WHERE term %s" % (idxphraseX, query_addons), query_params)
+        res = get_index_term_hitlists(idxphraseX, index_id, query_params)
     # fill the result set:
     for dummy_word, hitlist in res:
         hitset_bibphrase = intbitset(hitlist)
@@ -2772,9 +3261,10 @@ def search_unit_in_idxphrases(p, f, search_type, wl=0):
     # okay, return result set:
     return hitset
 
-def search_unit_in_bibxxx(p, f, type, wl=0):
+def search_unit_in_bibxxx(p, f, type, wl=0, restriction=None):
     """Searches for pattern 'p' inside bibxxx tables for field 'f' and returns hitset of recIDs found.
-    The search type is defined by 'type' (e.g. equals to 'r' for a regexp search)."""
+    The search type is defined by 'type' (e.g. equals to 'r' for a regexp search).
+    If the hitset 'restriction' is given, only its records are searched."""
 
     # call word search method in some cases:
     if f == 'journal' or f.endswith('count'):
@@ -2815,6 +3305,12 @@ def search_unit_in_bibxxx(p, f, type, wl=0):
         if not tl:
             # f index does not exist, nevermind
             pass
+    # restrict the search to the given records, if any:
+    restriction_ids = ''
+    if restriction is not None:
+        if not restriction:
+            return intbitset()
+        restriction_ids = ','.join([str(recid) for recid in restriction])
     # okay, start search:
     l = [] # will hold list of recID that matched
     for t in tl:
@@ -2830,19 +3326,22 @@ def search_unit_in_bibxxx(p, f, type, wl=0):
                     query_params = tuple(int(param) for param in query_params)
                 except ValueError:
                     return intbitset()
+            query = "SELECT id FROM bibrec WHERE id %s" % query_addons
+            if restriction_ids:
+                query += " AND id IN (%s)" % restriction_ids
             if use_query_limit:
                 try:
-                    res = run_sql_with_limit("SELECT id FROM bibrec WHERE id %s" % query_addons,
-                              query_params, wildcard_limit=wl)
+                    res = run_sql_with_limit(query, query_params, wildcard_limit=wl)
                 except InvenioDbQueryWildcardLimitError, excp:
                     res = excp.res
                     limit_reached = 1 # set the limit reached flag to true
             else:
-                res = run_sql("SELECT id FROM bibrec WHERE id %s" % query_addons,
-                              query_params)
+                res = run_sql(query, query_params)
         else:
             query = "SELECT bibx.id_bibrec FROM %s AS bx LEFT JOIN %s AS bibx ON bx.id=bibx.id_bibxxx WHERE bx.value %s" % \
                     (bx, bibx, query_addons)
+            if restriction_ids:
+                query += " AND bibx.id_bibrec IN (%s)" % restriction_ids
             if len(t) != 6 or t[-1:]=='%':
                 # wildcard query, or only the beginning of field 't'
                 # is defined, so add wildcard character:
@@ -2898,12 +3397,13 @@ def search_unit_in_xapian(p, f=None, m=None):
     return xapian_get_bitset(f, p)
 
 
-def search_unit_in_bibrec(datetext1, datetext2, search_type='c'):
+def search_unit_in_bibrec(datetext1, datetext2, search_type='c', restriction=None):
     """
     Return hitset of recIDs found that were either created or modified
     (according to 'type' arg being 'c' or 'm') from datetext1 until datetext2, inclusive.
     Does not pay attention to pattern, collection, anything.  Useful
     to intersect later on with the 'real' query.
+    If the hitset 'restriction' is given, only its records are searched.
     """
     hitset = intbitset()
     if search_type and search_type.startswith("m"):
@@ -2916,11 +3416,17 @@ def search_unit_in_bibrec(datetext1, datetext2, search_type='c'):
         datetext1 = parts[0]
         datetext2 = parts[1]
 
+    query_addons = ""
+    if restriction is not None:
+        if not restriction:
+            return hitset
+        query_addons = " AND id IN (%s)" % ','.join([str(recid) for recid in restriction])
+
     if datetext1 == datetext2:
-        res = run_sql("SELECT id FROM bibrec WHERE %s LIKE %%s" % (search_type,),
+        res = run_sql("SELECT id FROM bibrec WHERE %s LIKE %%s%s" % (search_type, query_addons),
                       (datetext1 + '%',))
     else:
-        res = run_sql("SELECT id FROM bibrec WHERE %s>=%%s AND %s<=%%s" % (search_type, search_type),
+        res = run_sql("SELECT id FROM bibrec WHERE %s>=%%s AND %s<=%%s%s" % (search_type, search_type, query_addons),
                       (datetext1, datetext2))
     for row in res:
         hitset += row[0]
@@ -3052,8 +3558,8 @@ def intersect_results_with_collrecs(req, hitset_in_any_collection, colls, of="hb
     records_that_can_be_displayed = intbitset()
     if not req or isinstance(req, cStringIO.OutputType): # called from CLI
         user_info = {}
+        results = split_hitset_into_collections(hitset_in_any_collection, colls)
         for coll in colls:
-            results[coll] = hitset_in_any_collection & get_collection_reclist(coll)
             results_nbhits += len(results[coll])
         records_that_can_be_displayed = hitset_in_any_collection
         permitted_restricted_collections = []
@@ -3088,26 +3594,12 @@ def intersect_results_with_collrecs(req, hitset_in_any_collection, colls, of="hb
         colls_to_be_displayed = [coll for coll in current_coll_children if coll in colls or coll in permitted_restricted_collections]
         colls_to_be_displayed.extend([coll for coll in colls if coll not in colls_to_be_displayed])
 
-        if policy == 'ANY':# the user needs to have access to at least one collection that restricts the records
-            #we need this to be able to remove records that are both in a public and restricted collection
-            permitted_recids = intbitset()
-            notpermitted_recids = intbitset()
-            for collection in restricted_collection_cache.cache:
-                if collection in permitted_restricted_collections:
-                    permitted_recids |= get_collection_reclist(collection)
-                else:
-                    notpermitted_recids |= get_collection_reclist(collection)
-            records_that_can_be_displayed = hitset_in_any_collection - (notpermitted_recids - permitted_recids)
-
-        else:# the user needs to have access to all collections that restrict a records
-            notpermitted_recids = intbitset()
-            for collection in restricted_collection_cache.cache:
-                if collection not in permitted_restricted_collections:
-                    notpermitted_recids |= get_collection_reclist(collection)
-            records_that_can_be_displayed = hitset_in_any_collection - notpermitted_recids
+        # remove the restricted records the user cannot view:
+        records_that_can_be_displayed = hitset_in_any_collection - \
+            get_restricted_recids_not_permitted(permitted_restricted_collections, policy)
 
+        results = split_hitset_into_collections(records_that_can_be_displayed, colls_to_be_displayed)
         for coll in colls_to_be_displayed:
-            results[coll] = results.get(coll, intbitset()) | (records_that_can_be_displayed & get_collection_reclist(coll))
             results_nbhits += len(results[coll])
 
     if results_nbhits == 0:
@@ -4054,6 +4546,8 @@ class BibSortDataCacher(DataCacher):
             if self.method_id == 0:
                 return {}
             try:
+                # read before the data, so that no delta can be missed:
+                delta_version = get_last_delta_version(method_id)
                 res_data = run_sql("""SELECT data_dict_ordered from bsrMETHODDATA \
                                    where id_bsrMETHOD = %s""", (method_id,))
                 res_buckets = run_sql("""SELECT bucket_no, bucket_data from bsrMETHODDATABUCKET\
@@ -4066,6 +4560,8 @@ class BibSortDataCacher(DataCacher):
             except IndexError:
                 data_dict_ordered = {}
             alldicts['data_dict_ordered'] = data_dict_ordered # recid: weight
+            alldicts['rank_array'] = build_rank_array(data_dict_ordered)
+            alldicts['delta_version'] = delta_version
             if not res_buckets:
                 alldicts['bucket_data'] = {}
                 return alldicts
@@ -4082,17 +4578,15 @@ class BibSortDataCacher(DataCacher):
 
         def timestamp_verifier():
             method_id = self.method_id
-            res = run_sql("""SELECT last_updated from bsrMETHODDATA where id_bsrMETHOD = %s""", (method_id,))
-            try:
-                update_time_methoddata = str(res[0][0])
-            except IndexError:
-                update_time_methoddata = '1970-01-01 00:00:00'
-            res = run_sql("""SELECT max(last_updated) from bsrMETHODDATABUCKET where id_bsrMETHOD = %s""", (method_id,))
-            try:
-                update_time_buckets = str(res[0][0])
-            except IndexError:
-                update_time_buckets = '1970-01-01 00:00:00'
-            return max(update_time_methoddata, update_time_buckets)
+            # apply in place the changes published by bibsort; missed
+            # deltas and the reload markers published after a
+            # rebalancing or a deletion force a full reload:
+            if self.cache:
+                delta_timestamp = update_bibsort_cache(self.cache, method_id)
+                if delta_timestamp is None:
+                    return '9999-12-31 23:59:59'
+                self.timestamp = max(self.timestamp, delta_timestamp)
+            return get_bibsort_data_timestamp(method_id)
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -4132,6 +4626,7 @@ def get_tags_from_sort_fields(sort_fields):
     return tags, ''
 
 
+@trace_stage('rank_records')
 def rank_records(req, rank_method_code, rank_limit_relevance, hitset_global, pattern=None, verbose=0, sort_order='d', of='hb', ln=CFG_SITE_LANG, rg=None, jrec=None, field='', sorting_methods=SORTING_METHODS):
     """Initial entry point for ranking records, acts like a dispatcher.
        (i) rank_method_code is in bsrMETHOD, bibsort buckets can be used;
@@ -4158,6 +4653,12 @@ def rank_records(req, rank_method_code, rank_limit_relevance, hitset_global, pat
     else:
         related_to = pattern
 
+    # only the best records up to the displayed page need to be sorted
+    # when they are displayed from the end of the list, unless the list
+    # is kept for the previous/next hit navigation:
+    partial_sort = sort_order == 'd' and \
+                   len(hitset_global) >= CFG_WEBSEARCH_PREV_NEXT_HIT_LIMIT
+
     solution_recs, solution_scores, prefix, suffix, comment = \
         rank_records_bibrank(rank_method_code=rank_method_code,
                              rank_limit_relevance=rank_limit_relevance,
@@ -4166,7 +4667,8 @@ def rank_records(req, rank_method_code, rank_limit_relevance, hitset_global, pat
                              field=field,
                              related_to=related_to,
                              rg=rg,
-                             jrec=jrec)
+                             jrec=jrec,
+                             partial_sort=partial_sort)
 
     # Solution recs can be None, in case of error or other cases
     # which should be all be changed to return an empty list.
@@ -4181,6 +4683,7 @@ def sort_records_latest(recIDs, jrec, rg, sort_order):
         recIDs.reverse()
     return slice_records(recIDs, jrec, rg)
 
+@trace_stage('sort_records')
 def sort_records(req, recIDs, sort_field='', sort_order='d', sort_pattern='', verbose=0, of='hb', ln=CFG_SITE_LANG, rg=None, jrec=None, sorting_methods=SORTING_METHODS):
     """Initial entry point for sorting records, acts like a dispatcher.
        (i) sort_field is in the bsrMETHOD, and thus, the BibSort has sorted the data for this field, so we can use the cache;
@@ -4282,15 +4785,11 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
         if len(solution) >= irec_max:
             break
 
-    dict_solution = {}
-    missing_records = intbitset()
-    for recid in solution:
-        try:
-            dict_solution[recid] = sort_cache['data_dict_ordered'][recid]
-        except KeyError:
-            #recid is in buckets, but not in the bsrMETHODDATA,
-            #maybe because the value has been deleted, but the change has not yet been propagated to the buckets
-            missing_records.add(recid)
+    reverse = sort_order == 'd'
+    #recids in buckets, but not in the bsrMETHODDATA, are missing,
+    #maybe because the value has been deleted, but the change has not yet been propagated to the buckets
+    ranked_solution, missing_records = sort_recids_by_rank(sort_cache['rank_array'], solution, reverse)
+    missing_records = intbitset(missing_records)
     #check if there are recids that are not in any bucket -> to be added at the end/top, ordered by insertion date
     if len(solution) < irec_max:
         #some records have not been yet inserted in the bibsort structures
@@ -4299,16 +4798,14 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
     #the records need to be sorted in reverse order for the print record function
     #the return statement should be equivalent with the following statements
     #(these are clearer, but less efficient, since they revert the same list twice)
-    #sorted_solution = (missing_records + sorted(dict_solution, key=dict_solution.__getitem__, reverse=sort_order=='d'))[:irec_max]
+    #sorted_solution = (missing_records + sorted(ranked_solution, key=weight, reverse=sort_order=='d'))[:irec_max]
     #sorted_solution.reverse()
     #return sorted_solution
-    reverse = sort_order == 'd'
-
     if sort_method.strip().lower().startswith('latest') and reverse:
         # If we want to sort the records on their insertion date, add the missing records at the top
-        solution = sorted(dict_solution, key=dict_solution.__getitem__, reverse=True) + sorted(missing_records, reverse=True)
+        solution = ranked_solution + sorted(missing_records, reverse=True)
     else:
-        solution = sorted(missing_records) + sorted(dict_solution, key=dict_solution.__getitem__, reverse=reverse)
+        solution = sorted(missing_records) + ranked_solution
 
     # Only keep records, we are going to display
     index_min = jrec - 1
@@ -4320,7 +4817,8 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
 
     if sort_or_rank == 'r':
         # We need the recids, with their ranking score
-        return solution, [dict_solution.get(record, 0) for record in solution]
+        data_dict_ordered = sort_cache['data_dict_ordered']
+        return solution, [data_dict_ordered.get(record, 0) for record in solution]
     else:
         return solution
 
@@ -4352,9 +4850,6 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
             write_warning(_("Sorry, sorting is allowed on sets of up to %d records only. Using default sort order.") % CFG_WEBSEARCH_NB_RECORDS_TO_SORT, "Warning", req=req)
         return slice_records(recIDs, jrec, rg)
 
-    recIDs_dict = {}
-    recIDs_out = []
-
     if not tags:
         # tags have not been camputed yet
         sort_fields = sort_field.split(',')
@@ -4371,48 +4866,138 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
 
     ## check if we have sorting tag defined:
     if tags:
-        # fetch the necessary field values:
-        for recID in recIDs:
-            val = "" # will hold value for recID according to which sort
-            vals = [] # will hold all values found in sorting tag for recID
-            for tag in tags:
-                if CFG_CERN_SITE and tag == '773__c':
-                    # CERN hack: journal sorting
-                    # 773__c contains page numbers, e.g. 3-13, and we want to sort by 3, and numerically:
-                    vals.extend(["%050s" % x.split("-", 1)[0] for x in get_fieldvalues(recID, tag)])
-                else:
-                    vals.extend(get_fieldvalues(recID, tag))
-            if sort_pattern:
-                # try to pick that tag value that corresponds to sort pattern
-                bingo = 0
-                for v in vals:
-                    if v.lower().startswith(sort_pattern.lower()): # bingo!
-                        bingo = 1
-                        val = v
-                        break
-                if not bingo: # sort_pattern not present, so add other vals after spaces
-                    val = sort_pattern + "          " + ''.join(vals)
+        # only the records up to the displayed page need to be sorted:
+        nb_top = None
+        if rg and rg > 0:
+            nb_top = (jrec or 1) - 1 + rg
+        sort_column = get_sort_column(tags)
+
+        def get_sort_items():
+            """Yield (sort value, position, recID) of every record."""
+            position = 0
+            for recID, vals in get_sort_field_values(recIDs, tags, sort_column):
+                yield (get_sort_value(vals, sort_pattern), position, recID)
+                position += 1
+
+        # the records with equal values stay in their original order,
+        # which is reversed for descending order:
+        if sort_order == 'd':
+            if nb_top is None:
+                items = sorted(get_sort_items(), reverse=True)
             else:
-                # no sort pattern defined, so join them all together
-                val = ''.join(vals)
-            val = strip_accents(val.lower()) # sort values regardless of accents and case
-            if val in recIDs_dict:
-                recIDs_dict[val].append(recID)
+                items = heapq.nlargest(nb_top, get_sort_items())
+        else:
+            if nb_top is None:
+                items = sorted(get_sort_items())
             else:
-                recIDs_dict[val] = [recID]
+                items = heapq.nsmallest(nb_top, get_sort_items())
+        recIDs = [recID for dummy_val, dummy_position, recID in items]
 
-        # create output array:
-        for k in sorted(recIDs_dict.keys()):
-            recIDs_out.extend(recIDs_dict[k])
+    # return only up to the maximum that we need
+    return slice_records(recIDs, jrec, rg)
 
-        # ascending or descending?
-        if sort_order == 'd':
-            recIDs_out.reverse()
+## number of records whose sort values are fetched at once:
+CFG_WEBSEARCH_SORT_CHUNK_SIZE = 1000
 
-        recIDs = recIDs_out
+## number of sorts by the same tags after which their sort column is
+## built and cached, if CFG_WEBSEARCH_SORT_COLUMN_CACHE_SIZE allows:
+CFG_WEBSEARCH_SORT_COLUMN_MIN_USES = 3
 
-    # return only up to the maximum that we need
-    return slice_records(recIDs, jrec, rg)
+## sort columns of the tags used repeatedly for sorting, as {tags:
+## [version, last use, {recID: values}]}, and number of sorts by the
+## tags not cached yet:
+_SORT_COLUMN_CACHE = {}
+_SORT_COLUMN_USES = {}
+
+def get_sort_value(vals, sort_pattern=''):
+    """
+    Return the value according to which a record having the values
+    VALS in its sort tags is sorted, preferring the value given by
+    SORT_PATTERN.
+    """
+    if sort_pattern:
+        # try to pick that tag value that corresponds to sort pattern
+        for v in vals:
+            if v.lower().startswith(sort_pattern.lower()): # bingo!
+                val = v
+                break
+        else: # sort_pattern not present, so add other vals after spaces
+            val = sort_pattern + "          " + ''.join(vals)
+    else:
+        # no sort pattern defined, so join them all together
+        val = ''.join(vals)
+    return strip_accents(val.lower()) # sort values regardless of accents and case
+
+def get_sort_field_values_by_record(recIDs, tags):
+    """
+    Return dictionary of {recID: list of values} of the sort TAGS of
+    RECIDS, or of all records if RECIDS is None.
+    """
+    out = {}
+    for tag in tags:
+        for recID, values in get_fieldvalues_by_record(recIDs, tag).iteritems():
+            if CFG_CERN_SITE and tag == '773__c':
+                # CERN hack: journal sorting
+                # 773__c contains page numbers, e.g. 3-13, and we want to sort by 3, and numerically:
+                values = ["%050s" % x.split("-", 1)[0] for x in values]
+            if recID in out:
+                out[recID].extend(values)
+            else:
+                out[recID] = values
+    return out
+
+def get_sort_field_values(recIDs, tags, sort_column=None, chunk_size=CFG_WEBSEARCH_SORT_CHUNK_SIZE):
+    """
+    Yield (recID, list of values) of the sort TAGS for every record
+    of RECIDS, in order.  The values are taken from SORT_COLUMN if
+    given, otherwise they are fetched from the database in chunks of
+    CHUNK_SIZE records.
+    """
+    if sort_column is not None:
+        for recID in recIDs:
+            yield recID, sort_column.get(recID, [])
+        return
+    recIDs_iter = iter(recIDs)
+    while True:
+        chunk = [recID for dummy, recID in zip(xrange(chunk_size), recIDs_iter)]
+        if not chunk:
+            break
+        values = get_sort_field_values_by_record(chunk, tags)
+        for recID in chunk:
+            yield recID, values.get(recID, [])
+
+def get_sort_column(tags):
+    """
+    Return the cached {recID: list of values} of the sort TAGS for all
+    records, or None if the tags are not used often enough to be
+    cached.  The sort column is built at the
+    CFG_WEBSEARCH_SORT_COLUMN_MIN_USES-th use of the tags and is valid
+    as long as the bibXXx tables of the tags do not change.
+    """
+    if not CFG_WEBSEARCH_SORT_COLUMN_CACHE_SIZE or '001___' in tags:
+        return None
+    key = tuple(tags)
+    tables = set()
+    for tag in tags:
+        tables.add('bib%sx' % tag[0:2])
+        tables.add('bibrec_bib%sx' % tag[0:2])
+    version = max([get_table_version(table) for table in tables])
+    cached = _SORT_COLUMN_CACHE.get(key)
+    if cached is not None and cached[0] == version:
+        cached[1] = time.time()
+        return cached[2]
+    if cached is None:
+        _SORT_COLUMN_USES[key] = _SORT_COLUMN_USES.get(key, 0) + 1
+        if _SORT_COLUMN_USES[key] < CFG_WEBSEARCH_SORT_COLUMN_MIN_USES:
+            return None
+        if len(_SORT_COLUMN_CACHE) >= CFG_WEBSEARCH_SORT_COLUMN_CACHE_SIZE:
+            # drop the least recently used sort column:
+            oldest = min(_SORT_COLUMN_CACHE, key=lambda cached_tags: _SORT_COLUMN_CACHE[cached_tags][1])
+            del _SORT_COLUMN_CACHE[oldest]
+        del _SORT_COLUMN_USES[key]
+    sort_column = get_sort_field_values_by_record(None, tags)
+    _SORT_COLUMN_CACHE[key] = [version, time.time(), sort_column]
+    return sort_column
 
 def get_interval_for_records_to_sort(nb_found, jrec=None, rg=None):
     """calculates in which interval should the sorted records be
@@ -4444,6 +5029,49 @@ def get_interval_for_records_to_sort(nb_found, jrec=None, rg=None):
 
     return irec_min, irec_max
 
+def print_records_stream(req, chunks, flush_size=CFG_WEBSEARCH_OUTPUT_FLUSH_SIZE):
+    """
+    Write the strings yielded by 'chunks' to 'req', sending them to
+    the client every 'flush_size' bytes, so that no more than that is
+    kept in memory whatever the length of the output is.
+    """
+    buf = []
+    buf_size = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        buf.append(chunk)
+        buf_size += len(chunk)
+        if buf_size >= flush_size:
+            req.write(''.join(buf))
+            buf = []
+            buf_size = 0
+    if buf:
+        req.write(''.join(buf))
+
+def print_recids_stream(req, recIDs, flush_size=CFG_WEBSEARCH_OUTPUT_FLUSH_SIZE):
+    """
+    Write the list of record IDs 'recIDs' to 'req' as text/plain like
+    str(recIDs) would do (e.g. for of=id), but streaming it piece by
+    piece.  Return the string the page handler has to return: empty
+    once the list has been written, or the list itself for HEAD
+    requests, whose body is not sent.
+    """
+    req.content_type = 'text/plain'
+    if req.header_only:
+        return str(recIDs)
+    def recids_chunks():
+        yield '['
+        for idx, recid in enumerate(recIDs):
+            if idx > 0:
+                yield ', '
+            yield repr(recid)
+        yield ']'
+    print_records_stream(req, recids_chunks(), flush_size)
+    return ''
+
 def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, format='hb', ot='', ln=CFG_SITE_LANG,
                   relevances=[], relevances_prologue="(", relevances_epilogue="%%)",
                   decompress=zlib.decompress, search_pattern='', print_records_prologue_p=True,
@@ -4522,29 +5150,27 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
 
             if ot:
                 # asked to print some filtered fields only, so call print_record() on the fly:
-                for recid in recIDs:
-                    x = print_record(recid,
-                                     format,
-                                     ot=ot,
-                                     ln=ln,
-                                     search_pattern=search_pattern,
-                                     user_info=user_info,
-                                     verbose=verbose,
-                                     sf=sf,
-                                     so=so,
-                                     sp=sp,
-                                     rm=rm)
-                    req.write(x)
-                    if x:
-                        req.write('\n')
+                records = (print_record(recid,
+                                        format,
+                                        ot=ot,
+                                        ln=ln,
+                                        search_pattern=search_pattern,
+                                        user_info=user_info,
+                                        verbose=verbose,
+                                        sf=sf,
+                                        so=so,
+                                        sp=sp,
+                                        rm=rm) for recid in recIDs)
+                print_records_stream(req, (x and x + '\n' for x in records))
             else:
-                format_records(recIDs,
-                               format,
-                               ln=ln,
-                               search_pattern=search_pattern,
-                               record_separator="\n",
-                               user_info=user_info,
-                               req=req)
+                # stream the records out as soon as they are formatted:
+                print_records_stream(req,
+                                     format_records_iterator(recIDs,
+                                                             format,
+                                                             ln=ln,
+                                                             search_pattern=search_pattern,
+                                                             record_separator="\n",
+                                                             user_info=user_info))
 
             # print footer if needed
             if print_records_epilogue_p:
@@ -4552,23 +5178,23 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
 
         elif format.startswith('t') or str(format[0:3]).isdigit():
             # we are doing plain text output:
-            for recid in recIDs:
-                x = print_record(recid, format, ot, ln, search_pattern=search_pattern,
-                                 user_info=user_info, verbose=verbose, sf=sf, so=so, sp=sp, rm=rm)
-                req.write(x)
-                if x:
-                    req.write('\n')
+            records = (print_record(recid, format, ot, ln, search_pattern=search_pattern,
+                                    user_info=user_info, verbose=verbose, sf=sf, so=so, sp=sp, rm=rm)
+                       for recid in recIDs)
+            print_records_stream(req, (x and x + '\n' for x in records))
         elif format.startswith('recjson'):
             # we are doing recjson output:
-            req.write('[')
-            for idx, recid in enumerate(recIDs):
-                if idx > 0:
-                    req.write(',')
-                req.write(print_record(recid, format, ot, ln,
+            def recjson_chunks():
+                yield '['
+                for idx, recid in enumerate(recIDs):
+                    if idx > 0:
+                        yield ','
+                    yield print_record(recid, format, ot, ln,
                                        search_pattern=search_pattern,
                                        user_info=user_info, verbose=verbose,
-                                       sf=sf, so=so, sp=sp, rm=rm))
-            req.write(']')
+                                       sf=sf, so=so, sp=sp, rm=rm)
+                yield ']'
+            print_records_stream(req, recjson_chunks())
         elif format == 'excel':
             create_excel(recIDs=recIDs, req=req, ot=ot, user_info=user_info)
         else:
@@ -4600,6 +5226,11 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
                 if em != "" and EM_REPOSITORY["basket"] not in em:
                     display_add_to_basket = False
                 req.write(websearch_templates.tmpl_record_format_htmlbrief_header(ln=ln))
+                if ln == CFG_SITE_LANG or format.lower() in CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS:
+                    # fetch the whole page of preformatted records at once:
+                    preformatted_records, dummy = get_preformatted_records(recIDs, format)
+                else:
+                    preformatted_records = {}
                 for irec, recid in enumerate(recIDs):
                     row_number = jrec+irec
                     if relevances and relevances[irec]:
@@ -4616,7 +5247,8 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
                                           sf=sf,
                                           so=so,
                                           sp=sp,
-                                          rm=rm)
+                                          rm=rm,
+                                          preformatted_record=preformatted_records.get(recid, (None, None)))
 
                     req.write(websearch_templates.tmpl_record_format_htmlbrief_body(
                         ln=ln,
@@ -4936,7 +5568,8 @@ def get_record(recid):
     return create_record(print_record(recid, 'xm'))[0]
 
 def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.decompress,
-                 search_pattern=None, user_info=None, verbose=0, sf='', so='d', sp='', rm=''):
+                 search_pattern=None, user_info=None, verbose=0, sf='', so='d', sp='', rm='',
+                 preformatted_record=None):
     """
     Prints record 'recID' formatted according to 'format'.
 
@@ -4944,6 +5577,11 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
     only for proper linking purposes: e.g. when a certain ranking
     method or a certain sort field was selected, keep it selected in
     any dynamic search links that may be printed.
+
+    'preformatted_record' is the (formatted record, needs 2nd pass)
+    tuple of the record in 'format' already fetched by
+    bibformat.get_preformatted_records, if any; (None, None) means
+    that the record is known not to be preformatted.
     """
     if format == 'recstruct':
         return get_record(recID)
@@ -5014,7 +5652,8 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
                 out += ' ' + _("The record %d replaces it." % merged_recid)
         else:
             out += call_bibformat(recID, format, ln, search_pattern=search_pattern,
-                                  user_info=user_info, verbose=verbose)
+                                  user_info=user_info, verbose=verbose,
+                                  preformatted_record=preformatted_record)
 
             # at the end of HTML brief mode, print the "Detailed record" functionality:
             if format.lower().startswith('hb') and \
@@ -5330,11 +5969,14 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
 
     return out
 
-def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, user_info=None, verbose=0):
+def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, user_info=None, verbose=0,
+                   preformatted_record=None):
     """
     Calls BibFormat and returns formatted record.
 
     BibFormat will decide by itself if old or new BibFormat must be used.
+
+    'preformatted_record' is passed to bibformat.format_record.
     """
 
     from invenio.bibformat_utils import get_pdf_snippets
@@ -5355,7 +5997,8 @@ def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, us
                          ln=ln,
                          search_pattern=keywords,
                          user_info=user_info,
-                         verbose=verbose)
+                         verbose=verbose,
+                         preformatted_record=preformatted_record)
 
     if CFG_WEBSEARCH_FULLTEXT_SNIPPETS and user_info and \
            'fulltext' in user_info['uri'].lower():
@@ -5607,7 +6250,16 @@ def perform_request_search(req=None, cc=CFG_SITE_NAME, c=None, p="", f="", rg=No
                                 d1y=d1y, d1m=d1m, d1d=d1d, d2=d2, d2y=d2y, d2m=d2m, d2d=d2d, dt=dt, verbose=verbose, ap=ap, ln=ln, ec=ec,
                                 tab=tab, wl=wl, em=em)
 
-    return prs_perform_search(kwargs=kwargs, **kwargs)
+    # trace the search stages if asked for or if the search is
+    # sampled for the trace log:
+    search_trace = start_search_trace(repr((kwargs['p'], kwargs['f'], kwargs['cc'],
+                                            kwargs['c'], kwargs['of'])),
+                                      force=bool(kwargs['verbose']))
+    try:
+        return prs_perform_search(kwargs=kwargs, **kwargs)
+    finally:
+        if search_trace is not None:
+            stop_search_trace(search_trace)
 
 
 def prs_perform_search(kwargs=None, **dummy):
@@ -5621,6 +6273,7 @@ def prs_perform_search(kwargs=None, **dummy):
     return prs_search(kwargs=kwargs, **kwargs)
 
 
+@trace_stage('prs_wash_arguments_colls')
 def prs_wash_arguments_colls(kwargs=None, of=None, req=None, cc=None, c=None, sc=None, verbose=None,
                           aas=None, ln=None, em="", **dummy):
     """
@@ -5812,6 +6465,10 @@ def prs_search(kwargs=None, recid=0, req=None, cc=None, p=None, p1=None, p2=None
         if not of in ['hcs', 'hcs2']:
             perform_external_collection_search_with_em(req, cc, [p, p1, p2, p3], f, ec, verbose,
                                                        ln, selected_external_collections_infos, em=em)
+        # print the timings of the search stages so far:
+        search_trace = get_current_search_trace()
+        if verbose and search_trace is not None:
+            write_warning("Search trace:<pre>%s</pre>" % cgi.escape(search_trace.format()), req=req)
     return page_end(req, of, ln, em)
 
 
@@ -5901,6 +6558,7 @@ def prs_browse(kwargs=None, req=None, of=None, cc=None, aas=None, ln=None, uid=N
         return page_end(req, of, ln, em)
 
 
+@trace_stage('prs_search_similar_records')
 def prs_search_similar_records(kwargs=None, req=None, of=None, cc=None, pl_in_url=None, ln=None, uid=None, _=None, p=None,
                     p1=None, p2=None, p3=None, colls_to_display=None, f=None, rg=None, sf=None,
                     so=None, sp=None, rm=None, ot=None, aas=None, f1=None, m1=None, op1=None,
@@ -5996,6 +6654,7 @@ def prs_search_similar_records(kwargs=None, req=None, of=None, cc=None, pl_in_ur
                     print_records_epilogue(req, of)
 
 
+@trace_stage('prs_search_cocitedwith')
 def prs_search_cocitedwith(kwargs=None, req=None, of=None, cc=None, pl_in_url=None, ln=None, uid=None, _=None, p=None,
                     p1=None, p2=None, p3=None, colls_to_display=None, f=None, rg=None, sf=None,
                     so=None, sp=None, rm=None, ot=None, aas=None, f1=None, m1=None, op1=None,
@@ -6066,6 +6725,7 @@ def prs_search_cocitedwith(kwargs=None, req=None, of=None, cc=None, pl_in_url=No
                     print_records_epilogue(req, of)
 
 
+@trace_stage('prs_search_hosted_collections')
 def prs_search_hosted_collections(kwargs=None, req=None, of=None, ln=None, _=None, p=None,
                     p1=None, p2=None, p3=None, hosted_colls=None, f=None,
                     colls_to_search=None, hosted_colls_actual_or_potential_results_p=None,
@@ -6122,6 +6782,7 @@ def prs_search_hosted_collections(kwargs=None, req=None, of=None, ln=None, _=Non
     kwargs['hosted_colls_true_results'] = hosted_colls_true_results
 
 
+@trace_stage('prs_advanced_search')
 def prs_advanced_search(results_in_any_collection, kwargs=None, req=None, of=None,
                         cc=None, ln=None, _=None, p=None, p1=None, p2=None, p3=None,
                         f=None, f1=None, m1=None, op1=None, f2=None, m2=None,
@@ -6211,14 +6872,19 @@ def prs_advanced_search(results_in_any_collection, kwargs=None, req=None, of=Non
         return page_end(req, of, ln, em)
 
 
+@trace_stage('prs_simple_search')
 def prs_simple_search(results_in_any_collection, kwargs=None, req=None, of=None, cc=None, ln=None, p=None, f=None,
                     p1=None, p2=None, p3=None, ec=None, verbose=None, selected_external_collections_infos=None,
                     only_hosted_colls_actual_or_potential_results_p=None, query_representation_in_cache=None,
                     ap=None, hosted_colls_actual_or_potential_results_p=None, wl=None, em=None,
                     **dummy):
-    if query_representation_in_cache in search_results_cache.cache:
-        # query is not in the cache already, so reuse it:
-        results_in_any_collection.union_update(search_results_cache.cache[query_representation_in_cache])
+    cached_results = None
+    if search_results_cache is not None:
+        cached_results = search_results_cache.get(query_representation_in_cache,
+                                                  get_search_results_cache_stamp())
+    if cached_results is not None:
+        # query is in the cache already, so reuse it:
+        results_in_any_collection.union_update(cached_results)
         if verbose and of.startswith("h"):
             write_warning("Search stage 0: query found in cache, reusing cached results.", req=req)
     else:
@@ -6239,6 +6905,7 @@ def prs_simple_search(results_in_any_collection, kwargs=None, req=None, of=None,
             return page_end(req, of, ln, em)
 
 
+@trace_stage('prs_intersect_results_with_collrecs')
 def prs_intersect_results_with_collrecs(results_final, results_in_any_collection,
                                         kwargs=None, colls_to_search=None,
                                         req=None, of=None, ln=None,
@@ -6262,15 +6929,24 @@ def prs_intersect_results_with_collrecs(results_final, results_in_any_collection
         return page_end(req, of, ln, em)
 
 
+def get_search_results_cache_stamp():
+    """
+    Return stamp of search results cache entries.  Cached results are
+    not reused after collection reclists have changed.
+    """
+    return str(get_table_version('collection'))
+
 def prs_store_results_in_cache(query_representation_in_cache, results_in_any_collection, req=None, verbose=None, of=None, **dummy):
-    if CFG_WEBSEARCH_SEARCH_CACHE_SIZE and query_representation_in_cache not in search_results_cache.cache:
-        if len(search_results_cache.cache) > CFG_WEBSEARCH_SEARCH_CACHE_SIZE:
-            search_results_cache.clear()
-        search_results_cache.cache[query_representation_in_cache] = results_in_any_collection
+    if search_results_cache is not None:
+        # (re)store the results, which refreshes their time to live:
+        search_results_cache.set(query_representation_in_cache,
+                                 results_in_any_collection,
+                                 get_search_results_cache_stamp())
         if verbose and of.startswith("h"):
-            write_warning(req, "Search stage 3: storing query results in cache.", req=req)
+            write_warning("Search stage 3: storing query results in cache.", req=req)
 
 
+@trace_stage('prs_apply_search_limits')
 def prs_apply_search_limits(results_final, kwargs=None, req=None, of=None, cc=None, ln=None, _=None,
                             p=None, p1=None, p2=None, p3=None, f=None, pl=None, ap=None, dt=None,
                             ec=None, selected_external_collections_infos=None,
@@ -6282,10 +6958,16 @@ def prs_apply_search_limits(results_final, kwargs=None, req=None, of=None, cc=No
         if verbose and of.startswith("h"):
             write_warning("Search stage 5: applying time etc limits, from %s until %s..." % (datetext1, datetext2), req=req)
         try:
+            # look up only the dates of the found records, if not too many:
+            date_restriction = intbitset()
+            for coll_hitset in results_final.itervalues():
+                date_restriction |= coll_hitset
+            if len(date_restriction) > CFG_WEBSEARCH_SEARCH_UNIT_RESTRICTION_LIMIT:
+                date_restriction = None
             results_temp = intersect_results_with_hitset(
                 req,
                 results_final,
-                search_unit_in_bibrec(datetext1, datetext2, dt),
+                search_unit_in_bibrec(datetext1, datetext2, dt, date_restriction),
                 ap,
                 aptext= _("No match within your time limits, "
                           "discarding this condition..."),
@@ -6347,6 +7029,7 @@ def prs_apply_search_limits(results_final, kwargs=None, req=None, of=None, cc=No
             return page_end(req, of, ln, em)
 
 
+@trace_stage('prs_split_into_collections')
 def prs_split_into_collections(kwargs=None, results_final=None, colls_to_search=None, hosted_colls_results=None,
                        cpu_time=0, results_final_nb_total=None, hosted_colls_actual_or_potential_results_p=None,
                        hosted_colls_true_results=None, hosted_colls_timeouts=None, **dummy):
@@ -6364,7 +7047,7 @@ def prs_split_into_collections(kwargs=None, results_final=None, colls_to_search=
     # we have to avoid counting it multiple times.  The price to
     # pay for this accuracy of results_final_nb_total is somewhat
     # increased CPU time.
-    if results_final.keys() == 1:
+    if len(results_final) == 1:
         # only one collection; no need to union them
         results_final_for_all_selected_colls = results_final.values()[0]
         results_final_nb_total = results_final_nb.values()[0]
@@ -6421,6 +7104,7 @@ def prs_summarize_records(kwargs=None, req=None, p=None, f=None, aas=None,
     summarize_records(results_final_for_all_selected_colls, of, ln, search_p, search_f, req)
 
 
+@trace_stage('prs_print_records')
 def prs_print_records(kwargs=None, results_final=None, req=None, of=None, cc=None, pl_in_url=None,
                     ln=None, _=None, p=None, p1=None, p2=None, p3=None, f=None, rg=None, sf=None,
                     so=None, sp=None, rm=None, ot=None, aas=None, f1=None, m1=None, op1=None,
@@ -6597,6 +7281,7 @@ try:
 except Exception:
     loaded_websearch_services = get_search_services()
 
+@trace_stage('prs_search_common')
 def prs_search_common(kwargs=None, req=None, of=None, cc=None, ln=None, uid=None, _=None, p=None,
                     p1=None, p2=None, p3=None, colls_to_display=None, f=None, rg=None, sf=None,
                     so=None, sp=None, rm=None, ot=None, aas=None, f1=None, m1=None, op1=None,
@@ -6743,6 +7428,7 @@ def prs_intersect_with_colls_and_apply_search_limits(results_in_any_collection,
         return output
 
 
+@trace_stage('prs_display_results')
 def prs_display_results(kwargs=None, results_final=None, req=None, of=None, sf=None,
                         so=None, sp=None, verbose=None, p=None, p1=None, p2=None, p3=None,
                         cc=None, ln=None, _=None, ec=None, colls_to_search=None, rm=None, cpu_time=None,
@@ -6848,7 +7534,7 @@ def perform_request_cache(req, action="show"):
     out = ""
     out += "<h1>Search Cache</h1>"
     # clear cache if requested:
-    if action == "clear":
+    if action == "clear" and search_results_cache is not None:
         search_results_cache.clear()
     req.write(out)
     # show collection reclist cache:
@@ -6864,16 +7550,33 @@ def perform_request_cache(req, action="show"):
     req.write(out)
     # show search results cache:
     out = "<h3>Search Cache</h3>"
-    out += "- search cache usage: %d queries cached (max. ~%d)" % \
-           (len(search_results_cache.cache), CFG_WEBSEARCH_SEARCH_CACHE_SIZE)
-    if len(search_results_cache.cache):
-        out += "<br />- search cache contents:"
-        out += "<blockquote>"
-        for query, hitset in search_results_cache.cache.items():
-            out += "<br />%s ... %s" % (query, hitset)
+    if search_results_cache is None:
+        out += "- search cache is switched off"
+    else:
+        stats = search_results_cache.get_statistics()
+        out += "- search cache backend: %s" % CFG_WEBSEARCH_SEARCH_CACHE_BACKEND
+        out += "<br />- search cache hits/misses in this process: %d/%d" % \
+               (stats['hits'], stats['misses'])
+        if 'entries' in stats:
+            out += "<br />- search cache usage: %d queries cached in %d bytes (max. ~%d queries)" % \
+                   (stats['entries'], stats['bytes'], CFG_WEBSEARCH_SEARCH_CACHE_SIZE)
+        if 'bytes_written' in stats:
+            out += "<br />- search cache bytes written by this process: %d" % stats['bytes_written']
         out += """<p><a href="%s/search/cache?action=clear">clear search results cache</a>""" % CFG_SITE_URL
-        out += "</blockquote>"
     req.write(out)
+    # show term hitlist cache:
+    hitlist_cache = get_hitlist_cache()
+    if hitlist_cache:
+        if action == "clear":
+            hitlist_cache.clear()
+        stats = hitlist_cache.get_statistics()
+        out = "<h3>Term hitlist cache</h3>"
+        out += "- hitlist cache file: %s" % cgi.escape(hitlist_cache.filename)
+        out += "<br />- hitlist cache usage: %d hitlists cached in %d bytes " \
+               "of %d bytes" % (stats['entries'], stats['used'], stats['size'])
+        out += "<br />- hitlist cache hits/misses in this process: %d/%d" % \
+               (stats['hits'], stats['misses'])
+        req.write(out)
     # show field i18nname cache:
     out = "<h3>Field I18N names cache</h3>"
     out += "- fieldname table last updated: %s" % get_table_update_time('fieldname')
@@ -7054,7 +7757,10 @@ def get_most_popular_field_values(recids, tags, exclude_values=None, count_repet
 
 
 def profile(p="", f="", c=CFG_SITE_NAME):
-    """Profile search time."""
+    """
+    Profile search time.  See also invenio.search_engine_trace for
+    the timings of the search stages of live searches.
+    """
     import profile as pyprofile
     import pstats
     pyprofile.run("perform_request_search(p='%s',f='%s', c='%s')" % (p, f, c), "perform_request_search_profile")
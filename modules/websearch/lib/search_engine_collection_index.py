@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio Search Engine collection membership index.
+
+Groups the records by the set of collections they belong to, so that
+a hitset can be split across many collections by intersecting it
+with the reclist of every such group only, instead of with the
+reclist of every collection.
+
+The distinct sets of collections records belong to (membership
+classes) are stored with the reclist of their records.  The index is
+built by webcoll from the collection reclists and stored in the cache
+directory.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import marshal
+
+from invenio.config import CFG_CACHEDIR
+from invenio.intbitset import intbitset
+
+CFG_COLLECTION_INDEX_FILE = os.path.join(CFG_CACHEDIR, 'collections',
+                                         'membership_index')
+
+# version of the stored index format:
+CFG_COLLECTION_INDEX_VERSION = 2
+
+
+class CollectionMembershipIndex(object):
+    """
+    Index of the collections every record belongs to.
+    """
+
+    def __init__(self, collections, classes, class_reclists, stamp=''):
+        """
+        @param collections: list of collection names
+        @param classes: list of tuples of positions in COLLECTIONS;
+            the first one must be the empty tuple
+        @param class_reclists: list of the reclists of the records of
+            every class of CLASSES; the first one is not used
+        @param stamp: version of the collection reclists the index was
+            built from
+        """
+        self.collections = collections
+        self.collection_positions = dict((name, i) for i, name in enumerate(collections))
+        self.classes = classes
+        self.class_reclists = class_reclists
+        self.stamp = stamp
+
+    @classmethod
+    def build(cls, reclists, stamp=''):
+        """
+        Return index built from RECLISTS, a dictionary of collection
+        names and their reclists.
+        """
+        collections = sorted(reclists.keys())
+        # reclists of the classes of the collections seen so far:
+        reclists_by_class = {}
+        for position, name in enumerate(collections):
+            reclist = reclists[name]
+            if not reclist:
+                continue
+            new_reclists_by_class = {}
+            remaining = intbitset(reclist)
+            for members, class_reclist in reclists_by_class.iteritems():
+                common = class_reclist & reclist
+                if common:
+                    new_reclists_by_class[members + (position, )] = common
+                    remaining -= common
+                    class_reclist = class_reclist - common
+                if class_reclist:
+                    new_reclists_by_class[members] = class_reclist
+            if remaining:
+                new_reclists_by_class[(position, )] = remaining
+            reclists_by_class = new_reclists_by_class
+        classes = [()] + sorted(reclists_by_class)
+        class_reclists = [intbitset()] + [reclists_by_class[members]
+                                          for members in classes[1:]]
+        return cls(collections, classes, class_reclists, stamp)
+
+    def get_collections(self, recid):
+        """Return list of the names of the collections of RECID."""
+        for record_class, class_reclist in enumerate(self.class_reclists):
+            if record_class and recid in class_reclist:
+                return [self.collections[position] for position
+                        in self.classes[record_class]]
+        return []
+
+    def get_nb_classes(self, colls):
+        """Return number of the classes of records of the collections
+        COLLS, i.e. of the intersections split() needs."""
+        wanted = set([self.collection_positions.get(coll) for coll in colls])
+        return len([members for members in self.classes
+                    if wanted.intersection(members)])
+
+    def split(self, hitset, colls):
+        """
+        Return dictionary of the hitsets given by the intersection of
+        HITSET with the reclists of the collections COLLS.
+        """
+        wanted = {}
+        for coll in colls:
+            position = self.collection_positions.get(coll)
+            if position is not None:
+                wanted[position] = coll
+        results = dict((coll, intbitset()) for coll in colls)
+        if wanted:
+            for record_class, members in enumerate(self.classes):
+                members = [position for position in members if position in wanted]
+                if not members:
+                    continue
+                hits = hitset & self.class_reclists[record_class]
+                if hits:
+                    for position in members:
+                        results[wanted[position]] |= hits
+        return results
+
+    def dumps(self):
+        """Return string representation of the index."""
+        return marshal.dumps((CFG_COLLECTION_INDEX_VERSION, self.stamp,
+                              self.collections, self.classes,
+                              [reclist.fastdump() for reclist in self.class_reclists]))
+
+    @classmethod
+    def loads(cls, data):
+        """Return index from its string representation DATA."""
+        version, stamp, collections, classes, class_reclists = marshal.loads(data)
+        if version != CFG_COLLECTION_INDEX_VERSION:
+            raise ValueError("unsupported collection index version %s" % version)
+        class_reclists = [intbitset(reclist) for reclist in class_reclists]
+        return cls(collections, classes, class_reclists, stamp)
+
+
+def save_collection_membership_index(index, filename=CFG_COLLECTION_INDEX_FILE):
+    """Store INDEX in FILENAME, replacing the previous one atomically."""
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp_filename = '%s.%s' % (filename, os.getpid())
+    tmp_file = open(tmp_filename, 'wb')
+    try:
+        tmp_file.write(index.dumps())
+    finally:
+        tmp_file.close()
+    os.rename(tmp_filename, filename)
+
+
+def load_collection_membership_index(filename=CFG_COLLECTION_INDEX_FILE):
+    """Return index stored in FILENAME, or None if there is none."""
+    try:
+        index_file = open(filename, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            return CollectionMembershipIndex.loads(index_file.read())
+        except (ValueError, EOFError, TypeError):
+            return None
+    finally:
+        index_file.close()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the search engine collection membership index."""
+
+__revision__ = "$Id$"
+
+import os
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio.search_engine_collection_index import CollectionMembershipIndex, \
+     save_collection_membership_index, load_collection_membership_index
+
+
+class CollectionMembershipIndexTest(InvenioTestCase):
+    """Test of the record-to-collections index."""
+
+    def setUp(self):
+        """Build index of a few collections."""
+        self.reclists = {'Articles': intbitset([1, 2, 3, 10]),
+                         'Preprints': intbitset([3, 4, 5]),
+                         'Articles & Preprints': intbitset([1, 2, 3, 4, 5, 10]),
+                         'Books': intbitset([6, 7]),
+                         'Empty': intbitset()}
+        self.index = CollectionMembershipIndex.build(self.reclists, 'stamp')
+
+    def test_classes_are_shared(self):
+        """search engine collection index - records of the same collections share their class"""
+        # no collection, {A, A&P}, {A, A&P, P}, {A&P, P}, {B}:
+        self.assertEqual(5, len(self.index.classes))
+        self.assertEqual(['Articles', 'Articles & Preprints', 'Preprints'],
+                         sorted(self.index.get_collections(3)))
+        self.assertEqual([], self.index.get_collections(8))
+        self.assertEqual([], self.index.get_collections(1000))
+
+    def test_nb_classes(self):
+        """search engine collection index - classes to intersect for collections"""
+        self.assertEqual(1, self.index.get_nb_classes(['Books', 'Empty']))
+        self.assertEqual(3, self.index.get_nb_classes(['Articles & Preprints']))
+        self.assertEqual(0, self.index.get_nb_classes(['Nonexistent']))
+
+    def test_split_equals_intersections(self):
+        """search engine collection index - splitting gives the reclist intersections"""
+        hitset = intbitset([1, 3, 4, 6, 8, 10, 200])
+        colls = ['Articles', 'Preprints', 'Books', 'Empty', 'Nonexistent']
+        expected = dict((coll, hitset & self.reclists.get(coll, intbitset()))
+                        for coll in colls)
+        self.assertEqual(expected, self.index.split(hitset, colls))
+
+    def test_save_and_load(self):
+        """search engine collection index - index is stored and loaded"""
+        fd, filename = tempfile.mkstemp(prefix='collection_index_')
+        os.close(fd)
+        try:
+            save_collection_membership_index(self.index, filename)
+            index = load_collection_membership_index(filename)
+        finally:
+            os.remove(filename)
+        self.assertEqual('stamp', index.stamp)
+        self.assertEqual(self.index.split(intbitset([1, 4, 7]), ['Preprints', 'Books']),
+                         index.split(intbitset([1, 4, 7]), ['Preprints', 'Books']))
+        self.assertEqual(None, load_collection_membership_index(filename))
+
+
+TEST_SUITE = make_test_suite(CollectionMembershipIndexTest, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
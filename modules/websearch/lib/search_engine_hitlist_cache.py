@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio Search Engine term hitlist cache.
+
+Hitlists of popular index terms (e.g. `980__:ARTICLE', frequent
+author names or years) are read and deserialized over and over again
+by every web worker.  This module provides a cache of hitlist blobs
+(as produced by intbitset.fastdump()) stored in a memory-mapped file
+that is shared by all the worker processes of a node, so that each
+hot hitlist is fetched from the database only once per node.
+
+The file is laid out as follows:
+
+  - a header holding the magic string, the geometry of the file,
+    the current write position and an access clock;
+
+  - a slot table, where each slot points to one record in the data
+    area and remembers when it was last accessed;
+
+  - the data area, used as a ring buffer of records, each record
+    holding the cache key, the validity stamp and the blob.
+
+New records are always appended at the write position, overwriting
+(and evicting) the oldest records.  Records that are read while they
+are about to be overwritten are appended anew, so that frequently
+used records survive; when all the slots of a key's bucket are taken,
+the least recently used one is evicted.  Readers and writers are
+synchronised by means of fcntl locks on the cache file.
+
+Each record carries a stamp given by the caller (for index terms the
+`last_updated' time of the index); a record whose stamp differs from
+the expected one is considered stale.
+
+A cache file is never resized nor rewritten once it may be mapped by
+other processes: when the configured size changes, a new file replaces
+it, and the processes started with the former size keep using the old
+one until they are restarted.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import mmap
+import fcntl
+import struct
+import tempfile
+import zlib
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from invenio.config import CFG_CACHEDIR, \
+     CFG_WEBSEARCH_HITLIST_CACHE_SIZE
+
+CFG_WEBSEARCH_HITLIST_CACHE_FILE = os.path.join(CFG_CACHEDIR, 'websearch',
+                                                'hitlist_cache.mmap')
+
+_MAGIC = 'INVHLC01'
+_HEADER = struct.Struct('<8sIIQQQQ') # magic, nslots, probes, data size,
+                                     # write position, high water mark,
+                                     # access clock
+_SLOT = struct.Struct('<QQIIQ')      # key hash, offset, length,
+                                     # blob checksum, last access
+_RECORD = struct.Struct('<4sIIHHI') # magic, total length, slot,
+                                    # key length, stamp length,
+                                    # blob length
+_RECORD_MAGIC = 'HLR1'
+## slot number of filler records:
+_NO_SLOT = 0xFFFFFFFF
+
+## how many slots to probe for a given key:
+_PROBES = 8
+## average record size used to dimension the slot table:
+_AVERAGE_RECORD_SIZE = 2048
+## records read within this fraction of the data area in front of
+## the write position are re-appended so that they are not evicted:
+_PROMOTION_ZONE = 0.2
+
+
+class HitlistCache(object):
+    """
+    Cache of hitlist blobs shared by several processes via a
+    memory-mapped file.  Keys, stamps and blobs are binary strings.
+    """
+
+    def __init__(self, filename, data_size):
+        """
+        @param filename: path of the shared cache file
+        @param data_size: size in bytes of the data area; determines
+            the memory used by the cache on the node
+        """
+        self.filename = filename
+        self.data_size = int(data_size)
+        self.nslots = max(1024, self.data_size // _AVERAGE_RECORD_SIZE)
+        self.slots_start = _HEADER.size
+        self.data_start = self.slots_start + self.nslots * _SLOT.size
+        self.file_size = self.data_start + self.data_size
+        self.hits = 0
+        self.misses = 0
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                pass # maybe created by a concurrent process
+        self.fd = self._open()
+        try:
+            new_file = os.fstat(self.fd).st_size == 0
+            if new_file:
+                # nobody can have mapped the file yet:
+                os.ftruncate(self.fd, self.file_size)
+            self.mmap = None
+            if os.fstat(self.fd).st_size == self.file_size:
+                self.mmap = mmap.mmap(self.fd, self.file_size, mmap.MAP_SHARED,
+                                      mmap.PROT_READ | mmap.PROT_WRITE)
+                magic, nslots, probes, data_size = \
+                       _HEADER.unpack_from(self.mmap, 0)[:4]
+                if new_file:
+                    self._initialize()
+                elif magic != _MAGIC or nslots != self.nslots or \
+                         probes != _PROBES or data_size != self.data_size:
+                    self.mmap.close()
+                    self.mmap = None
+            if self.mmap is None:
+                # file created with another geometry, which processes
+                # still running with the former configuration may have
+                # mapped: resizing or rewriting it would crash them
+                # (SIGBUS) or corrupt their view, so let us replace it
+                # by a new file and leave them the old one
+                self._replace_file()
+                self.mmap = mmap.mmap(self.fd, self.file_size, mmap.MAP_SHARED,
+                                      mmap.PROT_READ | mmap.PROT_WRITE)
+                self._initialize()
+        finally:
+            self._lock(fcntl.LOCK_UN)
+
+    def _open(self):
+        """
+        Open the cache file, creating it if needed, and return its
+        descriptor with exclusive lock held.
+        """
+        while True:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0660)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.filename).st_ino:
+                    return fd
+            except OSError:
+                pass
+            # the file was replaced by another process meanwhile
+            os.close(fd)
+
+    def _replace_file(self):
+        """
+        Replace the cache file by a new file of the right size and
+        make it the file of this cache.  Call with exclusive lock held.
+        """
+        dirname, basename = os.path.split(self.filename)
+        fd, tmpname = tempfile.mkstemp(prefix=basename + '.',
+                                       dir=dirname or os.curdir)
+        try:
+            os.fchmod(fd, 0660)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.ftruncate(fd, self.file_size)
+            os.rename(tmpname, self.filename)
+        except (IOError, OSError):
+            os.close(fd)
+            os.remove(tmpname)
+            raise
+        os.close(self.fd)
+        self.fd = fd
+
+    def _lock(self, operation):
+        """Lock or unlock the cache file."""
+        fcntl.flock(self.fd, operation)
+
+    def _initialize(self):
+        """Wipe out the cache content.  Call with exclusive lock held."""
+        self.mmap.seek(0)
+        chunk = '\0' * 65536
+        remaining = self.data_start
+        while remaining > 0:
+            self.mmap.write(chunk[:min(remaining, len(chunk))])
+            remaining -= len(chunk)
+        _HEADER.pack_into(self.mmap, 0, _MAGIC, self.nslots, _PROBES,
+                          self.data_size, 0, 0, 0)
+
+    def _tick(self):
+        """Increment and return the access clock."""
+        header = list(_HEADER.unpack_from(self.mmap, 0))
+        header[6] += 1
+        _HEADER.pack_into(self.mmap, 0, *header)
+        return header[6]
+
+    def _hash(self, key):
+        """Return 64-bit hash of KEY; zero is reserved for empty slots."""
+        return struct.unpack('<Q', md5(key).digest()[:8])[0] or 1
+
+    def _slot_offset(self, slot):
+        """Return position of the slot number SLOT in the file."""
+        return self.slots_start + slot * _SLOT.size
+
+    def _find_slot(self, key, key_hash):
+        """
+        Return (slot, offset, length) of the record holding KEY, or
+        None if the key is not cached.
+        """
+        first_slot = key_hash % self.nslots
+        for probe in xrange(_PROBES):
+            slot = (first_slot + probe) % self.nslots
+            slot_hash, offset, length, dummy, dummy_access = \
+                       _SLOT.unpack_from(self.mmap, self._slot_offset(slot))
+            if slot_hash == key_hash and length and \
+                   offset + _RECORD.size <= self.data_size:
+                record = _RECORD.unpack_from(self.mmap, self.data_start + offset)
+                rec_magic, dummy_total, rec_slot, key_len = record[:4]
+                start = self.data_start + offset + _RECORD.size
+                if rec_magic == _RECORD_MAGIC and rec_slot == slot and \
+                       self.mmap[start:start + key_len] == key:
+                    return slot, offset, length
+        return None
+
+    def get(self, key, stamp):
+        """
+        Return blob cached under KEY, or None if KEY is not cached or
+        if it was cached with a stamp different from STAMP.
+        """
+        key_hash = self._hash(key)
+        blob = None
+        promote = False
+        self._lock(fcntl.LOCK_SH)
+        try:
+            found = self._find_slot(key, key_hash)
+            if found:
+                slot, offset, length = found
+                checksum = _SLOT.unpack_from(self.mmap,
+                                             self._slot_offset(slot))[3]
+                dummy_magic, dummy_total, dummy_slot, key_len, stamp_len, blob_len = \
+                             _RECORD.unpack_from(self.mmap, self.data_start + offset)
+                start = self.data_start + offset + _RECORD.size + key_len
+                if self.mmap[start:start + stamp_len] == stamp:
+                    start += stamp_len
+                    blob = self.mmap[start:start + blob_len]
+                    if zlib.crc32(blob) & 0xffffffff != checksum:
+                        blob = None
+                if blob is not None:
+                    # remember the access; races with other readers
+                    # are harmless here:
+                    _SLOT.pack_into(self.mmap, self._slot_offset(slot),
+                                    key_hash, offset, length, checksum,
+                                    self._tick())
+                    write_pos = _HEADER.unpack_from(self.mmap, 0)[4]
+                    distance = (offset - write_pos) % self.data_size
+                    promote = distance < _PROMOTION_ZONE * self.data_size
+        finally:
+            self._lock(fcntl.LOCK_UN)
+        if blob is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if promote:
+                # the record is going to be overwritten soon, so
+                # let us give it a second chance:
+                self.set(key, stamp, blob)
+        return blob
+
+    def set(self, key, stamp, blob):
+        """
+        Cache BLOB under KEY with validity stamp STAMP.  Blobs that
+        do not fit into a quarter of the data area are not cached.
+        """
+        total = _RECORD.size + len(key) + len(stamp) + len(blob)
+        if total > self.data_size // 4 or len(key) > 65535 or \
+               len(stamp) > 65535:
+            return
+        key_hash = self._hash(key)
+        self._lock(fcntl.LOCK_EX)
+        try:
+            found = self._find_slot(key, key_hash)
+            if found:
+                self._free_slot(found[0])
+            slot = self._choose_slot(key_hash)
+            offset, total = self._reserve(total)
+            _RECORD.pack_into(self.mmap, self.data_start + offset,
+                              _RECORD_MAGIC, total, slot, len(key),
+                              len(stamp), len(blob))
+            start = self.data_start + offset + _RECORD.size
+            payload = key + stamp + blob
+            self.mmap[start:start + len(payload)] = payload
+            _SLOT.pack_into(self.mmap, self._slot_offset(slot),
+                            key_hash, offset, total,
+                            zlib.crc32(blob) & 0xffffffff, self._tick())
+        finally:
+            self._lock(fcntl.LOCK_UN)
+
+    def delete(self, key):
+        """Remove KEY from the cache."""
+        self._lock(fcntl.LOCK_EX)
+        try:
+            found = self._find_slot(key, self._hash(key))
+            if found:
+                self._free_slot(found[0])
+        finally:
+            self._lock(fcntl.LOCK_UN)
+
+    def clear(self):
+        """Remove everything from the cache."""
+        self._lock(fcntl.LOCK_EX)
+        try:
+            self._initialize()
+        finally:
+            self._lock(fcntl.LOCK_UN)
+
+    def _free_slot(self, slot):
+        """Mark slot number SLOT as empty."""
+        _SLOT.pack_into(self.mmap, self._slot_offset(slot), 0, 0, 0, 0, 0)
+
+    def _choose_slot(self, key_hash):
+        """
+        Return slot number for a new record with hash KEY_HASH: the
+        first empty slot of the bucket, or the least recently used
+        one, which gets evicted.
+        """
+        first_slot = key_hash % self.nslots
+        lru_slot, lru_access = None, None
+        for probe in xrange(_PROBES):
+            slot = (first_slot + probe) % self.nslots
+            dummy_hash, dummy_offset, length, dummy, access = \
+                        _SLOT.unpack_from(self.mmap, self._slot_offset(slot))
+            if not length:
+                return slot
+            if lru_access is None or access < lru_access:
+                lru_slot, lru_access = slot, access
+        self._free_slot(lru_slot)
+        return lru_slot
+
+    def _reserve(self, total):
+        """
+        Reserve at least TOTAL bytes in the data area at the write
+        position, evicting the records that were stored there.
+        Return tuple (offset, reserved size).
+        """
+        header = list(_HEADER.unpack_from(self.mmap, 0))
+        write_pos, high_water = header[4], header[5]
+        if write_pos + total > self.data_size:
+            # not enough room at the end of the data area; evict the
+            # tail records and wrap around:
+            self._evict(write_pos, self.data_size, high_water)
+            high_water = write_pos
+            write_pos = 0
+        evicted_end = self._evict(write_pos, write_pos + total, high_water)
+        gap = evicted_end - (write_pos + total)
+        if 0 < gap < _RECORD.size:
+            # too small to be described; let the new record absorb it
+            total += gap
+        elif gap >= _RECORD.size:
+            # describe the rest of the last evicted record by a filler
+            _RECORD.pack_into(self.mmap, self.data_start + write_pos + total,
+                              _RECORD_MAGIC, gap, _NO_SLOT, 0, 0, 0)
+        header[4] = write_pos + total
+        header[5] = max(high_water, write_pos + total)
+        _HEADER.pack_into(self.mmap, 0, *header)
+        return write_pos, total
+
+    def _evict(self, start, end, high_water):
+        """
+        Free slots of the records stored between START and END, but
+        not beyond HIGH_WATER, the end of the used data area.  Return
+        the position where the last evicted record ends.
+        """
+        pos = start
+        while pos < end and pos < high_water:
+            rec_magic, total, slot = \
+                       _RECORD.unpack_from(self.mmap, self.data_start + pos)[:3]
+            if rec_magic != _RECORD_MAGIC or total == 0:
+                # should not happen, but let us be safe and free all
+                # the slots pointing into the area:
+                self._evict_by_slots(pos, end)
+                return end
+            if slot < self.nslots:
+                slot_offset = _SLOT.unpack_from(self.mmap,
+                                                self._slot_offset(slot))[1]
+                if slot_offset == pos:
+                    self._free_slot(slot)
+            pos += total
+        return pos
+
+    def _evict_by_slots(self, start, end):
+        """Free all slots pointing to records overlapping START..END."""
+        for slot in xrange(self.nslots):
+            dummy_hash, offset, length = \
+                        _SLOT.unpack_from(self.mmap, self._slot_offset(slot))[:3]
+            if length and offset < end and offset + length > start:
+                self._free_slot(slot)
+
+    def get_statistics(self):
+        """
+        Return dictionary of usage statistics: hits and misses of this
+        process, number of cached entries, bytes used by them and size
+        of the data area.
+        """
+        used_slots = 0
+        used_bytes = 0
+        self._lock(fcntl.LOCK_SH)
+        try:
+            for slot in xrange(self.nslots):
+                length = _SLOT.unpack_from(self.mmap, self._slot_offset(slot))[2]
+                if length:
+                    used_slots += 1
+                    used_bytes += length
+        finally:
+            self._lock(fcntl.LOCK_UN)
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': used_slots,
+                'used': used_bytes,
+                'size': self.data_size}
+
+
+_HITLIST_CACHE = {}
+
+def get_hitlist_cache():
+    """
+    Return the term hitlist cache of this process, or None if the
+    cache is switched off via CFG_WEBSEARCH_HITLIST_CACHE_SIZE.
+    """
+    if not CFG_WEBSEARCH_HITLIST_CACHE_SIZE:
+        return None
+    if 'cache' not in _HITLIST_CACHE:
+        try:
+            _HITLIST_CACHE['cache'] = HitlistCache(
+                CFG_WEBSEARCH_HITLIST_CACHE_FILE,
+                CFG_WEBSEARCH_HITLIST_CACHE_SIZE * 1024 * 1024)
+        except (IOError, OSError, mmap.error):
+            from invenio.errorlib import register_exception
+            register_exception(alert_admin=True)
+            _HITLIST_CACHE['cache'] = None
+    return _HITLIST_CACHE['cache']
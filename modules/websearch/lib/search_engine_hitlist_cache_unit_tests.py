@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the search engine term hitlist cache."""
+
+__revision__ = "$Id$"
+
+import os
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio.search_engine_hitlist_cache import HitlistCache
+
+
+class HitlistCacheTest(InvenioTestCase):
+    """Test of the memory-mapped term hitlist cache."""
+
+    def setUp(self):
+        """Create cache in a temporary file."""
+        fd, self.filename = tempfile.mkstemp(prefix='hitlist_cache_')
+        os.close(fd)
+        self.cache = HitlistCache(self.filename, 64 * 1024)
+
+    def tearDown(self):
+        """Remove the temporary cache file."""
+        os.remove(self.filename)
+
+    def test_set_and_get(self):
+        """search engine hitlist cache - hitlist is stored and retrieved"""
+        hitlist = intbitset([1, 5, 10]).fastdump()
+        self.cache.set('idxWORD01F:ellis', '2015-01-01 00:00:00', hitlist)
+        self.assertEqual(hitlist, self.cache.get('idxWORD01F:ellis',
+                                                 '2015-01-01 00:00:00'))
+        self.assertEqual(None, self.cache.get('idxWORD01F:muon',
+                                              '2015-01-01 00:00:00'))
+
+    def test_stale_stamp(self):
+        """search engine hitlist cache - entries with old stamp are misses"""
+        self.cache.set('idxWORD01F:ellis', '2015-01-01 00:00:00', 'x')
+        self.assertEqual(None, self.cache.get('idxWORD01F:ellis',
+                                              '2015-01-02 00:00:00'))
+
+    def test_shared_between_instances(self):
+        """search engine hitlist cache - entries are seen by other processes"""
+        other_cache = HitlistCache(self.filename, 64 * 1024)
+        self.cache.set('idxPAIR01F:muon decay', 's', 'hitlist')
+        self.assertEqual('hitlist', other_cache.get('idxPAIR01F:muon decay', 's'))
+        other_cache.delete('idxPAIR01F:muon decay')
+        self.assertEqual(None, self.cache.get('idxPAIR01F:muon decay', 's'))
+
+    def test_resized_file_is_replaced(self):
+        """search engine hitlist cache - other size does not touch a mapped file"""
+        self.cache.set('idxWORD01F:ellis', 's', 'hitlist')
+        inode = os.stat(self.filename).st_ino
+        other_cache = HitlistCache(self.filename, 32 * 1024)
+        self.assertNotEqual(inode, os.stat(self.filename).st_ino)
+        self.assertEqual(other_cache.file_size, os.path.getsize(self.filename))
+        self.assertEqual('hitlist', self.cache.get('idxWORD01F:ellis', 's'))
+        self.assertEqual(None, other_cache.get('idxWORD01F:ellis', 's'))
+        third_cache = HitlistCache(self.filename, 32 * 1024)
+        other_cache.set('idxWORD01F:muon', 's', 'hitlist')
+        self.assertEqual('hitlist', third_cache.get('idxWORD01F:muon', 's'))
+
+    def test_size_bounded_eviction(self):
+        """search engine hitlist cache - old entries are evicted, new ones are kept"""
+        blob = 'x' * 1000
+        for i in range(500):
+            self.cache.set('term%d' % i, 's', blob + str(i))
+        self.assertEqual(None, self.cache.get('term0', 's'))
+        self.assertEqual(blob + '499', self.cache.get('term499', 's'))
+        for i in range(500):
+            value = self.cache.get('term%d' % i, 's')
+            self.failUnless(value is None or value == blob + str(i))
+
+    def test_statistics(self):
+        """search engine hitlist cache - used bytes of the cached entries"""
+        self.cache.set('idxWORD01F:ellis', 's', 'x' * 100)
+        self.cache.set('idxWORD01F:muon', 's', 'x' * 200)
+        stats = self.cache.get_statistics()
+        self.assertEqual(2, stats['entries'])
+        self.failUnless(300 < stats['used'] < 1024)
+        self.assertEqual(64 * 1024, stats['size'])
+        self.cache.delete('idxWORD01F:muon')
+        self.failUnless(stats['used'] > self.cache.get_statistics()['used'])
+
+    def test_too_big_blob_is_not_cached(self):
+        """search engine hitlist cache - blobs bigger than the cache are ignored"""
+        self.cache.set('big', 's', 'x' * 64 * 1024)
+        self.assertEqual(None, self.cache.get('big', 's'))
+
+
+TEST_SUITE = make_test_suite(HitlistCacheTest, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio Search Engine query planner.
+
+Decides in which order the basic search units of a query (as returned
+by create_basic_search_units()) are to be evaluated.  The boolean
+query is evaluated from left to right, so that the units cannot be
+freely reordered; however, the `+' (intersection) and `-' (difference)
+operations commute with one another.  The units are therefore split
+into segments, a new segment starting with every `|' (union) unit,
+and inside every segment the units following the union, if any, can
+be evaluated in any order.
+
+The planner runs first the units whose hitsets are already known
+(e.g. exact words prefetched from the word indexes), the smallest
+intersections first, and then the other units from the cheapest to
+the most expensive one.  This keeps the running result small, so that
+the search engine can stop evaluating a segment as soon as its result
+is empty and can restrict the expensive units to the records of the
+running result.
+"""
+
+__revision__ = "$Id$"
+
+## estimated costs of the evaluation of search units, from the
+## cheapest to the most expensive one:
+CFG_SEARCH_UNIT_COST_KNOWN = 0    # hitset already fetched
+CFG_SEARCH_UNIT_COST_INDEX = 1    # look-up of index terms (wildcards,
+                                  # spans, phrases)
+CFG_SEARCH_UNIT_COST_SCAN = 2     # scan of bibxxx values or of record
+                                  # dates
+CFG_SEARCH_UNIT_COST_SUBQUERY = 3 # citation subqueries, external engines
+
+
+def get_search_unit_segments(operators):
+    """
+    Return list of segments of the search units with OPERATORS, each
+    segment being the list of the positions of its units.  A new
+    segment starts with every union unit.
+    """
+    segments = []
+    for position, operator in enumerate(operators):
+        if not segments or operator == '|':
+            segments.append([])
+        segments[-1].append(position)
+    return segments
+
+
+def plan_search_units(operators, estimates):
+    """
+    Return evaluation plan of the search units with OPERATORS, as a
+    list of segments (see get_search_unit_segments()), each segment
+    being the list of the positions of its units in the order they
+    are to be evaluated.
+
+    @param operators: list of the operators ('+', '-' or '|') of the
+        search units
+    @param estimates: list of (cost, nb_hits) tuples for every search
+        unit, where cost is one of the CFG_SEARCH_UNIT_COST_* values
+        and nb_hits is the number of hits of the unit if known, or
+        None
+    """
+    def get_evaluation_key(position):
+        """Return sort key of the unit at POSITION."""
+        cost, nb_hits = estimates[position]
+        intersection = operators[position] == '+'
+        if nb_hits is not None:
+            if intersection:
+                return (0, nb_hits, position)
+            return (1, 0, position)
+        if intersection:
+            return (2, cost, position)
+        return (3, cost, position)
+
+    plan = []
+    for segment in get_search_unit_segments(operators):
+        if operators[segment[0]] == '|':
+            # the union has to be done before the following units:
+            plan.append(segment[:1] + sorted(segment[1:], key=get_evaluation_key))
+        else:
+            plan.append(sorted(segment, key=get_evaluation_key))
+    return plan
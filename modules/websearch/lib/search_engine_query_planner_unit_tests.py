@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the search engine query planner."""
+
+__revision__ = "$Id$"
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.search_engine_query_planner import get_search_unit_segments, \
+     plan_search_units, \
+     CFG_SEARCH_UNIT_COST_KNOWN, \
+     CFG_SEARCH_UNIT_COST_INDEX, \
+     CFG_SEARCH_UNIT_COST_SCAN, \
+     CFG_SEARCH_UNIT_COST_SUBQUERY
+
+
+class SearchQueryPlannerTest(InvenioTestCase):
+    """Test of the evaluation order of search units."""
+
+    def test_segments(self):
+        """search engine query planner - unions start new segments"""
+        self.assertEqual([[0, 1], [2, 3, 4], [5]],
+                         get_search_unit_segments(['+', '-', '|', '+', '+', '|']))
+        self.assertEqual([], get_search_unit_segments([]))
+
+    def test_selective_units_first(self):
+        """search engine query planner - known and cheap units run first"""
+        # e.g. title:/muon.*/ refersto:ellis 980:ARTICLE -higgs higgs
+        operators = ['+', '+', '+', '-', '+']
+        estimates = [(CFG_SEARCH_UNIT_COST_SCAN, None),
+                     (CFG_SEARCH_UNIT_COST_SUBQUERY, None),
+                     (CFG_SEARCH_UNIT_COST_KNOWN, 10000),
+                     (CFG_SEARCH_UNIT_COST_KNOWN, 5),
+                     (CFG_SEARCH_UNIT_COST_KNOWN, 20)]
+        self.assertEqual([[4, 2, 3, 0, 1]], plan_search_units(operators, estimates))
+
+    def test_unions_are_not_reordered(self):
+        """search engine query planner - units are not moved across unions"""
+        operators = ['+', '+', '|', '-', '+']
+        estimates = [(CFG_SEARCH_UNIT_COST_INDEX, None),
+                     (CFG_SEARCH_UNIT_COST_KNOWN, 3),
+                     (CFG_SEARCH_UNIT_COST_KNOWN, 1),
+                     (CFG_SEARCH_UNIT_COST_INDEX, None),
+                     (CFG_SEARCH_UNIT_COST_SCAN, None)]
+        self.assertEqual([[1, 0], [2, 4, 3]], plan_search_units(operators, estimates))
+
+
+TEST_SUITE = make_test_suite(SearchQueryPlannerTest, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio Search Engine query results cache.
+
+Caches the hitsets of recent search queries, mainly for the "next
+page" functionality.  The hitsets are stored as compressed intbitset
+dumps by one of the following backends:
+
+  - 'local': an LRU cache living inside each web worker process,
+    bounded both in number of entries and in bytes;
+
+  - 'redis': a cache shared by all the web workers via the redis
+    key/value store (see invenio.redisutils), so that paginating
+    queries hit the cache whichever worker serves them.  Redis itself
+    should be configured with an LRU `maxmemory-policy'.
+
+Every entry has a time to live and is stored together with a stamp
+(e.g. the last update time of collection reclists) so that cached
+results are not reused after the collections have changed.
+"""
+
+__revision__ = "$Id$"
+
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from invenio.config import \
+     CFG_WEBSEARCH_SEARCH_CACHE_BACKEND, \
+     CFG_WEBSEARCH_SEARCH_CACHE_SIZE, \
+     CFG_WEBSEARCH_SEARCH_CACHE_MEMORY, \
+     CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT
+from invenio.intbitset import intbitset
+from invenio.redisutils import get_redis
+
+
+class LocalSearchResultsCacheBackend(object):
+    """
+    In-process LRU store of binary strings, bounded by the number of
+    entries and by their total size in bytes.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        """Remove all the entries."""
+        # entries are [prev, next, key, value, expiry] links of a
+        # circular doubly linked list ordered from the least to the
+        # most recently used one:
+        self.root = [None, None, None, None, None]
+        self.root[0] = self.root[1] = self.root
+        self.entries = {}
+        self.nbytes = 0
+
+    def _unlink(self, link):
+        """Remove LINK from the LRU list."""
+        link_prev, link_next = link[0], link[1]
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+
+    def _append(self, link):
+        """Put LINK at the most recently used end of the LRU list."""
+        last = self.root[0]
+        link[0], link[1] = last, self.root
+        last[1] = self.root[0] = link
+
+    def get(self, key):
+        """Return value stored under KEY or None."""
+        link = self.entries.get(key)
+        if link is None:
+            return None
+        if link[4] and link[4] < time.time():
+            self.delete(key)
+            return None
+        self._unlink(link)
+        self._append(link)
+        return link[3]
+
+    def set(self, key, value, timeout=None):
+        """Store VALUE under KEY, for TIMEOUT seconds if set."""
+        self.delete(key)
+        if self.max_bytes and len(value) > self.max_bytes:
+            return
+        expiry = timeout and time.time() + timeout or None
+        link = [None, None, key, value, expiry]
+        self._append(link)
+        self.entries[key] = link
+        self.nbytes += len(value)
+        while (self.max_entries and len(self.entries) > self.max_entries) or \
+              (self.max_bytes and self.nbytes > self.max_bytes):
+            self.delete(self.root[1][2])
+
+    def delete(self, key):
+        """Remove KEY."""
+        link = self.entries.pop(key, None)
+        if link is not None:
+            self._unlink(link)
+            self.nbytes -= len(link[3])
+
+    def keys(self):
+        """Return keys from the least to the most recently used one."""
+        out = []
+        link = self.root[1]
+        while link is not self.root:
+            out.append(link[2])
+            link = link[1]
+        return out
+
+    def get_statistics(self):
+        """Return dictionary with the number and size of entries."""
+        return {'entries': len(self.entries),
+                'bytes': self.nbytes}
+
+
+class RedisSearchResultsCacheBackend(object):
+    """
+    Store of binary strings shared by all the worker processes via
+    redis.  Entries are namespaced by a generation number stored in
+    redis too, so that the whole cache can be cleared at once.
+    """
+
+    prefix = 'search_results_cache'
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes_written = 0
+
+    def _namespace(self):
+        """Return current key namespace."""
+        generation = get_redis().get(self.prefix + ':generation') or '0'
+        return '%s:%s:' % (self.prefix, generation)
+
+    def clear(self):
+        """Invalidate all the entries."""
+        get_redis().set(self.prefix + ':generation', str(time.time()))
+
+    def get(self, key):
+        """Return value stored under KEY or None."""
+        return get_redis().get(self._namespace() + key)
+
+    def set(self, key, value, timeout=None):
+        """Store VALUE under KEY, for TIMEOUT seconds if set."""
+        if self.max_bytes and len(value) > self.max_bytes:
+            return
+        get_redis().set(self._namespace() + key, value, timeout)
+        self.nbytes_written += len(value)
+
+    def delete(self, key):
+        """Remove KEY."""
+        get_redis().delete(self._namespace() + key)
+
+    def keys(self):
+        """Keys of the shared store cannot be listed."""
+        return []
+
+    def get_statistics(self):
+        """Return dictionary with the number of bytes written."""
+        return {'bytes_written': self.nbytes_written}
+
+
+class SearchResultsCache(object):
+    """
+    Provides temporary cache for Search Results.  Useful when users
+    click on `next page'.  Keys are query representations, values are
+    hitsets.
+    """
+
+    def __init__(self, backend, timeout=None):
+        """
+        @param backend: store of binary strings, e.g. an instance of
+            LocalSearchResultsCacheBackend
+        @param timeout: time to live of entries in seconds
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, query_representation):
+        """Return backend key for QUERY_REPRESENTATION."""
+        return md5(query_representation).hexdigest()
+
+    def get(self, query_representation, stamp=''):
+        """
+        Return hitset cached for QUERY_REPRESENTATION, or None if it
+        is not cached or if it was cached with another STAMP.
+        """
+        value = self.backend.get(self._key(query_representation))
+        if value is not None:
+            cached_stamp, dump = value.split('\n', 1)
+            if cached_stamp == stamp:
+                self.hits += 1
+                return intbitset(dump)
+        self.misses += 1
+        return None
+
+    def set(self, query_representation, hitset, stamp=''):
+        """Cache HITSET for QUERY_REPRESENTATION valid for STAMP."""
+        self.backend.set(self._key(query_representation),
+                         '%s\n%s' % (stamp, hitset.fastdump()),
+                         self.timeout)
+
+    def clear(self):
+        """Remove all the cached results."""
+        self.backend.clear()
+
+    def get_statistics(self):
+        """Return dictionary of cache usage statistics of this process."""
+        stats = {'hits': self.hits,
+                 'misses': self.misses}
+        stats.update(self.backend.get_statistics())
+        return stats
+
+
+def create_search_results_cache():
+    """
+    Return search results cache according to the configuration, or
+    None if the cache is switched off.
+    """
+    if not CFG_WEBSEARCH_SEARCH_CACHE_SIZE:
+        return None
+    max_bytes = CFG_WEBSEARCH_SEARCH_CACHE_MEMORY * 1024 * 1024
+    if CFG_WEBSEARCH_SEARCH_CACHE_BACKEND == 'redis':
+        backend = RedisSearchResultsCacheBackend(max_bytes)
+    else:
+        backend = LocalSearchResultsCacheBackend(CFG_WEBSEARCH_SEARCH_CACHE_SIZE,
+                                                 max_bytes)
+    return SearchResultsCache(backend, CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the search engine query results cache."""
+
+__revision__ = "$Id$"
+
+import time
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio.search_engine_results_cache import SearchResultsCache, \
+     LocalSearchResultsCacheBackend
+
+
+class LocalSearchResultsCacheBackendTest(InvenioTestCase):
+    """Test of the in-process LRU backend."""
+
+    def test_lru_eviction_by_number_of_entries(self):
+        """search engine results cache - least recently used entries are evicted"""
+        backend = LocalSearchResultsCacheBackend(2, 0)
+        backend.set('a', '1')
+        backend.set('b', '2')
+        self.assertEqual('1', backend.get('a'))
+        backend.set('c', '3')
+        self.assertEqual(None, backend.get('b'))
+        self.assertEqual(['a', 'c'], backend.keys())
+
+    def test_eviction_by_size(self):
+        """search engine results cache - entries are evicted to fit the byte limit"""
+        backend = LocalSearchResultsCacheBackend(0, 10)
+        backend.set('a', '12345')
+        backend.set('b', '12345')
+        backend.set('c', '123')
+        self.assertEqual(['b', 'c'], backend.keys())
+        self.assertEqual(8, backend.get_statistics()['bytes'])
+        backend.set('d', '12345678901')
+        self.assertEqual(None, backend.get('d'))
+
+    def test_timeout(self):
+        """search engine results cache - expired entries are not returned"""
+        backend = LocalSearchResultsCacheBackend(10, 0)
+        backend.set('a', '1', 1)
+        backend.set('b', '2')
+        time.sleep(1.1)
+        self.assertEqual(None, backend.get('a'))
+        self.assertEqual('2', backend.get('b'))
+
+
+class SearchResultsCacheTest(InvenioTestCase):
+    """Test of the search results cache front-end."""
+
+    def setUp(self):
+        """Create cache with the in-process backend."""
+        self.cache = SearchResultsCache(LocalSearchResultsCacheBackend(10, 0), 60)
+
+    def test_hitset_round_trip(self):
+        """search engine results cache - hitsets are stored and retrieved"""
+        self.cache.set("('ellis', '', ['Articles'], 0)", intbitset([1, 2, 3]), 'stamp')
+        self.assertEqual(intbitset([1, 2, 3]),
+                         self.cache.get("('ellis', '', ['Articles'], 0)", 'stamp'))
+        self.assertEqual(None, self.cache.get("('muon', '', ['Articles'], 0)", 'stamp'))
+        self.assertEqual(1, self.cache.get_statistics()['hits'])
+        self.assertEqual(1, self.cache.get_statistics()['misses'])
+
+    def test_stamp_invalidation(self):
+        """search engine results cache - results cached with other stamp are misses"""
+        self.cache.set('query', intbitset([1]), '2015-01-01 00:00:00')
+        self.assertEqual(None, self.cache.get('query', '2015-01-02 00:00:00'))
+
+
+TEST_SUITE = make_test_suite(LocalSearchResultsCacheBackendTest,
+                             SearchResultsCacheTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Invenio Search Engine query plan and timing traces.
+
+A trace records, for every stage of the search pipeline (washing of
+arguments, query parsing, search units, intersection with the
+collections, ranking, sorting, printing...), the wall and CPU time it
+took, the number of SQL queries it ran and of rows they returned, and
+the size of the hitset it produced; as well as the hitset size of
+every basic search unit.  Timings of a stage include the ones of the
+stages run from within it.
+
+Traces are switched on for verbose searches, whose trace is printed
+together with the results, and for a random sample of all searches
+(see CFG_WEBSEARCH_TRACE_LOG_SAMPLING), whose traces are appended as
+JSON lines to CFG_LOGDIR/search_trace.log.  The log can be summarized
+as percentiles per stage by the `websearchtrace' command line tool.
+
+When no trace is active, the cost of the instrumentation is one
+thread-local attribute lookup per stage.
+"""
+
+__revision__ = "$Id$"
+
+import os
+import sys
+import time
+import getopt
+from random import random
+from threading import local
+
+from invenio.config import CFG_LOGDIR, CFG_WEBSEARCH_TRACE_LOG_SAMPLING
+from invenio.dbquery import start_run_sql_statistics, \
+     stop_run_sql_statistics, get_run_sql_statistics
+from invenio.intbitset import intbitset
+from invenio.jsonutils import json
+
+CFG_SEARCH_TRACE_LOG_FILE = os.path.join(CFG_LOGDIR, 'search_trace.log')
+
+# percentiles reported by summarize_search_trace_log():
+CFG_SEARCH_TRACE_PERCENTILES = (50, 95, 99)
+
+_THREAD_TRACE = local()
+
+
+def _get_cpu_time():
+    """Return user plus system CPU time of the process."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+class SearchTrace(object):
+    """
+    Timings and sizes of the stages of one search.
+    """
+
+    def __init__(self, query='', log=False):
+        """
+        @param query: representation of the search query
+        @param log: whether the trace is to be appended to the log
+        """
+        self.query = query
+        self.log = log
+        self.stages = []
+        self.units = []
+        self.depth = 0
+        self.start_wall = time.time()
+        self.start_cpu = _get_cpu_time()
+        self.wall = self.cpu = None
+
+    def run_stage(self, name, function, args, kwargs):
+        """
+        Return FUNCTION(*ARGS, **KWARGS), recording it as stage NAME.
+        """
+        # append the stage before running it, so that stages are
+        # listed in the order they were started:
+        stage = {'stage': name, 'depth': self.depth}
+        self.stages.append(stage)
+        self.depth += 1
+        nb_queries, nb_rows = get_run_sql_statistics()
+        start_cpu = _get_cpu_time()
+        start_wall = time.time()
+        try:
+            result = function(*args, **kwargs)
+            if isinstance(result, intbitset):
+                stage['nb_hits'] = len(result)
+            return result
+        finally:
+            stage['wall'] = time.time() - start_wall
+            stage['cpu'] = _get_cpu_time() - start_cpu
+            end_queries, end_rows = get_run_sql_statistics()
+            stage['queries'] = end_queries - nb_queries
+            stage['rows'] = end_rows - nb_rows
+            self.depth -= 1
+
+    def add_search_unit(self, operator, pattern, field, match, nb_hits, wall):
+        """Record basic search unit and the size of its hitset."""
+        self.units.append({'operator': operator,
+                           'pattern': pattern,
+                           'field': field,
+                           'match': match,
+                           'nb_hits': nb_hits,
+                           'wall': wall})
+
+    def stop(self):
+        """Record the total time of the search."""
+        self.wall = time.time() - self.start_wall
+        self.cpu = _get_cpu_time() - self.start_cpu
+
+    def get_data(self):
+        """Return the trace as a JSON serializable dictionary."""
+        return {'query': self.query,
+                'time': self.start_wall,
+                'wall': self.wall,
+                'cpu': self.cpu,
+                'stages': self.stages,
+                'units': self.units}
+
+    def format(self):
+        """Return the trace as a text table."""
+        out = ["%-40s %9s %9s %7s %9s %9s" % ('stage', 'wall [s]', 'cpu [s]',
+                                               'queries', 'rows', 'hits')]
+        for stage in self.stages:
+            out.append("%-40s %9.4f %9.4f %7d %9d %9s" % (
+                '  ' * stage['depth'] + stage['stage'],
+                stage.get('wall', 0), stage.get('cpu', 0),
+                stage.get('queries', 0), stage.get('rows', 0),
+                stage.get('nb_hits', '')))
+        if self.units:
+            out.append('')
+            out.append("%-40s %9s %9s" % ('search unit', 'wall [s]', 'hits'))
+            for unit in self.units:
+                out.append("%-40s %9.4f %9d" % (
+                    '%s %s:%s (%s)' % (unit['operator'], unit['field'],
+                                       unit['pattern'], unit['match']),
+                    unit['wall'], unit['nb_hits']))
+        if self.wall is not None:
+            out.append('')
+            out.append("total: %.4f s wall, %.4f s cpu" % (self.wall, self.cpu))
+        return '\n'.join(out)
+
+
+def start_search_trace(query='', force=False):
+    """
+    Start tracing the search QUERY in this thread, if FORCE is set or
+    if the search is picked for the trace log sample.  Return the new
+    trace, or None if tracing was not started, e.g. because a trace
+    of an enclosing search is already running.
+    """
+    if getattr(_THREAD_TRACE, 'trace', None) is not None:
+        return None
+    log = CFG_WEBSEARCH_TRACE_LOG_SAMPLING > 0 and \
+          random() < CFG_WEBSEARCH_TRACE_LOG_SAMPLING
+    if not (force or log):
+        return None
+    start_run_sql_statistics()
+    trace = SearchTrace(query, log)
+    _THREAD_TRACE.trace = trace
+    return trace
+
+
+def get_current_search_trace():
+    """Return the trace running in this thread, or None."""
+    return getattr(_THREAD_TRACE, 'trace', None)
+
+
+def stop_search_trace(trace):
+    """
+    Stop TRACE started by start_search_trace() and write it to the
+    trace log if it belongs to the log sample.
+    """
+    trace.stop()
+    _THREAD_TRACE.trace = None
+    _THREAD_TRACE.last_trace = trace
+    stop_run_sql_statistics()
+    if trace.log:
+        write_search_trace_log(trace)
+
+
+def get_last_search_trace():
+    """Return the last trace stopped in this thread, or None."""
+    return getattr(_THREAD_TRACE, 'last_trace', None)
+
+
+def trace_stage(name):
+    """
+    Decorator recording every call of the decorated function as
+    search stage NAME of the current trace, if any.
+    """
+    def decorator(function):
+        def traced_function(*args, **kwargs):
+            trace = getattr(_THREAD_TRACE, 'trace', None)
+            if trace is None:
+                return function(*args, **kwargs)
+            return trace.run_stage(name, function, args, kwargs)
+        traced_function.__name__ = function.__name__
+        traced_function.__doc__ = function.__doc__
+        traced_function.__module__ = function.__module__
+        return traced_function
+    return decorator
+
+
+def write_search_trace_log(trace, filename=CFG_SEARCH_TRACE_LOG_FILE):
+    """Append TRACE as one JSON line to FILENAME."""
+    try:
+        log_file = open(filename, 'a')
+        try:
+            log_file.write(json.dumps(trace.get_data()) + '\n')
+        finally:
+            log_file.close()
+    except IOError:
+        # tracing must never break searching
+        pass
+
+
+def get_percentile(sorted_values, percentile):
+    """
+    Return PERCENTILE of the non-empty list SORTED_VALUES, using the
+    nearest rank method.
+    """
+    rank = -(-len(sorted_values) * percentile // 100)
+    return sorted_values[max(rank, 1) - 1]
+
+
+def summarize_search_traces(traces):
+    """
+    Return summary of TRACES, a list of trace dictionaries as
+    returned by SearchTrace.get_data().  The summary is a dictionary
+    of stage names (plus 'total' for whole searches) and of
+    dictionaries with the number of searches the stage was run in,
+    and the percentiles of its wall time, CPU time and number of SQL
+    queries per search.  Stages run several times in a search are
+    counted once, with their timings summed up.
+    """
+    values = {}
+    for trace in traces:
+        per_search = {}
+        for stage in trace['stages']:
+            # nested calls of the same stage would be counted twice:
+            if stage['stage'] in per_search and per_search[stage['stage']][3] < stage['depth']:
+                continue
+            stage_values = per_search.setdefault(stage['stage'],
+                                                 [0.0, 0.0, 0, stage['depth']])
+            stage_values[0] += stage.get('wall', 0)
+            stage_values[1] += stage.get('cpu', 0)
+            stage_values[2] += stage.get('queries', 0)
+        if trace.get('wall') is not None:
+            per_search['total'] = [trace['wall'], trace['cpu'],
+                                   sum([stage.get('queries', 0) for stage in trace['stages']
+                                        if stage['depth'] == 0]), 0]
+        for name, (wall, cpu, queries, dummy_depth) in per_search.iteritems():
+            stage_values = values.setdefault(name, ([], [], []))
+            stage_values[0].append(wall)
+            stage_values[1].append(cpu)
+            stage_values[2].append(queries)
+    summary = {}
+    for name, stage_values in values.iteritems():
+        summary[name] = {'count': len(stage_values[0])}
+        for key, key_values in zip(('wall', 'cpu', 'queries'), stage_values):
+            key_values.sort()
+            for percentile in CFG_SEARCH_TRACE_PERCENTILES:
+                summary[name]['%s_p%d' % (key, percentile)] = \
+                    get_percentile(key_values, percentile)
+    return summary
+
+
+def summarize_search_trace_log(filename=CFG_SEARCH_TRACE_LOG_FILE):
+    """Return summary of the traces logged in FILENAME, see summarize_search_traces()."""
+    def read_traces():
+        """Yield the traces of the log, skipping damaged lines."""
+        log_file = open(filename)
+        try:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        finally:
+            log_file.close()
+    return summarize_search_traces(read_traces())
+
+
+def format_search_trace_summary(summary):
+    """Return SUMMARY as a text table, slowest stages first."""
+    header = "%-36s %7s" % ('stage', 'count')
+    for key in ('wall', 'cpu'):
+        for percentile in CFG_SEARCH_TRACE_PERCENTILES:
+            header += " %10s" % ('%s p%d' % (key, percentile))
+    for percentile in CFG_SEARCH_TRACE_PERCENTILES:
+        header += " %7s" % ('sql p%d' % percentile)
+    out = [header]
+    names = summary.keys()
+    names.sort(key=lambda name: summary[name]['wall_p95'], reverse=True)
+    for name in names:
+        line = "%-36s %7d" % (name, summary[name]['count'])
+        for key in ('wall', 'cpu'):
+            for percentile in CFG_SEARCH_TRACE_PERCENTILES:
+                line += " %10.4f" % summary[name]['%s_p%d' % (key, percentile)]
+        for percentile in CFG_SEARCH_TRACE_PERCENTILES:
+            line += " %7d" % summary[name]['queries_p%d' % percentile]
+        out.append(line)
+    return '\n'.join(out)
+
+
+def usage(exitcode=1, msg=""):
+    """Print usage info and exit with EXITCODE."""
+    if msg:
+        sys.stderr.write("Error: %s.\n" % msg)
+    sys.stderr.write("""\
+Usage: %s [options] [search_trace_log_file]
+
+Summarize the search engine traces logged in search_trace_log_file
+(default: %s) as percentiles of the wall time, CPU time and number of
+SQL queries of every search stage.  The traces are logged for a sample
+of searches, see CFG_WEBSEARCH_TRACE_LOG_SAMPLING.
+
+Options:
+  -j, --json    Print the summary in JSON.
+  -h, --help    Print this help.
+""" % (os.path.basename(sys.argv[0]), CFG_SEARCH_TRACE_LOG_FILE))
+    sys.exit(exitcode)
+
+
+def main():
+    """Summarize the search trace log given on the command line."""
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "jh", ["json", "help"])
+    except getopt.GetoptError, err:
+        usage(1, err)
+    output_json = False
+    for opt, dummy_value in opts:
+        if opt in ("-h", "--help"):
+            usage(0)
+        elif opt in ("-j", "--json"):
+            output_json = True
+    if len(args) > 1:
+        usage(1, "too many arguments")
+    filename = args and args[0] or CFG_SEARCH_TRACE_LOG_FILE
+    try:
+        summary = summarize_search_trace_log(filename)
+    except IOError, err:
+        sys.stderr.write("Error: cannot read %s: %s\n" % (filename, err))
+        sys.exit(1)
+    if output_json:
+        print json.dumps(summary, indent=2, sort_keys=True)
+    else:
+        print format_search_trace_summary(summary)
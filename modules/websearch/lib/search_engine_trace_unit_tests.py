@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2015 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the search engine traces."""
+
+__revision__ = "$Id$"
+
+import os
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio.search_engine_trace import trace_stage, start_search_trace, \
+     stop_search_trace, get_current_search_trace, get_last_search_trace, \
+     get_percentile, summarize_search_traces, summarize_search_trace_log, \
+     write_search_trace_log
+
+
+@trace_stage('outer')
+def _outer_stage(recids):
+    """Run inner stage twice."""
+    return _inner_stage(recids) | _inner_stage([])
+
+
+@trace_stage('inner')
+def _inner_stage(recids):
+    """Return hitset of RECIDS."""
+    return intbitset(recids)
+
+
+class SearchTraceTest(InvenioTestCase):
+    """Test of the recording of search stages."""
+
+    def test_no_trace_by_default(self):
+        """search engine trace - stages run untraced without active trace"""
+        self.assertEqual(None, start_search_trace('query'))
+        self.assertEqual(intbitset([1, 2]), _outer_stage([1, 2]))
+        self.assertEqual(None, get_current_search_trace())
+
+    def test_stages_are_recorded(self):
+        """search engine trace - nested stages are recorded in call order"""
+        trace = start_search_trace('query', force=True)
+        try:
+            self.assertEqual(None, start_search_trace('nested query', force=True))
+            self.assertEqual(intbitset([1, 2]), _outer_stage([1, 2]))
+            get_current_search_trace().add_search_unit('+', 'ellis', 'author', 'a', 2, 0.1)
+        finally:
+            stop_search_trace(trace)
+        self.assertEqual(None, get_current_search_trace())
+        self.assertEqual(trace, get_last_search_trace())
+        self.assertEqual([('outer', 0, 2), ('inner', 1, 2), ('inner', 1, 0)],
+                         [(stage['stage'], stage['depth'], stage['nb_hits'])
+                          for stage in trace.stages])
+        self.failUnless(trace.wall >= trace.stages[0]['wall'])
+        self.failUnless('author:ellis' in trace.format())
+
+
+class SearchTraceSummaryTest(InvenioTestCase):
+    """Test of the percentiles of the trace log."""
+
+    def test_percentile(self):
+        """search engine trace - nearest rank percentiles"""
+        values = range(1, 101)
+        self.assertEqual(50, get_percentile(values, 50))
+        self.assertEqual(99, get_percentile(values, 99))
+        self.assertEqual(7, get_percentile([7], 95))
+
+    def test_summary(self):
+        """search engine trace - stages are summarized per search"""
+        traces = []
+        for i in range(1, 101):
+            traces.append({'wall': 2.0 * i, 'cpu': 1.0 * i, 'units': [],
+                           'stages': [{'stage': 'search_unit', 'depth': 0,
+                                       'wall': 1.0 * i, 'cpu': 0.5 * i, 'queries': 1},
+                                      {'stage': 'search_unit', 'depth': 0,
+                                       'wall': 1.0 * i, 'cpu': 0.5 * i, 'queries': 2}]})
+        summary = summarize_search_traces(traces)
+        self.assertEqual(100, summary['search_unit']['count'])
+        self.assertEqual(100.0, summary['search_unit']['wall_p50'])
+        self.assertEqual(95.0, summary['search_unit']['cpu_p95'])
+        self.assertEqual(3, summary['search_unit']['queries_p99'])
+        self.assertEqual(198.0, summary['total']['wall_p99'])
+
+    def test_log(self):
+        """search engine trace - traces are logged and summarized"""
+        fd, filename = tempfile.mkstemp(prefix='search_trace_')
+        os.close(fd)
+        try:
+            trace = start_search_trace('query', force=True)
+            _outer_stage([1])
+            stop_search_trace(trace)
+            write_search_trace_log(trace, filename)
+            write_search_trace_log(trace, filename)
+            open(filename, 'a').write('damaged line\n')
+            summary = summarize_search_trace_log(filename)
+        finally:
+            os.remove(filename)
+        self.assertEqual(['inner', 'outer', 'total'], sorted(summary.keys()))
+        self.assertEqual(2, summary['outer']['count'])
+
+
+TEST_SUITE = make_test_suite(SearchTraceTest,
+                             SearchTraceSummaryTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
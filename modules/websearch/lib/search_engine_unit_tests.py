@@ -40,6 +40,14 @@ class TestMiscUtilityFunctions(InvenioTestCase):
         self.assertEqual(search_engine.ziplist([1, 2, 3], ['a', 'b', 'c'], [9, 8, 7]),
                          [[1, 'a', 9], [2, 'b', 8], [3, 'c', 7]])
 
+    def test_get_sort_value(self):
+        """search engine - sort value of record preferring sort pattern"""
+        self.assertEqual("cern-th-2001", search_engine.get_sort_value(["CERN-TH-2001"]))
+        self.assertEqual("cern-ps-1999",
+                         search_engine.get_sort_value(["CERN-TH-2001", "CERN-PS-1999"], "CERN-PS"))
+        self.assertEqual("cern-ps          cern-th-2001",
+                         search_engine.get_sort_value(["CERN-TH-2001"], "CERN-PS"))
+
 
 class TestWashQueryParameters(InvenioTestCase):
     """Test for washing of search query parameters."""
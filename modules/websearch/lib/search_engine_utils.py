@@ -89,6 +89,55 @@ def get_fieldvalues(recIDs, tag, repetitive_values=True, sort=True, split_by=0):
     return out
 
 
+def get_fieldvalues_by_record(recIDs, tag):
+    """
+    Return dictionary of {recID: list of field values} for field TAG
+    of the records RECIDS, or of all the records having the field if
+    RECIDS is None.  The values of every record are ordered like
+    get_fieldvalues(recID, tag) does.  The records are looked up with
+    one query for all of them, so callers should pass chunks of
+    reasonable size.
+    """
+    out = {}
+    if tag == "001___":
+        if recIDs is not None:
+            for recID in recIDs:
+                out[recID] = [str(recID)]
+        return out
+    if recIDs is not None:
+        recIDs = list(recIDs)
+        if not recIDs:
+            return out
+    digits = tag[0:2]
+    try:
+        intdigits = int(digits)
+        if intdigits < 0 or intdigits > 99:
+            raise ValueError
+    except ValueError:
+        # invalid tag value asked for
+        return out
+    bx = "bib%sx" % digits
+    bibx = "bibrec_bib%sx" % digits
+    if recIDs is None:
+        query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx " \
+                "WHERE bx.id=bibx.id_bibxxx AND bx.tag LIKE %%s " \
+                "ORDER BY bibx.id_bibrec, bibx.field_number, bx.tag ASC" % (bx, bibx)
+        res = run_sql(query, (tag,))
+    else:
+        query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx " \
+                "WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx AND " \
+                "bx.tag LIKE %%s " \
+                "ORDER BY bibx.id_bibrec, bibx.field_number, bx.tag ASC" % \
+                (bx, bibx, ("%s,"*len(recIDs))[:-1])
+        res = run_sql(query, tuple(recIDs) + (tag,))
+    for recID, value in res:
+        if recID in out:
+            out[recID].append(value)
+        else:
+            out[recID] = [value]
+    return out
+
+
 def get_fieldvalues_alephseq_like(recID, tags_in, can_see_hidden=False):
     """Return buffer of ALEPH sequential-like textual format with fields found
        in the list TAGS_IN for record RECID.
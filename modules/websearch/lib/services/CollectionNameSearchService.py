@@ -24,7 +24,7 @@ import urllib
 from invenio.websearch_services import ListLinksService
 from invenio.messages import gettext_set_language
 from invenio.bibindex_engine_stemmer import stem
-from invenio.dbquery import get_table_update_time
+from invenio.data_cacher import get_table_version
 from invenio.config import \
      CFG_WEBSEARCH_COLLECTION_NAMES_SEARCH, \
      CFG_SITE_URL, \
@@ -145,5 +145,5 @@ class CollectionNameSearchService(ListLinksService):
 
         @return: string-formatted time '%Y-%m-%d %H:%M:%S'
         """
-        return max(get_table_update_time('collectionname'),
-                   get_table_update_time('collection_collection'))
+        return max(get_table_version('collectionname'),
+                   get_table_version('collection_collection'))
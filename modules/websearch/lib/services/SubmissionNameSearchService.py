@@ -25,7 +25,7 @@ from invenio.websearch_services import ListLinksService, clean_and_split_words_a
 from invenio.dbquery import run_sql
 from invenio.messages import gettext_set_language
 from invenio.bibindex_engine_stemmer import stem
-from invenio.dbquery import get_table_update_time
+from invenio.data_cacher import get_table_version
 from invenio.config import \
      CFG_WEBSEARCH_COLLECTION_NAMES_SEARCH, \
      CFG_SITE_URL, \
@@ -194,4 +194,4 @@ class SubmissionNameSearchService(ListLinksService):
 
         @return: string-formatted time '%Y-%m-%d %H:%M:%S'
         """
-        return get_table_update_time('sbmDOCTYPE')
+        return get_table_version('sbmDOCTYPE')
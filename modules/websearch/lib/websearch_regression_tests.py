@@ -60,8 +60,12 @@ from invenio.webinterface_handler_wsgi import SimulatedModPythonRequest
 from invenio.search_engine import perform_request_search, \
     guess_primary_collection_of_a_record, guess_collection_of_a_record, \
     collection_restricted_p, get_permitted_restricted_collections, \
+    get_restricted_recids_not_permitted, get_all_restricted_recids, \
+    get_collection_reclist, \
     search_pattern, search_unit, search_unit_in_bibrec, \
-    wash_colls, record_public_p
+    search_unit_in_bibwords, search_unit_in_bibwords_bulk, \
+    search_unit_in_idxphrases, search_unit_in_idxphrases_bulk, \
+    create_basic_search_units, wash_colls, record_public_p
 from invenio import search_engine_summarizer
 from invenio.search_engine_utils import get_fieldvalues
 from invenio.intbitset import intbitset
@@ -3389,6 +3393,23 @@ class WebSearchRestrictedCollectionTest(InvenioTestCase):
         self.assertEqual(get_permitted_restricted_collections(collect_user_info(get_uid_from_email('balthasar.montague@cds.cern.ch'))), ['ALEPH Theses', 'ALEPH Internal Notes', 'Atlantis Times Drafts'])
         self.assertEqual(get_permitted_restricted_collections(collect_user_info(get_uid_from_email('dorian.gray@cds.cern.ch'))), ['ISOLDE Internal Notes'])
 
+    def test_get_restricted_recids_not_permitted(self):
+        """websearch - get_restricted_recids_not_permitted"""
+        from invenio.webuser import collect_user_info
+        theses = get_collection_reclist('Theses')
+        all_restricted_recids = get_all_restricted_recids()
+        self.failUnless(theses)
+        self.failUnless(theses <= all_restricted_recids)
+        self.assertEqual(all_restricted_recids, get_restricted_recids_not_permitted([]))
+        # the admin can view all the restricted collections:
+        admin_collections = get_permitted_restricted_collections(collect_user_info(1))
+        for policy in ('ANY', 'ALL'):
+            self.assertEqual(intbitset(),
+                             get_restricted_recids_not_permitted(admin_collections, policy))
+            notpermitted_recids = get_restricted_recids_not_permitted(['Theses'], policy)
+            self.failUnless(notpermitted_recids <= all_restricted_recids)
+        self.failIf(theses & get_restricted_recids_not_permitted(['Theses'], 'ANY'))
+
     def test_restricted_record_has_restriction_flag(self):
         """websearch - restricted record displays a restriction flag"""
         browser = Browser()
@@ -4583,6 +4604,66 @@ class WebSearchDateQueryTest(InvenioTestCase):
         self.assertEqual(self.empty, search_unit_in_bibrec("3000-01-01", "9999-12-31", 'creationdate'))
 
 
+class WebSearchBibwordsBulkQueryTest(InvenioTestCase):
+    """Test of exact word lookups done in bulk."""
+
+    def test_bulk_equals_individual_lookups(self):
+        """websearch - search_unit_in_bibwords_bulk gives same hits as individual lookups"""
+        words = ['ellis', 'muon', 'higgs', 'nonexistingwordxyzzy']
+        for f in ('', 'title', 'author'):
+            res = search_unit_in_bibwords_bulk(words, f)
+            self.assertEqual(sorted(res.keys()), sorted(words))
+            for word in words:
+                self.assertEqual(res[word], search_unit_in_bibwords(word, f))
+
+    def test_search_pattern_with_bulk_prefetch(self):
+        """websearch - search_pattern for multi-word query uses bulk prefetch"""
+        self.assertEqual(search_pattern(p='of the', f='title'),
+                         search_unit('of', 'title') & search_unit('the', 'title'))
+        self.assertEqual(search_pattern(p='ellis | muon'),
+                         search_unit('ellis') | search_unit('muon'))
+
+    def test_phrase_bulk_equals_individual_lookups(self):
+        """websearch - search_unit_in_idxphrases_bulk gives same hits as individual lookups"""
+        phrases = ['hep-th/9809057', 'CERN-TH-4036', 'HEP-TH/9809057',
+                   'nonexistingreportxyzzy']
+        res = search_unit_in_idxphrases_bulk(phrases, 'reportnumber')
+        self.assertEqual(sorted(res.keys()), sorted(phrases))
+        for phrase in phrases:
+            self.assertEqual(res[phrase],
+                             search_unit_in_idxphrases(phrase, 'reportnumber', 'a'))
+
+
+class WebSearchQueryPlannerTest(InvenioTestCase):
+    """Test of the evaluation order of search units."""
+
+    def test_reordered_query_gives_same_hits(self):
+        """websearch - search_pattern results do not depend on the evaluation order"""
+        for p in ('title:"/.*muon.*/" ellis', '980:ARTICLE -ellis',
+                  'datecreated:1000-01-01->9999-12-31 higgs',
+                  'ellis | muon -higgs 980:PREPRINT'):
+            # evaluate the units from left to right:
+            expected = intbitset(trailing_bits=1)
+            expected.discard(0)
+            for bsu_o, bsu_p, bsu_f, bsu_m in create_basic_search_units(None, p, ''):
+                hitset = search_unit(bsu_p, bsu_f, bsu_m)
+                if bsu_o == '+':
+                    expected &= hitset
+                elif bsu_o == '-':
+                    expected -= hitset
+                else:
+                    expected |= hitset
+            self.assertEqual(expected, search_pattern(p=p))
+
+    def test_restricted_search_units(self):
+        """websearch - restricted search units give hits among the restriction"""
+        restriction = intbitset([1, 8, 10, 77])
+        for p, f, m in (('.*muon.*', 'title', 'r'),
+                        ('1000-01-01->9999-12-31', 'datecreated', 'w')):
+            self.assertEqual(search_unit(p, f, m) & restriction,
+                             search_unit(p, f, m, restriction=restriction) & restriction)
+
+
 class WebSearchSynonymQueryTest(InvenioTestCase):
     """Test of queries using synonyms."""
 
@@ -5139,6 +5220,8 @@ TEST_SUITE = make_test_suite(WebSearchWebPagesAvailabilityTest,
                              WebSearchReferstoCitedbyTest,
                              WebSearchSPIRESSyntaxTest,
                              WebSearchDateQueryTest,
+                             WebSearchBibwordsBulkQueryTest,
+                             WebSearchQueryPlannerTest,
                              WebSearchTestWildcardLimit,
                              WebSearchSynonymQueryTest,
                              WebSearchWashCollectionsTest,
@@ -25,9 +25,8 @@ import re
 from invenio.pluginutils import PluginContainer
 from invenio.config import CFG_SITE_LANG, CFG_PYLIBDIR
 from invenio.bibknowledge import get_kb_mappings
-from invenio.data_cacher import DataCacher
+from invenio.data_cacher import DataCacher, get_table_version
 from invenio.bibindex_engine_stemmer import stem
-from invenio.dbquery import get_table_update_time
 from invenio.messages import gettext_set_language
 from invenio import template
 
@@ -311,7 +310,7 @@ class KnowledgeBaseService(ListLinksService):
         @return: string-formatted time '%Y-%m-%d %H:%M:%S'
         """
         # This is an approximation...
-        return get_table_update_time('knwKBRVAL')
+        return get_table_version('knwKBRVAL')
 
 re_split_words_pattern = re.compile('\s*')
 re_non_alphanum_only = re.compile('\W')
@@ -40,11 +40,15 @@ from invenio.config import \
      CFG_SITE_LANGS, \
      CFG_WEBSEARCH_DEFAULT_SEARCH_INTERFACE, \
      CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, \
+     CFG_WEBSEARCH_COLLECTION_INDEX_THRESHOLD, \
      CFG_SCOAP3_SITE
 from invenio.messages import gettext_set_language
 from invenio.search_engine import search_pattern_parenthesised, get_creation_date, get_field_i18nname, collection_restricted_p, sort_records, EM_REPOSITORY
 from invenio.search_engine_config import CFG_WEBSEARCH_ENABLED_SEARCH_INTERFACES
+from invenio.search_engine_collection_index import CollectionMembershipIndex, \
+     save_collection_membership_index
 from invenio.dbquery import run_sql, Error, get_table_update_time
+from invenio.data_cacher import bump_table_version
 from invenio.bibrank_record_sorter import get_bibrank_methods
 from invenio.dateutils import convert_datestruct_to_dategui, strftime
 from invenio.bibformat import format_record
@@ -1127,6 +1131,25 @@ def task_submit_check_options():
             return False
     return True
 
+def update_collection_membership_index(version):
+    """
+    Rebuild the index of the collections every record belongs to from
+    the reclists of all the collections, and store it in the cache
+    for the search engine.  VERSION is the version of the collection
+    table the reclists are up to date with.
+    """
+    write_message("Updating collection membership index", verbose=3)
+    reclists = {}
+    for name, reclist in run_sql("SELECT name, reclist FROM collection"):
+        if reclist:
+            try:
+                reclists[name] = intbitset(reclist)
+            except Exception:
+                write_message("Cannot load reclist of collection %s" % name, verbose=2)
+    index = CollectionMembershipIndex.build(reclists, version)
+    save_collection_membership_index(index)
+    write_message("Collection membership index has %d classes of records" % len(index.classes), verbose=3)
+
 def task_run_core():
     """ Reimplement to add the body of the task."""
 ##
@@ -1189,6 +1212,11 @@ def task_run_core():
                 coll.update_reclist()
                 task_update_progress("Part 1/2: done %d/%d" % (i, len(colls)))
                 task_sleep_now_if_required(can_stop_too=True)
+            reclists_version = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            if CFG_WEBSEARCH_COLLECTION_INDEX_THRESHOLD:
+                update_collection_membership_index(reclists_version)
+            # let web workers know that reclists have changed:
+            bump_table_version('collection', reclists_version)
         # thirdly, update collection webpage cache:
         if task_get_option("part", 2) == 2:
             # Updates cache only for chosen languages or for all available ones if none was chosen
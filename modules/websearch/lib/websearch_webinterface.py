@@ -83,6 +83,7 @@ from invenio.search_engine import check_user_can_view_record, \
      perform_request_cache, \
      perform_request_log, \
      perform_request_search, \
+     print_recids_stream, \
      restricted_collection_cache, \
      get_coll_normalised_name, \
      EM_REPOSITORY
@@ -295,8 +296,10 @@ class WebInterfaceRecordPages(WebInterfaceDirectory):
         out = perform_request_search(req, **argd)
         if isinstance(out, intbitset):
             return out.fastdump()
-        elif out == []:
-            return str(out)
+        elif isinstance(out, list):
+            # of=id: stream the list of record IDs instead of building
+            # its string representation at once
+            return print_recids_stream(req, out)
         else:
             return out
 
@@ -385,8 +388,10 @@ class WebInterfaceRecordRestrictedPages(WebInterfaceDirectory):
         out = perform_request_search(req, **argd)
         if isinstance(out, intbitset):
             return out.fastdump()
-        elif out == []:
-            return str(out)
+        elif isinstance(out, list):
+            # of=id: stream the list of record IDs instead of building
+            # its string representation at once
+            return print_recids_stream(req, out)
         else:
             return out
 
@@ -500,8 +505,10 @@ class WebInterfaceSearchResultsPages(WebInterfaceDirectory):
         out = perform_request_search(req, **argd)
         if isinstance(out, intbitset):
             return out.fastdump()
-        elif out == []:
-            return str(out)
+        elif isinstance(out, list):
+            # of=id: stream the list of record IDs instead of building
+            # its string representation at once
+            return print_recids_stream(req, out)
         else:
             return out
 
@@ -564,8 +571,10 @@ class WebInterfaceSearchResultsPages(WebInterfaceDirectory):
         out = perform_request_search(req, **argd)
         if isinstance(out, intbitset):
             return out.fastdump()
-        elif out == []:
-            return str(out)
+        elif isinstance(out, list):
+            # of=id: stream the list of record IDs instead of building
+            # its string representation at once
+            return print_recids_stream(req, out)
         else:
             return out
 
@@ -1189,8 +1198,10 @@ class WebInterfaceRecordExport(WebInterfaceDirectory):
         out = perform_request_search(req, **argd)
         if isinstance(out, intbitset):
             return out.fastdump()
-        elif out == []:
-            return str(out)
+        elif isinstance(out, list):
+            # of=id: stream the list of record IDs instead of building
+            # its string representation at once
+            return print_recids_stream(req, out)
         else:
             return out
 